@@ -22,7 +22,7 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 
 import logging
 from odemis.model import MD_PIXEL_SIZE
-from .autofocus import AutoFocus, AutoFocusSpectrometer, Sparc2AutoFocus
+from .autofocus import AutoFocus, AutoFocusSpectrometer, PredictiveAutoFocus, Sparc2AutoFocus
 from .light import turnOnLight
 from .find_overlay import FindOverlay
 from .spot import AlignSpot, FindSpot
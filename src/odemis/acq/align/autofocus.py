@@ -35,7 +35,8 @@ from odemis.acq.align import light
 from odemis.model import InstantaneousFuture
 from odemis.util import executeAsyncTask, almost_equal
 from odemis.util.driver import guessActuatorMoveDuration
-from odemis.util.focus import MeasureSEMFocus, Measure1d, MeasureSpotsFocus, AssessFocus
+from odemis.util.focus import MeasureSEMFocus, Measure1d, MeasureSpotsFocus, AssessFocus, \
+    CropForFocus, FocusSurface, FOCUS_ROI_SHAPE
 from odemis.util.img import Subtract
 
 MTD_BINARY = 0
@@ -43,6 +44,8 @@ MTD_EXHAUSTIVE = 1
 
 MAX_STEPS_NUMBER = 100  # Max steps to perform autofocus
 MAX_BS_NUMBER = 1  # Maximum number of applying binary search with a smaller max_step
+# Default distance around the predicted focus position where the best focus is searched
+PREDICTION_MARGIN = 10e-6  # m
 
 
 def getNextImage(det: model.Detector, timeout: Optional[float] = None) -> model.DataArray:
@@ -115,6 +118,31 @@ def _discard_data(df: Any, data: Any) -> None:
     pass
 
 
+def getMeasureFunction(detector: model.Detector) -> Callable:
+    """
+    Pick the function to measure the focus level of the images of a detector.
+    detector: Detector on which to improve the focus quality
+    returns: function which takes an image and returns its focus level (higher is better)
+    """
+    # Pick measurement method based on the heuristics that SEM detectors
+    # are typically just a point (ie, shape == data depth).
+    # TODO: is this working as expected? Alternatively, we could check
+    # MD_DET_TYPE.
+    if len(detector.shape) > 1:
+        if detector.role == 'diagnostic-ccd':
+            logging.debug("Using Spot method to estimate focus")
+            return MeasureSpotsFocus
+        elif detector.resolution.value[1] == 1:
+            logging.debug("Using 1d method to estimate focus")
+            return Measure1d
+        else:
+            logging.debug("Using Spot method to estimate focus")
+            return MeasureSpotsFocus
+    else:
+        logging.debug("Using SEM method to estimate focus")
+        return MeasureSEMFocus
+
+
 def _DoBinaryFocus(
         future: model.ProgressiveFuture,
         detector: model.Detector,
@@ -213,24 +241,8 @@ def _DoBinaryFocus(
         best_fm = 0
         last_pos = None
 
-        # Pick measurement method based on the heuristics that SEM detectors
-        # are typically just a point (ie, shape == data depth).
-        # TODO: is this working as expected? Alternatively, we could check
-        # MD_DET_TYPE.
         if measure_func is None:
-            if len(detector.shape) > 1:
-                if detector.role == 'diagnostic-ccd':
-                    logging.debug("Using Spot method to estimate focus")
-                    Measure = MeasureSpotsFocus
-                elif detector.resolution.value[1] == 1:
-                    logging.debug("Using 1d method to estimate focus")
-                    Measure = Measure1d
-                else:
-                    logging.debug("Using Spot method to estimate focus")
-                    Measure = MeasureSpotsFocus
-            else:
-                logging.debug("Using SEM method to estimate focus")
-                Measure = MeasureSEMFocus
+            Measure = getMeasureFunction(detector)
         else:
             logging.debug(f"Using measure function {measure_func.__name__} to estimate focus")
             Measure = measure_func
@@ -446,24 +458,8 @@ def _DoExhaustiveFocus(
             dof = 1e-6  # m, not too bad value
         logging.debug("Depth of field is %.7g", dof)
 
-        # Pick measurement method based on the heuristics that SEM detectors
-        # are typically just a point (ie, shape == data depth).
-        # TODO: is this working as expected? Alternatively, we could check
-        # MD_DET_TYPE.
         if measure_func is None:
-            if len(detector.shape) > 1:
-                if detector.role == 'diagnostic-ccd':
-                    logging.debug("Using Spot method to estimate focus")
-                    Measure = MeasureSpotsFocus
-                elif detector.resolution.value[1] == 1:
-                    logging.debug("Using 1d method to estimate focus")
-                    Measure = Measure1d
-                else:
-                    logging.debug("Using Spot method to estimate focus")
-                    Measure = MeasureSpotsFocus
-            else:
-                logging.debug("Using SEM method to estimate focus")
-                Measure = MeasureSEMFocus
+            Measure = getMeasureFunction(detector)
         else:
             logging.debug(f"Using measure function {measure_func.__name__} to estimate focus")
             Measure = measure_func
@@ -1096,6 +1092,142 @@ def AutoFocus(
     return f
 
 
+def _DoPredictiveFocus(
+        future: model.ProgressiveFuture,
+        detector: model.Detector,
+        emt: Optional[model.Emitter],
+        focus: model.Actuator,
+        dfbkg: Optional[model.DataFlow],
+        surface: FocusSurface,
+        pos: Tuple[float, float],
+        good_focus: Optional[float],
+        rng_focus: Optional[Tuple[float, float]],
+        margin: float,
+        roi_shape: Optional[Tuple[int, int]],
+) -> Tuple[float, float, float]:
+    """
+    Predicts the focus position from the ones previously found, and looks for the
+    best focus only in a small range around it. If no focus position is known yet,
+    or if the best focus seems to be outside of that small range, it falls back to
+    an exhaustive search.
+    future: Progressive future provided by the wrapper
+    detector: Detector on which to improve the focus quality
+    emt: In case of a SED this is the scanner used
+    focus: The focus actuator (with a "z" axis)
+    dfbkg: dataflow of se- or bs- detector
+    surface: the focus positions previously found. The focus position found is added to it.
+    pos: the current position of the stage (X, Y)
+    good_focus: if provided, an already known good focus position to be
+      taken into consideration in case of exhaustive search
+    rng_focus: if provided, the search of the best focus position is limited
+      within this range
+    margin: distance around the predicted focus position where the best focus is searched
+    roi_shape: if provided, the focus level is measured only on the center of
+      the images, of this shape (Y, X)
+    returns:
+        (float): Focus position (m)
+        (float): Focus level
+        (float): Focus confidence (0<=f<=1, 0 is not in focus and 1 is the best possible focus)
+    raises:
+            CancelledError if cancelled
+            IOError if procedure failed
+    """
+    full_measure = getMeasureFunction(detector)
+    if roi_shape:
+        def measure_center(image):
+            return full_measure(CropForFocus(image, roi_shape))
+        measure = measure_center
+    else:
+        measure = full_measure
+
+    rng = focus.axes["z"].range
+    if rng_focus:
+        rng = (max(rng[0], rng_focus[0]), min(rng[1], rng_focus[1]))
+
+    if len(surface) > 0:
+        z_pred = surface.predict(*pos)
+        z_pred = max(rng[0], min(z_pred, rng[1]))
+        pred_rng = (max(rng[0], z_pred - margin), min(rng[1], z_pred + margin))
+        logging.debug("Predicted focus at %s is %.7g, searching within z=%s", pos, z_pred, pred_rng)
+        focus_pos, focus_lvl, confidence = _DoBinaryFocus(future, detector, emt, focus, dfbkg,
+                                                          z_pred, pred_rng, measure_func=measure)
+
+        # If the best focus is close to the limit of the range searched (but not
+        # of the whole range), it's probably actually outside.
+        edge_dist = margin / 4
+        at_edge = ((pred_rng[0] > rng[0] and focus_pos - pred_rng[0] < edge_dist) or
+                   (pred_rng[1] < rng[1] and pred_rng[1] - focus_pos < edge_dist))
+        if at_edge or confidence <= 0.1:
+            logging.info("Focus not found around predicted position %.7g (best at %.7g), "
+                         "will search the whole range", z_pred, focus_pos)
+            with future._autofocus_lock:
+                if future._autofocus_state == CANCELLED:
+                    raise CancelledError()
+                future._autofocus_state = RUNNING
+            focus_pos, focus_lvl, confidence = _DoExhaustiveFocus(future, detector, emt, focus, dfbkg,
+                                                                  good_focus, rng, measure_func=measure)
+    else:
+        focus_pos, focus_lvl, confidence = _DoExhaustiveFocus(future, detector, emt, focus, dfbkg,
+                                                              good_focus, rng, measure_func=measure)
+
+    if confidence > 0.1:
+        surface.add_point(pos[0], pos[1], focus_pos)
+    return focus_pos, focus_lvl, confidence
+
+
+def PredictiveAutoFocus(
+        detector: model.Detector,
+        emt: Optional[model.Emitter],
+        focus: model.Actuator,
+        surface: FocusSurface,
+        pos: Tuple[float, float],
+        dfbkg: Optional[model.DataFlow] = None,
+        good_focus: Optional[float] = None,
+        rng_focus: Optional[Tuple[float, float]] = None,
+        margin: float = PREDICTION_MARGIN,
+        roi_shape: Optional[Tuple[int, int]] = FOCUS_ROI_SHAPE,
+) -> model.ProgressiveFuture:
+    """
+    Autofocus which reuses the focus positions found at other places of the
+    sample (for instance, on the previous tiles of a tiled acquisition) to only
+    search close to the expected focus position. The focus position found is
+    added to the known positions, for the next calls.
+    detector: Detector on which to improve the focus quality
+    emt: In case of a SED this is the scanner used
+    focus: The focus actuator
+    surface: the focus positions previously found. Start with an empty
+      FocusSurface, and pass the same one at every call.
+    pos: the current position of the stage (X, Y)
+    dfbkg: If provided, will be used to start/stop the e-beam emission (see AutoFocus())
+    good_focus: if provided, an already known good focus position to be
+      taken into consideration when no prediction is possible
+    rng_focus: if provided, the search of the best focus position is limited
+      within this range
+    margin: distance around the predicted focus position where the best focus is searched
+    roi_shape: if provided, the focus level is measured only on the center of
+      the images, of this shape (Y, X). This is faster on large images.
+    returns:  Progress of the autofocus, whose result() will return:
+            Focus position (m)
+            Focus level
+            Focus confidence
+    """
+    if len(surface) > 0:
+        z_pred = surface.predict(*pos)
+        est_rng = (z_pred - margin, z_pred + margin)
+    else:
+        est_rng = rng_focus
+    f = model.ProgressiveFuture(remaining_time=estimateAutoFocusTime(detector, emt, focus, dfbkg, good_focus,
+                                                                     est_rng))
+    f._autofocus_state = RUNNING
+    f._autofocus_lock = threading.Lock()
+    f.task_canceller = _CancelAutoFocus
+
+    executeAsyncTask(f, _DoPredictiveFocus,
+                     args=(f, detector, emt, focus, dfbkg, surface, pos, good_focus, rng_focus,
+                           margin, roi_shape))
+    return f
+
+
 def AutoFocusSpectrometer(
         spectrograph: model.Actuator,
         focuser: model.Actuator,
@@ -114,8 +114,25 @@ def MeasureShift(previous_img, current_img, precision=1):
     assert previous_img.shape == current_img.shape, "Prev shape %s != new shape %s" % (
         previous_img.shape, current_img.shape)
 
-    previous_fft = fft.fft2(previous_img)
-    current_fft = fft.fft2(current_img)
+    return MeasureShiftFFT(fft.fft2(previous_img), fft.fft2(current_img), precision)
+
+
+def MeasureShiftFFT(previous_fft, current_fft, precision=1):
+    """
+    Same as MeasureShift(), but from the Fourier transforms of the images, as
+    returned by numpy.fft.fft2(). This allows computing the transform of an image
+    only once, when it's compared to several other images.
+    previous_fft (numpy.array of complex): 2d Fourier transform of the previous frame
+    current_fft (numpy.array of complex): 2d Fourier transform of the last frame,
+      must be of same shape as previous_fft
+    precision (1<=int): Calculate drift within 1/precision of a pixel
+    returns (tuple of floats): Drift in pixels (horizontal, vertical).
+    """
+    if precision < 1:
+        raise ValueError("Precision cannot be less than 1, got %s." % (precision,))
+    assert previous_fft.shape == current_fft.shape, "Prev shape %s != new shape %s" % (
+        previous_fft.shape, current_fft.shape)
+
     shape = previous_fft.shape
     m, n = previous_fft.shape
     image_product = previous_fft * current_fft.conj()
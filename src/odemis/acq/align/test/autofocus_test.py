@@ -29,14 +29,17 @@ from odemis.dataio import tiff
 from odemis import model, acq
 import odemis
 from odemis.acq import align, stream
-from odemis.acq.align.autofocus import Sparc2AutoFocus, MTD_BINARY
+from odemis.acq.align.autofocus import Sparc2AutoFocus, MTD_BINARY, MTD_EXHAUSTIVE
 from odemis.dataio import hdf5
 from odemis.util import testing, timeout, img
 import os
 from scipy import ndimage
 import time
 import unittest
+from unittest import mock
 from odemis.acq import path
+from odemis.driver import simcam, simulated
+from odemis.util.focus import FocusSurface
 
 
 # logging.basicConfig(format=" - %(levelname)s \t%(message)s")
@@ -620,5 +623,78 @@ class TestAutofocus1d(unittest.TestCase):
         numpy.testing.assert_allclose(foc_pos, self._good_focus, atol=2.5e-5)
 
 
+class TestPredictiveAutoFocus(unittest.TestCase):
+    """
+    Compare the predictive autofocus with the exhaustive autofocus, on a simulated
+    tilted sample acquired as tiles.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.focus = simulated.Stage(name="focus", role="focus", axes=["z"], ranges={"z": [0, 200e-6]})
+        cls.focus.moveAbsSync({"z": 100e-6})
+        cls.ccd = simcam.Camera(name="camera", role="ccd", image="andorcam2-fake-clara.tiff",
+                                dependencies={"focus": cls.focus})
+        cls.ccd.exposureTime.value = cls.ccd.exposureTime.range[0]
+        cls.rng_focus = (50e-6, 150e-6)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ccd.terminate()
+        cls.focus.terminate()
+
+    def _z_sample(self, x, y):
+        """
+        return (float): the good focus position of the (tilted) sample at the given stage position
+        """
+        return 100e-6 + 0.02 * x - 0.01 * y
+
+    def _run_tiles(self, method, n_tiles):
+        """
+        Autofocus on each tile of a grid
+        method (str): "exhaustive" or "predictive"
+        n_tiles (int, int): number of tiles in X and Y
+        return (float, list of int): maximum error of the focus position (m),
+          number of focus steps (ie, moves of the focuser) for each tile
+        """
+        surface = FocusSurface()
+        tile_size = 500e-6  # m
+        max_err = 0
+        steps = []
+        for iy in range(n_tiles[1]):
+            for ix in range(n_tiles[0]):
+                x, y = ix * tile_size, iy * tile_size
+                z_good = self._z_sample(x, y)
+                self.ccd.updateMetadata({model.MD_FAV_POS_ACTIVE: {"z": z_good}})
+                with mock.patch.object(self.focus, "moveAbs", wraps=self.focus.moveAbs) as move:
+                    if method == "exhaustive":
+                        f = align.AutoFocus(self.ccd, None, self.focus, good_focus=100e-6,
+                                            rng_focus=self.rng_focus, method=MTD_EXHAUSTIVE)
+                    else:
+                        f = align.PredictiveAutoFocus(self.ccd, None, self.focus, surface, (x, y),
+                                                      good_focus=100e-6, rng_focus=self.rng_focus)
+                    foc_pos, _, _ = f.result(timeout=900)
+                logging.debug("Tile %dx%d: found focus at %g, good focus at %g, in %d steps",
+                              ix, iy, foc_pos, z_good, move.call_count)
+                max_err = max(max_err, abs(foc_pos - z_good))
+                steps.append(move.call_count)
+        return max_err, steps
+
+    @timeout(1000)
+    def test_focus_steps(self):
+        """
+        The predictive autofocus should need fewer focus steps than the exhaustive one,
+        once the focus of a few tiles is known.
+        """
+        # The exhaustive autofocus always scans the whole range, so one tile is representative
+        err_exh, steps_exh = self._run_tiles("exhaustive", (1, 1))
+        err_pred, steps_pred = self._run_tiles("predictive", (3, 3))
+        logging.info("Exhaustive autofocus: %s steps, max error %g m. Predictive autofocus: %s steps, max error %g m.",
+                     steps_exh, err_exh, steps_pred, err_pred)
+        self.assertLess(err_pred, 5e-6)
+        # From the 4th tile, the focus is predicted from the surface fitted on the previous tiles
+        for s in steps_pred[3:]:
+            self.assertLess(s, steps_exh[0])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -22,7 +22,7 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 import math
 from numpy import fft
 import numpy
-from odemis.acq.align.shift import MeasureShift
+from odemis.acq.align.shift import MeasureShift, MeasureShiftFFT
 from odemis.dataio import hdf5
 import os
 import unittest
@@ -129,6 +129,17 @@ class TestMeasureShift(unittest.TestCase):
         drift = MeasureShift(self.data[0], self.data_random_drifted, 1000)
         numpy.testing.assert_almost_equal(drift, (self.deltac, self.deltar), 3)
 
+    def test_fft_inputs(self):
+        """
+        Tests passing directly the Fourier transforms gives the same result
+        """
+        ref_fft = fft.fft2(self.data[0])
+        for img in (self.data[0], self.data_drifted[0], self.data_random_drifted):
+            for precision in (1, 10):
+                exp_drift = MeasureShift(self.data[0], img, precision)
+                drift = MeasureShiftFFT(ref_fft, fft.fft2(img), precision)
+                self.assertEqual(drift, exp_drift)
+
     def test_identical_inputs_noisy(self):
         """
         Tests for input of identical images after noise is added.
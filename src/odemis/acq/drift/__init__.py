@@ -27,9 +27,10 @@ import threading
 
 import numpy
 import cv2
+from numpy import fft
 
 from odemis import model
-from odemis.acq.align.shift import MeasureShift
+from odemis.acq.align.shift import MeasureShift, MeasureShiftFFT
 
 MIN_RESOLUTION = (20, 20)  # sometimes 8x8 works, but it's not reliable enough
 MAX_PIXELS = 128 ** 2  # px
@@ -72,6 +73,8 @@ class AnchoredEstimator(object):
         self.max_drift = (0, 0)  # in sem px
 
         self.raw = []  # first 2 and last 2 anchor areas acquired (in order)
+        # Fourier transforms of the anchor areas, so that each of them is computed only once
+        self._spectra = {}  # id of an image in .raw -> (image, FFT)
         self._acq_sem_complete = threading.Event()
 
         # Calculate initial translation for anchor region acquisition
@@ -124,21 +127,13 @@ class AnchoredEstimator(object):
         """
         Scan the anchor area
         """
-        # Save current SEM settings
-        cur_dwell_time = self._emitter.dwellTime.value
-        cur_scale = self._emitter.scale.value
-        cur_resolution = self._emitter.resolution.value
-        cur_trans = self._emitter.translation.value
-
-        try:
-            self._updateScannerSettings()
-            logging.debug("Beam spot to anchor region: %s",
-                          self._emitter.translation.value)
-            logging.debug("Scanning anchor region with resolution "
+        # Save current SEM settings, and restore them afterwards
+        with model.PreservedVAs(self._emitter, ("dwellTime", "scale", "resolution", "translation")):
+            settings = self._updateScannerSettings()
+            logging.debug("Scanning anchor region at %s with resolution "
                           "%s and dwelltime %s and scale %s",
-                          self._emitter.resolution.value,
-                          self._emitter.dwellTime.value,
-                          self._emitter.scale.value)
+                          settings["translation"], settings["resolution"],
+                          settings["dwellTime"], settings["scale"])
             data = self._semd.data.get(asap=False)
             if data.shape[::-1] != self._res:
                 logging.warning("Shape of data is %s instead of %s", data.shape[::-1], self._res)
@@ -151,12 +146,6 @@ class AnchoredEstimator(object):
             else:
                 self.raw = self.raw[0:2]
             self.raw.append(data)
-        finally:
-            # Restore scanner settings
-            self._emitter.dwellTime.value = cur_dwell_time
-            self._emitter.scale.value = cur_scale
-            self._emitter.resolution.value = cur_resolution
-            self._emitter.translation.value = cur_trans
 
     def estimate(self):
         """
@@ -175,11 +164,15 @@ class AnchoredEstimator(object):
             # include also the drift of the previous image.
             # Also, MeasureShift return the shift in image pixels, which is
             # different (usually bigger) from the SEM px.
-            prev_drift = MeasureShift(self.raw[-2], self.raw[-1], 10)
+            # The spectra of the first and previous images were already computed
+            # during the previous estimations, so only the current one is new.
+            self._update_spectra()
+            cur_fft = self._spectra[id(self.raw[-1])][1]
+            prev_drift = MeasureShiftFFT(self._spectra[id(self.raw[-2])][1], cur_fft, 10)
             prev_drift = (prev_drift[0] * self._scale[0] + self.drift[0],
                           prev_drift[1] * self._scale[1] + self.drift[1])
 
-            orig_drift = MeasureShift(self.raw[0], self.raw[-1], 10)
+            orig_drift = MeasureShiftFFT(self._spectra[id(self.raw[0])][1], cur_fft, 10)
             self.drift = (orig_drift[0] * self._scale[0],
                           orig_drift[1] * self._scale[1])
             logging.debug("Current drift: %s", self.drift)
@@ -201,6 +194,20 @@ class AnchoredEstimator(object):
 
         return self.drift
 
+    def _update_spectra(self):
+        """
+        Compute the Fourier transform of the images in .raw which don't have one
+        yet, and forget the ones of the images not in .raw anymore.
+        """
+        # Note: as the cache holds a reference to each image, the ids cannot be reused
+        spectra = {}
+        for im in self.raw:
+            if id(im) in self._spectra:
+                spectra[id(im)] = self._spectra[id(im)]
+            else:
+                spectra[id(im)] = (im, fft.fft2(im))
+        self._spectra = spectra
+
     def estimateAcquisitionTime(self):
         """
         return (float): estimated time to acquire 1 anchor area
@@ -255,6 +262,7 @@ class AnchoredEstimator(object):
         """
         Update the scanning area of the SEM according to the anchor region
         for drift correction.
+        return (dict str -> value): the settings actually used by the SEM
         """
 
         if self._follow_drift:
@@ -269,11 +277,11 @@ class AnchoredEstimator(object):
                 logging.warning("Generated image may be incorrect due to extensive "
                                 "drift of %s clipped to %s", trans, self._trans)
 
-        # always in this order
-        self._emitter.scale.value = self._scale
-        self._emitter.resolution.value = self._res
-        self._emitter.translation.value = self._trans
-        self._emitter.dwellTime.value = self._dwell_time
+        # All set at once, in the order scale, resolution, translation, dwell time
+        return self._emitter.setVAValues({"scale": self._scale,
+                                          "resolution": self._res,
+                                          "translation": self._trans,
+                                          "dwellTime": self._dwell_time})
 
 
 def GuessAnchorRegion(whole_img, sample_region):
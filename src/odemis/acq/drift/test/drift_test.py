@@ -17,7 +17,7 @@ You should have received a copy of the GNU General Public License along with Ode
 import itertools
 import logging
 import numpy
-from odemis.acq.drift import AnchoredEstimator, GuessAnchorRegion, MIN_RESOLUTION, MAX_PIXELS
+from odemis.acq.drift import AnchoredEstimator, GuessAnchorRegion, MIN_RESOLUTION, MAX_PIXELS, MeasureShift
 from odemis.dataio import hdf5
 from odemis.driver import simsem
 import os
@@ -57,8 +57,11 @@ class TestAnchoredEstimator(unittest.TestCase):
         # the acquired region should follow min_resolution and max_pixels settings
         region = (0, 0, 0.1, 0.1)
         dwellTime = 5e-6
+        orig_settings = self.scanner.getVAValues(("dwellTime", "scale", "resolution", "translation"))
         ac = AnchoredEstimator(self.scanner, self.detector, region, dwellTime)
         ac.acquire()
+        # The scanner settings should be back to the original ones
+        self.assertEqual(self.scanner.getVAValues(list(orig_settings)), orig_settings)
         acquired_data = ac.raw[0]
         acquired_res = acquired_data.shape
         total_pixels = numpy.prod(acquired_res)
@@ -85,6 +88,22 @@ class TestAnchoredEstimator(unittest.TestCase):
                        self._trans_range[1][1] - self._trans_range[0][1])
         self.assertLessEqual(calculated_drift, translation)
 
+    def test_estimate_series(self):
+        """
+        Tests the drift estimated over many acquisitions matches the direct measurement
+        """
+        region = (0.1, 0.1, 0.2, 0.2)
+        dwellTime = 1e-6
+        ac = AnchoredEstimator(self.scanner, self.detector, region, dwellTime, follow_drift=False)
+        for i in range(6):
+            ac.acquire()
+            drift = ac.estimate()
+            if i > 0:
+                orig_drift = MeasureShift(ac.raw[0], ac.raw[-1], 10)
+                self.assertEqual(drift, (orig_drift[0] * ac._scale[0], orig_drift[1] * ac._scale[1]))
+                # Only the spectra of the images still in use are kept
+                self.assertEqual(len(ac._spectra), len(ac.raw))
+
     def test_updateScannerSettings(self):
         """
         Tests the change in SEM settings by changing the values indirectly
@@ -15,7 +15,8 @@ Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRAN
 You should have received a copy of the GNU General Public License along with Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 from odemis.acq.stitching._constants import REGISTER_GLOBAL_SHIFT, REGISTER_SHIFT, \
-    REGISTER_IDENTITY, WEAVER_MEAN, WEAVER_COLLAGE, WEAVER_COLLAGE_REVERSE
+    REGISTER_IDENTITY, REGISTER_BATCH_SHIFT, WEAVER_MEAN, WEAVER_COLLAGE, WEAVER_COLLAGE_REVERSE, \
+    WEAVER_MEAN_MEMMAP
 from odemis.acq.stitching._tiledacq import (acquireTiledArea, acquireOverview, estimateOverviewTime,
                                             estimateTiledAcquisitionTime, estimateTiledAcquisitionMemory,
                                             FocusingMethod, get_zstack_levels, get_tiled_bboxes, get_stream_based_bbox,
@@ -21,6 +21,8 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 REGISTER_IDENTITY = 0
 REGISTER_SHIFT = 1
 REGISTER_GLOBAL_SHIFT = 2
+REGISTER_BATCH_SHIFT = 3  # Same as REGISTER_GLOBAL_SHIFT, but faster and with a least-squares fit
 WEAVER_MEAN = 0
 WEAVER_COLLAGE = 1
 WEAVER_COLLAGE_REVERSE = 2
+WEAVER_MEAN_MEMMAP = 3  # Same as WEAVER_MEAN, but with the image stored on disk
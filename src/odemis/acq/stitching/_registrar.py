@@ -30,11 +30,14 @@ content, in other words performing "image registration".
 
 import logging
 import math
+import os
 from collections import deque
 
 import numpy
-from scipy.sparse import csr_matrix
+import scipy.fft
+from scipy.sparse import coo_matrix, csr_matrix
 from scipy.sparse.csgraph import minimum_spanning_tree
+from scipy.sparse.linalg import lsqr
 
 from odemis import model
 from odemis.acq.drift import MeasureShift
@@ -591,15 +594,15 @@ class GlobalShiftRegistrar(ShiftRegistrar):
         self.acq_order.append([row, col])
         return row, col
 
-    def _get_shift(self, prev_tile, tile):
+    def _get_overlap_rois(self, prev_tile, tile):
         """
-        Calculates the shift  between the two tiles. It also returns an error metric based on the
-        normalized cross-correlation (ncc).
+        Computes the regions of the two tiles which are expected to overlap, based on their metadata.
 
         :param prev_tile: (DataArray) static tile to which other tile is compared
         :param tile: (DataArray) shifted tile
-        :returns: ((float, float), float) x shift, y shift, normalized cross correlation (-1 <= ncc <= 1, higher
-        is better)
+        :returns: ((float, float), (4 ints), (4 ints)) expected distance between the tiles in px (x, y),
+        top, bottom, left, right of the overlapping region in prev_tile, and the same in tile
+        :raises ValueError: if the tiles are not expected to overlap
         """
         px_size = tile.metadata[model.MD_PIXEL_SIZE]
         # The y-axis of the reference coordinate system used here is inverted compared to
@@ -625,6 +628,20 @@ class GlobalShiftRegistrar(ShiftRegistrar):
             t1, b1 = int(exp_tile_dist_px[1]), tile.shape[0]
             t2, b2 = 0, tile.shape[0] - int(exp_tile_dist_px[1])
 
+        return exp_tile_dist_px, (t1, b1, l1, r1), (t2, b2, l2, r2)
+
+    def _get_shift(self, prev_tile, tile):
+        """
+        Calculates the shift  between the two tiles. It also returns an error metric based on the
+        normalized cross-correlation (ncc).
+
+        :param prev_tile: (DataArray) static tile to which other tile is compared
+        :param tile: (DataArray) shifted tile
+        :returns: ((float, float), float) x shift, y shift, normalized cross correlation (-1 <= ncc <= 1, higher
+        is better)
+        """
+        exp_tile_dist_px, (t1, b1, l1, r1), (t2, b2, l2, r2) = self._get_overlap_rois(prev_tile, tile)
+
         # TODO should we take a larger area?
         prev_tile_roi = numpy.array(prev_tile)[t1:b1, l1:r1]
         tile_roi = numpy.array(tile)[t2:b2, l2:r2]
@@ -632,11 +649,28 @@ class GlobalShiftRegistrar(ShiftRegistrar):
         # If you need to crop the tile without changing the output shift,
         # you can do it here with the pattern tile_roi[t:-b, l:-r]
         meas_tile_dist_px = MeasureShift(tile_roi, prev_tile_roi)
+
+        avg = numpy.average(prev_tile), numpy.average(tile)
+        return self._evaluate_shift(prev_tile_roi, tile_roi, avg, exp_tile_dist_px, meas_tile_dist_px, tile.shape)
+
+    @staticmethod
+    def _evaluate_shift(prev_tile_roi, tile_roi, avg, exp_tile_dist_px, meas_tile_dist_px, shape):
+        """
+        Computes the shift to apply to the tile, and checks how reliable it is.
+
+        :param prev_tile_roi: (ndarray) overlapping region in the static tile
+        :param tile_roi: (ndarray) overlapping region in the shifted tile
+        :param avg: (float, float) average value of the static tile and shifted tile
+        :param exp_tile_dist_px: (float, float) expected distance between the tiles (x, y)
+        :param meas_tile_dist_px: (float, float) distance measured in the overlapping regions (x, y)
+        :param shape: (int, int) shape of the tiles
+        :returns: ((float, float), float) x shift, y shift, normalized cross correlation (-1 <= ncc <= 1, higher
+        is better)
+        """
         # How much to shift the tile relative to the metadata position
         shift_px = numpy.subtract(exp_tile_dist_px, meas_tile_dist_px)
 
         # Measure accuracy (ncc value)
-        avg = numpy.average(prev_tile), numpy.average(tile)
         diff = prev_tile_roi - avg[0], tile_roi - avg[1]
         covar = numpy.sum(diff[0] * diff[1]) / prev_tile_roi.size
         var = numpy.sum(diff[0] ** 2) / prev_tile_roi.size, numpy.sum(diff[1] ** 2) / tile_roi.size
@@ -649,7 +683,7 @@ class GlobalShiftRegistrar(ShiftRegistrar):
         # The axis with the largest exp_tile_dist_px is the axis along which the tiles are shifted.
         shifted_axis = numpy.argmax(exp_tile_dist_px)
         # tile.shape is YX, so reverse it
-        overlap = numpy.abs(numpy.subtract(tile.shape[::-1], numpy.abs(exp_tile_dist_px)))[shifted_axis]
+        overlap = numpy.abs(numpy.subtract(shape[::-1], numpy.abs(exp_tile_dist_px)))[shifted_axis]
         # Typically, the side of the overlapping area of the non-shifted axis is longer than that of the shifted axis.
         # Because of that the measured shift along that axis can be very high. It is expected that along the
         # non-shifted axis the measured shift is close to zero and along the shifted axis it should be smaller than the
@@ -765,3 +799,196 @@ class GlobalShiftRegistrar(ShiftRegistrar):
                         idx_queue.append(next_idx)
 
         return positions
+
+
+class BatchShiftRegistrar(GlobalShiftRegistrar):
+    """
+    Same approach as the GlobalShiftRegistrar (cross-correlation of each tile with all its
+    neighbours), but faster, and the global positions are found by a least-squares fit:
+    * When a tile is added, the shifts with all its (already added) neighbours are computed
+      together: the overlapping regions are transformed in a single batch of real FFTs, which
+      can run in multiple threads.
+    * The overlapping regions are directly used from the tiles (without copying the whole tile),
+      and the average of each tile is only computed once.
+    * The final positions are the weighted least-squares solution of all the measured shifts
+      (weighted by the normalized cross-correlation), using a sparse solver. So every measurement
+      contributes, and errors are spread over the whole mosaic, instead of accumulating along a
+      single path.
+    """
+
+    def __init__(self, workers=None):
+        """
+        :param workers: (int or None) number of threads used to compute the FFTs. If None,
+        all the CPUs are used.
+        """
+        super().__init__()
+        self._workers = workers or os.cpu_count() or 1
+        self._tile_avg = {}  # id(tile) -> float: average value of each tile
+
+    def _insert_tile_to_grid(self, tile):
+        row, col = super()._insert_tile_to_grid(tile)
+        # The average is used for every overlap of the tile, so only compute it once
+        self._tile_avg[id(tile)] = numpy.average(tile)
+        return row, col
+
+    def _compute_registration(self, tile, row, col):
+        """
+        Performs registration of the tile at grid position row, col with respect to every
+        available neighbour, all at once. The computed shifts and the respective
+        cross-correlation values are stored in self.shifts_hor and self.shifts_ver.
+
+        :param row: (int) row index
+        :param col: (int) col index
+        :updates self.shifts_hor, self.shifts_ver:
+        """
+        num_cols = len(self.tiles[0])
+        num_rows = len(self.tiles)
+
+        # List of shift tables, index, tiles to compare for all the neighbours which are not registered yet
+        pairs = []
+        if col > 0 and self.tiles[row][col - 1] is not None and self.shifts_hor[row][col - 1] is None:
+            pairs.append((self.shifts_hor[row], col - 1, self.tiles[row][col - 1], tile))
+        if col < num_cols - 1 and self.tiles[row][col + 1] is not None and self.shifts_hor[row][col] is None:
+            pairs.append((self.shifts_hor[row], col, tile, self.tiles[row][col + 1]))
+        if row > 0 and self.tiles[row - 1][col] is not None and self.shifts_ver[row - 1][col] is None:
+            pairs.append((self.shifts_ver[row - 1], col, self.tiles[row - 1][col], tile))
+        if row < num_rows - 1 and self.tiles[row + 1][col] is not None and self.shifts_ver[row][col] is None:
+            pairs.append((self.shifts_ver[row], col, tile, self.tiles[row + 1][col]))
+
+        shifts = self._get_shifts([(prev_tile, t) for _, _, prev_tile, t in pairs])
+        for (table, idx, _, _), s in zip(pairs, shifts):
+            table[idx] = s
+
+    def _get_shifts(self, pairs):
+        """
+        Calculates the shift between every pair of tiles, like _get_shift(), but in batch.
+
+        :param pairs: (list of (DataArray, DataArray)) the static tile and the shifted tile
+        :returns: (list of ((float, float), float)) for each pair: x shift, y shift, normalized
+        cross correlation (-1 <= ncc <= 1, higher is better)
+        """
+        rois = []
+        for prev_tile, tile in pairs:
+            exp_tile_dist_px, (t1, b1, l1, r1), (t2, b2, l2, r2) = self._get_overlap_rois(prev_tile, tile)
+            prev_tile_roi = numpy.asarray(prev_tile)[t1:b1, l1:r1]
+            tile_roi = numpy.asarray(tile)[t2:b2, l2:r2]
+            rois.append((exp_tile_dist_px, prev_tile_roi, tile_roi))
+
+        # Group the regions by shape, so that they can be processed together
+        meas_tile_dist_px = [None] * len(pairs)
+        shapes = {r[1].shape for r in rois}
+        for shape in shapes:
+            idxs = [i for i, r in enumerate(rois) if r[1].shape == shape]
+            for i, m in zip(idxs, self._measure_shifts([rois[i][2] for i in idxs],
+                                                       [rois[i][1] for i in idxs])):
+                meas_tile_dist_px[i] = m
+
+        shifts = []
+        for (prev_tile, tile), (exp_tile_dist_px, prev_tile_roi, tile_roi), meas in zip(pairs, rois, meas_tile_dist_px):
+            avg = self._tile_avg[id(prev_tile)], self._tile_avg[id(tile)]
+            shifts.append(self._evaluate_shift(prev_tile_roi, tile_roi, avg, exp_tile_dist_px, meas, tile.shape))
+
+        return shifts
+
+    def _measure_shifts(self, previous_imgs, current_imgs):
+        """
+        Same as MeasureShift() (with precision = 1), on multiple pairs of images at once.
+
+        :param previous_imgs: (list of 2D ndarrays) first image of each pair
+        :param current_imgs: (list of 2D ndarrays) second image of each pair, same shape as the first images
+        :returns: (list of (float, float)) drift in pixels (horizontal, vertical) of each pair
+        """
+        n = len(previous_imgs)
+        shape = previous_imgs[0].shape
+        imgs = numpy.empty((2 * n,) + shape, dtype=numpy.float32)
+        for i, im in enumerate(previous_imgs + current_imgs):
+            imgs[i] = im
+
+        # The images are real, so only half of the (symmetric) spectrum is needed
+        ffts = scipy.fft.rfft2(imgs, workers=self._workers)
+        image_product = ffts[:n] * ffts[n:].conj()
+        eps = numpy.finfo(image_product.real.dtype).eps
+        image_product /= numpy.maximum(numpy.abs(image_product), 100 * eps)
+        cross_correlation = scipy.fft.irfft2(image_product, s=shape, workers=self._workers)
+
+        midpoints = numpy.array([numpy.fix(axis_size / 2) for axis_size in shape])
+        drifts = []
+        for cc in cross_correlation:
+            maxima = numpy.unravel_index(numpy.argmax(numpy.abs(cc)), shape)
+            shifts = numpy.array(maxima, dtype=numpy.float64)
+            shifts[shifts > midpoints] -= numpy.array(shape)[shifts > midpoints]
+            drifts.append((shifts[1], shifts[0]))
+
+        return drifts
+
+    def _assemble_mosaic(self):
+        """
+        Finds the positions which best fit all the shifts measured between the tiles, using
+        a weighted (sparse) least-squares solver.
+
+        :returns: (numpy array with shape: num_rows x num_cols x 2) registered positions relative to the upper left
+        tile in pixels
+        """
+        num_cols = len(self.tiles[0])
+        num_rows = len(self.tiles)
+
+        # Each tile present (except the first one, fixed at 0,0) is a variable
+        first_pos = self.tiles[0][0].metadata[model.MD_POS]
+        var_idx = {}  # (row, col) -> index of the variable
+        for row in range(num_rows):
+            for col in range(num_cols):
+                if (row, col) != (0, 0) and self.tiles[row][col] is not None:
+                    var_idx[(row, col)] = len(var_idx)
+
+        # Each shift is an equation: pos(tile) - pos(previous tile) = shift
+        edges = []  # (previous tile, tile), shift, ncc
+        for row in range(num_rows):
+            for col in range(num_cols - 1):
+                if self.shifts_hor[row][col]:
+                    edges.append((((row, col), (row, col + 1)),) + tuple(self.shifts_hor[row][col]))
+        for row in range(num_rows - 1):
+            for col in range(num_cols):
+                if self.shifts_ver[row][col]:
+                    edges.append((((row, col), (row + 1, col)),) + tuple(self.shifts_ver[row][col]))
+
+        rows, cols, vals = [], [], []
+        targets = []
+        weights = []
+        for eq, ((prev_rc, rc), shift, ncc) in enumerate(edges):
+            if prev_rc in var_idx:
+                rows.append(eq)
+                cols.append(var_idx[prev_rc])
+                vals.append(-1)
+            if rc in var_idx:
+                rows.append(eq)
+                cols.append(var_idx[rc])
+                vals.append(1)
+            targets.append(shift)
+            # A bad match only has very little influence (but it's still better than nothing)
+            weights.append(max(ncc, 0) ** 2 + 1e-3)
+
+        # Also add a very weak "prior" on the expected position of each tile, to make sure
+        # that every tile has a position, even if it's not connected to the first one.
+        for (row, col), i in var_idx.items():
+            md_pos = self.tiles[row][col].metadata[model.MD_POS]
+            rows.append(len(targets))
+            cols.append(i)
+            vals.append(1)
+            targets.append(((md_pos[0] - first_pos[0]) / self.px_size[0],
+                            -(md_pos[1] - first_pos[1]) / self.px_size[1]))
+            weights.append(1e-6)
+
+        positions = numpy.zeros((num_rows, num_cols, 2))  # start with no shift for each tile
+        if not var_idx:
+            return positions
+
+        sqrt_w = numpy.sqrt(weights)
+        a = coo_matrix((numpy.array(vals, dtype=float) * sqrt_w[rows], (rows, cols)),
+                       shape=(len(targets), len(var_idx))).tocsr()
+        targets = numpy.array(targets, dtype=float) * sqrt_w[:, numpy.newaxis]
+        for ax in range(2):
+            sol = lsqr(a, targets[:, ax], atol=1e-12, btol=1e-12)[0]
+            for (row, col), i in var_idx.items():
+                positions[row, col, ax] = sol[i]
+
+        return positions
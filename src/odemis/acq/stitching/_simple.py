@@ -16,48 +16,63 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 import copy
 from odemis import model
+from odemis.dataio import tiff
 from odemis.acq.stitching._constants import REGISTER_GLOBAL_SHIFT, REGISTER_SHIFT, \
-    REGISTER_IDENTITY, WEAVER_MEAN, WEAVER_COLLAGE, WEAVER_COLLAGE_REVERSE
-from odemis.acq.stitching._registrar import ShiftRegistrar, IdentityRegistrar, GlobalShiftRegistrar
-from odemis.acq.stitching._weaver import MeanWeaver, CollageWeaver, CollageWeaverReverse
+    REGISTER_IDENTITY, REGISTER_BATCH_SHIFT, WEAVER_MEAN, WEAVER_COLLAGE, WEAVER_COLLAGE_REVERSE, \
+    WEAVER_MEAN_MEMMAP
+from odemis.acq.stitching._registrar import ShiftRegistrar, IdentityRegistrar, GlobalShiftRegistrar, \
+    BatchShiftRegistrar
+from odemis.acq.stitching._weaver import MeanWeaver, CollageWeaver, CollageWeaverReverse, MemmapMeanWeaver
 
 
-def register(tiles, method=REGISTER_GLOBAL_SHIFT):
+def get_registrar(method=REGISTER_GLOBAL_SHIFT):
     """
-    tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles to compute the registration.
-    If it's tuples, the first tile of each tuple is the “main tile”, and the following ones are
-    dependent tiles.
-    method (REGISTER_*): REGISTER_SHIFT → ShiftRegistrar, REGISTER_IDENTITY → IdentityRegistrar
-    returns:
-        tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles as passed, but with updated
-        MD_POS metadata
+    method (REGISTER_*): REGISTER_SHIFT → ShiftRegistrar, REGISTER_IDENTITY → IdentityRegistrar,
+      REGISTER_GLOBAL_SHIFT → GlobalShiftRegistrar, REGISTER_BATCH_SHIFT → BatchShiftRegistrar
+    returns (Registrar): a new registrar, ready to receive tiles
+    raises ValueError: if the method is unknown
     """
-
     if method == REGISTER_SHIFT:
-        registrar = ShiftRegistrar()
+        return ShiftRegistrar()
     elif method == REGISTER_IDENTITY:
-        registrar = IdentityRegistrar()
+        return IdentityRegistrar()
     elif method == REGISTER_GLOBAL_SHIFT:
-        registrar = GlobalShiftRegistrar()
+        return GlobalShiftRegistrar()
+    elif method == REGISTER_BATCH_SHIFT:
+        return BatchShiftRegistrar()
     else:
         raise ValueError("Invalid registrar %s" % (method,))
 
-    # Register tiles
-    updatedTiles = []
-    for ts in tiles:
-        # Separate tile and dependent_tiles
-        if isinstance(ts, tuple):
-            tile = ts[0]
-            dep_tiles = ts[1:]
-        else:
-            tile = ts
-            dep_tiles = None
-        registrar.addTile(tile, dep_tiles)
 
-    # Compute the positions
-    positions, dep_positions = registrar.getPositions()
+def add_tile(registrar, ts):
+    """
+    Pass one tile to the registrar.
+    registrar (Registrar): the registrar, as returned by get_registrar()
+    ts (DataArray of shape YX or tuple of DataArrays): the tile. If it's a tuple,
+      the first DataArray is the "main tile", and the following ones are dependent tiles.
+    """
+    # Separate tile and dependent_tiles
+    if isinstance(ts, tuple):
+        tile = ts[0]
+        dep_tiles = ts[1:]
+    else:
+        tile = ts
+        dep_tiles = None
+    registrar.addTile(tile, dep_tiles)
+
 
+def update_positions(tiles, positions, dep_positions):
+    """
+    Set the registered positions on the tiles.
+    tiles (list of DataArray of shape YX or tuples of DataArrays): the tiles, in
+      the same order as they were passed to the registrar
+    positions, dep_positions: as returned by Registrar.getPositions()
+    returns:
+        tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles as passed, but with updated
+        MD_POS metadata
+    """
     # Update positions, by creating DataArrays with the same data, but different MD_POS
+    updatedTiles = []
     for i, ts in enumerate(tiles):
         # Return tuple of positions if dependent tiles are present
         if isinstance(ts, tuple):
@@ -87,12 +102,38 @@ def register(tiles, method=REGISTER_GLOBAL_SHIFT):
     return updatedTiles
 
 
-def weave(tiles, method=WEAVER_MEAN, adjust_brightness=False):
+def register(tiles, method=REGISTER_GLOBAL_SHIFT):
+    """
+    tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles to compute the registration.
+    If it's tuples, the first tile of each tuple is the “main tile”, and the following ones are
+    dependent tiles.
+    method (REGISTER_*): REGISTER_SHIFT → ShiftRegistrar, REGISTER_IDENTITY → IdentityRegistrar
+    returns:
+        tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles as passed, but with updated
+        MD_POS metadata
+    """
+    registrar = get_registrar(method)
+
+    # Register tiles
+    for ts in tiles:
+        add_tile(registrar, ts)
+
+    # Compute the positions
+    positions, dep_positions = registrar.getPositions()
+
+    return update_positions(tiles, positions, dep_positions)
+
+
+def weave(tiles, method=WEAVER_MEAN, adjust_brightness=False, filename=None):
     """
     tiles (list of DataArray or DataArrayShadow of shape YX): The tiles to draw
-    method (WEAVER_*): WEAVER_MEAN → MeanWeaver, WEAVER_COLLAGE → CollageWeaver
+    method (WEAVER_*): WEAVER_MEAN → MeanWeaver, WEAVER_COLLAGE → CollageWeaver,
+      WEAVER_COLLAGE_REVERSE → CollageWeaverReverse, WEAVER_MEAN_MEMMAP → MemmapMeanWeaver
+    filename (str or None): if provided, the image is written, tile by tile, to
+      this (pyramidal) TIFF file, and it's returned as a DataArrayShadow of the
+      file. This avoids keeping the complete image in memory.
     return:
-        image (DataArray of shape Y'X'): A large image containing all the tiles
+        image (DataArray or DataArrayShadow of shape Y'X'): A large image containing all the tiles
     """
 
     if method == WEAVER_MEAN:
@@ -101,13 +142,35 @@ def weave(tiles, method=WEAVER_MEAN, adjust_brightness=False):
         weaver = CollageWeaver(adjust_brightness)
     elif method == WEAVER_COLLAGE_REVERSE:
         weaver = CollageWeaverReverse(adjust_brightness)
+    elif method == WEAVER_MEAN_MEMMAP:
+        weaver = MemmapMeanWeaver(adjust_brightness)
     else:
         raise ValueError("Invalid weaver %s" % (method,))
 
     for t in tiles:
-        if isinstance(t, model.DataArrayShadow):
-            t =  t.getData()
+        # The memmap weaver only reads the data when needed
+        if isinstance(t, model.DataArrayShadow) and not isinstance(weaver, MemmapMeanWeaver):
+            t = t.getData()
         weaver.addTile(t)
-    stitched_image = weaver.getFullImage()
 
-    return stitched_image
+    if filename:
+        if isinstance(weaver, MemmapMeanWeaver):
+            # Directly woven into the file, without ever having the complete image
+            return weaver.exportFullImage(filename)
+        _write_pyramid(filename, weaver.getFullImage())
+        return tiff.open_data(filename).content[0]
+
+    return weaver.getFullImage()
+
+
+def _write_pyramid(filename, image):
+    """
+    Write an image to a pyramidal TIFF file, one row of tiles at a time, so that
+    if the image is memory-mapped, it's never fully loaded in memory.
+    filename (str): path of the TIFF file to create
+    image (DataArray of shape YX): the image to write
+    """
+    with tiff.PyramidWriter(filename, image.shape, image.dtype, image.metadata) as writer:
+        ts = writer.tile_size
+        for top in range(0, image.shape[0], ts):
+            writer.write_region(0, top, image[top:top + ts])
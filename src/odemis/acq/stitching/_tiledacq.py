@@ -33,12 +33,11 @@ from typing import Dict, List, Optional, Tuple, Union
 import numpy
 import psutil
 from scipy.ndimage import binary_fill_holes
-from scipy.spatial import Delaunay
 from shapely.geometry import Polygon, box
 
 from odemis import dataio, model
 from odemis.acq import acqmng
-from odemis.acq.align.autofocus import MTD_EXHAUSTIVE, AutoFocus
+from odemis.acq.align.autofocus import PredictiveAutoFocus
 from odemis.acq.align.roi_autofocus import (
     autofocus_in_roi,
     estimate_autofocus_in_roi_time,
@@ -48,7 +47,7 @@ from odemis.acq.stitching._constants import (
     REGISTER_IDENTITY,
     WEAVER_MEAN,
 )
-from odemis.acq.stitching._simple import register, weave
+from odemis.acq.stitching._simple import add_tile, get_registrar, register, update_positions, weave
 from odemis.acq.stream import (
     ARStream,
     CLStream,
@@ -62,11 +61,11 @@ from odemis.acq.stream import (
 )
 from odemis.model import DataArray
 from odemis.util import dataio as udataio
-from odemis.util import img, linalg, rect_intersect
-from odemis.util.focus import MeasureOpticalFocus
+from odemis.util import img, rect_intersect
+from odemis.util.focus import FocusSurface, MeasureOpticalFocus
 from odemis.util.img import assembleZCube
 from odemis.util.linalg import generate_triangulation_points
-from odemis.util.raster import get_polygon_grid_cells, point_in_polygon
+from odemis.util.raster import get_polygon_grid_cells
 
 # TODO: Find a value that works fine with common cases
 # Ratio of the allowed difference of tile focus from good focus
@@ -105,7 +104,8 @@ class TiledAcquisitionTask(object):
 
     def __init__(self, streams, stage, region, overlap, settings_obs=None, log_path=None, future=None, zlevels=None,
                  registrar=REGISTER_GLOBAL_SHIFT, weaver=WEAVER_MEAN, focusing_method=FocusingMethod.NONE,
-                 focus_points=None, focus_range=None, centered_acq=True):
+                 focus_points=None, focus_range=None, centered_acq=True, pipelined=False,
+                 stitched_path=None):
         """
         :param streams: (list of Streams) the streams to acquire
         :param stage: (Actuator) the sample stage to move to the possible tiles locations
@@ -131,6 +131,13 @@ class TiledAcquisitionTask(object):
         :param centered_acq: (bool) If True, center the acquisition area on the given region; any extra area is added
             symmetrically to all sides of the bounding box. If False, the top-left of the acquisition area is aligned
             with the top-left of the bounding box.
+        :param pipelined: (bool) If True, each tile is registered in a separate thread, while the
+            next tiles are acquired. Only the final positioning and the weaving are left to do after
+            the last tile is acquired. If False, all the stitching is done after the acquisition.
+        :param stitched_path: (str or None) If provided, the stitched image of each stream is written
+            to a pyramidal TIFF file with this name (followed by the stream index, if there are
+            several streams), and the returned data is read from these files (as DataArrayShadows).
+            This avoids keeping the complete stitched images in memory.
         """
         self._future = future
         self._streams = streams
@@ -193,18 +200,20 @@ class TiledAcquisitionTask(object):
             # used in re-focusing method
             self._focus_points = numpy.array(focus_points) if focus_points else None
             # triangulate focus points
-            self._tri_focus_points = None
+            self._focus_points_surface = None
             if focus_points is not None:
-                if len(focus_points) >= 3:
-                    self._tri_focus_points = Delaunay(self._focus_points[:, :2])
-                elif len(focus_points) == 1:
-                    # Triangulation needs minimum three points to define a plane
-                    # When the number of focus points is less than three
-                    # The focus is set constant and based on a single focus point
-                    pass
+                # Triangulation needs minimum three points to define a plane
+                # When the number of focus points is less than three
+                # The focus is set constant and based on a single focus point
+                if len(focus_points) >= 3 or len(focus_points) == 1:
+                    self._focus_points_surface = FocusSurface(focus_points)
                 else:
                     raise ValueError(f"focus_points length {len(focus_points)} is not supported")
 
+            # Focus positions found by the autofocus on the previous tiles, to
+            # predict the focus position of the next tiles.
+            self._autofocus_surface = FocusSurface(focus_points or ())
+
         if focusing_method == FocusingMethod.MAX_INTENSITY_PROJECTION and not zlevels:
             raise ValueError("MAX_INTENSITY_PROJECTION requires zlevels, but none passed")
             # Note: we even allow if only one zlevels. It would not do MIP, but
@@ -251,7 +260,16 @@ class TiledAcquisitionTask(object):
 
         self._registrar = registrar
         self._weaver = weaver
-        self._focus_plane = {}
+        self._stitched_path = stitched_path
+
+        # Only useful if there is some stitching to do
+        self._pipelined = pipelined and registrar is not None and weaver is not None
+        # For the pipelined mode, the registration is done in a separate thread,
+        # as soon as each tile is acquired
+        self._register_executor = None
+        self._register_futures = []
+        self._tile_registrar = None
+        self._registration_failed = False
 
     def _convert_region_to_polygon(
             self,
@@ -690,6 +708,14 @@ class TiledAcquisitionTask(object):
         except ValueError:  # no current streams
             move_time = 0.5
 
+        if self._pipelined and self._number_of_tiles > 0:
+            # The registration of each tile runs while the next tiles are acquired,
+            # so it's hidden by the acquisition, apart from the last tile (and
+            # if it's slower than the acquisition).
+            stitch_time_last = stitch_time / self._number_of_tiles
+            overlapped_time = min(stitch_time - stitch_time_last, max(0, acq_time + move_time))
+            stitch_time -= overlapped_time
+
         logging.info(f"The computed time in seconds for tiled acquisition for {remaining} tiles for move is {move_time},"
                      f" acquisition is {acq_time}")
 
@@ -830,7 +856,9 @@ class TiledAcquisitionTask(object):
         # by stage to move to different indices also includes the time taken to move when scanning indices increase due
         # to increase in overlap. This means stitching time is included when move time between tiles is observed.
         # Hence, observed time due to stitching is set to zero
-        self._save_time["stitch"] = [0]
+        # In pipelined mode, the registration time of each tile is recorded instead.
+        if not self._pipelined:
+            self._save_time["stitch"] = [0]
         move_to_tile_start = None
         start_time = time.time()
 
@@ -869,59 +897,31 @@ class TiledAcquisitionTask(object):
                 self._save_tiles(ix, iy, das)
 
             # Sort tiles (largest sem on first position)
-            da_list.append(self._sortDAs(das, self._streams))
+            sorted_das = self._sortDAs(das, self._streams)
+            da_list.append(sorted_das)
             self._save_time["save"].append(time.time() - save_tile_start)
 
+            if self._register_executor is not None and sorted_das:
+                # Register the tile in the background, while moving to the next tile
+                f = self._register_executor.submit(self._registerTile, sorted_das)
+                self._register_futures.append(f)
+
             i += 1
             move_to_tile_start = time.time()
 
         return da_list
 
-    def _get_z_on_focus_plane(self, x, y):
-        if not self._focus_plane:
-            gamma, normal = linalg.fit_plane_lstsq(self._focus_points)
-            self._focus_plane["gamma"] = gamma
-            self._focus_plane["normal"] = normal
-        point_on_plane = (0, 0, self._focus_plane["gamma"])  # where the plane intersects with the z-axis
-        z = linalg.get_z_pos_on_plane(x, y, point_on_plane, self._focus_plane["normal"])
-        return z
-
     def _get_triangulated_focus_point(self, x, y):
-        """Triangulate focus points and get the z position of the xy-point in the corresponding focus-triangle."""
-
-        point_in_triangle = False
-        # Check in 2D if the point is in one of the triangles from the focus points
-        for simplex in self._tri_focus_points.simplices:
-            triangle = [self._focus_points[:, :2][simplex[0]],
-                        self._focus_points[:, :2][simplex[1]],
-                        self._focus_points[:, :2][simplex[2]]]
-            point_in_triangle = point_in_polygon([x, y], polygon=triangle)
-            if point_in_triangle:
-                break
-
-        if point_in_triangle is False:
-            # TODO determine a better way for dealing with points outside of the focused area, for instance
-            #  by using linear extrapolation.
-            logging.debug("Acquiring tile outside of focused area, will use plane fitting to find the focus.")
-            # If the point is not in one of the triangles fit a plane through all
-            # focus points and base the z position on that plane fit.
-            z = self._get_z_on_focus_plane(x, y)
-        else:
-            tr = [self._focus_points[simplex[0]],
-                  self._focus_points[simplex[1]],
-                  self._focus_points[simplex[2]]]
-
-            z = linalg.get_point_on_plane(x, y, tr)
-
-        return z
+        """
+        Triangulate focus points and get the z position of the xy-point in the corresponding focus-triangle.
+        Outside of the triangles, the z position is based on a plane fitted through all the focus points.
+        """
+        return self._focus_points_surface.predict(x, y)
 
     def _refocus(self):
         """Update the z-levels to fit the found focus positions"""
         current_pos = self._stage.position.value
-        if self._tri_focus_points:
-            z = self._get_triangulated_focus_point(current_pos["x"], current_pos["y"])
-        else:
-            z = self._focus_points[0][2]
+        z = self._get_triangulated_focus_point(current_pos["x"], current_pos["y"])
         logging.info(f"Found z focus: {z}")
         self._zlevels = self._get_zstack_levels(z)
 
@@ -1010,12 +1010,15 @@ class TiledAcquisitionTask(object):
             raise ValueError(f"Unexpected focusing method {self._focusing_method}")
 
         try:
-            self._future.running_subf = AutoFocus(self._focus_stream.detector,
-                                                  self._focus_stream.emitter,
-                                                  self._focus_stream.focuser,
-                                                  good_focus=self._good_focus,
-                                                  rng_focus=self._focus_rng,
-                                                  method=MTD_EXHAUSTIVE)
+            # Only search around the focus expected from the previous tiles (if any)
+            stage_pos = self._stage.position.value
+            self._future.running_subf = PredictiveAutoFocus(self._focus_stream.detector,
+                                                            self._focus_stream.emitter,
+                                                            self._focus_stream.focuser,
+                                                            self._autofocus_surface,
+                                                            (stage_pos["x"], stage_pos["y"]),
+                                                            good_focus=self._good_focus,
+                                                            rng_focus=self._focus_rng)
             _, focus_pos, _ = self._future.running_subf.result()  # blocks until autofocus is finished
 
             # Corner case where it started very badly: update the "good focus"
@@ -1036,6 +1039,52 @@ class TiledAcquisitionTask(object):
 
         return das
 
+    def _registerTile(self, das):
+        """
+        Add one tile to the registrar. Used in pipelined mode, and run in the
+        registration thread, while the next tiles are acquired.
+        :param das: (tuple of DataArrays) the data of the tile, as sorted by _sortDAs()
+        """
+        if self._future._task_state == CANCELLED or self._registration_failed:
+            return
+
+        register_start = time.time()
+        try:
+            add_tile(self._tile_registrar, das)
+        except ValueError as exp:
+            # Will fallback to the identity registrar at the end
+            logging.warning("Registration with %s failed %s. Will use identity registrar.", self._registrar, exp)
+            self._registration_failed = True
+        self._save_time["stitch"].append(time.time() - register_start)
+
+    def _registerTiles(self, da_list):
+        """
+        Compute the position of each tile
+        :param da_list: (list of tuples of DataArrays) the acquired data for each tile
+        :return: (list of tuples of DataArrays): same data as da_list, with updated MD_POS
+        """
+        if self._register_executor is not None:
+            # In pipelined mode, the tiles have already been passed to the registrar
+            # during the acquisition => wait for the last tile, and compute the final positions.
+            self._register_executor.shutdown(wait=True)
+            for f in self._register_futures:
+                f.result()  # To pass on any unexpected exception
+
+            if not self._registration_failed:
+                try:
+                    positions, dep_positions = self._tile_registrar.getPositions()
+                    return update_positions(da_list, positions, dep_positions)
+                except ValueError as exp:
+                    logging.warning("Registration with %s failed %s. Retrying with identity registrar.",
+                                    self._registrar, exp)
+            return register(da_list, method=REGISTER_IDENTITY)
+
+        try:
+            return register(da_list, method=self._registrar)
+        except ValueError as exp:
+            logging.warning("Registration with %s failed %s. Retrying with identity registrar.", self._registrar, exp)
+            return register(da_list, method=REGISTER_IDENTITY)
+
     def _stitchTiles(self, da_list):
         """
         Stitch the acquired tiles to create a complete view of the required total area
@@ -1044,27 +1093,37 @@ class TiledAcquisitionTask(object):
         st_data = []
         logging.info("Computing big image out of %d images", len(da_list))
 
-        # TODO: Do this registration step in a separate thread while acquiring
-        try:
-            das_registered = register(da_list, method=self._registrar)
-        except ValueError as exp:
-            logging.warning("Registration with %s failed %s. Retrying with identity registrar.", self._registrar, exp)
-            das_registered = register(da_list, method=REGISTER_IDENTITY)
+        das_registered = self._registerTiles(da_list)
 
         logging.info("Using weaving method %s.", self._weaver)
         # Weave every stream
         if isinstance(das_registered[0], tuple):
-            for s in range(len(das_registered[0])):
+            nstreams = len(das_registered[0])
+            for s in range(nstreams):
                 streams = []
                 for da in das_registered:
                     streams.append(da[s])
-                da = weave(streams, self._weaver)
+                da = weave(streams, self._weaver, filename=self._getStitchedFilename(s, nstreams))
                 st_data.append(da)
         else:
-            da = weave(das_registered, self._weaver)
+            da = weave(das_registered, self._weaver, filename=self._getStitchedFilename(0, 1))
             st_data.append(da)
         return st_data
 
+    def _getStitchedFilename(self, idx, nstreams):
+        """
+        :param idx: (int) index of the stream
+        :param nstreams: (int) total number of streams stitched
+        :return: (str or None) the file where to write the stitched image of the stream,
+          or None if the stitched image should stay in memory
+        """
+        if not self._stitched_path:
+            return None
+        if nstreams == 1:
+            return self._stitched_path
+        bs, ext = udataio.splitext(self._stitched_path)
+        return "%s-%d%s" % (bs, idx, ext)
+
     def run(self):
         """
         Runs the tiled acquisition procedure
@@ -1079,6 +1138,11 @@ class TiledAcquisitionTask(object):
         self._future._task_state = RUNNING
         st_data = []
         try:
+            if self._pipelined:
+                # A single thread, as the registrar expects the tiles in order
+                self._register_executor = ThreadPoolExecutor(max_workers=1)
+                self._tile_registrar = get_registrar(self._registrar)
+
             # Acquire the needed tiles
             da_list = self._acquireTiles()
 
@@ -1108,6 +1172,13 @@ class TiledAcquisitionTask(object):
             logging.debug(f"The average time taken per tile is {self.average_acquisition_time}")
             if self._save_executor is not None:
                 self._save_executor.shutdown()
+            if self._register_executor is not None:
+                # Only useful in case of error, otherwise, it's already done.
+                # Cancel the registrations not started yet (shutdown() only
+                # supports cancel_futures from Python 3.9)
+                for f in self._register_futures:
+                    f.cancel()
+                self._register_executor.shutdown(wait=False)
             with self._future._task_lock:
                 self._future._task_state = FINISHED
         return st_data
@@ -1137,7 +1208,8 @@ def estimateTiledAcquisitionMemory(*args, **kwargs):
 
 def acquireTiledArea(streams, stage, area, overlap=0.2, settings_obs=None, log_path=None, zlevels=None,
                      registrar=REGISTER_GLOBAL_SHIFT, weaver=WEAVER_MEAN, focusing_method=FocusingMethod.NONE,
-                     focus_points=None, focus_range=None, centered_acq=True):
+                     focus_points=None, focus_range=None, centered_acq=True, pipelined=False,
+                     stitched_path=None):
     """
     Start a tiled acquisition task for the given streams (SEM or FM) in order to
     build a complete view of the TEM grid. Needed tiles are first acquired for
@@ -1154,7 +1226,8 @@ def acquireTiledArea(streams, stage, area, overlap=0.2, settings_obs=None, log_p
     # Create a tiled acquisition task
     task = TiledAcquisitionTask(streams, stage, area, overlap, settings_obs, log_path, future=future, zlevels=zlevels,
                                 registrar=registrar, weaver=weaver, focusing_method=focusing_method,
-                                focus_points=focus_points, focus_range=focus_range, centered_acq=centered_acq)
+                                focus_points=focus_points, focus_range=focus_range, centered_acq=centered_acq,
+                                pipelined=pipelined, stitched_path=stitched_path)
     future.task_canceller = task._cancelAcquisition  # let the future cancel the task
     # Estimate memory and check if it's sufficient to decide on running the task
     mem_sufficient, mem_est = task.estimateMemory()
@@ -1181,7 +1254,8 @@ def estimateOverviewTime(*args, **kwargs):
 
 def acquireOverview(streams, stage, areas, focus, detector, overlap=0.2, settings_obs=None, log_path=None, zlevels=None,
                     registrar=REGISTER_GLOBAL_SHIFT, weaver=WEAVER_MEAN, focusing_method=FocusingMethod.NONE,
-                    use_autofocus: bool = False, focus_points_dist: float = MAX_DISTANCE_FOCUS_POINTS):
+                    use_autofocus: bool = False, focus_points_dist: float = MAX_DISTANCE_FOCUS_POINTS,
+                    pipelined: bool = False):
     """
     Start autofocus and tiled acquisition tasks for each area in the list of area which is
     given by the input argument areas.
@@ -1202,6 +1276,8 @@ def acquireOverview(streams, stage, areas, focus, detector, overlap=0.2, setting
     :param weaver: (str) the type of weaver to use
     :param focusing_method: (str) the focusing method to use
     :param use_autofocus: (bool) whether to use autofocus or not
+    :param focus_points_dist: (float) maximum distance between the focus points (in m)
+    :param pipelined: (bool) whether to register the tiles while acquiring (see TiledAcquisitionTask)
     :return: (ProgressiveFuture) an object that represents the task, allow to
         know how much time before it is over and to cancel it. It also permits
         to receive the result of the task, which is a list of model.DataArray:
@@ -1211,7 +1287,8 @@ def acquireOverview(streams, stage, areas, focus, detector, overlap=0.2, setting
     future = model.ProgressiveFuture()
     task = AcquireOverviewTask(streams, stage, areas, focus, detector, future, overlap, settings_obs,
                                log_path, zlevels,
-                               registrar, weaver, focusing_method, use_autofocus, focus_points_dist)
+                               registrar, weaver, focusing_method, use_autofocus, focus_points_dist,
+                               pipelined)
     future.task_canceller = task.cancel  # let the future cancel the task
 
     future.set_progress(remaining_time=task.estimate_remaining_time())
@@ -1230,7 +1307,7 @@ class AcquireOverviewTask(object):
                  overlap=0.2, settings_obs=None, log_path=None,
                  zlevels=None, registrar=REGISTER_GLOBAL_SHIFT, weaver=WEAVER_MEAN,
                  focusing_method=FocusingMethod.NONE, use_autofocus: bool = False,
-                 focus_points_dist: float = MAX_DISTANCE_FOCUS_POINTS):
+                 focus_points_dist: float = MAX_DISTANCE_FOCUS_POINTS, pipelined: bool = False):
         # site and feature means the same
         # list of time taken for each task i.e autofocus and tiled acquisition for each area
         self.time_per_task = []
@@ -1269,6 +1346,7 @@ class AcquireOverviewTask(object):
         self._zlevels = zlevels
         self._registrar = registrar
         self._weaver = weaver
+        self._pipelined = pipelined
 
     def cancel(self, future):
         """
@@ -1304,7 +1382,8 @@ class AcquireOverviewTask(object):
                                     zlevels=self._zlevels,
                                     registrar=self._registrar,
                                     weaver=self._weaver,
-                                    focusing_method=self.focusing_method)
+                                    focusing_method=self.focusing_method,
+                                    pipelined=self._pipelined)
             tiled_time += tiled_acq_time
 
             if self._use_autofocus:
@@ -1391,7 +1470,8 @@ class AcquireOverviewTask(object):
                                                                  registrar=self._registrar,
                                                                  weaver=self._weaver,
                                                                  focusing_method=self.focusing_method,
-                                                                 focus_points=focus_points)
+                                                                 focus_points=focus_points,
+                                                                 pipelined=self._pipelined)
                     # remove the current tiled acquisition time from the list and assign the remaining time to the future
                     # along with the time update of the current tiled acquisition sub future
                     self.time_per_task.pop(0)
@@ -16,12 +16,15 @@ You should have received a copy of the GNU General Public License along with Ode
 """
 
 from abc import ABCMeta
+import functools
 import logging
 import copy
 import numpy
+import tempfile
 from abc import abstractmethod
 from odemis import model, util
-from odemis.util import img
+from odemis.dataio import tiff
+from odemis.util import img, transform
 
 
 # This is a series of classes which use different methods to generate a large
@@ -209,8 +212,17 @@ class Weaver(metaclass=ABCMeta):
         # In general, even this simple calculation helps to improve the quality of the overall image
         # if there are a lot of bleaching/deposition effects, which cause a small number of tiles to have
         # a very different (typically higher) brightness than the others.
+        return self._set_brightness(tile, numpy.mean(tiles))
+
+    @staticmethod
+    def _set_brightness(tile, im_brt):
+        """
+        Shifts the brightness of a tile, so its mean corresponds to the given brightness.
+        :param tile (DataArray): tile to adjust
+        :param im_brt (float): target mean
+        :returns (2D DataArray): tile with adjusted brightness
+        """
         tile = copy.deepcopy(tile)  # don't change the input tile
-        im_brt = numpy.mean(tiles)
         tile_brt = numpy.mean(tile)
         diff = im_brt - tile_brt
         # To avoid overflows, we need to clip the results to the dtype range.
@@ -344,23 +356,7 @@ class MeanWeaver(Weaver):
 
             # Create gradient in overlapping region. Ratio between old image and new tile values determined by
             # distance to the center of the tile
-
-            # Create weight matrix with decreasing values from its center that
-            # has the same size as the tile.
-            sz = numpy.array(roi.shape)
-            hh, hw = sz / 2  # half-height, half-width
-            x = numpy.linspace(-hw, hw, sz[1])
-            y = numpy.linspace(-hh, hh, sz[0])
-            xx, yy = numpy.meshgrid((x / hw) ** 6, (y / hh) ** 6)
-            w = numpy.maximum(xx, yy)
-            # Hardcoding a weight function is quite arbitrary and might result in
-            # suboptimal solutions in some cases.
-            # Alternatively, different weights might be used. One option would be to select
-            # a fixed region on the sides of the image, e.g. 20% (expected overlap), and
-            # only apply a (linear) gradient to these parts, while keeping the new tile for the
-            # rest of the region. However, this approach does not solve the hardcoding problem
-            # since the overlap region is still arbitrary. Future solutions might adaptively
-            # select this region.
+            w = get_gradient_weights(roi.shape)
 
             # Use weights to create gradient in overlapping region
             roi[moi] = (t * (1 - w))[moi] + (roi * w)[moi]
@@ -368,3 +364,313 @@ class MeanWeaver(Weaver):
             # Update mask
             mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]] = True
         return im
+
+
+@functools.lru_cache(maxsize=8)
+def get_gradient_weights(shape):
+    """
+    Create weight matrix with decreasing values from its center, used by the
+    mean weavers to blend the overlapping regions.
+    As all the tiles typically have the same shape, the result is cached.
+    shape (int, int): the shape of the tile
+    return (2D ndarray of float): weights between 0 (center) and 1 (edges).
+      It's shared between calls, so it must not be modified.
+    """
+    sz = numpy.array(shape)
+    hh, hw = sz / 2  # half-height, half-width
+    x = numpy.linspace(-hw, hw, sz[1])
+    y = numpy.linspace(-hh, hh, sz[0])
+    xx, yy = numpy.meshgrid((x / hw) ** 6, (y / hh) ** 6)
+    w = numpy.maximum(xx, yy)
+    # Hardcoding a weight function is quite arbitrary and might result in
+    # suboptimal solutions in some cases.
+    # Alternatively, different weights might be used. One option would be to select
+    # a fixed region on the sides of the image, e.g. 20% (expected overlap), and
+    # only apply a (linear) gradient to these parts, while keeping the new tile for the
+    # rest of the region. However, this approach does not solve the hardcoding problem
+    # since the overlap region is still arbitrary. Future solutions might adaptively
+    # select this region.
+    w.flags.writeable = False
+    return w
+
+
+class _TileInfo(object):
+    """
+    Reference to a tile, with its metadata, so that it can be placed without
+    reading its data.
+    """
+
+    def __init__(self, tile, metadata):
+        """
+        tile (DataArray or DataArrayShadow): the tile, of shape YX, or CTZYX with CTZ=111
+        metadata (dict): the metadata of the tile, with the correction metadata merged
+        """
+        if any(s != 1 for s in tile.shape[:-2]):
+            raise ValueError("Tile must be 2D, but got shape %s" % (tile.shape,))
+        self.tile = tile
+        self.shape = tile.shape[-2:]
+        self.dtype = tile.dtype
+        self.metadata = metadata
+
+    def getData(self):
+        """
+        return (2D DataArray): the data of the tile (read from disk if it's a DataArrayShadow)
+        """
+        if isinstance(self.tile, model.DataArrayShadow):
+            return img.ensure2DImage(self.tile.getData())
+        return img.ensure2DImage(self.tile)
+
+
+class MemmapMeanWeaver(MeanWeaver):
+    """
+    Same as MeanWeaver, but the global image is never fully held in memory. It's
+    either stored in a memory-mapped file (getFullImage()), or directly written
+    to a pyramidal TIFF file (exportFullImage()). The tiles can be passed as
+    DataArrayShadow, in which case their data is only read when it's woven.
+    The global image is computed by band of rows, so the memory usage depends on
+    the size of a row of tiles, instead of the size of the global image, which
+    allows to weave very large images.
+    The pixels where tiles overlap are computed from the bounding boxes of the
+    tiles, instead of keeping a mask of the global image. To find quickly the
+    tiles overlapping an area, the bounding boxes are indexed in a grid.
+    """
+
+    def __init__(self, adjust_brightness=False, filename=None):
+        """
+        adjust_brightness (bool): True if brightness correction should be applied.
+        filename (str or None): path to the file where getFullImage() stores the
+          global image, in the numpy format (.npy). If None, a temporary file is
+          used, which is deleted as soon as the image is not used anymore.
+        """
+        super().__init__(adjust_brightness)
+        self._filename = filename
+
+    def addTile(self, tile):
+        """
+        Adds one tile to the weaver. The data is not read until the image is woven.
+        tile (2D DataArray or DataArrayShadow): the image must have at least MD_POS and
+        MD_PIXEL_SIZE metadata. All provided tiles should have the same dtype.
+        raise ValueError: if the tile is not 2D
+        """
+        md = tile.metadata.copy()
+        img.mergeMetadata(md)
+        self.tiles.append(_TileInfo(tile, md))
+
+    def _prepare_tiles(self):
+        """
+        Place the tiles, without rotation
+        return (dict, float, (float, float)): the metadata of the global image
+          (before rotation), the rotation and the center of rotation
+        """
+        # Same as Weaver.getFullImage(), but only the metadata of the tiles is rotated
+        rotation = self.tiles[0].metadata.get(model.MD_ROTATION, 0)
+        center_of_rot = self.tiles[0].metadata[model.MD_POS]
+        for t in self.tiles:
+            t.metadata = _rotate_metadata(t.metadata, -rotation, center_of_rot)
+
+        self.tbbx_px, self.gbbx_px, self.gbbx_phy, self.stage_bare_pos = self.get_bounding_boxes(self.tiles)
+        md = self.get_final_metadata(self.tiles[0].metadata.copy())
+        return md, rotation, center_of_rot
+
+    def getFullImage(self):
+        """
+        Assembles the tiles into a large image.
+        return (2D DataArray): same dtype as the tiles, with shape corresponding to the bounding box of the tiles.
+          The data is backed by a memory-mapped file.
+        """
+        md, rotation, center_of_rot = self._prepare_tiles()
+        im = self.weave_tiles()
+        return img.rotate_img_metadata(model.DataArray(im, md), rotation, center_of_rot)
+
+    def exportFullImage(self, filename):
+        """
+        Assembles the tiles into a large image, which is directly written, band by
+          band, into a pyramidal TIFF file.
+        filename (str): path of the TIFF file to create
+        return (2D DataArrayShadow): the image, read from the file
+        """
+        md, rotation, center_of_rot = self._prepare_tiles()
+        md = _rotate_metadata(md, rotation, center_of_rot)
+        shape = (self.gbbx_px[-1], self.gbbx_px[-2])
+        logging.debug("Generating global image of size %dx%d px, into %s",
+                      shape[1], shape[0], filename)
+        with tiff.PyramidWriter(filename, shape, self.tiles[0].dtype, md) as writer:
+            self._weave_bands(lambda top, band: writer.write_region(0, top, band),
+                              writer.tile_size)
+        return tiff.open_data(filename).content[0]
+
+    def _create_image(self, shape, dtype):
+        """
+        return (numpy.memmap): the (uninitialized) global image
+        """
+        if self._filename:
+            return numpy.lib.format.open_memmap(self._filename, mode="w+", dtype=dtype, shape=shape)
+        else:
+            # The file is removed when closed, but the memory-map keeps it accessible
+            with tempfile.TemporaryFile(prefix="odemis-weaver-") as f:
+                return numpy.memmap(f, mode="w+", dtype=dtype, shape=shape)
+
+    def _get_covered_mask(self, i, grid):
+        """
+        Computes which pixels of a tile are covered by the tiles woven before.
+        i (int): index of the tile
+        grid (_TileGrid): index of the tile bounding boxes
+        return (2D ndarray of bool): same shape as the tile, True where a previous tile is present
+        """
+        b = self.tbbx_px[i]
+        moi = numpy.zeros((b[3] - b[1], b[2] - b[0]), dtype=bool)
+        for j in grid.find(b):
+            if j >= i:
+                break
+            pb = self.tbbx_px[j]
+            l, t = max(b[0], pb[0]), max(b[1], pb[1])
+            r, btm = min(b[2], pb[2]), min(b[3], pb[3])
+            moi[t - b[1]:btm - b[1], l - b[0]:r - b[0]] = True
+        return moi
+
+    def _get_tiles_stats(self):
+        """
+        Reads every tile once, to compute the values needed before weaving.
+        return (number, float or None): the minimum value of all the tiles (used
+          as background), and their mean, if the brightness should be adjusted
+        """
+        bg = None
+        tsum = 0
+        tcount = 0
+        for t in self.tiles:
+            data = t.getData()
+            tmin = numpy.amin(data)
+            bg = tmin if bg is None else min(bg, tmin)
+            if self.adjust_brt:
+                tsum += numpy.sum(data, dtype=numpy.float64)
+                tcount += data.size
+
+        im_brt = tsum / tcount if self.adjust_brt else None
+        return bg, im_brt
+
+    def _weave_bands(self, write_band, band_height):
+        """
+        Weave tiles by using a smooth gradient, as MeanWeaver, one band of rows at a time.
+        The tiles overlapping a band are kept in memory until the band below them is woven,
+        so each tile is only read twice: once for the background (and brightness), and once to weave it.
+        write_band (callable (int, 2D ndarray) -> None): called with the index of the top row and
+          the data, for each band, from top to bottom
+        band_height (int > 0): number of rows of each band (the last one might be smaller)
+        """
+        shape = (self.gbbx_px[-1], self.gbbx_px[-2])
+        dtype = self.tiles[0].dtype
+        grid = _TileGrid(self.tbbx_px)
+        bg, im_brt = self._get_tiles_stats()
+
+        weights = {}  # tile shape -> gradient weights
+        active = {}  # tile index -> (data, covered mask): tiles overlapping the current band
+        for top in range(0, shape[0], band_height):
+            bottom = min(top + band_height, shape[0])
+            band = numpy.full((bottom - top, shape[1]), bg, dtype=dtype)
+
+            # Drop the tiles which are entirely above
+            for i in [i for i, (data, moi) in active.items() if self.tbbx_px[i][3] <= top]:
+                del active[i]
+
+            for i in grid.find((0, top, shape[1], bottom)):
+                b = self.tbbx_px[i]
+                if i not in active:
+                    data = self.tiles[i].getData()
+                    if im_brt is not None:
+                        data = self._set_brightness(data, im_brt)
+                    active[i] = data, self._get_covered_mask(i, grid)
+                data, moi = active[i]
+
+                # Part of the tile and of the band overlapping
+                t, btm = max(top, b[1]), min(bottom, b[3])
+                tdata = data[t - b[1]:btm - b[1]]
+                tmoi = moi[t - b[1]:btm - b[1]]
+                roi = band[t - top:btm - top, b[0]:b[2]]
+
+                # Insert image at positions that are still empty
+                roi[~tmoi] = tdata[~tmoi]
+
+                # Create gradient in overlapping region, with the same weights as MeanWeaver
+                if tmoi.any():
+                    if data.shape not in weights:
+                        weights[data.shape] = get_gradient_weights(data.shape)
+                    w = weights[data.shape][t - b[1]:btm - b[1]]
+                    roi[tmoi] = tdata[tmoi] * (1 - w[tmoi]) + roi[tmoi] * w[tmoi]
+
+            write_band(top, band)
+
+    def weave_tiles(self):
+        """
+        Weave tiles by using a smooth gradient, as MeanWeaver, directly into the memory-mapped image.
+        return (2D numpy.memmap): The weaved image.
+        """
+        shape = (self.gbbx_px[-1], self.gbbx_px[-2])
+        logging.debug("Generating global image of size %dx%d px, memory-mapped",
+                      shape[1], shape[0])
+        im = self._create_image(shape, self.tiles[0].dtype)
+
+        def copy_band(top, band):
+            im[top:top + band.shape[0]] = band
+
+        self._weave_bands(copy_band, tiff.TILE_SIZE)
+        im.flush()
+        return im
+
+
+class _TileGrid(object):
+    """
+    Spatial index of the bounding boxes of the tiles, to quickly find the tiles
+    overlapping a given area. The area is split in square cells, of the size of
+    the largest tile, and each cell contains the list of tiles overlapping it.
+    """
+
+    def __init__(self, bboxes):
+        """
+        bboxes (list of (int, int, int, int)): ltrb bounding box of each tile, in px
+        """
+        self._bboxes = bboxes
+        self._cell_size = max(max(b[2] - b[0], b[3] - b[1]) for b in bboxes)
+        self._cells = {}  # (int, int) -> list of int: cell position -> tile indices
+        for i, b in enumerate(bboxes):
+            for c in self._get_cells(b):
+                self._cells.setdefault(c, []).append(i)
+
+    def _get_cells(self, b):
+        """
+        return (iterator of (int, int)): the position of the cells overlapping the bounding box
+        """
+        cs = self._cell_size
+        for cx in range(b[0] // cs, (b[2] - 1) // cs + 1):
+            for cy in range(b[1] // cs, (b[3] - 1) // cs + 1):
+                yield cx, cy
+
+    def find(self, b):
+        """
+        b (int, int, int, int): ltrb bounding box
+        return (list of int): the indices of the tiles overlapping the bounding box, in increasing order
+        """
+        found = set()
+        for c in self._get_cells(b):
+            for i in self._cells.get(c, ()):
+                tb = self._bboxes[i]
+                if tb[0] < b[2] and b[0] < tb[2] and tb[1] < b[3] and b[1] < tb[3]:
+                    found.add(i)
+        return sorted(found)
+
+
+def _rotate_metadata(md, rotation, center_of_rot):
+    """
+    Same as img.rotate_img_metadata(), but only on the metadata, so that the data
+    doesn't need to be loaded.
+    md (dict): metadata with at least MD_POS
+    rotation (float): [rad] counter-clockwise rotation
+    center_of_rot (float, float): [m] center of rotation
+    return (dict): a copy of the metadata with MD_POS and MD_ROTATION updated
+    """
+    md = md.copy()
+    transl = transform.RigidTransform(translation=center_of_rot)
+    rot = transform.RigidTransform(rotation=rotation)
+    p = transl.apply(rot.apply(transl.inverse().apply(md[model.MD_POS])))
+    md[model.MD_POS] = (p[0], p[1])
+    md[model.MD_ROTATION] = md.get(model.MD_ROTATION, 0) + rotation
+    return md
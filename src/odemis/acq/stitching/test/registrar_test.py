@@ -26,6 +26,7 @@ import logging
 import os
 import random
 import re
+import time
 import unittest
 import warnings
 
@@ -33,10 +34,10 @@ import numpy
 
 import odemis
 from odemis import model
-from odemis.acq.stitching import IdentityRegistrar, ShiftRegistrar, GlobalShiftRegistrar
+from odemis.acq.stitching import IdentityRegistrar, ShiftRegistrar, GlobalShiftRegistrar, BatchShiftRegistrar
 from odemis.acq.stitching.test.stitching_test import decompose_image
 from odemis.dataio import find_fittest_converter
-from odemis.util import testing
+from odemis.util import synthetic, testing
 from odemis.util.img import ensure2DImage
 
 logging.getLogger().setLevel(logging.DEBUG)
@@ -611,6 +612,7 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
     Tests GlobalShiftRegistrar on synthetic and real images (simulated with decompose_image function)
     with known positions
     """
+    registrar_class = GlobalShiftRegistrar
 
     def setUp(self):
         random.seed(1)
@@ -676,7 +678,7 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
 
                     tiles = [model.DataArray(tile1, md1),
                              model.DataArray(tile2, md2)]
-                    registrar = GlobalShiftRegistrar()
+                    registrar = self.registrar_class()
                     for t in tiles:
                         registrar.addTile(t)
 
@@ -723,7 +725,7 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
         tiles = [model.DataArray(tile1, md1), model.DataArray(tile2, md2),
                  model.DataArray(tile3, md3), model.DataArray(tile4, md4)]
 
-        registrar = GlobalShiftRegistrar()
+        registrar = self.registrar_class()
         for i in range(len(tiles)):
             registrar.addTile(tiles[i])
 
@@ -749,7 +751,7 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
             # Create artificial tiled image
             [tiles, real_pos] = decompose_image(data, o, num, a)
             px_size = tiles[0].metadata[model.MD_PIXEL_SIZE]
-            registrar = GlobalShiftRegistrar()
+            registrar = self.registrar_class()
 
             # Register tiles
             for tile in tiles:
@@ -775,7 +777,7 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
             cropped1 = img[0:400, 0:400]
             cropped2 = img[4:404, 322:722]
 
-            registrar = GlobalShiftRegistrar()
+            registrar = self.registrar_class()
             tile1 = model.DataArray(numpy.array(cropped1), {
                 model.MD_PIXEL_SIZE: [1 / 20, 1 / 20],  # m/px
                 model.MD_POS: (200 / 20, img.shape[1] / 20 - 200 / 20),  # m
@@ -805,7 +807,7 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
             reported_shift = (120, 190)  # px, the simulated positioning error
 
             pxs = (1 / 1000, 1 / 1000)  # m/px
-            registrar = GlobalShiftRegistrar()
+            registrar = self.registrar_class()
             tile1 = model.DataArray(numpy.array(cropped1), {
                 model.MD_PIXEL_SIZE: pxs,  # m/px
                 model.MD_POS: (0, 0),  # m
@@ -836,7 +838,7 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
             o = 0.3  # fails for 0.2
             a = "horizontalZigzag"
             [tiles, pos] = decompose_image(img, o, num, a)
-            registrar = GlobalShiftRegistrar()
+            registrar = self.registrar_class()
             for i in range(len(pos)):
                 registrar.addTile(tiles[i], (tiles[i], tiles[i]))
             tile_pos, dep_tile_pos = registrar.getPositions()
@@ -880,7 +882,7 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
             # Test with shifted dependent tiles
             [tiles, pos] = decompose_image(img, o, num, a)
 
-            registrar = GlobalShiftRegistrar()
+            registrar = self.registrar_class()
 
             # Add different shift for every dependent tile
             dep_tiles = copy.deepcopy(tiles)
@@ -918,5 +920,66 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
                     self.assertAlmostEqual(dep_tile[1], p[1] + r2 * px_size[1])
 
 
+class TestBatchShiftRegistrar(TestGlobalShiftRegistrar):
+    """
+    Tests BatchShiftRegistrar, with the same tests as GlobalShiftRegistrar, and compare their speed
+    """
+    registrar_class = BatchShiftRegistrar
+
+    def test_white_image(self):
+        """ Position should be left as-is in case of white images """
+        # Same as for GlobalShiftRegistrar, but the least-squares fit is not exact to the last bit
+        tiles = []
+        size_m = 200 * 1.3e-6
+        for i, j in ((0, 0), (0, 1), (1, 0), (1, 1)):
+            md = {
+                model.MD_PIXEL_SIZE: (1.3e-6, 1.3e-6),  # m/px
+                model.MD_POS: (10e-3 + i * size_m * 0.8, 300e-3 - j * size_m * 0.8),  # m
+            }
+            tiles.append(model.DataArray(255 * numpy.ones((200, 200)), md))
+
+        registrar = self.registrar_class()
+        for t in tiles:
+            registrar.addTile(t)
+
+        calculated_positions = registrar.getPositions()[0]
+        for t, p in zip(tiles, calculated_positions):
+            testing.assert_tuple_almost_equal(p, t.metadata[model.MD_POS], delta=1e-9)
+
+    def test_speed_synthetic_grid(self):
+        """
+        Compare the accuracy of the BatchShiftRegistrar and GlobalShiftRegistrar
+        on a grid of synthetic tiles. The speed is only reported, as it depends
+        too much on the computer.
+        """
+        # Image with many random spots
+        rng = numpy.random.default_rng(0)
+        shape = (1600, 1600)
+        spots = rng.uniform(0, shape[0], (800, 2)) - numpy.array(shape) / 2
+        img = synthetic.psf_gaussian(shape, spots, 4)
+        img += rng.integers(0, 500, shape, dtype=numpy.uint16)
+
+        num = 6
+        tiles, real_pos = decompose_image(img, 0.2, num, "horizontalZigzag")
+        px_size = tiles[0].metadata[model.MD_PIXEL_SIZE]
+
+        durations = {}
+        for registrar_class in (GlobalShiftRegistrar, BatchShiftRegistrar):
+            tstart = time.time()
+            registrar = registrar_class()
+            for tile in tiles:
+                registrar.addTile(tile)
+            registered_pos = registrar.getPositions()[0]
+            durations[registrar_class] = time.time() - tstart
+
+            # Compare positions to real positions, allow 2 px offset
+            diff = numpy.absolute(numpy.subtract(registered_pos, real_pos))
+            numpy.testing.assert_array_less(diff / px_size[0], 2.5,
+                                            "Position off with %s" % (registrar_class.__name__,))
+
+        logging.info("Registration of %dx%d tiles of %s px took %g s with GlobalShiftRegistrar, %g s with BatchShiftRegistrar",
+                     num, num, tiles[0].shape, durations[GlobalShiftRegistrar], durations[BatchShiftRegistrar])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -36,6 +36,7 @@ from odemis.acq import acqmng, stream
 from odemis.acq.acqmng import SettingsObserver
 from odemis.acq.move import MicroscopePostureManager, Posture
 from odemis.acq.stitching import (
+    REGISTER_GLOBAL_SHIFT,
     REGISTER_IDENTITY,
     WEAVER_COLLAGE_REVERSE,
     WEAVER_MEAN,
@@ -52,8 +53,9 @@ from odemis.acq.stitching._tiledacq import (
     get_tiled_bboxes,
     get_zstack_levels,
 )
+from odemis.acq.stitching.test.stitching_test import decompose_image
 from odemis.acq.stream import FluoStream
-from odemis.util import img, testing
+from odemis.util import img, linalg, testing
 from odemis.util.comp import compute_camera_fov, compute_scanner_fov
 
 logging.getLogger().setLevel(logging.DEBUG)
@@ -374,36 +376,6 @@ class CRYOSECOMTestCase(unittest.TestCase):
         except Exception as e:
             self.fail("Unexpected exception raised: %s" % e)
 
-    def test_get_z_on_focus_plane(self):
-        """Test the function that calculates the z position on the focus plane."""
-        area = (-0.001, -0.001, 0.001, 0.001)
-        overlap = 0.2
-        focus_points = [[-0.0001989, -0.0001485, 2.519e-05],
-                        [0.0, -0.0001485, -1.815e-05],
-                        [0.0001989, -0.0001485, -3.383e-06],
-                        [-0.0001989, 0.0, 1.38e-05],
-                        [0.0, 0.0, 2.321e-06],
-                        [0.0001989, 0.0, 3e-05],
-                        [-0.0001989, 0.0001485, -1.781e-05],
-                        [0.0, 0.0001485, -8.125e-06],
-                        [0.0001989, 0.0001485, 4.766e-06]]
-
-        tiled_acq_task = TiledAcquisitionTask(self.fm_streams, self.stage,
-                                              area, overlap=overlap, future=model.InstantaneousFuture(),
-                                              focus_points=focus_points)
-        # Test a point that is on the plane
-        x = 0
-        y = 0
-        z = tiled_acq_task._get_z_on_focus_plane(x, y)
-        self.assertEqual(z, tiled_acq_task._focus_plane["gamma"])
-
-        # Check the equation of the plane for the given focus points. Plane equation is found from the focus points
-        gamma = 3.1784e-06
-        normal = (0.008549, -0.02786, -1)
-        z = tiled_acq_task._get_z_on_focus_plane(x, y)
-        self.assertAlmostEqual(tiled_acq_task._focus_plane["gamma"], gamma)
-        self.assertAlmostEqual(z, gamma + normal[0] * x + normal[1] * y)
-
     def test_get_triangulated_focus_point(self):
         """Test the function that calculates the z position of a point in the focus plane."""
         n_tiles = (3, 3)
@@ -450,7 +422,9 @@ class CRYOSECOMTestCase(unittest.TestCase):
         focus_points = numpy.array(focus_points)
         point_outside = focus_points[0] - (focus_points[1] - focus_points[0])
         z = tiled_acq_task._get_triangulated_focus_point(point_outside[0], point_outside[1])
-        z_expected = tiled_acq_task._get_z_on_focus_plane(point_outside[0], point_outside[1])
+        # Based on the plane fitted through all the focus points
+        gamma, normal = linalg.fit_plane_lstsq(focus_points)
+        z_expected = linalg.get_z_pos_on_plane(point_outside[0], point_outside[1], (0, 0, gamma), normal)
         self.assertAlmostEqual(z, z_expected, places=9)
 
     def test_always_focusing_method(self):
@@ -918,6 +892,71 @@ class TiledAcquisitionTaskTestCase(unittest.TestCase):
         sorted_indices = tiled_acq_task._sort_tile_indices_zigzag([])
         self.assertListEqual(sorted_indices, [])
 
+    def _create_fake_acq_task(self, tiles, pipelined):
+        """
+        Create a tiled acquisition task which "acquires" the given tiles, without any hardware.
+        tiles (list of DataArrays): 3x3 tiles, in zigzag order
+        """
+        mock_stream = mock.Mock(spec=stream.SEMStream)
+        mock_stream.configure_mock(**{"guessFoV.return_value": (0.0021, 0.0018),
+                                      "estimateAcquisitionTime.return_value": 0.1})
+        mock_stream.focuser = None
+        mock_stream.raw = []
+        task = TiledAcquisitionTask(streams=[mock_stream], stage=mock.Mock(spec=model.Actuator),
+                                    region=(0, 0, 1e-3, 1e-3), overlap=0.2, future=model.ProgressiveFuture(),
+                                    registrar=REGISTER_GLOBAL_SHIFT, weaver=WEAVER_MEAN, pipelined=pipelined)
+        task._tile_indices = [(ix, iy) for iy in range(3) for ix in range(3)]
+        task._number_of_tiles = len(task._tile_indices)
+        task._moveToTile = mock.Mock()
+        task._updateFov = lambda das, sfov: sfov
+        task._sortDAs = lambda das, ss: tuple(das)
+        task._getTileDAs = lambda i, ix, iy: [tiles[i]]
+        return task
+
+    def test_pipelined_stitching(self):
+        """
+        Check the tiles registered while acquiring are stitched the same way as when
+        registering after the acquisition.
+        """
+        numpy.random.seed(0)
+        image = numpy.random.randint(0, 4096, (600, 600), dtype=numpy.uint16)
+        tiles, _ = decompose_image(image, overlap=0.2, numTiles=3, method="horizontalZigzag")
+
+        task = self._create_fake_acq_task(tiles, pipelined=False)
+        st_data = task.run()
+        task_pipe = self._create_fake_acq_task(tiles, pipelined=True)
+        st_data_pipe = task_pipe.run()
+
+        self.assertEqual(len(st_data_pipe), 1)
+        # The registration time was recorded for every tile
+        self.assertEqual(len(task_pipe._save_time["stitch"]), len(tiles))
+        numpy.testing.assert_array_equal(st_data_pipe[0], st_data[0])
+        self.assertEqual(st_data_pipe[0].metadata[model.MD_POS], st_data[0].metadata[model.MD_POS])
+
+    def test_estimate_time_pipelined(self):
+        """
+        Check the registration is (mostly) considered to run in parallel of the acquisition in pipelined mode
+        """
+        mock_stream = mock.Mock(spec=stream.SEMStream)
+        mock_stream.configure_mock(**{"guessFoV.return_value": (0.0021, 0.0018),
+                                      "estimateAcquisitionTime.return_value": 2.0})
+        mock_stream.focuser = None
+        mock_stream.raw = [model.DataArray(numpy.zeros((2048, 2048), dtype=numpy.uint16))]
+        region = (0.0, 0.0, 14.0e-3, 13.0e-3)
+        stage = mock.Mock(spec=model.Actuator)
+
+        task_nostitch = TiledAcquisitionTask([mock_stream], stage, region, overlap=0.2, registrar=None, weaver=None)
+        task = TiledAcquisitionTask([mock_stream], stage, region, overlap=0.2)
+        task_pipe = TiledAcquisitionTask([mock_stream], stage, region, overlap=0.2, pipelined=True)
+
+        t_nostitch = task_nostitch.estimateTime()
+        t = task.estimateTime()
+        t_pipe = task_pipe.estimateTime()
+        self.assertLess(t_pipe, t)
+        # At least the stitching of one tile is not overlapped
+        self.assertGreater(t_pipe, t_nostitch)
+        self.assertAlmostEqual(t_pipe - t_nostitch, (t - t_nostitch) / task._number_of_tiles)
+
 
 if __name__ == '__main__':
     unittest.main()
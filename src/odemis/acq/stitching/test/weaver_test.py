@@ -37,12 +37,16 @@ from odemis.acq.stitching import (
     WEAVER_COLLAGE,
     WEAVER_COLLAGE_REVERSE,
     WEAVER_MEAN,
+    WEAVER_MEAN_MEMMAP,
     CollageWeaver,
     CollageWeaverReverse,
     MeanWeaver,
+    MemmapMeanWeaver,
+    weave,
 )
+from odemis.acq.stitching._weaver import _TileGrid
 from odemis.acq.stitching.test.stitching_test import decompose_image
-from odemis.dataio import find_fittest_converter
+from odemis.dataio import find_fittest_converter, hdf5
 from odemis.util.img import ensure2DImage
 
 logging.getLogger().setLevel(logging.DEBUG)
@@ -85,6 +89,8 @@ class WeaverBaseTest:
             weaver = CollageWeaverReverse()
         elif self.weaver_type == WEAVER_MEAN:
             weaver = MeanWeaver()
+        elif self.weaver_type == WEAVER_MEAN_MEMMAP:
+            weaver = MemmapMeanWeaver()
 
         weaver.addTile(intile)
         outd = weaver.getFullImage()
@@ -112,6 +118,8 @@ class WeaverBaseTest:
             weaver = CollageWeaverReverse()
         elif self.weaver_type == WEAVER_MEAN:
             weaver = MeanWeaver()
+        elif self.weaver_type == WEAVER_MEAN_MEMMAP:
+            weaver = MemmapMeanWeaver()
 
         weaver.addTile(intile)
         outd = weaver.getFullImage()
@@ -140,6 +148,8 @@ class WeaverBaseTest:
                         weaver = CollageWeaverReverse()
                     elif self.weaver_type == WEAVER_MEAN:
                         weaver = MeanWeaver()
+                    elif self.weaver_type == WEAVER_MEAN_MEMMAP:
+                        weaver = MemmapMeanWeaver()
 
                     for t in tiles:
                         weaver.addTile(t)
@@ -193,6 +203,8 @@ class WeaverBaseTest:
             weaver = CollageWeaverReverse()
         elif self.weaver_type == WEAVER_MEAN:
             weaver = MeanWeaver()
+        elif self.weaver_type == WEAVER_MEAN_MEMMAP:
+            weaver = MemmapMeanWeaver()
 
         weaver.addTile(in0)
         weaver.addTile(in1)
@@ -211,6 +223,8 @@ class WeaverBaseTest:
             weaver_class = CollageWeaverReverse
         elif self.weaver_type == WEAVER_MEAN:
             weaver_class = MeanWeaver
+        elif self.weaver_type == WEAVER_MEAN_MEMMAP:
+            weaver_class = MemmapMeanWeaver
 
         for img in IMGS:
             conv = find_fittest_converter(img)
@@ -298,6 +312,8 @@ class WeaverBaseTest:
             weaver_class = CollageWeaverReverse
         elif self.weaver_type == WEAVER_MEAN:
             weaver_class = MeanWeaver
+        elif self.weaver_type == WEAVER_MEAN_MEMMAP:
+            weaver_class = MemmapMeanWeaver
         weaver = weaver_class()
         weaver.addTile(in1)
         weaver.addTile(in2)
@@ -496,5 +512,137 @@ class TestCollageWeaverReverse(WeaverBaseTest, unittest.TestCase):
         numpy.testing.assert_equal(o, 256 * numpy.ones((80, 30)))
 
 
+class TestMemmapMeanWeaver(WeaverBaseTest, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.weaver_type = WEAVER_MEAN_MEMMAP
+
+    def setUp(self):
+        super().setUp()
+        self.filename = "test-weaver-memmap.npy"
+        self.filename_h5 = "test-weaver-tiles.h5"
+        self.filename_tiff = "test-weaver-pyramid.ome.tiff"
+
+    def tearDown(self):
+        for fn in (self.filename, self.filename_h5, self.filename_tiff):
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+
+    def _get_shifted_tiles(self, dtype):
+        """
+        Create tiles at irregular positions, with overlaps and empty areas between them
+        """
+        numpy.random.seed(1)
+        img = numpy.random.randint(0, 200, (400, 500)).astype(dtype)
+        tiles, _ = decompose_image(img, 0.3, 3, "horizontalZigzag", True)
+        # Move one tile away, to leave a gap
+        md = tiles[-1].metadata
+        md[model.MD_POS] = (md[model.MD_POS][0] + 40e-6, md[model.MD_POS][1] - 15e-6)
+        return tiles
+
+    def test_same_as_mean(self):
+        """
+        Test the result is identical to the MeanWeaver
+        """
+        for dtype in (numpy.uint8, numpy.uint16, numpy.float64):
+            tiles = self._get_shifted_tiles(dtype)
+
+            weaver = MeanWeaver()
+            for t in tiles:
+                weaver.addTile(t)
+            exp_out = weaver.getFullImage()
+
+            weaver = MemmapMeanWeaver()
+            for t in tiles:
+                weaver.addTile(t)
+            outd = weaver.getFullImage()
+
+            self.assertEqual(outd.dtype, exp_out.dtype)
+            numpy.testing.assert_array_equal(outd, exp_out)
+            self.assertEqual(outd.metadata[model.MD_POS], exp_out.metadata[model.MD_POS])
+
+            # Same thing using the generic function
+            outd = weave(tiles, WEAVER_MEAN_MEMMAP)
+            numpy.testing.assert_array_equal(outd, exp_out)
+
+    def test_shadow_tiles(self):
+        """
+        Test weaving tiles stored in a file, and storing the result in a file
+        """
+        tiles = self._get_shifted_tiles(numpy.uint16)
+        weaver = MeanWeaver()
+        for t in tiles:
+            weaver.addTile(t)
+        exp_out = weaver.getFullImage()
+
+        hdf5.export(self.filename_h5, tiles)
+        acd = hdf5.open_data(self.filename_h5)
+        self.assertEqual(len(acd.content), len(tiles))
+        weaver = MemmapMeanWeaver(filename=self.filename)
+        for t in acd.content:
+            self.assertIsInstance(t, model.DataArrayShadow)
+            weaver.addTile(t)
+        outd = weaver.getFullImage()
+        numpy.testing.assert_array_equal(outd, exp_out)
+
+        # The data is also available in the file
+        del outd
+        saved = numpy.load(self.filename)
+        numpy.testing.assert_array_equal(saved, exp_out)
+
+    def test_weave_to_pyramid(self):
+        """
+        Test weaving directly into a pyramidal TIFF file
+        """
+        tiles = self._get_shifted_tiles(numpy.uint16)
+        weaver = MeanWeaver()
+        for t in tiles:
+            weaver.addTile(t)
+        exp_out = weaver.getFullImage()
+
+        outd = weave(tiles, WEAVER_MEAN_MEMMAP, filename=self.filename_tiff)
+        self.assertIsInstance(outd, model.DataArrayShadow)
+        self.assertGreaterEqual(outd.maxzoom, 1)
+        numpy.testing.assert_array_equal(outd.getData(), exp_out)
+        numpy.testing.assert_almost_equal(outd.metadata[model.MD_POS], exp_out.metadata[model.MD_POS])
+
+    def test_tile_grid(self):
+        """
+        Test the spatial index finds the same tiles as checking every tile
+        """
+        random.seed(4)
+        bboxes = []
+        for i in range(200):
+            l, t = random.randint(0, 3000), random.randint(0, 3000)
+            bboxes.append((l, t, l + random.randint(50, 300), t + random.randint(50, 300)))
+        grid = _TileGrid(bboxes)
+
+        for b in bboxes[:20] + [(0, 0, 3300, 256), (1000, 1000, 1001, 1001)]:
+            exp = [i for i, tb in enumerate(bboxes)
+                   if tb[0] < b[2] and b[0] < tb[2] and tb[1] < b[3] and b[1] < tb[3]]
+            self.assertEqual(grid.find(b), exp)
+
+    def test_brightness_adjust(self):
+        """
+        Test the tiles get a similar brightness when asked
+        """
+        tiles = []
+        for i, v in enumerate((1000, 1500)):
+            md = {
+                model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+                model.MD_POS: (i * 90e-6, 0),  # m
+            }
+            tiles.append(model.DataArray(numpy.zeros((100, 100), dtype=numpy.uint16) + v, md))
+
+        weaver = MemmapMeanWeaver(adjust_brightness=True)
+        for t in tiles:
+            weaver.addTile(t)
+        outd = weaver.getFullImage()
+        numpy.testing.assert_array_equal(outd, numpy.zeros((100, 190)) + 1250)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -190,6 +190,7 @@ class Stream(object):
 
         # Duplicate VA if requested
         self._hwvas = {}  # str (name of the proxied VA) -> original Hw VA
+        self._hwvacomps = {}  # str (name of the proxied VA) -> Component, name of the Hw VA
         self._hwvasetters = {}  # str (name of the proxied VA) -> setter
         self._lvaupdaters = {}  # str (name of the proxied VA) -> listener
         self._axisvaupdaters = {}  # str (name of the axis VA) -> listener (functools.partial)
@@ -254,6 +255,9 @@ class Stream(object):
         self.histogram = model.VigilantAttribute(numpy.empty(0), readonly=True)
         self.histogram._full_hist = numpy.ndarray(0) # for finding the outliers
         self.histogram._edges = None
+        # If not None, the histogram is computed only on a subsample of at most
+        # this number of pixels (for speed, with large images).
+        self._histogram_max_pixels = None
 
         # Tuple of (int, str) or (None, None): loglevel and message
         self.status = model.VigilantAttribute((None, None), readonly=True)
@@ -275,6 +279,8 @@ class Stream(object):
         """ Initialize the VAs related with image projection
         """
         # DataArray or None: RGB projection of the raw data
+        # Note: the same image in BGRA (as used for display) is available in
+        # the .bgra attribute of the DataArray.
         self.image = model.VigilantAttribute(None)
 
         # Don't call at init, so don't set metadata if default value
@@ -389,6 +395,7 @@ class Stream(object):
 
             # Keep the link between the new VA and the original VA so they can be synchronised
             self._hwvas[newname] = va
+            self._hwvacomps[newname] = (comp, vaname)
             # Keep setters, mostly to not have them dereferenced
             self._hwvasetters[newname] = vasetter
 
@@ -499,23 +506,6 @@ class Stream(object):
 
         return newva
 
-    # Order in which VAs should be set to ensure the values are kept as-is.
-    # This should be the behaviour of the hardware component... but the driver
-    # might be buggy, so beware!
-    VA_ORDER = ("Binning", "Scale", "Resolution", "Translation", "Rotation", "DwellTime",
-                "TimeRange", "StreakMode", "MCPGain")
-    def _index_in_va_order(self, va_entry):
-        """
-        return the position of the VA name in VA_ORDER
-        va_entry (tuple): first element must be the name of the VA
-        return (int)
-        """
-        name = va_entry[0][3:]  # strip "det" or "emt"
-        try:
-            return self.VA_ORDER.index(name)
-        except ValueError: # VA name is not listed => put last
-            return len(self.VA_ORDER) + 1
-
     # TODO: rename to applyHwVAs and never call unlinkHwVAs?
     def _linkHwVAs(self):
         """
@@ -527,30 +517,30 @@ class Stream(object):
         if self._lvaupdaters:
             logging.warning("Going to link Hw VAs, while already linked")
 
-        # Make sure the VAs are set in the right order to keep values
-        hwvas = list(self._hwvas.items())  # must be a list
-        hwvas.sort(key=self._index_in_va_order)
+        hwvas = [(n, va) for n, va in self._hwvas.items() if not va.readonly]
 
+        # Set all the VAs of a component in one call, which also takes care of
+        # setting them in the right order to keep values.
+        comp_values = {}  # Component -> dict str (name of the Hw VA) -> value
         for vaname, hwva in hwvas:
-            if hwva.readonly:
-                continue
-            lva = getattr(self, vaname)
-            try:
-                hwva.value = lva.value
-            except Exception:
-                logging.debug("Failed to set VA %s to value %s on hardware",
-                              vaname, lva.value)
+            comp, hwname = self._hwvacomps[vaname]
+            comp_values.setdefault(comp, {})[hwname] = getattr(self, vaname).value
+
+        hw_values = {}  # Component -> dict str (name of the Hw VA) -> value
+        for comp, values in comp_values.items():
+            # The values are read back immediately, to get the actual values
+            # accepted by the hardware
+            hw_values[comp] = comp.setVAValues(values, ignore_errors=True)
 
-        # Immediately read the VAs back, to read the actual values accepted by the hardware
         for vaname, hwva in hwvas:
-            if hwva.readonly:
-                continue
+            comp, hwname = self._hwvacomps[vaname]
             lva = getattr(self, vaname)
+            hwval = hw_values[comp][hwname]
             try:
-                lva.value = hwva.value
+                lva.value = hwval
             except Exception:
                 logging.debug("Failed to update VA %s to value %s from hardware",
-                              vaname, hwva.value)
+                              vaname, hwval)
 
             # Hack: There shouldn't be a resolution local VA, but for now there is.
             # In order to set it to some correct value, we read back from the hardware.
@@ -1036,7 +1026,10 @@ class Stream(object):
         return (DataArray): 3D DataArray
         """
         irange = self._getDisplayIRange()
-        rgbim = img.DataArray2RGB(data, irange, tint)
+        # Directly computed in the format used for display (BGRA), so that the
+        # canvases don't need to convert it.
+        bgra = img.DataArray2BGRA(data, irange, tint)
+        rgbim = img.BGRA2RGB(bgra)
         rgbim.flags.writeable = False
         # Commented to prevent log flooding
         # if model.MD_ACQ_DATE in data.metadata:
@@ -1044,7 +1037,9 @@ class Stream(object):
         #                    time.time() - data.metadata[model.MD_ACQ_DATE])
         md = self._find_metadata(data.metadata)
         md[model.MD_DIMS] = "YXC" # RGB format
-        return model.DataArray(rgbim, md)
+        rgbim = model.DataArray(rgbim, md)
+        rgbim.bgra = bgra  # Used as-is by the canvases (cf format_rgba_darray())
+        return rgbim
 
     def _shouldUpdateImage(self):
         """
@@ -1225,7 +1220,8 @@ class Stream(object):
         self._updateDRange(data)
 
         # Initially, _drange might be None, in which case it will be guessed
-        hist, edges = img.histogram(data, irange=self._drange)
+        hist, edges = img.histogram(data, irange=self._drange,
+                                    max_pixels=self._histogram_max_pixels)
         if hist.size > 256:
             chist = img.compactHistogram(hist, 256)
         else:
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+Copyright © 2026 Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License version 2 as published by the Free Software Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+import json
+import logging
+import os
+from typing import Tuple, List, Optional, Dict, Any
+
+import h5py
+import numpy
+
+from odemis import model
+from odemis.util.conversion import JsonExtraEncoder
+
+# Format version of the checkpoint files. To be increased every time the format changes
+# in an incompatible way.
+CHECKPOINT_VERSION = 2
+
+
+def _encode_metadata(obj: Any) -> Any:
+    """
+    Converts the metadata to an object which can be serialized to JSON, while keeping
+    the types which JSON doesn't distinguish (tuples and numpy arrays).
+    :param obj: metadata dict, or any value in it
+    :return: the same data, with tuples and arrays replaced by tagged dicts
+    """
+    if isinstance(obj, dict):
+        return {k: _encode_metadata(v) for k, v in obj.items()}
+    elif isinstance(obj, tuple):
+        return {"__tuple__": [_encode_metadata(v) for v in obj]}
+    elif isinstance(obj, list):
+        return [_encode_metadata(v) for v in obj]
+    elif isinstance(obj, numpy.ndarray):
+        return {"__ndarray__": obj.tolist(), "dtype": obj.dtype.str}
+    return obj  # JsonExtraEncoder takes care of the rest (eg, numpy numbers)
+
+
+def _decode_metadata(obj: Dict[str, Any]) -> Any:
+    """
+    Object hook for json.loads(), to convert back the data encoded by _encode_metadata()
+    """
+    if "__tuple__" in obj:
+        return tuple(obj["__tuple__"])
+    elif "__ndarray__" in obj:
+        return numpy.array(obj["__ndarray__"], dtype=obj["dtype"])
+    return obj
+
+
+class AcquisitionCheckpoint:
+    """
+    Stores on disk the data of a pixel-by-pixel acquisition (typically SEM + CCD), as soon as
+    each pixel is acquired, so that an interrupted acquisition can be resumed later.
+    The file is an HDF5 file. For each polarization, and each stream, the data is stored in a
+    chunked dataset of shape (Y, X) + shape of the data of one pixel. The file also contains the
+    settings of the acquisition, and which pixels have been completely acquired.
+    The metadata of each pixel is stored as JSON.
+    """
+
+    def __init__(self, filename: str, settings: Dict[str, Any], rep: Tuple[int, int],
+                 npol: int, nstreams: int):
+        """
+        :param filename: path of the file. If it already exists, and was recorded with the same
+        settings, the pixels already stored are reused. Otherwise, it is created.
+        :param settings: anything that defines the acquisition. It must be serializable to JSON.
+        :param rep: number of pixels to acquire (X, Y)
+        :param npol: number of polarizations (ie, number of spatial acquisitions)
+        :param nstreams: number of streams
+        :raise ValueError: if the file already exists, but is not a checkpoint of an acquisition
+        with the same settings.
+        """
+        self.filename = filename
+        self._settings = json.dumps(settings, cls=JsonExtraEncoder, sort_keys=True)
+        self._shape = (npol, rep[1], rep[0])
+        self._nstreams = nstreams
+
+        if os.path.exists(filename):
+            self._file = h5py.File(filename, "a")
+            try:
+                self._check_compatible()
+            except Exception:
+                self._file.close()
+                raise
+        else:
+            self._file = h5py.File(filename, "w")
+            self._file.attrs["Version"] = CHECKPOINT_VERSION
+            self._file.attrs["Settings"] = self._settings
+            self._file.attrs["NumberOfStreams"] = nstreams
+            self._file.create_dataset("Done", shape=self._shape, dtype=bool)
+
+        self._ds_done = self._file["Done"]
+        self._done = self._ds_done[()]  # Copy in memory, to quickly check the state of each pixel
+        logging.debug("Opened checkpoint %s, with %d pixels already acquired", filename, self.n_done)
+
+    def _check_compatible(self) -> None:
+        """
+        :raise ValueError: if the (opened) file doesn't match the acquisition
+        """
+        f = self._file
+        if f.attrs.get("Version") != CHECKPOINT_VERSION:
+            raise ValueError("File %s is not a checkpoint of version %d" %
+                             (self.filename, CHECKPOINT_VERSION))
+        if (f.attrs.get("Settings") != self._settings or
+            f.attrs.get("NumberOfStreams") != self._nstreams or
+            "Done" not in f or f["Done"].shape != self._shape
+           ):
+            raise ValueError("Checkpoint %s was recorded with different settings" % (self.filename,))
+
+    @property
+    def n_done(self) -> int:
+        """
+        Number of pixels completely acquired (for all the polarizations)
+        """
+        return int(numpy.count_nonzero(self._done))
+
+    def is_done(self, pol_idx: int, px_idx: Tuple[int, int]) -> bool:
+        """
+        :param pol_idx: polarization index
+        :param px_idx: pixel index (Y, X)
+        :return: True if the data of the pixel is stored
+        """
+        return bool(self._done[(pol_idx,) + tuple(px_idx)])
+
+    def _get_datasets(self, pol_idx: int, n: int, da: Optional[model.DataArray] = None
+                      ) -> Optional[Tuple[h5py.Dataset, h5py.Dataset]]:
+        """
+        :param pol_idx: polarization index
+        :param n: stream index
+        :param da: data of one pixel, to create the datasets if they don't exist yet.
+        :return: the datasets for the data and metadata, or None if they don't exist (and da is None)
+        """
+        gname = "Pol%d/Stream%d" % (pol_idx, n)
+        if gname not in self._file:
+            if da is None:
+                return None
+            group = self._file.create_group(gname)
+            rep = self._shape[1:]
+            # One chunk per pixel: the data is written pixel by pixel, and the data of a pixel
+            # is typically a whole CCD image.
+            group.create_dataset("Data", shape=rep + da.shape, dtype=da.dtype,
+                                 chunks=(1, 1) + da.shape)
+            group.create_dataset("Metadata", shape=rep, dtype=h5py.string_dtype())
+
+        group = self._file[gname]
+        return group["Data"], group["Metadata"]
+
+    def write_pixel(self, pol_idx: int, px_idx: Tuple[int, int], px_pos: Tuple[float, float],
+                    das: List[Optional[model.DataArray]]) -> None:
+        """
+        Store the data of one pixel, and mark it as done. Call flush() to make sure it's on disk.
+        :param pol_idx: polarization index
+        :param px_idx: pixel index (Y, X)
+        :param px_pos: position of the pixel (X, Y) in m
+        :param das: the data of the pixel, for each stream (None if no data for the stream)
+        """
+        px_idx = tuple(px_idx)
+        for n, da in enumerate(das):
+            if da is None:
+                continue
+            ds_data, ds_md = self._get_datasets(pol_idx, n, da)
+            ds_data[px_idx] = da
+            ds_md[px_idx] = json.dumps(_encode_metadata(da.metadata), cls=JsonExtraEncoder)
+
+        pname = "Pol%d/Position" % (pol_idx,)
+        if pname not in self._file:
+            self._file.create_dataset(pname, shape=self._shape[1:] + (2,), dtype=float)
+        self._file[pname][px_idx] = px_pos
+
+        # Only mark it as done once all the data has been written
+        self._ds_done[(pol_idx,) + px_idx] = True
+        self._done[(pol_idx,) + px_idx] = True
+
+    def read_pixel(self, pol_idx: int, px_idx: Tuple[int, int]
+                   ) -> Tuple[Tuple[float, float], List[Optional[model.DataArray]]]:
+        """
+        Read back the data of one pixel, as passed to write_pixel().
+        :param pol_idx: polarization index
+        :param px_idx: pixel index (Y, X)
+        :return: position of the pixel (X, Y) in m, data for each stream
+        :raise LookupError: if the pixel is not stored
+        """
+        px_idx = tuple(px_idx)
+        if not self.is_done(pol_idx, px_idx):
+            raise LookupError("Pixel %s of polarization %d is not stored" % (px_idx, pol_idx))
+
+        das = []
+        for n in range(self._nstreams):
+            datasets = self._get_datasets(pol_idx, n)
+            if datasets is None:
+                das.append(None)
+                continue
+            ds_data, ds_md = datasets
+            md_str = ds_md[px_idx]
+            if isinstance(md_str, bytes):
+                md_str = md_str.decode("utf-8")
+            if not md_str:  # No data for this stream at this pixel
+                das.append(None)
+                continue
+            md = json.loads(md_str, object_hook=_decode_metadata)
+            das.append(model.DataArray(ds_data[px_idx], md))
+
+        px_pos = tuple(float(p) for p in self._file["Pol%d/Position" % (pol_idx,)][px_idx])
+        return px_pos, das
+
+    def flush(self) -> None:
+        """
+        Ensure all the data written so far is stored in the file
+        """
+        self._file.flush()
+
+    def close(self) -> None:
+        """
+        Flush the data and close the file. The checkpoint cannot be used afterwards.
+        """
+        if self._file is None:
+            return
+        try:
+            self._file.flush()
+        finally:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """
+        Close and delete the file. To be called when the acquisition is complete.
+        """
+        self.close()
+        try:
+            os.remove(self.filename)
+        except OSError as ex:
+            logging.warning("Failed to delete checkpoint %s: %s", self.filename, ex)
@@ -36,6 +36,10 @@ import weakref
 
 from ._base import Stream
 
+# Maximum number of pixels used to compute the histogram of live images.
+# With 1M pixels, the ratio of pixels below a given value is typically within
+# 0.2% of the real one, which is less than the ratio of outliers removed.
+LIVE_HISTOGRAM_MAX_PIXELS = 1024 * 1024
 
 class LiveStream(Stream):
     """
@@ -51,6 +55,11 @@ class LiveStream(Stream):
 
         self._forcemd = forcemd
 
+        # The histogram is only used for display and to find the outliers
+        # (typically 1/256 of the pixels), so a subsample is precise enough, and
+        # keeps the histogram computation fast with large live images.
+        self._histogram_max_pixels = LIVE_HISTOGRAM_MAX_PIXELS
+
         self.is_active.subscribe(self._onActive)
 
         # Allows to stop the acquisition after a single frame, also interrupts ongoing acquisitions if set to True.
@@ -20,6 +20,8 @@ You should have received a copy of the GNU General Public License along with
 Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 
+import collections
+import itertools
 import threading
 import weakref
 import logging
@@ -28,7 +30,7 @@ import math
 import gc
 import numpy
 
-from typing import Tuple, Dict, Union
+from typing import Tuple, Union, Hashable, Optional
 from odemis.acq.stream import POL_POSITIONS
 from odemis.model import TINT_FIT_TO_RGB
 
@@ -46,6 +48,135 @@ from odemis.acq.stream._static import StaticSpectrumStream
 from abc import abstractmethod
 
 
+# Maximum memory used by the tiles cached, shared among all the projections (in bytes)
+TILE_CACHE_MAX_SIZE = 512 * 2 ** 20
+
+# Metadata defining the geometry of an AR image, which must be identical to convert images together
+AR_GEOMETRY_MD = (model.MD_PIXEL_SIZE, model.MD_AR_POLE, model.MD_AR_PARABOLA_F, model.MD_AR_XMAX,
+                  model.MD_AR_HOLE_DIAMETER, model.MD_AR_FOCUS_DISTANCE)
+
+
+class TileCache(object):
+    """
+    Least-recently-used cache of tiles, limited by the total memory they use.
+    It's thread-safe, so that it can be shared between all the projections.
+    The keys are tuples, which start with a token identifying the data they
+    come from (see get_token()).
+    """
+
+    def __init__(self, max_size: int):
+        """
+        max_size: maximum number of bytes used by all the tiles
+        """
+        self._lock = threading.Lock()
+        self._tiles = collections.OrderedDict()  # key -> DataArray, the most recently used last
+        self._size = 0  # bytes currently used
+        self._max_size = max_size
+        self._tokens = weakref.WeakKeyDictionary()  # data -> int
+        self._token_counter = itertools.count()
+        self._dead_tokens = []  # int: tokens whose data has been garbage-collected
+
+    @property
+    def size(self) -> int:
+        """
+        Number of bytes used by the cached tiles
+        """
+        return self._size
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value: int):
+        with self._lock:
+            self._max_size = value
+            self._evict()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __contains__(self, key):
+        return key in self._tiles
+
+    def get_token(self, data) -> int:
+        """
+        Return an identifier for the given data, which is unique over the
+         lifetime of the process. When the data is garbage-collected, all the
+         tiles with this token are dropped.
+        data (DataArrayShadow): the (pyramidal) data from which the tiles come
+        """
+        with self._lock:
+            try:
+                return self._tokens[data]
+            except KeyError:
+                token = next(self._token_counter)
+                self._tokens[data] = token
+        # Called during garbage collection, so just record it, and actually
+        # discard the tiles later, to avoid any reentrance issue
+        weakref.finalize(data, self._dead_tokens.append, token)
+        return token
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[model.DataArray]:
+        """
+        return: the tile, or None if it's not in the cache
+        """
+        with self._lock:
+            try:
+                tile = self._tiles[key]
+            except KeyError:
+                return None
+            self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: Tuple[Hashable, ...], tile: model.DataArray):
+        """
+        Add (or replace) a tile, and drop the least recently used tiles if the
+        cache is above its size.
+        """
+        nbytes = tile.nbytes
+        with self._lock:
+            self._discard_dead()
+            if key in self._tiles:
+                self._size -= self._tiles.pop(key).nbytes
+            if nbytes > self._max_size:
+                return  # too big, no point in caching it
+            self._tiles[key] = tile
+            self._size += nbytes
+            self._evict()
+
+    def discard(self, token: int):
+        """
+        Remove all the tiles corresponding to the given data token
+        """
+        with self._lock:
+            self._discard_tokens({token})
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self._size = 0
+
+    def _evict(self):
+        # Must be called with the lock taken
+        while self._size > self._max_size:
+            _, tile = self._tiles.popitem(last=False)
+            self._size -= tile.nbytes
+
+    def _discard_dead(self):
+        # Must be called with the lock taken
+        if self._dead_tokens:
+            tokens = set()
+            while self._dead_tokens:
+                tokens.add(self._dead_tokens.pop())
+            self._discard_tokens(tokens)
+
+    def _discard_tokens(self, tokens):
+        # Must be called with the lock taken
+        for k in [k for k in self._tiles if k[0] in tokens]:
+            self._size -= self._tiles.pop(k).nbytes
+
+
 class DataProjection(object):
 
     def __init__(self, stream):
@@ -136,6 +267,8 @@ class RGBProjection(DataProjection):
         '''
         super(RGBProjection, self).__init__(stream)
 
+        # Note: the same image in BGRA (as used for display) is available in
+        # the .bgra attribute of the DataArray.
         self.image = model.VigilantAttribute(None)
 
         # Don't call at init, so don't set metadata if default value
@@ -192,7 +325,10 @@ class RGBProjection(DataProjection):
         """
         # TODO replace by local irange
         irange = self.stream._getDisplayIRange()
-        rgbim = img.DataArray2RGB(data, irange, tint)
+        # Directly computed in the format used for display (BGRA), so that the
+        # canvases don't need to convert it.
+        bgra = img.DataArray2BGRA(data, irange, tint)
+        rgbim = img.BGRA2RGB(bgra)
         rgbim.flags.writeable = False
         # Commented to prevent log flooding
         # if model.MD_ACQ_DATE in data.metadata:
@@ -200,7 +336,9 @@ class RGBProjection(DataProjection):
         #                    time.time() - data.metadata[model.MD_ACQ_DATE])
         md = self._find_metadata(data.metadata)
         md[model.MD_DIMS] = "YXC"  # RGB format
-        return model.DataArray(rgbim, md)
+        rgbim = model.DataArray(rgbim, md)
+        rgbim.bgra = bgra  # Used as-is by the canvases (cf format_rgba_darray())
+        return rgbim
 
     def projectAsRaw(self):
         """ Project a raw image without converting to RGB
@@ -225,10 +363,11 @@ class RGBProjection(DataProjection):
     def force_image_update(self):
         """Forces the image to be recomputed entirely, and invalidates the cache for tiled images"""
 
-        if hasattr(self, "_projectedTilesCache") and hasattr(self, "_rawTilesCache"):
-            # invalidate the raw and projected tiles cache
-            self._projectedTilesCache = {}
-            self._rawTilesCache = {}
+        if hasattr(self, "tileCache"):
+            # invalidate the raw and projected tiles of the data
+            raw = self.stream.raw
+            if raw and isinstance(raw[0], model.DataArrayShadow):
+                self.tileCache.discard(self.tileCache.get_token(raw[0]))
             self._update_rect()  # re-compute the image rect
         self._shouldUpdateImage()
 
@@ -353,6 +492,34 @@ class ARProjection(RGBProjection):
 
         return image_resized
 
+    def _convertAR(self, images, convert, output_size):
+        """
+        Convert several AR images to a projection. When they all have the same geometry (as is
+        the case for the images of a given ebeam position), they are converted at once, as a cube.
+        :param images: (dict: key -> 2D DataArray) The (background corrected) images to convert.
+        :param convert: (callable) angleres.AngleResolved2Polar or angleres.AngleResolved2Rectangular.
+        :param output_size: (int or (int, int)) The size of the output images.
+        :returns: (dict: key -> 2D DataArray) The converted images, with their own metadata.
+        """
+        first = next(iter(images.values()))
+        same_geometry = all(im.shape == first.shape and
+                            all(im.metadata.get(k) == first.metadata.get(k) for k in AR_GEOMETRY_MD)
+                            for im in images.values())
+        if len(images) == 1 or not same_geometry:
+            return {k: convert(im, output_size, hole=False) for k, im in images.items()}
+
+        cube = model.DataArray(numpy.stack(list(images.values())), first.metadata)
+        converted = convert(cube, output_size, hole=False)
+        # The geometry metadata might have been adjusted by the conversion (eg, flipped mirror)
+        geom_md = {k: v for k, v in converted.metadata.items() if k in AR_GEOMETRY_MD}
+        converted_images = {}
+        for i, (k, im) in enumerate(images.items()):
+            md = im.metadata.copy()
+            md.update(geom_md)
+            converted_images[k] = model.DataArray(converted[i], md)
+
+        return converted_images
+
 
 class ARRawProjection(ARProjection):
     """
@@ -393,37 +560,50 @@ class ARRawProjection(ARProjection):
         try:
             polar_data = polar_cache.setdefault(ebeam_pos, {})[pol_pos]
         except KeyError:
-            # Compute the polar representation
+            try:
+                self._computePolar(polar_cache, ebeam_pos, [pol_pos])
+                polar_data = polar_cache[ebeam_pos][pol_pos]
+            except Exception:
+                logging.exception("Failed to convert to azimuthal projection")
+                return self.stream._pos[ebeam_pos + (pol_pos,)]  # display its raw as fallback
+
+        return polar_data
+
+    def _computePolar(self, polar_cache, ebeam_pos, pol_positions):
+        """
+        Compute the polar representation of the images at the given positions, and store them in the cache.
+        All the images are converted at once.
+        :param polar_cache: (dict) The cache of polar images, as ._polar_cache.
+        :param ebeam_pos: (float, float), string or None) Ebeam position (must be part of the .stream._pos).
+        :param pol_positions: (list of str or None) Polarization positions (must be part of the .stream._pos).
+        """
+        calibrated = {}
+        for pol_pos in pol_positions:
             data = self.stream._pos[ebeam_pos + (pol_pos,)]
             # TODO: stream._pos can be then also be structured ebeam_pos/pol_pos.
             #   That would also simplify the check for the correct bg image etc.
 
-            try:
-                # Correct image for background. It must match the polarization (defaulting to MD_POL_NONE).
-                calibrated = self._processBackground(data, data.metadata.get(model.MD_POL_MODE, model.MD_POL_NONE))
-
-                # resize if too large to not run into memory problems
-                if numpy.prod(calibrated.shape) > (1280 * 1080):
-                    calibrated = self._resizeImage(calibrated, size=1024)
+            # Correct image for background. It must match the polarization (defaulting to MD_POL_NONE).
+            calib = self._processBackground(data, data.metadata.get(model.MD_POL_MODE, model.MD_POL_NONE))
 
-                # define the size of the image for polar representation in GUI
-                # 2 x size of original/raw image (on smallest axis) and at most
-                # the size of a full-screen canvas (1134)
-                output_size = min(min(calibrated.shape) * 2, 1134)
+            # resize if too large to not run into memory problems
+            if numpy.prod(calib.shape) > (1280 * 1080):
+                calib = self._resizeImage(calib, size=1024)
+            calibrated[pol_pos] = calib
 
-                # TODO: could use the size of the canvas that will display the image to save some computation time.
+        # define the size of the image for polar representation in GUI
+        # 2 x size of original/raw image (on smallest axis) and at most
+        # the size of a full-screen canvas (1134)
+        output_size = min(min(next(iter(calibrated.values())).shape) * 2, 1134)
 
-                # Warning: allocates lot of memory, which will not be free'd until
-                # the current thread is terminated.
-                polar_data = angleres.AngleResolved2Polar(calibrated, output_size, hole=False)
+        # TODO: could use the size of the canvas that will display the image to save some computation time.
 
-                # TODO: don't hold too many of them in cache (eg, max 3 * 1134**2)
-                polar_cache[ebeam_pos][pol_pos] = polar_data
-            except Exception:
-                logging.exception("Failed to convert to azimuthal projection")
-                return data  # display its raw as fallback
+        # Warning: allocates lot of memory, which will not be free'd until
+        # the current thread is terminated.
+        polar_data = self._convertAR(calibrated, angleres.AngleResolved2Polar, output_size)
 
-        return polar_data
+        # TODO: don't hold too many of them in cache (eg, max 3 * 1134**2)
+        polar_cache.setdefault(ebeam_pos, {}).update(polar_data)
 
     def _updateImage(self):
         """
@@ -482,31 +662,31 @@ class ARRawProjection(ARProjection):
             as described, but for every polarization analyzer positions.
         """
         ebeam_pos = self.stream.point.value  # ebeam pos selected
-        data_dict = {}
 
         if hasattr(self, "polarization"):
             pol_positions = self.polarization.choices
         else:
             pol_positions = [None]
 
+        calibrated = {}
         for pol_pos in pol_positions:
             data = self.stream._pos[ebeam_pos + (pol_pos,)]
 
             # Correct image for background. It must match the polarization (defaulting to MD_POL_NONE).
-            calibrated = self._processBackground(data, data.metadata.get(model.MD_POL_MODE, model.MD_POL_NONE),
-                                                 clip_data=False)
+            calib = self._processBackground(data, data.metadata.get(model.MD_POL_MODE, model.MD_POL_NONE),
+                                            clip_data=False)
 
             # resize if too large to not run into memory problems
-            if numpy.prod(calibrated.shape) > (800 * 800):
-                calibrated = self._resizeImage(calibrated, size=768)
+            if numpy.prod(calib.shape) > (800 * 800):
+                calib = self._resizeImage(calib, size=768)
+            calibrated[pol_pos] = calib
 
-            output_size = (90, 360)  # Note: increase if data is high def
-
-            # calculate raw theta/phi representation
-            data = angleres.AngleResolved2Rectangular(calibrated, output_size, hole=False)
+        output_size = (90, 360)  # Note: increase if data is high def
 
+        # calculate raw theta/phi representation, of all the polarization positions at once
+        data_dict = self._convertAR(calibrated, angleres.AngleResolved2Rectangular, output_size)
+        for data in data_dict.values():
             data.metadata[model.MD_ACQ_TYPE] = model.MD_AT_AR
-            data_dict[pol_pos] = data
 
         # TODO for now we distinguish in export between dict and array...
         if len(pol_positions) > 1:
@@ -525,6 +705,15 @@ class ARRawProjection(ARProjection):
         data_dict = {}
 
         if hasattr(self, "polarization"):
+            # Convert all the missing polarization positions at once
+            polar_cache = self._polar_cache
+            missing = [p for p in self.polarization.choices if p not in polar_cache.get(ebeam_pos, {})]
+            if missing:
+                try:
+                    self._computePolar(polar_cache, ebeam_pos, missing)
+                except Exception:
+                    logging.exception("Failed to convert to azimuthal projection")
+
             for pol_pos in self.polarization.choices:
                 data = self._project2Polar(ebeam_pos, pol_pos)
                 data = self._project2RGB(data, self.stream.tint.value)
@@ -613,25 +802,27 @@ class ARPolarimetryProjection(ARProjection):
                 # and tested on an image of size (256, 1024).
 
                 # TODO get the raw/bg processed data from polar_cache, as now we do bg subtraction twice
-                calibrated_raw = {}
 
                 # TODO allow variable input size? Calc based on raw data? E.g. with binning
                 # The number of pixels (theta, phi) of the output image.
                 output_size = (400, 600)  # defines the resolution of the displayed image
 
+                calibrated = {}
                 for pol, raw in data_raw.items():
                     logging.debug("Processing polarimetry raw image for ebeam pos %s and pol %s", ebeam_pos, pol)
 
                     # Correct image for background. It must match the polarization (defaulting to MD_POL_NONE).
-                    calibrated = self._processBackground(raw, raw.metadata.get(model.MD_POL_MODE, model.MD_POL_NONE))
+                    calib = self._processBackground(raw, raw.metadata.get(model.MD_POL_MODE, model.MD_POL_NONE))
 
                     # check if image is too large and we might run into memory trouble -> resize
-                    if numpy.prod(calibrated.shape) > (1280 * 1080):
-                        calibrated = self._resizeImage(calibrated, size=1024)
+                    if numpy.prod(calib.shape) > (1280 * 1080):
+                        calib = self._resizeImage(calib, size=1024)
+                    calibrated[pol] = calib
 
-                    logging.debug("Calculating rectangular representation for ebeam pos %s and pol %s", ebeam_pos, pol)
-                    # calculate the rectangular representation (phi/theta) of the background corrected raw images
-                    calibrated_raw[pol] = angleres.AngleResolved2Rectangular(calibrated, output_size, hole=False)
+                logging.debug("Calculating rectangular representation for ebeam pos %s", ebeam_pos)
+                # calculate the rectangular representation (phi/theta) of the background corrected raw images,
+                # all the polarization positions at once
+                calibrated_raw = self._convertAR(calibrated, angleres.AngleResolved2Rectangular, output_size)
 
                 # Get the center wavelength of the filter used (no filter aka "pass-through" use fallback)
                 # Does not matter from which of the 6 images as they all were recorded with the same filter
@@ -827,6 +1018,10 @@ class RGBSpatialProjection(RGBProjection):
     That is the recommended way to create a RGBSpatialProjection.
     """
 
+    # Cache for the raw and projected tiles of pyramidal data, shared by all the
+    # projections. Its .max_size can be changed to adjust the memory usage.
+    tileCache = TileCache(TILE_CACHE_MAX_SIZE)
+
     def __new__(cls, stream):
 
         if isinstance(stream, StaticSpectrumStream):
@@ -872,11 +1067,11 @@ class RGBSpatialProjection(RGBProjection):
             self.rect.clip_on_range = True
             self.mpp.subscribe(self._onMpp)
             self.rect.subscribe(self._onRect)
-            # initialize the projected tiles cache
-            self._projectedTilesCache = {}
-            # initialize the raw tiles cache
-            self._rawTilesCache = {}
-            # When True, the projected tiles cache should be invalidated
+            # Number of tiles found (hits) or not (misses) in the tile cache
+            self._cacheStats = {"raw_hits": 0, "raw_misses": 0,
+                                "projected_hits": 0, "projected_misses": 0}
+            # When True, the display settings have changed, so the tiles
+            # currently being projected should be recomputed
             self._projectedTilesInvalid = True
 
         self._shouldUpdateImage()
@@ -902,16 +1097,34 @@ class RGBSpatialProjection(RGBProjection):
         exp = round(exp)
         return ps0 * 2 ** exp
 
-    def _projectXY2RGB(self, data, tint=(255, 255, 255)):
+    def getTileCacheStats(self):
+        """
+        Get the statistics of the tile cache usage by this projection
+        return (dict str -> int): number of tiles found ("*_hits") or not ("*_misses")
+          in the cache, for the raw and projected tiles. Also the current ("size")
+          and maximum ("max_size") memory used by the (shared) cache, in bytes.
+        """
+        stats = dict(self._cacheStats)
+        stats["size"] = self.tileCache.size
+        stats["max_size"] = self.tileCache.max_size
+        return stats
+
+    def _projectXY2RGB(self, data, tint=(255, 255, 255), irange=None):
         """
         Project a 2D spatial DataArray into a RGB representation
         data (DataArray): 2D DataArray
         tint ((int, int, int)): colouration of the image, in RGB.
+        irange (None or (number, number)): the min/max values to map to
+          black/white. If None, uses the current display range of the stream.
         return (DataArray): 3D DataArray
         """
         # TODO replace by local irange
-        irange = self.stream._getDisplayIRange()
-        rgbim = img.DataArray2RGB(data, irange, tint)
+        if irange is None:
+            irange = self.stream._getDisplayIRange()
+        # Directly computed in the format used for display (BGRA), so that the
+        # canvases don't need to convert it.
+        bgra = img.DataArray2BGRA(data, irange, tint)
+        rgbim = img.BGRA2RGB(bgra)
         rgbim.flags.writeable = False
         # Commented to prevent log flooding
         # if model.MD_ACQ_DATE in data.metadata:
@@ -919,7 +1132,9 @@ class RGBSpatialProjection(RGBProjection):
         #                    time.time() - data.metadata[model.MD_ACQ_DATE])
         md = self._find_metadata(data.metadata)
         md[model.MD_DIMS] = "YXC"  # RGB format
-        return model.DataArray(rgbim, md)
+        rgbim = model.DataArray(rgbim, md)
+        rgbim.bgra = bgra  # Used as-is by the canvases (cf format_rgba_darray())
+        return rgbim
 
     def getPixelCoordinates(self, p_pos):
         """
@@ -1026,65 +1241,85 @@ class RGBSpatialProjection(RGBProjection):
             int(round(rect[1] / (-ps[1]) + img_shape[1] / 2)) - 1,
         )
 
+    def _getDisplayKey(self, irange, tint):
+        """
+        Compute the part of the key of the projected tiles which depends on the
+         display settings.
+        irange ((number, number)): the min/max values mapped to black/white
+        tint (tuple or Colormap): the colouration
+        return (tuple): hashable representation of the display settings
+        """
+        if not isinstance(tint, tuple):
+            # Colormaps are not always hashable, but they all have a name
+            tint = getattr(tint, "name", id(tint))
+        key = (tuple(irange), tint)
+        if model.hasVA(self.stream, "zIndex"):
+            key += (self.stream.zIndex.value,)
+        if model.hasVA(self.stream, "max_projection"):
+            key += (self.stream.max_projection.value,)
+        return key
+
     def _getTile(
         self,
         x: int,
         y: int,
         z: int,
-        prev_raw_cache: Dict[str, model.DataArray],
-        prev_proj_cache: Dict[str, model.DataArray],
+        irange: Tuple[float, float],
+        tint,
     ) -> Tuple[model.DataArray, model.DataArray]:
         """
-        Get a tile from a DataArrayShadow. Uses cache.
-        The cache for projected tiles and the cache for raw tiles has always the same tiles
+        Get a tile from a DataArrayShadow. Uses the (shared) tile cache.
         x (int): X coordinate of the tile
         y (int): Y coordinate of the tile
         z (int): zoom level where the tile is
-        prev_raw_cache (dictionary): raw tiles cache from the
-            last execution of _updateImage
-        prev_proj_cache (dictionary): projected tiles cache from the
-            last execution of _updateImage
+        irange: the min/max values mapped to black/white
+        tint (tuple or Colormap): the colouration
         return (DataArray, DataArray): raw tile and projected tile
         """
-        # the key of the tile on the cache
-        tile_key = "%d-%d-%d" % (x, y, z)
+        das = self.stream.raw[0]
+        token = self.tileCache.get_token(das)
+        raw_key = (token, "raw", x, y, z)
+        proj_key = (token, "rgb", x, y, z, self._getDisplayKey(irange, tint))
 
-        # if the raw tile has been already cached, read it from the cache
-        if tile_key in prev_raw_cache:
-            raw_tile = prev_raw_cache[tile_key]
-        elif tile_key in self._rawTilesCache:
-            raw_tile = self._rawTilesCache[tile_key]
-        else:
+        raw_tile = self.tileCache.get(raw_key)
+        if raw_tile is None:
             # The tile was not cached, so it must be read from the file
-            raw_tile = self.stream.raw[0].getTile(x, y, z)
-
-        # if the projected tile has been already cached, read it from the cache
-        if tile_key in prev_proj_cache:
-            proj_tile = prev_proj_cache[tile_key]
-        elif tile_key in self._projectedTilesCache:
-            proj_tile = self._projectedTilesCache[tile_key]
+            self._cacheStats["raw_misses"] += 1
+            raw_tile = das.getTile(x, y, z)
+            self.tileCache.put(raw_key, raw_tile)
         else:
+            self._cacheStats["raw_hits"] += 1
+
+        proj_tile = self.tileCache.get(proj_key)
+        if proj_tile is None:
             # The tile was not cached, so it must be projected again
-            proj_tile = self._projectTile(raw_tile)
+            self._cacheStats["projected_misses"] += 1
+            proj_tile = self._projectTile(raw_tile, irange, tint)
+            self.tileCache.put(proj_key, proj_tile)
+        else:
+            self._cacheStats["projected_hits"] += 1
 
-        # cache raw and projected tiles
-        self._rawTilesCache[tile_key] = raw_tile
-        self._projectedTilesCache[tile_key] = proj_tile
         return raw_tile, proj_tile
 
-    def _projectTile(self, tile):
+    def _projectTile(self, tile, irange=None, tint=None):
         """
         Project the tile
         tile (DataArray): Raw tile
+        irange (None or (number, number)): the min/max values to map to
+          black/white. If None, uses the current display range of the stream.
+        tint (None or tuple or Colormap): the colouration. If None, uses the
+          current tint of the stream.
         return (DataArray): Projected tile
         """
         dims = tile.metadata.get(model.MD_DIMS, "CTZYX"[-tile.ndim::])
         ci = dims.find("C")  # -1 if not found
         # handle the tint
-        tint = self.stream.tint.value
+        if tint is None:
+            tint = self.stream.tint.value
+        if irange is None:
+            irange = self.stream._getDisplayIRange()
 
         if dims in ("CYX", "YXC") and tile.shape[ci] in (3, 4):  # is RGB?
-            irange = self.stream._getDisplayIRange()
             # Take the RGB data as-is, just needs to make sure it's in the right order
             tile = img.ensureYXC(tile)
             if not isinstance(tint, tuple):
@@ -1106,7 +1341,44 @@ class RGBSpatialProjection(RGBProjection):
         else:
             tile = img.ensure2DImage(tile)
 
-        return self._projectXY2RGB(tile, tint)
+        return self._projectXY2RGB(tile, tint, irange)
+
+    def _prefetchTiles(self, das, tile_rect, z):
+        """
+        Ask the data to read in advance the tiles which are not in the cache:
+        first the ones visible, then the ones around, and the ones of the next
+        zoom levels.
+        das (DataArrayShadow): the data, with a prefetchTiles() method
+        tile_rect (int, int, int, int): the indices of the visible tiles (x1, y1, x2, y2)
+        z (int): the current zoom level
+        """
+        x1, y1, x2, y2 = tile_rect
+        xc, yc = (x1 + x2) / 2, (y1 + y2) / 2
+        token = self.tileCache.get_token(das)
+
+        def by_distance(tiles, zoom):
+            # The tiles the closest to the center are the most likely to be needed
+            scale = 2 ** (z - zoom)
+            return sorted(tiles, key=lambda t: (t[0] / scale - xc) ** 2 + (t[1] / scale - yc) ** 2)
+
+        visible = [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+        around = [(x, y) for x in range(x1 - 1, x2 + 2) for y in range(y1 - 1, y2 + 2)
+                  if not (x1 <= x <= x2 and y1 <= y <= y2)]
+        # When zooming in, the tiles will be at the zoom level just below
+        zoom_in = [(x, y) for x in range(x1 * 2, x2 * 2 + 2) for y in range(y1 * 2, y2 * 2 + 2)]
+        zoom_out = {(x // 2, y // 2) for x, y in visible}
+
+        tiles = []
+        for zoom, ztiles in ((z, visible), (z, by_distance(around, z)),
+                             (z - 1, by_distance(zoom_in, z - 1)),
+                             (z + 1, by_distance(zoom_out, z + 1))):
+            if zoom < 0:
+                continue
+            tiles.extend((x, y, zoom) for x, y in ztiles
+                         if (token, "raw", x, y, zoom) not in self.tileCache)
+
+        if tiles:
+            das.prefetchTiles(tiles)
 
     def _getTilesFromSelectedArea(self):
         """
@@ -1121,9 +1393,6 @@ class RGBSpatialProjection(RGBProjection):
 
         das = self.stream.raw[0]
 
-        # store the previous cache to use in this execution
-        prev_raw_cache = self._rawTilesCache
-        prev_proj_cache = self._projectedTilesCache
         # Execute at least once. If mpp and rect changed in
         # the last execution of the loops, execute again
         need_recompute = True
@@ -1142,13 +1411,14 @@ class RGBSpatialProjection(RGBProjection):
             rect = self.rect.value
             rect_x, rect_y = rect[2] - rect[0], rect[3] - rect[1]
 
-            # the 4 lines below avoids that lots of old tiles
-            # stays in instance caches
-            prev_raw_cache.update(self._rawTilesCache)
-            prev_proj_cache.update(self._projectedTilesCache)
-            # empty current caches
-            self._rawTilesCache = {}
-            self._projectedTilesCache = {}
+            if hasattr(das, "prefetchTiles"):
+                self._prefetchTiles(das, (x1, y1, x2, y2), z)
+
+            # The display settings are part of the key of the projected tiles,
+            # so the tiles projected with previous settings are simply not used.
+            self._projectedTilesInvalid = False
+            irange = self.stream._getDisplayIRange()
+            tint = self.stream.tint.value
 
             raw_tiles = []
             projected_tiles = []
@@ -1159,22 +1429,18 @@ class RGBSpatialProjection(RGBProjection):
                     pt_column = []
 
                     for y in range(y1, y2 + 1):
-                        # the projected tiles cache is invalid
+                        # the display settings have changed
                         if self._projectedTilesInvalid:
-                            self._projectedTilesCache = {}
-                            prev_proj_cache = {}
-                            self._projectedTilesInvalid = False
                             raise NeedRecomputeException()
 
                         # check if the image changed in the middle of the process
                         if self._im_needs_recompute.is_set():
                             self._im_needs_recompute.clear()
                             # Raise the exception, so everything will be calculated again,
-                            # but using the cache from the last execution
+                            # but using the tiles cached during this execution
                             raise NeedRecomputeException()
 
-                        raw_tile, proj_tile = \
-                            self._getTile(x, y, z, prev_raw_cache, prev_proj_cache)
+                        raw_tile, proj_tile = self._getTile(x, y, z, irange, tint)
                         rt_column.append(raw_tile)
                         pt_column.append(proj_tile)
 
@@ -42,6 +42,7 @@ from odemis.util import units, executeAsyncTask, almost_equal, img, angleres
 from odemis.util.driver import guessActuatorMoveDuration
 from ._helper import MonochromatorSettingsStream
 from ._base import Stream, POL_POSITIONS, POL_MOVE_TIME
+from ._checkpoint import AcquisitionCheckpoint
 
 # This contains "synchronised streams", which handle acquisition from multiple
 # detector simultaneously.
@@ -952,6 +953,12 @@ class SEMCCDMDStream(MultipleDetectorStream):
         self._trigger = self._emitter.startScan  # to acquire a CCD image every time the SEM starts a new scan
         self._ccd_idx = len(self._streams) - 1  # optical detector is always last in streams
 
+        # If not empty, path of a file where the data of each pixel is stored as soon as it is
+        # acquired. If the acquisition is interrupted (cancelled, error, crash...), running it
+        # again with the same settings resumes it, without acquiring again the pixels already
+        # stored. The file is deleted once the acquisition is complete.
+        self.checkpointFilename = model.StringVA("")
+
     def _supports_hw_sync(self):
         """
         :returns (bool): True if hardware synchronised acquisition is supported.
@@ -968,6 +975,11 @@ class SEMCCDMDStream(MultipleDetectorStream):
         if self.leeches:
             return False
 
+        # not supported with a checkpoint, as the whole area is scanned at once, so it cannot be
+        # resumed from a given pixel
+        if self.checkpointFilename.value:
+            return False
+
         # if emitter/scanner has newPixel Event, and affects CCD,
         if not hasattr(self._emitter, "newPixel") or not isinstance(self._emitter.newPixel, model.EventBase):
             return False
@@ -1209,6 +1221,43 @@ class SEMCCDMDStream(MultipleDetectorStream):
 
         return int_das
 
+    def _open_checkpoint(self, acquirer: "SEMCCDAcquirer", pos_polarizations: List[Optional[str]]
+                         ) -> Optional[AcquisitionCheckpoint]:
+        """
+        Open the checkpoint file, if one is requested.
+        :param acquirer: the acquirer, with the hardware already prepared
+        :param pos_polarizations: the polarizations to acquire
+        :return: the checkpoint, or None if no checkpoint should be used
+        :raise ValueError: if the file is a checkpoint of an acquisition with different settings
+        """
+        filename = self.checkpointFilename.value
+        if not filename:
+            return None
+
+        # Everything which should be identical to be able to resume the acquisition
+        settings = {
+            "type": self.__class__.__name__,
+            "repetition": self.repetition.value,
+            "roi": self.roi.value,
+            "rotation": self.rotation.value,
+            "polarizations": pos_polarizations,
+            "integration_count": acquirer.integration_count,
+            "tile_size": acquirer.tile_size,
+            "streams": [{"detector": s.detector.name,
+                         "settings": {n: va.value for n, va in
+                                      list(s.det_vas.items()) + list(s.emt_vas.items()) + list(s.axis_vas.items())}
+                         } for s in self._streams],
+        }
+        if hasattr(self, "fuzzing"):
+            settings["fuzzing"] = self.fuzzing.value
+
+        checkpoint = AcquisitionCheckpoint(filename, settings, self.repetition.value,
+                                           len(pos_polarizations), len(self._streams))
+        if checkpoint.n_done:
+            logging.info("Resuming acquisition from checkpoint %s, with %d pixels already acquired",
+                         filename, checkpoint.n_done)
+        return checkpoint
+
     def _assemble_final_data_all_streams(self):
         # Process all the (intermediary) ._live_data to the right shape/format for the final ._raw
         for stream_idx, das in enumerate(self._live_data):
@@ -1230,6 +1279,7 @@ class SEMCCDMDStream(MultipleDetectorStream):
         #      acquire one pixel acquisition, containing multiple pixel snapshots (exposure)
 
         error = None
+        checkpoint = None
         self._acq_done.clear()
         self._anchor_raw = []
         try:
@@ -1244,6 +1294,8 @@ class SEMCCDMDStream(MultipleDetectorStream):
             # total number of snapshot to acquire
             tot_num = int(numpy.prod(rep)) * acquirer.integration_count * len(pos_polarizations)
 
+            checkpoint = self._open_checkpoint(acquirer, pos_polarizations)
+
             # Prepare the leeches: *might* run some of them
             leech_time_p_snapshot = self._prepare_leeches(acquirer.snapshot_time, tot_num,
                                                           pos_polarizations, rep,
@@ -1262,6 +1314,7 @@ class SEMCCDMDStream(MultipleDetectorStream):
             # Iterate for the polarisations
             start_t = time.time()
             n = 0  # number of images acquired so far
+            n_resumed = 0  # number of images read from the checkpoint
             for pol_idx, pol_pos in enumerate(pos_polarizations):
                 # Move to the polarisation position
                 time_move_pol_left = self._select_polarization(pol_pos)
@@ -1271,34 +1324,46 @@ class SEMCCDMDStream(MultipleDetectorStream):
 
                 # iterate over pixel positions for scanning.
                 for px_idx in numpy.ndindex(*rep[::-1]):  # last dim (X) iterates first
-                    px_pos = acquirer.start_pixel_acquisition(px_idx)
-                    logging.debug("Acquiring px %s at %s", px_idx, px_pos)
-
-                    # Update the SEM update location => global
-                    self._update_live_area(px_idx, acquirer.tile_size, in_progress=True)
-
-                    # Prepare integrator (also work if just one snapshot is acquired)
-                    self._img_intor = [img.ImageIntegrator(acquirer.integration_count) for _ in self._streams]
-
-                    # Iterate over the integration time
-                    pixel_das = []
-                    for i in range(acquirer.integration_count):
-                        # Acquire the image
-                        start_snapshot = time.time()
-                        # NOTE: for hwsync, this is just about retrieving the image
-                        snapshot_das = acquirer.acquire_one_snapshot(n, px_idx)
-                        self._check_cancelled()
-                        self._update_live_pixel(snapshot_das[self._ccd_idx], acquirer.integration_count)
-                        pixel_das = self._integrate_snapshot(snapshot_das)
-                        dur_snapshot = time.time() - start_snapshot
-
-                        # extra time needed taking leeches into account and moving polarizer HW if present
-                        leech_time_left = (tot_num - n + 1) * leech_time_p_snapshot
-                        extra_time = leech_time_left + time_move_pol_left
-                        self._updateProgress(future, dur_snapshot, n + 1, tot_num, extra_time)
-
-                        self._run_leeches(acquirer, pixel_das)
-                        n += 1  # number of images acquired so far
+                    if checkpoint and checkpoint.is_done(pol_idx, px_idx):
+                        # Already acquired, during a previous (interrupted) acquisition
+                        px_pos, pixel_das = checkpoint.read_pixel(pol_idx, px_idx)
+                        n += acquirer.integration_count
+                        n_resumed += acquirer.integration_count
+                    else:
+                        px_pos = acquirer.start_pixel_acquisition(px_idx)
+                        logging.debug("Acquiring px %s at %s", px_idx, px_pos)
+
+                        # Update the SEM update location => global
+                        self._update_live_area(px_idx, acquirer.tile_size, in_progress=True)
+
+                        # Prepare integrator (also work if just one snapshot is acquired)
+                        self._img_intor = [img.ImageIntegrator(acquirer.integration_count) for _ in self._streams]
+
+                        # Iterate over the integration time
+                        pixel_das = []
+                        for i in range(acquirer.integration_count):
+                            # Acquire the image
+                            start_snapshot = time.time()
+                            # NOTE: for hwsync, this is just about retrieving the image
+                            snapshot_das = acquirer.acquire_one_snapshot(n, px_idx)
+                            self._check_cancelled()
+                            self._update_live_pixel(snapshot_das[self._ccd_idx], acquirer.integration_count)
+                            pixel_das = self._integrate_snapshot(snapshot_das)
+                            dur_snapshot = time.time() - start_snapshot
+
+                            # extra time needed taking leeches into account and moving polarizer HW if present
+                            leech_time_left = (tot_num - n + 1) * leech_time_p_snapshot
+                            extra_time = leech_time_left + time_move_pol_left
+                            self._updateProgress(future, dur_snapshot, n + 1 - n_resumed, tot_num - n_resumed, extra_time)
+
+                            self._run_leeches(acquirer, pixel_das)
+                            n += 1  # number of images acquired so far
+
+                        if checkpoint:
+                            # Store before assembling, as it may modify the metadata
+                            checkpoint.write_pixel(pol_idx, px_idx, px_pos, pixel_das)
+                            if px_idx[1] == rep[0] - 1:  # Row completed => make sure it's saved
+                                checkpoint.flush()
 
                     # All the data for this pixel has been acquired => store it in the "live data".
                     # Live data = data is the same shape as the final data, but not yet completely acquired.
@@ -1336,6 +1401,10 @@ class SEMCCDMDStream(MultipleDetectorStream):
             with self._acq_lock:
                 self._check_cancelled()
                 self._acq_state = FINISHED
+
+            # All the data is available => the checkpoint is not needed anymore
+            if checkpoint:
+                checkpoint.remove()
         except Exception as exp:
             acquirer.terminate_acquisition()
             if not isinstance(exp, CancelledError):
@@ -1356,6 +1425,8 @@ class SEMCCDMDStream(MultipleDetectorStream):
         finally:
             # Stop the acquisition for safety and clean up
             acquirer.terminate_acquisition()
+            if checkpoint:
+                checkpoint.close()  # No-op if already removed
             # Restore hardware settings
             for s in self._streams:
                 s._unlinkHwVAs()
@@ -526,6 +526,58 @@ class BaseSPARCTestCase(unittest.TestCase, ABC):
         sp_dims = spec_md.get(model.MD_DIMS, "CTZYX"[-sp_da.ndim::])
         self.assertEqual(sp_dims, "CTZYX")
 
+    def test_acq_spec_checkpoint(self):
+        """
+        Test resuming a cancelled Spectrometer acquisition, using a checkpoint file
+        """
+        self.skipIfNotSupported("spec")
+        # Create the stream
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam)
+        specs = stream.SpectrumSettingsStream("test spec", self.spec, self.spec.data, self.ebeam,
+                                              detvas={"exposureTime"})
+        sps = stream.SEMSpectrumMDStream("test sem-spec", [sems, specs])
+
+        specs.roi.value = (0.15, 0.6, 0.8, 0.8)
+        specs.detExposureTime.value = 0.1  # s
+        specs.repetition.value = (5, 6)
+        exp_pos, exp_pxs, exp_res = roi_to_phys(specs)
+
+        checkpoint_fn = "test-checkpoint.h5"
+        if os.path.exists(checkpoint_fn):
+            os.remove(checkpoint_fn)
+        sps.checkpointFilename.value = checkpoint_fn
+
+        # Start acquisition, and stop it in the middle
+        f = sps.acquire()
+        time.sleep(2)
+        f.cancel()
+        self.assertTrue(f.cancelled())
+        self.assertTrue(os.path.exists(checkpoint_fn))
+
+        # Changing the settings => cannot resume
+        specs.detExposureTime.value = 0.05  # s
+        f = sps.acquire()
+        data, exp = f.result(10)
+        self.assertIsInstance(exp, ValueError)
+        self.assertTrue(os.path.exists(checkpoint_fn))
+
+        # Same settings => resume, and only acquire the missing pixels
+        specs.detExposureTime.value = 0.1  # s
+        timeout = 1 + 1.5 * sps.estimateAcquisitionTime()
+        f = sps.acquire()
+        data, exp = f.result(timeout)
+        self.assertIsNone(exp)
+        self.assertFalse(os.path.exists(checkpoint_fn))  # Deleted once complete
+
+        sem_da = sps.raw[0]
+        self.assertEqual(sem_da.shape, exp_res[::-1])
+        sp_da = sps.raw[1]
+        self.assertEqual(sp_da.shape[-2:], exp_res[::-1])
+        # All the pixels should have some data (ie, none is left at 0)
+        self.assertTrue(numpy.all(sp_da.reshape(sp_da.shape[0], -1).any(axis=0)))
+        numpy.testing.assert_allclose(sp_da.metadata[model.MD_POS], exp_pos)
+        numpy.testing.assert_allclose(sp_da.metadata[model.MD_PIXEL_SIZE], exp_pxs)
+
     def test_acq_fuz(self):
         """
         Test short & long acquisition with fuzzing for Spectrometer
@@ -0,0 +1,140 @@
+#-*- coding: utf-8 -*-
+"""
+Copyright © 2026 Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+
+# Test acq.stream._checkpoint
+
+import logging
+import os
+import unittest
+
+import numpy
+
+from odemis import model
+from odemis.acq.stream._checkpoint import AcquisitionCheckpoint
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+FILENAME = "test-checkpoint.h5"
+SETTINGS = {"repetition": (4, 3), "streams": [{"detector": "spec", "settings": {"exposureTime": 0.1}}]}
+
+
+class TestAcquisitionCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(FILENAME):
+            os.remove(FILENAME)
+
+    def tearDown(self):
+        if os.path.exists(FILENAME):
+            os.remove(FILENAME)
+
+    def _pixel_data(self, px_idx):
+        sem = model.DataArray(numpy.full((1, 1), px_idx[0] * 10 + px_idx[1], dtype=numpy.uint16),
+                              {model.MD_DWELL_TIME: 1e-6})
+        spec = model.DataArray(numpy.arange(50, dtype=numpy.uint32).reshape(1, 50) + px_idx[1],
+                               {model.MD_EXP_TIME: 0.1, model.MD_WL_LIST: list(range(50)),
+                                model.MD_POS: (px_idx[1] * 1e-6, px_idx[0] * 1e-6)})
+        return [sem, spec]
+
+    def test_write_resume(self):
+        rep = (4, 3)
+        ckpt = AcquisitionCheckpoint(FILENAME, SETTINGS, rep, 1, 2)
+        self.assertEqual(ckpt.n_done, 0)
+
+        # Acquire the first 5 pixels, and "crash"
+        for i, px_idx in enumerate(numpy.ndindex(*rep[::-1])):
+            if i == 5:
+                break
+            ckpt.write_pixel(0, px_idx, (px_idx[1] * 1e-6, -px_idx[0] * 1e-6), self._pixel_data(px_idx))
+        ckpt.close()
+
+        # Resume
+        ckpt = AcquisitionCheckpoint(FILENAME, SETTINGS, rep, 1, 2)
+        self.assertEqual(ckpt.n_done, 5)
+        for i, px_idx in enumerate(numpy.ndindex(*rep[::-1])):
+            self.assertEqual(ckpt.is_done(0, px_idx), i < 5)
+            if i >= 5:
+                with self.assertRaises(LookupError):
+                    ckpt.read_pixel(0, px_idx)
+                continue
+
+            px_pos, das = ckpt.read_pixel(0, px_idx)
+            self.assertEqual(px_pos, (px_idx[1] * 1e-6, -px_idx[0] * 1e-6))
+            for da, exp_da in zip(das, self._pixel_data(px_idx)):
+                self.assertIsInstance(da, model.DataArray)
+                self.assertEqual(da.dtype, exp_da.dtype)
+                numpy.testing.assert_array_equal(da, exp_da)
+                self.assertEqual(da.metadata, exp_da.metadata)
+
+        # Stream without data for a pixel
+        ckpt.write_pixel(0, (1, 1), (0, 0), [None, self._pixel_data((1, 1))[1]])
+        px_pos, das = ckpt.read_pixel(0, (1, 1))
+        self.assertIsNone(das[0])
+        self.assertIsInstance(das[1], model.DataArray)
+
+        ckpt.remove()
+        self.assertFalse(os.path.exists(FILENAME))
+
+    def test_metadata(self):
+        """The metadata types not supported by JSON should be read back identical"""
+        rep = (2, 2)
+        md = {model.MD_POS: (1e-6, -2e-6),
+              model.MD_WL_LIST: [500e-9, 501e-9],
+              model.MD_EXTRA_SETTINGS: {"ccd": {"binning": [(1, 1), "px"]}},
+              model.MD_THETA_LIST: numpy.linspace(0, 1, 5),
+              model.MD_EXP_TIME: numpy.float32(0.5),
+              }
+        da = model.DataArray(numpy.zeros((2, 3), dtype=numpy.uint16), md)
+        ckpt = AcquisitionCheckpoint(FILENAME, SETTINGS, rep, 1, 1)
+        ckpt.write_pixel(0, (0, 1), (0, 0), [da])
+        ckpt.close()
+
+        ckpt = AcquisitionCheckpoint(FILENAME, SETTINGS, rep, 1, 1)
+        px_pos, das = ckpt.read_pixel(0, (0, 1))
+        rmd = das[0].metadata
+        self.assertEqual(rmd[model.MD_POS], md[model.MD_POS])
+        self.assertIsInstance(rmd[model.MD_POS], tuple)
+        self.assertEqual(rmd[model.MD_WL_LIST], md[model.MD_WL_LIST])
+        self.assertIsInstance(rmd[model.MD_WL_LIST], list)
+        self.assertEqual(rmd[model.MD_EXTRA_SETTINGS], md[model.MD_EXTRA_SETTINGS])
+        self.assertIsInstance(rmd[model.MD_THETA_LIST], numpy.ndarray)
+        numpy.testing.assert_array_equal(rmd[model.MD_THETA_LIST], md[model.MD_THETA_LIST])
+        self.assertEqual(rmd[model.MD_EXP_TIME], 0.5)
+        ckpt.close()
+
+    def test_different_settings(self):
+        rep = (4, 3)
+        ckpt = AcquisitionCheckpoint(FILENAME, SETTINGS, rep, 1, 2)
+        ckpt.write_pixel(0, (0, 0), (0, 0), self._pixel_data((0, 0)))
+        ckpt.close()
+
+        other_settings = {"repetition": (4, 3), "streams": [{"detector": "spec", "settings": {"exposureTime": 0.2}}]}
+        with self.assertRaises(ValueError):
+            AcquisitionCheckpoint(FILENAME, other_settings, rep, 1, 2)
+
+        with self.assertRaises(ValueError):
+            AcquisitionCheckpoint(FILENAME, SETTINGS, rep, 4, 2)  # More polarizations
+
+        # Tuples and lists are considered identical
+        ckpt = AcquisitionCheckpoint(FILENAME, {"repetition": [4, 3], "streams": SETTINGS["streams"]}, rep, 1, 2)
+        self.assertEqual(ckpt.n_done, 1)
+        ckpt.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -89,6 +89,10 @@ class StaticStreamsTestCase(unittest.TestCase):
         self.assertEqual(im.shape, (512, 1024, 3))
         numpy.testing.assert_equal(im[0, 0], [0, 0, 0])
         numpy.testing.assert_equal(im[12, 1], md[model.MD_USER_TINT])
+        # The RGB image is a normal array, and the same image in BGRA is available for display
+        self.assertTrue(im.flags.c_contiguous)
+        self.assertEqual(im.bgra.shape, (512, 1024, 4))
+        numpy.testing.assert_equal(im.bgra[:, :, 2::-1], im)
 
     def test_fluo_3d(self):
         """Test StaticFluoStream with Z-stack"""
@@ -1334,11 +1338,11 @@ class StaticStreamsTestCase(unittest.TestCase):
         self.assertEqual(len(pj.image.value), 3)
         self.assertEqual(len(pj.image.value[0]), 4)
 
-        # half image (right side), only the center tiles will are cached
+        # half image (right side), all the tiles are still cached
         pj.rect.value = (POS[0], POS[1] - 0.001, POS[0] + 0.0015, POS[1] + 0.001)
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        self.assertEqual(40, len(read_tiles))
+        self.assertEqual(28, len(read_tiles))
         self.assertEqual(len(pj.image.value), 4)
         self.assertEqual(len(pj.image.value[0]), 4)
 
@@ -1347,7 +1351,11 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        self.assertEqual(40, len(read_tiles))
+        self.assertEqual(28, len(read_tiles))
+        stats = pj.getTileCacheStats()
+        self.assertGreater(stats["raw_hits"], 0)
+        self.assertGreater(stats["projected_hits"], 0)
+        self.assertLessEqual(stats["size"], stats["max_size"])
         self.assertEqual(len(pj.image.value), 1)
         self.assertEqual(len(pj.image.value[0]), 1)
 
@@ -1479,14 +1487,15 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        # Only 2 tiles read from disk. It means that the loop inside _updateImage,
-        # triggered by the change on .rect was immediately stopped when .mpp changed
-        if len(read_tiles) == 8:
-            logging.warning("Two tiles read while expected to have just one, but "
+        # No tile read from disk, as the tiles at max mpp are still in the cache.
+        # It means that the loop inside _updateImage, triggered by the change
+        # on .rect was immediately stopped when .mpp changed
+        if len(read_tiles) == 6:
+            logging.warning("One tile read while expected to have none, but "
                             "this is acceptable as updateImage thread might have "
                             "gone very fast.")
         else:
-            self.assertEqual(7, len(read_tiles))
+            self.assertEqual(5, len(read_tiles))
         self.assertEqual(len(pj.image.value), 2)
         self.assertEqual(len(pj.image.value[0]), 1)
 
@@ -1534,8 +1543,8 @@ class StaticStreamsTestCase(unittest.TestCase):
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
 
-        # reads 4 tiles from the disk, no tile is cached because the zoom changed
-        self.assertEqual(10, len(read_tiles))
+        # reads 3 tiles from the disk, the 4th one was cached when first zooming in
+        self.assertEqual(9, len(read_tiles))
         self.assertEqual(len(pj.image.value), 2)
         self.assertEqual(len(pj.image.value[0]), 2)
         # top-left pixel of the top-left tile
@@ -1668,5 +1677,55 @@ class StaticStreamsTestCase(unittest.TestCase):
         self.assertEqual(pj.getPixelCoordinates(out_y_phys), None)
 
 
+class TileCacheTestCase(unittest.TestCase):
+
+    def test_lru(self):
+        tile = model.DataArray(numpy.zeros((16, 16), dtype=numpy.uint8))  # 256 bytes
+        cache = stream.TileCache(3 * tile.nbytes)
+        for i in range(3):
+            cache.put((0, "raw", i, 0, 0), tile)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.size, 3 * tile.nbytes)
+
+        # Use the first one, so that the second one is the least recently used
+        self.assertIs(cache.get((0, "raw", 0, 0, 0)), tile)
+        cache.put((0, "raw", 3, 0, 0), tile)
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get((0, "raw", 1, 0, 0)))
+        self.assertIsNotNone(cache.get((0, "raw", 0, 0, 0)))
+
+        # Reducing the budget drops the oldest tiles
+        cache.max_size = tile.nbytes
+        self.assertEqual(len(cache), 1)
+        self.assertIsNotNone(cache.get((0, "raw", 0, 0, 0)))
+
+        # Too big tiles are not cached
+        big = model.DataArray(numpy.zeros((32, 32), dtype=numpy.uint8))
+        cache.put((0, "raw", 4, 0, 0), big)
+        self.assertIsNone(cache.get((0, "raw", 4, 0, 0)))
+
+    def test_token(self):
+        cache = stream.TileCache(2 ** 20)
+        tile = model.DataArray(numpy.zeros((16, 16), dtype=numpy.uint8))
+        # Any (weak-referenceable) object can be used as data
+        das1 = threading.Event()
+        das2 = threading.Event()
+        t1 = cache.get_token(das1)
+        t2 = cache.get_token(das2)
+        self.assertNotEqual(t1, t2)
+        self.assertEqual(t1, cache.get_token(das1))
+
+        cache.put((t1, "raw", 0, 0, 0), tile)
+        cache.put((t2, "raw", 0, 0, 0), tile)
+        cache.discard(t1)
+        self.assertIsNone(cache.get((t1, "raw", 0, 0, 0)))
+        self.assertIsNotNone(cache.get((t2, "raw", 0, 0, 0)))
+
+        # When the data disappears, its tiles are eventually dropped
+        del das2
+        cache.put((t1, "raw", 1, 0, 0), tile)
+        self.assertIsNone(cache.get((t2, "raw", 0, 0, 0)))
+
+
 if __name__ == '__main__':
     unittest.main()
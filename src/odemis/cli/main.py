@@ -40,6 +40,7 @@ from odemis.util.driver import BACKEND_RUNNING, \
     BACKEND_DEAD, BACKEND_STOPPED, get_backend_status, BACKEND_STARTING
 import sys
 import threading
+import time
 
 
 status_to_xtcode = {BACKEND_RUNNING: 0,
@@ -231,6 +232,37 @@ def list_components(pretty=True):
             print_component(c, pretty)
 
 
+def print_startup_timeline(pretty=True):
+    """
+    Show when each component was instantiated by the back-end, and how long it took.
+    pretty (bool): if True, display with pretty-printing
+    """
+    microscope = model.getMicroscope()
+    timeline = microscope.startupTimeline.value
+    if not timeline:
+        logging.info("No component instantiation recorded")
+        return
+
+    now = time.time()
+    t0 = min(start for start, end in timeline.values())
+    tend = max((now if end is None else end) for start, end in timeline.values())
+    total = max(tend - t0, 1e-3)
+    barw = 40  # number of characters for the whole timeline
+    namew = max(len(n) for n in timeline)
+    for name, (start, end) in sorted(timeline.items(), key=lambda i: i[1][0]):
+        dur = (now if end is None else end) - start
+        if pretty:
+            bstart = int(round((start - t0) / total * barw))
+            blen = max(1, int(round(dur / total * barw)))
+            bar = " " * bstart + ("=" if end is not None else "-") * blen
+            print("%s\t+%6.2f s\t%6.2f s%s\t|%s|" %
+                  (name.ljust(namew), start - t0, dur,
+                   "" if end is not None else "+", bar.ljust(barw)))
+        else:
+            print("%s\tstart:%f\tduration:%f\tdone:%s" %
+                  (name, start - t0, dur, end is not None))
+
+
 def print_axes(name, value, pretty):
     if pretty:
         print("\t%s (RO Attribute)" % (name,))
@@ -962,6 +994,8 @@ def main(args):
                          "a specific hardware to scan can be specified.")
     dm_grpe.add_argument("--list", "-l", dest="list", action="store_true", default=False,
                          help="list the components of the microscope")
+    dm_grpe.add_argument("--startup-timeline", dest="timeline", action="store_true", default=False,
+                         help="show when each component was started by the back-end, and how long it took")
     dm_grpe.add_argument("--list-prop", "-L", dest="listprop", metavar="<component>",
                          help="list the properties of a component. Use '*' to list all the components.")
     dm_grpe.add_argument("--set-attr", "-s", dest="setattr", nargs="+", action='append',
@@ -1034,7 +1068,7 @@ def main(args):
 
     # anything to do?
     if not any((options.check, options.kill, options.scan,
-        options.list, options.stop, options.move,
+        options.list, options.timeline, options.stop, options.move,
         options.position, options.reference,
         options.listprop, options.setattr, options.upmd,
         options.acquire, options.live)):
@@ -1083,6 +1117,8 @@ def main(args):
             kill_backend()
         elif options.list:
             list_components(pretty=not options.machine)
+        elif options.timeline:
+            print_startup_timeline(pretty=not options.machine)
         elif options.listprop is not None:
             list_properties(options.listprop, pretty=not options.machine)
         elif options.setattr is not None:
@@ -29,7 +29,7 @@ import sys
 import time
 import unittest
 import warnings
-from io import BytesIO
+from io import BytesIO, StringIO
 from unittest.case import skip
 
 from PIL import Image
@@ -154,6 +154,25 @@ class TestWithBackend(unittest.TestCase):
         self.assertTrue(b"Light Source" in output)
         self.assertTrue(b"Camera" in output)
 
+    def test_startup_timeline(self):
+        try:
+            # change the stdout
+            out = StringIO()
+            sys.stdout = out
+
+            cmdline = "cli --machine --startup-timeline"
+            ret = main.main(cmdline.split())
+        except SystemExit as exc:
+            ret = exc.code
+        self.assertEqual(ret, 0, "trying to run '%s'" % cmdline)
+
+        # Every component started by the back-end is listed, and finished
+        output = out.getvalue()
+        lines = output.splitlines()
+        self.assertGreater(len(lines), 1)
+        for l in lines:
+            self.assertIn("done:True", l)
+
     def test_list_no_dash(self):
         try:
             # change the stdout
@@ -20,17 +20,25 @@ Public License for more details.
 You should have received a copy of the GNU General Public License along with Odemis. If not,
 see http://www.gnu.org/licenses/.
 """
+import collections
 import configparser
+import hashlib
 import logging
 import math
 import numpy
+import os
 import re
 import requests
+import threading
+import weakref
+from concurrent import futures
+from typing import Optional, Tuple, List
 from urllib.parse import urlparse, parse_qs
 
 from PIL import Image
 from io import BytesIO
 from requests import HTTPError
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
 from odemis import model
@@ -77,6 +85,16 @@ SUPPORTED_CONTENT_TYPES = {
 
 KEY_PATH = "~/.local/share/odemis/catmaid.key"
 
+# The tiles downloaded are stored in this directory, to not download them again. When the total
+# size is above TILE_CACHE_SIZE, the least recently used tiles are deleted.
+TILE_CACHE_DIR = "~/.cache/odemis/catmaid"
+TILE_CACHE_SIZE = 1024 * 1024 * 1024  # bytes
+
+# Maximum number of connections to the server, and so of tiles downloaded simultaneously
+MAX_CONNECTIONS = 8
+# Maximum number of tiles downloaded in advance, per prefetch request
+MAX_PREFETCHED_TILES = 64
+
 # Tile Source Types
 FILE_BASED = 1
 REQUEST_QUERY = 2
@@ -141,13 +159,13 @@ class DataArrayShadowPyramidalCatmaid(DataArrayShadow):
     This class implements the read of a Pyramidal Catmaid instance.
     """
 
-    def __init__(self, stack_info, base_url):
+    def __init__(self, stack_info, base_url, cache_dir=TILE_CACHE_DIR):
         """
         Constructor
         stack_info (dict): information about the Catmaid stack and tiles in the stack.
         base_url (str): URL where the Catmaid instance is hosted.
-        dtype (numpy.dtype): the data type
-        metadata (dict str->val): The metadata
+        cache_dir (str or None): directory where to store the tiles downloaded. If None, the
+          tiles are not stored.
         """
         shape = (stack_info["dimension"]["x"], stack_info["dimension"]["y"])
         tile_shape = (stack_info["mirrors"][0]["tile_width"], stack_info["mirrors"][0]["tile_height"])
@@ -167,13 +185,48 @@ class DataArrayShadowPyramidalCatmaid(DataArrayShadow):
         DataArrayShadow.__init__(self, shape, dtype, metadata, maxzoom=maxzoom, tile_shape=tile_shape)
 
         self._base_url = base_url
-        self._session = requests.Session()
         _, username, password = read_config_file(self._base_url, username=True, password=True)
         self._auth = (username, password)
+        cache = TileDiskCache(cache_dir) if cache_dir is not None else None
+        self._fetcher = _TileFetcher(self._auth, cache)
         self._stack_info = stack_info
         file_extension = self._stack_info["mirrors"][0]["file_extension"]
         self._file_extension = file_extension[1:] if file_extension.startswith(".") else file_extension
 
+    def _get_tile_url(self, x, y, zoom, depth):
+        tile_width, tile_height = self.tile_shape
+        return format_tile_url(
+            tile_source_type=self._stack_info["mirrors"][0]["tile_source_type"],
+            image_base=self._stack_info["mirrors"][0]["image_base"],
+            zoom=zoom,
+            depth=depth,
+            col=x,
+            row=y,
+            file_extension=self._file_extension,
+            tile_width=tile_width,
+            tile_height=tile_height,
+        )
+
+    def prefetchTiles(self, tiles, depth=0):
+        """
+        Start downloading tiles in background, so that the following calls to
+          getTile() for these tiles are faster. It's just a hint: it's fine to
+          never request these tiles, or to request other ones.
+        tiles (list of (int, int, int)): X, Y, zoom of each tile to download, the
+          most likely to be requested first. Tiles outside of the image are ignored.
+        depth (0<=int): The Z index of the stack.
+        """
+        keys = []
+        for x, y, zoom in tiles:
+            if not 0 <= zoom <= self.maxzoom:
+                continue
+            width = self.shape[0] // 2 ** zoom
+            height = self.shape[1] // 2 ** zoom
+            if 0 <= x * self.tile_shape[0] < width and 0 <= y * self.tile_shape[1] < height:
+                keys.append((self._get_tile_url(x, y, zoom, depth), zoom))
+
+        self._fetcher.prefetch(keys)
+
     def getTile(self, x, y, zoom, depth=0):
         """
         Fetches one tile
@@ -186,19 +239,9 @@ class DataArrayShadowPyramidalCatmaid(DataArrayShadow):
             tile (DataArray): tile containing the image data and the relevant metadata.
         """
         tile_width, tile_height = self.tile_shape
-        tile_url = format_tile_url(
-            tile_source_type=self._stack_info["mirrors"][0]["tile_source_type"],
-            image_base=self._stack_info["mirrors"][0]["image_base"],
-            zoom=zoom,
-            depth=depth,
-            col=x,
-            row=y,
-            file_extension=self._file_extension,
-            tile_width=tile_width,
-            tile_height=tile_height,
-        )
+        tile_url = self._get_tile_url(x, y, zoom, depth)
         try:
-            image = response_to_array(self._session.get(tile_url, auth=self._auth))
+            image = content_to_array(self._fetcher.fetch(tile_url, zoom))
         except HTTPError as e:
             if e.response.status_code == 401:
                 raise AuthenticationError("Authentication failed while getting tiles at {}".format(tile_url))
@@ -222,6 +265,235 @@ class DataArrayShadowPyramidalCatmaid(DataArrayShadow):
         raise NotImplementedError()
 
 
+class TileDiskCache(object):
+    """
+    Stores the tiles (as received from the server) in files, so that they don't have to be
+    downloaded again, even after restarting. When the total size of the files is above the
+    maximum, the least recently used tiles are deleted.
+    """
+
+    def __init__(self, directory: str, max_size: int = TILE_CACHE_SIZE):
+        """
+        directory: where to store the files. It is created if it doesn't exist yet.
+        max_size: maximum total size of the files (in bytes)
+        """
+        self._directory = os.path.expanduser(directory)
+        os.makedirs(self._directory, exist_ok=True)
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        # filename -> size (in bytes), the least recently used first
+        self._files = collections.OrderedDict()
+        self._size = 0
+
+        # The modification time of the files is updated on every use, so it indicates the usage order
+        entries = []
+        for fn in os.listdir(self._directory):
+            if not fn.endswith(".tile"):
+                continue
+            try:
+                st = os.stat(os.path.join(self._directory, fn))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, fn, st.st_size))
+        for _, fn, size in sorted(entries):
+            self._files[fn] = size
+            self._size += size
+        logging.debug("Tile cache %s contains %d tiles (%d bytes)", self._directory, len(self._files), self._size)
+
+    @staticmethod
+    def _get_filename(url: str, zoom: int) -> str:
+        return hashlib.sha1(("%d:%s" % (zoom, url)).encode("utf-8")).hexdigest() + ".tile"
+
+    def get(self, url: str, zoom: int) -> Optional[bytes]:
+        """
+        return: the content of the tile, or None if it's not in the cache
+        """
+        fn = self._get_filename(url, zoom)
+        with self._lock:
+            if fn not in self._files:
+                return None
+            self._files.move_to_end(fn)
+
+        path = os.path.join(self._directory, fn)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+            os.utime(path)  # Mark as recently used
+        except OSError as ex:
+            logging.warning("Failed to read cached tile %s: %s", path, ex)
+            with self._lock:
+                self._size -= self._files.pop(fn, 0)
+            return None
+        return content
+
+    def put(self, url: str, zoom: int, content: bytes) -> None:
+        """
+        Store the content of a tile
+        """
+        fn = self._get_filename(url, zoom)
+        path = os.path.join(self._directory, fn)
+        # Write to a temporary file first, so that a tile file is never partially written
+        tmp_path = "%s.%d.tmp" % (path, threading.get_ident())
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError as ex:
+            logging.warning("Failed to cache tile %s: %s", path, ex)
+            return
+
+        with self._lock:
+            self._size += len(content) - self._files.pop(fn, 0)
+            self._files[fn] = len(content)
+            while self._size > self._max_size and len(self._files) > 1:
+                old_fn, old_size = self._files.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.remove(os.path.join(self._directory, old_fn))
+                except OSError as ex:
+                    logging.debug("Failed to delete cached tile %s: %s", old_fn, ex)
+
+
+class _TileFetcher(object):
+    """
+    Downloads tiles from a Catmaid server, with several connections simultaneously. It can also
+    download tiles in advance (prefetch), in background threads. A request for a tile which is
+    already being downloaded waits for that download, instead of downloading it a second time.
+    """
+
+    def __init__(self, auth, cache: Optional[TileDiskCache] = None, max_connections: int = MAX_CONNECTIONS):
+        """
+        auth: the authentication to pass to the requests
+        cache: where to store the tiles downloaded, and look for them before downloading
+        max_connections: maximum number of simultaneous connections to the server
+        """
+        self._auth = auth
+        self._cache = cache
+        self._session = requests.Session()
+        # Reuse the connections, but never more than max_connections at the same time
+        adapter = HTTPAdapter(pool_maxsize=max_connections, pool_block=True)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        # (url, zoom) -> Future: tiles currently being downloaded
+        self._pending = {}
+        # Incremented at every new prefetch request, to drop the older requests
+        self._prefetch_gen = 0
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_connections,
+                                                    thread_name_prefix="Catmaid tile fetcher")
+        weakref.finalize(self, _TileFetcher._close, self._session, self._pending, self._lock, self._executor)
+
+    @staticmethod
+    def _close(session, pending, lock, executor):
+        # Drop the prefetch requests not yet started (shutdown() only has a
+        # cancel_futures argument from Python 3.9)
+        with lock:
+            futs = list(pending.values())
+        for f in futs:
+            f.cancel()
+        executor.shutdown(wait=False)
+        session.close()
+
+    def _download(self, url: str, zoom: int) -> bytes:
+        """
+        Download a tile from the server, and store it in the cache
+        return: the content of the tile (as a compressed image)
+        raise HTTPError: if the server returned an error
+        raise ValueError: if the content is not a supported image
+        """
+        content = check_image_response(self._session.get(url, auth=self._auth))
+        if self._cache:
+            self._cache.put(url, zoom, content)
+        return content
+
+    def fetch(self, url: str, zoom: int) -> bytes:
+        """
+        Get the content of a tile, from the cache, or from the server.
+        return: the content of the tile (as a compressed image)
+        raise HTTPError: if the server returned an error
+        raise ValueError: if the content is not a supported image
+        """
+        key = (url, zoom)
+        while True:
+            if self._cache:
+                content = self._cache.get(url, zoom)
+                if content is not None:
+                    return content
+
+            with self._lock:
+                f = self._pending.get(key)
+                if f is None:
+                    # Not being downloaded => download it in this thread
+                    f = futures.Future()
+                    f.set_running_or_notify_cancel()
+                    self._pending[key] = f
+                    break
+
+            if f.cancel():
+                # Prefetch still queued => faster to download it directly
+                with self._lock:
+                    if self._pending.get(key) is f:
+                        del self._pending[key]
+                continue
+
+            # Already being downloaded, just wait for it
+            content = f.result()
+            if content is not None:
+                return content
+            # The prefetch was dropped, or failed => try again
+
+        try:
+            content = self._download(url, zoom)
+        except BaseException as ex:
+            f.set_exception(ex)
+            raise
+        else:
+            f.set_result(content)
+        finally:
+            with self._lock:
+                del self._pending[key]
+        return content
+
+    def prefetch(self, keys: List[Tuple[str, int]]) -> None:
+        """
+        Start downloading tiles in the background. Previous prefetch requests which
+          have not started yet are dropped.
+        keys: url, zoom of each tile, the most important first.
+        """
+        with self._lock:
+            self._prefetch_gen += 1
+            gen = self._prefetch_gen
+            for key in keys[:MAX_PREFETCHED_TILES]:
+                if key in self._pending:
+                    continue
+                self._pending[key] = self._executor.submit(self._prefetch_tile, gen, key)
+
+    def _prefetch_tile(self, gen: int, key: Tuple[str, int]) -> Optional[bytes]:
+        """
+        Called in a separate thread, to download a tile in advance
+        return: the content of the tile, or None if it was not needed anymore (or failed)
+        """
+        try:
+            with self._lock:
+                if gen != self._prefetch_gen:
+                    return None  # Too late, the viewport has changed
+
+            if self._cache:
+                content = self._cache.get(*key)
+                if content is not None:
+                    return content
+
+            try:
+                return self._download(*key)
+            except Exception:
+                logging.debug("Failed to prefetch tile %s", key[0], exc_info=True)
+                return None
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+
 class AcquisitionDataCatmaid(AcquisitionData):
     """
     Implements AcquisitionData for Catmaid instances
@@ -281,18 +553,37 @@ def response_to_array(response):
     return:
        image (numpy array): the requested image from the response.
     """
+    return content_to_array(check_image_response(response))
+
+
+def check_image_response(response):
+    """
+    response (Response): http response for the requested image.
+    return (bytes): the content of the response (ie, the compressed image)
+    raise HTTPError: if the response is an error
+    raise ValueError: if the response is not a supported image
+    """
     response.raise_for_status()
     content_type = response.headers['Content-Type']
 
     if content_type in SUPPORTED_CONTENT_TYPES:
-        buffer = BytesIO(response.content)  # opening directly from raw response doesn't work for JPEGs
-        raw_img = Image.open(buffer).convert('L')
-        return numpy.array(raw_img)
+        return response.content
     else:
         raise ValueError('Image fetching is only implemented for greyscale PNG and JPEG, not {}'.format(
             content_type.upper().split('/')[1]))
 
 
+def content_to_array(content):
+    """
+    content (bytes): the compressed image (PNG or JPEG), as received from the server.
+    return:
+       image (numpy array): the image, as greyscale.
+    """
+    buffer = BytesIO(content)  # opening directly from raw response doesn't work for JPEGs
+    raw_img = Image.open(buffer).convert('L')
+    return numpy.array(raw_img)
+
+
 STACK_URL = "{base_url}/{project_id}/stack/{stack_id}/info"
 
 
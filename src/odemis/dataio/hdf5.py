@@ -23,7 +23,9 @@ from collections.abc import Iterable
 import json
 import logging
 import os
+import re
 import time
+import weakref
 from typing import Union
 
 import h5py
@@ -32,6 +34,7 @@ from numpy.polynomial import polynomial
 
 import odemis
 from odemis import model
+from odemis.model import AcquisitionData, DataArrayShadow
 from odemis.util import fluo, img, spectrum
 from odemis.util.conversion import JsonExtraEncoder
 
@@ -42,6 +45,30 @@ EXTENSIONS = [".h5", ".hdf5"]
 LOSSY = False
 CAN_SAVE_PYRAMID = False
 
+# Compression methods which can be used to store the data.
+# gzip (zlib level 4) is the historical default and can be read by any
+# software supporting HDF5.
+COMPRESSION_GZIP = "gzip"
+# zlib level 1 + byte shuffling: a lot faster to write, for a size close to the
+# default gzip, and still readable by any software supporting HDF5.
+COMPRESSION_GZIP_FAST = "gzip-fast"
+# LZF is even faster, but compresses less, and is only readable by h5py (or
+# software with the LZF filter plugin installed).
+COMPRESSION_LZF = "lzf"
+# compression method -> arguments for h5py create_dataset()
+_COMPRESSION_FILTERS = {
+    COMPRESSION_GZIP: {"compression": "gzip"},
+    COMPRESSION_GZIP_FAST: {"compression": "gzip", "compression_opts": 1, "shuffle": True},
+    COMPRESSION_LZF: {"compression": "lzf", "shuffle": True},
+}
+
+# Maximum size of a chunk of the image datasets (in bytes). The HDF5 documentation
+# recommends to stay around 1 MiB.
+CHUNK_MAX_SIZE = 2 ** 20
+# Size of the chunk cache (per dataset) used when writing progressively the data.
+# It should be large enough to hold all the chunks of one scanned row.
+CHUNK_CACHE_SIZE = 64 * 2 ** 20
+
 # We are trying to follow the same format as SVI, as defined here:
 # http://www.svi.nl/HDF5
 # A file follows this structure:
@@ -127,7 +154,57 @@ _dtid = h5py.special_dtype(enum=('i', {
 _dictid = h5py.check_dtype(enum=_dtid)
 
 
-def _create_image_dataset(group, dataset_name, image, **kwargs):
+def _get_compression_args(compression):
+    """
+    Convert a compression method to the arguments for h5py create_dataset()
+    compression (None or str): one of the COMPRESSION_* values, or None for no
+      compression
+    return (dict): arguments to pass to create_dataset()
+    raises ValueError: if the compression is unknown
+    """
+    if compression is None:
+        return {}
+    try:
+        return dict(_COMPRESSION_FILTERS[compression])
+    except KeyError:
+        raise ValueError("Unknown compression %s, should be one of %s" %
+                         (compression, ", ".join(_COMPRESSION_FILTERS.keys())))
+
+
+def _guess_chunk_shape(shape, dtype, dims):
+    """
+    Pick the shape of the chunks for an image dataset, in a way that fits
+    how the data is acquired and read: a chunk contains the whole C, T or A
+    dimensions (ie, full spectra) of a few consecutive pixels of the same row.
+    So every scanned row fills complete chunks, and reading a pixel spectrum,
+    or a plane only needs to decompress a small part of the data.
+    shape (tuple of int): shape of the dataset
+    dtype (numpy.dtype): type of the data
+    dims (str): the name of each dimension (eg, "CTZYX")
+    return (tuple of int): the shape of a chunk (same length as shape)
+    """
+    itemsize = numpy.dtype(dtype).itemsize
+    # One row (of one plane)
+    chunk = [1 if d in "ZY" else s for d, s in zip(dims, shape)]
+
+    # Too big? => halve the largest dimension, until it fits
+    while numpy.prod(chunk) * itemsize > CHUNK_MAX_SIZE:
+        i = int(numpy.argmax(chunk))
+        if chunk[i] == 1:
+            break
+        chunk[i] = (chunk[i] + 1) // 2
+
+    # Rows are small? => group several of them in a chunk
+    if "Y" in dims:
+        yi = dims.index("Y")
+        while (chunk[yi] < shape[yi] and
+               numpy.prod(chunk) * itemsize * 2 <= CHUNK_MAX_SIZE):
+            chunk[yi] = min(chunk[yi] * 2, shape[yi])
+
+    return tuple(max(1, c) for c in chunk)
+
+
+def _create_image_dataset(group, dataset_name, image, fill=True, **kwargs):
     """
     Create a dataset respecting the HDF5 image specification
     http://www.hdfgroup.org/HDF5/doc/ADGuide/ImageSpec.html
@@ -135,10 +212,17 @@ def _create_image_dataset(group, dataset_name, image, **kwargs):
     group (HDF group): the group that will contain the dataset
     dataset_name (string): name of the dataset
     image (numpy.ndimage): the image to create. It should have at least 2 dimensions
+    fill (bool): if False, only the shape and dtype of the image are used, and
+      the dataset is created empty, for the data to be written later. In such
+      case, IMAGE_MINMAXRANGE is not set.
     returns the new dataset
     """
     assert(len(image.shape) >= 2)
-    image_dataset = group.create_dataset(dataset_name, data=image, **kwargs)
+    if fill:
+        image_dataset = group.create_dataset(dataset_name, data=image, **kwargs)
+    else:
+        image_dataset = group.create_dataset(dataset_name, shape=image.shape,
+                                             dtype=image.dtype, **kwargs)
 
     # numpy.string_ is to force fixed-length string (necessary for compatibility)
     # FIXME: needs to be NULLTERM, not NULLPAD... but h5py doesn't allow to distinguish
@@ -157,7 +241,8 @@ def _create_image_dataset(group, dataset_name, image, **kwargs):
     else:
         image_dataset.attrs["IMAGE_SUBCLASS"] = numpy.string_("IMAGE_GRAYSCALE")
         image_dataset.attrs["IMAGE_WHITE_IS_ZERO"] = numpy.array(0, dtype="uint8")
-        image_dataset.attrs["IMAGE_MINMAXRANGE"] = [image.min(), image.max()]
+        if fill:
+            image_dataset.attrs["IMAGE_MINMAXRANGE"] = [image.min(), image.max()]
 
     image_dataset.attrs["DISPLAY_ORIGIN"] = numpy.string_("UL") # not rotated
     image_dataset.attrs["IMAGE_VERSION"] = numpy.string_("1.2")
@@ -174,6 +259,14 @@ def _read_image_dataset(dataset):
      IOError: if it doesn't conform to the standard
      NotImplementedError: if the image uses so fancy standard features
     """
+    return _open_image_dataset(dataset).getData()
+
+
+def _open_image_dataset(dataset):
+    """
+    Same as _read_image_dataset(), but doesn't read the data.
+    returns (DataArrayShadowHDF5)
+    """
     # check basic format
     if len(dataset.shape) < 2:
         raise IOError("Image has a shape of %s" % (dataset.shape,))
@@ -184,7 +277,7 @@ def _read_image_dataset(dataset):
     # conversion is almost entirely different depending on subclass
     subclass = dataset.attrs.get("IMAGE_SUBCLASS", b"IMAGE_GRAYSCALE")
 
-    image = model.DataArray(dataset[...])
+    image = DataArrayShadowHDF5(dataset)
     if subclass == b"IMAGE_GRAYSCALE":
         pass
     elif subclass == b"IMAGE_TRUECOLOR":
@@ -682,9 +775,9 @@ def _parse_physical_data(pdgroup, da):
     """
     Parse the metadata found in PhysicalData, and cut the DataArray if necessary.
     pdgroup (HDF Group): the group "PhysicalData" associated to an image
-    da (DataArray): the DataArray that was obtained by reading the ImageData
-    returns (list of DataArrays): The same data, but broken into smaller
-      DataArrays if necessary, and with additional metadata.
+    da (DataArrayShadowHDF5): the image that was obtained by opening the ImageData
+    returns (list of DataArrayShadowHDF5): The same data, but broken into smaller
+      images if necessary, and with additional metadata.
     """
     # The information in PhysicalData might be different for each channel (e.g.
     # fluorescence image). In this case, the DA must be separated into smaller
@@ -705,8 +798,9 @@ def _parse_physical_data(pdgroup, da):
                             da.shape[0], n)
             das = [da]
         else:
-            # list(da) does almost what we need, but metadata is shared
-            das = [model.DataArray(c, da.metadata.copy()) for c in da]
+            # Each channel is a sub-part of the dataset, with its own metadata
+            das = [DataArrayShadowHDF5(da.dataset, da.metadata.copy(), da.index + (c,))
+                   for c in range(n)]
     else:
         das = [da]
 
@@ -1269,13 +1363,16 @@ def _add_svi_info(group):
     gi["URL"] = "www.delmic.com"
 
 
-def _add_acquistion_svi(group, data, mds, **kwargs):
+def _add_acquistion_svi(group, data, mds, compression=None, fill=True):
     """
     Adds the acquisition data according to the sub-format by SVI
     group (HDF Group): the group that will contain the metadata (named "PhysicalData")
     data (DataArray): image with (global) metadata, all the images must
       have the same shape.
     mds (None or list of dict): metadata for each C of the image (if different)
+    compression (None or str): COMPRESSION_* method to use
+    fill (bool): if False, the image dataset is created empty (see _create_image_dataset)
+    returns (HDF Dataset): the image dataset
     """
     gi = group.create_group("ImageData")
 
@@ -1283,11 +1380,20 @@ def _add_acquistion_svi(group, data, mds, **kwargs):
     # FIXME: should be done by _h5svi_set_state (and used)
     _h5py_enum_commit(group, b"StateEnumeration", _dtstate)
 
+    kwargs = _get_compression_args(compression)
+    dims = data.metadata.get(model.MD_DIMS, "")
+    if len(dims) == data.ndim == 5:  # Not RGB
+        kwargs["chunks"] = _guess_chunk_shape(data.shape, data.dtype, dims)
+
     # TODO: use scaleoffset to store the number of bits used (MD_BPP)
-    ids = _create_image_dataset(gi, "Image", data, **kwargs)
+    ids = _create_image_dataset(gi, "Image", data, fill=fill, **kwargs)
+    if compression is not None:
+        # Our extension, to know how the file was written
+        ids.attrs["COMPRESSION"] = numpy.string_(compression)
     _add_image_info(gi, ids, data)
     _add_image_metadata(group, data, mds)
     _add_svi_info(group)
+    return ids
 
 
 def _findImageGroups(das):
@@ -1341,6 +1447,25 @@ def _findImageGroups(das):
     return gdata
 
 
+def _getDims(md, shape):
+    """
+    Find the order of the dimensions of data
+    md (dict): metadata of the data
+    shape (tuple of int): shape of the data
+    return (str): name of each dimension (eg, "CTZYX")
+    """
+    l = len(shape)
+    if model.MD_THETA_LIST in md:
+        default_dims = "CAZYX"[-l::]
+    else:
+        default_dims = "CTZYX"[-l::]
+    dims = md.get(model.MD_DIMS, default_dims)
+    if len(dims) != l:
+        logging.warning("MD_DIMS contains %s, but the data has shape %s, will discard it", dims, shape)
+        dims = default_dims
+    return dims
+
+
 def _adjustDimensions(da):
     """
     Ensure the DataArray has 5 dimensions ordered CTZYX or CAZYX (as dictated by the HDF5
@@ -1352,16 +1477,7 @@ def _adjustDimensions(da):
     md = dict(da.metadata)
 
     l = da.ndim
-    if model.MD_THETA_LIST in md:
-        dims = md.get(model.MD_DIMS, "CAZYX"[-l::])
-    else:
-        dims = md.get(model.MD_DIMS, "CTZYX"[-l::])
-    if len(dims) != l:
-        logging.warning("MD_DIMS contains %s, but the data has shape %s, will discard it", dims, da.shape)
-        if model.MD_THETA_LIST in md:
-            dims = "CAZYX"[-l::]
-        else:
-            dims = "CTZYX"[-l::]
+    dims = _getDims(md, da.shape)
 
     # Special cases for RGB
     if dims == "YXC":
@@ -1466,14 +1582,13 @@ def _updateRGBMD(da):
     da.metadata[model.MD_DIMS] = dims
 
 
-def _thumbFromHDF5(filename):
+def _thumbFromHDF5(f):
     """
-    Read thumbnails from an HDF5 file.
+    Open thumbnails from an HDF5 file.
     Expects to find them as IMAGE in Preview/Image.
-    return (list of model.DataArray)
+    f (h5py.File): the root of the file
+    return (list of DataArrayShadowHDF5)
     """
-    f = h5py.File(filename, "r")
-
     thumbs = []
     # look for the Preview directory
     try:
@@ -1487,7 +1602,7 @@ def _thumbFromHDF5(filename):
         # an image? (== has the attribute CLASS: IMAGE)
         if isinstance(ds, h5py.Dataset) and ds.attrs.get("CLASS") == b"IMAGE":
             try:
-                da = _read_image_dataset(ds)
+                da = _open_image_dataset(ds)
             except Exception:
                 logging.info("Skipping image '%s' which couldn't be read.", name)
                 continue
@@ -1509,7 +1624,7 @@ def _dataFromSVIHDF5(f):
     Read microscopy data from an HDF5 file using the SVI convention.
     Expects to find them as IMAGE in XXX/ImageData/Image + XXX/PhysicalData.
     f (h5py.File): the root of the file
-    return (list of model.DataArray)
+    return (list of DataArrayShadowHDF5)
     """
     data = []
 
@@ -1523,11 +1638,12 @@ def _dataFromSVIHDF5(f):
         except KeyError:
             continue  # not conforming => try next object
 
-        # Read the raw data
+        # Open the raw data
         try:
-            da = _read_image_dataset(image)
+            da = _open_image_dataset(image)
         except Exception:
             logging.exception("Failed to read data of acquisition '%s'", obj.name)
+            continue
 
         # TODO: read more metadata
         try:
@@ -1540,14 +1656,12 @@ def _dataFromSVIHDF5(f):
     return data
 
 
-def _dataFromHDF5(filename):
+def _dataFromHDF5(f):
     """
-    Read microscopy data from an HDF5 file.
-    filename (string): path of the file to read
-    return (list of model.DataArray)
+    Open microscopy data from an HDF5 file.
+    f (h5py.File): the root of the file
+    return (list of DataArrayShadowHDF5)
     """
-    f = h5py.File(filename, "r")
-
     # if follows SVI convention => use the special function
     # If it has at least one directory like XXX/SVIData => it follows SVI conventions
     for obj in f.values():
@@ -1568,15 +1682,111 @@ def _dataFromHDF5(filename):
                 return
             # TODO: if it's an image, open it as an image
             # TODO: try to get some metadata?
-            da = model.DataArray(obj[...])
+            da = DataArrayShadowHDF5(obj)
         except Exception:
             logging.info("Skipping '%s' as it doesn't seem a correct data", name)
+            return
         data.append(da)
 
     f.visititems(addIfWorthy)
     return data
 
 
+class DataArrayShadowHDF5(DataArrayShadow):
+    """
+    An image stored in an HDF5 file, which is only read when needed.
+    Besides reading the whole image with getData(), it's possible to read just
+    a part of it by slicing it (eg, das[:, 0, 0, 12, 5] for the spectrum of one
+    pixel of a CTZYX image). In such case, only the chunks of the file which
+    contain the requested data are read.
+    """
+
+    def __init__(self, dataset, metadata=None, index=()):
+        """
+        dataset (h5py.Dataset): the dataset containing the image
+        metadata (dict str->val): The metadata
+        index (tuple of int): index of the image in the first dimensions of the
+          dataset, if the image is only a part of the dataset (eg, one channel).
+        """
+        self.dataset = dataset
+        self.index = tuple(index)
+        # _HDF5File: keeps the file open as long as the image is used
+        # (set by AcquisitionDataHDF5)
+        self._file_handle = None
+        DataArrayShadow.__init__(self, dataset.shape[len(self.index):],
+                                 dataset.dtype, metadata)
+
+    def getData(self):
+        """
+        Fetches the whole data of the image.
+        return DataArray: the data, with its metadata
+        """
+        return model.DataArray(self.dataset[self.index + (Ellipsis,)],
+                               metadata=self.metadata.copy())
+
+    def __getitem__(self, key):
+        """
+        Reads only a part of the image.
+        key (int, slice, Ellipsis, or tuple of them): the part to read, as for
+          a numpy array. Steps must be positive.
+        return DataArray: the data, with a copy of the metadata
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        return model.DataArray(self.dataset[self.index + key],
+                               metadata=self.metadata.copy())
+
+
+class _HDF5File(object):
+    """
+    An HDF5 file opened for reading, which is closed as soon as this object is
+    not referenced anymore (ie, when the AcquisitionData and all its images are
+    not used anymore).
+    """
+
+    def __init__(self, filename):
+        # A larger chunk cache than the default (1 MiB) avoids re-reading the
+        # chunks when accessing successively nearby pixels.
+        self.file = h5py.File(filename, "r", rdcc_nbytes=CHUNK_CACHE_SIZE)
+        weakref.finalize(self, self.file.close)
+
+
+class AcquisitionDataHDF5(AcquisitionData):
+    """
+    Implements AcquisitionData for HDF5 files
+    """
+
+    def __init__(self, filename):
+        """
+        filename (str): The name of the HDF5 file
+        """
+        # The file stays open as long as the AcquisitionData or one of its
+        # images is used, and is closed as soon as they are all released.
+        self._handle = _HDF5File(filename)
+        try:
+            data = _dataFromHDF5(self._handle.file)
+            thumbnails = _thumbFromHDF5(self._handle.file)
+        except Exception:
+            self.close()
+            raise
+
+        # Inject filename and in-file index for project management purposes
+        for i, da in enumerate(data):
+            da.metadata[model.MD_FILENAME] = filename
+            da.metadata[model.MD_IN_FILE_INDEX] = i
+
+        for da in data + thumbnails:
+            da._file_handle = self._handle
+
+        AcquisitionData.__init__(self, tuple(data), tuple(thumbnails))
+
+    def close(self):
+        """
+        Close the file immediately. The images cannot be read anymore afterwards.
+        """
+        self._handle.file.close()
+
+
 def _mergeCorrectionMetadata(da):
     """
     Create a new DataArray with metadata updated to with the correction metadata
@@ -1589,7 +1799,21 @@ def _mergeCorrectionMetadata(da):
     return model.DataArray(da, md) # create a view
 
 
-def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
+def _add_thumbnail(f, thumbnail, compression=None):
+    """
+    Save the thumbnail as-is in a special group "Preview"
+    f (h5py.File): the root of the file
+    thumbnail (DataArray): the thumbnail, see export
+    compression (None or str): COMPRESSION_* method to use
+    """
+    thumbnail = _mergeCorrectionMetadata(thumbnail)
+    prevg = f.create_group("Preview")
+    _updateRGBMD(thumbnail) # ensure RGB info is there if needed
+    ids = _create_image_dataset(prevg, "Image", thumbnail, **_get_compression_args(compression))
+    _add_image_info(prevg, ids, thumbnail)
+
+
+def _saveAsHDF5(filename, ldata, thumbnail, compressed=True, compression=COMPRESSION_GZIP):
     """
     Saves a list of DataArray as a HDF5 (SVI) file.
     filename (string): name of the file to save
@@ -1597,6 +1821,7 @@ def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
      Should have at least one array.
     thumbnail (None or DataArray): see export
     compressed (boolean): whether the file is compressed or not.
+    compression (str): COMPRESSION_* method to use, if compressed.
     """
     # h5py will extend the current file by default, so we want to make sure
     # there is no file at all.
@@ -1605,20 +1830,13 @@ def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
     except OSError:
         pass
     f = h5py.File(filename, "w") # w will fail if file exists
-    if compressed:
-        # szip is not free for commercial usage and lzf doesn't seem to be
-        # well supported yet
-        compression = "gzip"
-    else:
+    if not compressed:
         compression = None
+    # szip is not free for commercial usage, so not proposed
+    _get_compression_args(compression)  # Check it's valid before writing anything
 
     if thumbnail is not None:
-        thumbnail = _mergeCorrectionMetadata(thumbnail)
-        # Save the image as-is in a special group "Preview"
-        prevg = f.create_group("Preview")
-        _updateRGBMD(thumbnail) # ensure RGB info is there if needed
-        ids = _create_image_dataset(prevg, "Image", thumbnail, compression=compression)
-        _add_image_info(prevg, ids, thumbnail)
+        _add_thumbnail(f, thumbnail, compression)
 
     # merge correction metadata (as we cannot save them separatly in OME-TIFF)
     ldata = [_mergeCorrectionMetadata(da) for da in ldata]
@@ -1632,9 +1850,160 @@ def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
     f.close()
 
 
-# TODO: allow to append data to a file, or any other way to allow saving large
-# data without having everything in memory simultaneously.
-def export(filename, data, thumbnail=None):
+class AcquisitionWriter(object):
+    """
+    Writes an HDF5 (SVI) file progressively, so that large data (eg, a spectrum
+    or temporal spectrum cube) never has to be fully in memory. Each image is
+    stored in a chunked dataset of its own "AcquisitionN" group. The shape and
+    metadata of an image must be known when creating it, and then the data is
+    written block by block (eg, one scanned row at a time), in any order.
+    After every flush(), the file is a valid HDF5 file, with the parts not yet
+    written filled with 0's.
+    Note: contrarily to export(), the images are never merged along C.
+    It can also be used to append images to an existing file.
+    """
+
+    def __init__(self, filename, compression=COMPRESSION_GZIP_FAST, append=False):
+        """
+        filename (str): path of the file to write
+        compression (None or str): COMPRESSION_* method to use, or None for no
+          compression. The default is (almost) as compact as export(), but
+          faster to write.
+        append (bool): if True and the file already exists, the new images are
+          added after the ones already in the file. Otherwise, the file is
+          overwritten.
+        """
+        self.filename = str(filename)
+        _get_compression_args(compression)  # Check it's valid
+        self._compression = compression
+
+        if not append:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+        self._file = h5py.File(self.filename, "a", rdcc_nbytes=CHUNK_CACHE_SIZE)
+
+        # Continue the numbering of the acquisitions already in the file
+        self._next_acq = 0
+        for name in self._file.keys():
+            m = re.match(r"Acquisition(\d+)$", name)
+            if m:
+                self._next_acq = max(self._next_acq, int(m.group(1)) + 1)
+
+        # For each image: dataset, dims, axes (to reorder the data in the
+        # dataset order), current min/max (or None)
+        self._images = []
+
+    def set_thumbnail(self, thumbnail):
+        """
+        Store (or replace) the thumbnail of the file
+        thumbnail (DataArray): see export()
+        """
+        if "Preview" in self._file:
+            del self._file["Preview"]
+        _add_thumbnail(self._file, thumbnail, self._compression)
+
+    def create_image(self, shape, dtype, metadata=None):
+        """
+        Add a new (empty) image to the file
+        shape (tuple of int): the shape of the complete image, with 2 to 5
+          dimensions, ordered as MD_DIMS (or CTZYX by default).
+        dtype (numpy.dtype): the type of the data
+        metadata (None or dict): metadata of the image
+        return (int): the index of the image, to pass to write()
+        raises ValueError: if the data is RGB, which is not supported
+        """
+        shape = tuple(shape)
+        dtype = numpy.dtype(dtype)
+        if len(shape) < 2:
+            raise ValueError("Image should have at least 2 dimensions, got %s" % (shape,))
+
+        # A (read-only) image without any data, to compute the metadata
+        shadow = numpy.lib.stride_tricks.as_strided(numpy.zeros(1, dtype=dtype),
+                                                    shape=shape, strides=(0,) * len(shape))
+        shadow = _mergeCorrectionMetadata(model.DataArray(shadow, metadata or {}))
+        dims = _getDims(shadow.metadata, shape)
+        ashadow = _adjustDimensions(shadow)
+        adims = ashadow.metadata[model.MD_DIMS]
+        if len(adims) != 5:
+            raise ValueError("RGB data (of shape %s) is not supported" % (shape,))
+        axes = [dims.index(d) for d in adims if d in dims]
+
+        ga = self._file.create_group("Acquisition%d" % self._next_acq)
+        self._next_acq += 1
+        ids = _add_acquistion_svi(ga, ashadow, None, compression=self._compression, fill=False)
+        self._images.append([ids, adims, dims, axes, None])
+        return len(self._images) - 1
+
+    def write(self, n, data, pos):
+        """
+        Write a part of an image
+        n (int): index of the image, as returned by create_image()
+        data (numpy.ndarray): the data, with the same number of dimensions as the
+          image, and in the same order.
+        pos (tuple of int): index in the image of the first element of data
+          (ie, top-left corner), for each dimension.
+        """
+        ids, adims, dims, axes, minmax = self._images[n]
+        data = numpy.asarray(data)
+        if data.ndim != len(dims) or len(pos) != len(dims):
+            raise ValueError("Expected data and position of %d dimensions, but got %s @ %s" %
+                             (len(dims), data.shape, pos))
+
+        # Convert to the order of the dataset, with the missing dimensions of size 1
+        block = data.transpose(axes)
+        bshape = tuple(data.shape[dims.index(d)] if d in dims else 1 for d in adims)
+        block = block.reshape(bshape)
+        bpos = tuple(pos[dims.index(d)] if d in dims else 0 for d in adims)
+        if any(p < 0 or p + s > ms for p, s, ms in zip(bpos, bshape, ids.shape)):
+            raise IndexError("Data of shape %s @ %s doesn't fit in image of shape %s" %
+                             (data.shape, pos, self._getShape(n)))
+
+        ids[tuple(slice(p, p + s) for p, s in zip(bpos, bshape))] = block
+
+        if block.size:
+            bmin, bmax = block.min(), block.max()
+            if minmax is not None:
+                bmin, bmax = min(bmin, minmax[0]), max(bmax, minmax[1])
+            self._images[n][4] = (bmin, bmax)
+
+    def _getShape(self, n):
+        """
+        return (tuple of int): the shape of the image, in the original order
+        """
+        ids, adims, dims, axes, minmax = self._images[n]
+        return tuple(ids.shape[adims.index(d)] for d in dims)
+
+    def flush(self):
+        """
+        Ensure all the data written so far is stored in the file
+        """
+        for ids, adims, dims, axes, minmax in self._images:
+            if minmax is not None:
+                ids.attrs["IMAGE_MINMAXRANGE"] = list(minmax)
+        self._file.flush()
+
+    def close(self):
+        """
+        Flush the data and close the file. The writer cannot be used afterwards.
+        """
+        if self._file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export(filename, data, thumbnail=None, compression=COMPRESSION_GZIP):
     '''
     Write an HDF5 file with the given image and metadata
     filename (str): filename of the file to create (including path)
@@ -1648,6 +2017,9 @@ def export(filename, data, thumbnail=None):
       (reasonable) size. Must be either 2D array (greyscale) or 3D with last
       dimension of length 3 (RGB). If the exporter doesn't support it, it will
       be dropped silently.
+    compression (None or str): COMPRESSION_* method to use, or None to not
+      compress the data. The method is recorded in the file.
+    Note: to write data too large to hold in memory, use AcquisitionWriter.
     '''
     filename = str(filename)
     # TODO: add an argument to not do any clever data aggregation?
@@ -1655,7 +2027,8 @@ def export(filename, data, thumbnail=None):
         # TODO should probably not enforce it: respect duck typing
         assert(isinstance(data, model.DataArray))
         data = [data]
-    _saveAsHDF5(filename, data, thumbnail)
+    _saveAsHDF5(filename, data, thumbnail, compressed=compression is not None,
+                compression=compression)
 
 
 def read_data(filename):
@@ -1671,16 +2044,11 @@ def read_data(filename):
     raises:
         IOError in case the file format is not as expected.
     """
-    # TODO: support filename to be a File or Stream (but it seems very difficult
-    # to do it without looking at the .filename attribute)
-    # see http://pytables.github.io/cookbook/inmemory_hdf5_files.html
-
-    data = _dataFromHDF5(filename)
-    # Inject filename and in-file index for project management purposes
-    for i, da in enumerate(data):
-        da.metadata[model.MD_FILENAME] = filename
-        da.metadata[model.MD_IN_FILE_INDEX] = i
-    return data
+    acd = open_data(filename)
+    try:
+        return [da.getData() for da in acd.content]
+    finally:
+        acd.close()
 
 
 def read_thumbnail(filename):
@@ -1693,9 +2061,26 @@ def read_thumbnail(filename):
     raises:
         IOError in case the file format is not as expected.
     """
-    # TODO: support filename to be a File or Stream
+    acd = open_data(filename)
+    try:
+        return [da.getData() for da in acd.thumbnails]
+    finally:
+        acd.close()
 
-    return _thumbFromHDF5(filename)
+
+def open_data(filename):
+    """
+    Opens an HDF5 file, and return an AcquisitionData instance. The data is only
+    read from the file when requested, and can be read partially.
+    filename (str): path to the file
+    return (AcquisitionData): an opened file
+    raises:
+        IOError in case the file format is not as expected.
+    """
+    # TODO: support filename to be a File or Stream (but it seems very difficult
+    # to do it without looking at the .filename attribute)
+    # see http://pytables.github.io/cookbook/inmemory_hdf5_files.html
+    return AcquisitionDataHDF5(str(filename))
 
 
 def convert_to_str(s: Union[bytes, str]) -> str:
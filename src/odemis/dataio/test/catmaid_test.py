@@ -20,13 +20,187 @@ PURPOSE. See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along with
 Odemis. If not, see http://www.gnu.org/licenses/.
 """
+import collections
+import http.server
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from io import BytesIO
 
 import numpy
+from PIL import Image
 from requests import ConnectionError
 
 from odemis.dataio import AuthenticationError
-from odemis.dataio.catmaid import open_data
+from odemis.dataio.catmaid import open_data, DataArrayShadowPyramidalCatmaid, TileDiskCache, FILE_BASED
+
+TILE_SIZE = 256
+
+
+class TileRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves tiles as a (simple) Catmaid server: /tiles/{depth}/{row}_{col}_{zoom}.png
+    Each tile is filled with the value row * 10 + col + zoom.
+    """
+    delay = 0  # s, to simulate a slow server
+    requests = collections.Counter()  # path -> number of requests
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.requests[self.path] += 1
+        time.sleep(self.delay)
+
+        m = re.fullmatch(r"/tiles/(\d+)/(\d+)_(\d+)_(\d+)\.png", self.path)
+        if not m or int(m.group(2)) >= 4:
+            self.send_error(404)
+            return
+        depth, row, col, zoom = (int(g) for g in m.groups())
+        tile = numpy.full((TILE_SIZE, TILE_SIZE), row * 10 + col + zoom, dtype=numpy.uint8)
+        buf = BytesIO()
+        Image.fromarray(tile).save(buf, format="PNG")
+        content = buf.getvalue()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass  # Don't print every request
+
+
+class TestCatmaidTileFetcher(unittest.TestCase):
+    """
+    Test fetching the tiles, with a local HTTP server
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("localhost", 0), TileRequestHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.base_url = "http://localhost:%d" % (cls.server.server_address[1],)
+        cls.stack_info = {
+            "dimension": {"x": 4 * TILE_SIZE, "y": 4 * TILE_SIZE, "z": 1},
+            "resolution": {"x": 4.0, "y": 4.0, "z": 40.0},
+            "num_zoom_levels": 2,
+            "mirrors": [{
+                "tile_width": TILE_SIZE,
+                "tile_height": TILE_SIZE,
+                "file_extension": "png",
+                "tile_source_type": FILE_BASED,
+                "image_base": cls.base_url + "/tiles/",
+            }],
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        TileRequestHandler.delay = 0
+        TileRequestHandler.requests.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_tile_cached(self):
+        das = DataArrayShadowPyramidalCatmaid(self.stack_info, self.base_url, cache_dir=self.cache_dir)
+        tile = das.getTile(1, 2, 0)
+        self.assertEqual(tile.shape, (TILE_SIZE, TILE_SIZE))
+        self.assertTrue(numpy.all(tile == 21))
+        self.assertEqual(sum(TileRequestHandler.requests.values()), 1)
+
+        # Second time, it comes from the cache
+        tile = das.getTile(1, 2, 0)
+        self.assertTrue(numpy.all(tile == 21))
+        self.assertEqual(sum(TileRequestHandler.requests.values()), 1)
+
+        # Also after "restarting"
+        das = DataArrayShadowPyramidalCatmaid(self.stack_info, self.base_url, cache_dir=self.cache_dir)
+        tile = das.getTile(1, 2, 0)
+        self.assertTrue(numpy.all(tile == 21))
+        self.assertEqual(sum(TileRequestHandler.requests.values()), 1)
+
+        # A different zoom level is a different tile
+        tile = das.getTile(1, 2, 1)
+        self.assertTrue(numpy.all(tile == 22))
+        self.assertEqual(sum(TileRequestHandler.requests.values()), 2)
+
+    def test_missing_tile(self):
+        das = DataArrayShadowPyramidalCatmaid(self.stack_info, self.base_url, cache_dir=self.cache_dir)
+        for i in range(2):
+            tile = das.getTile(1, 5, 0)  # Server returns 404 => blank tile
+            self.assertEqual(tile.shape, (TILE_SIZE, TILE_SIZE))
+            self.assertTrue(numpy.all(tile == 0))
+        # Errors are not cached
+        self.assertEqual(sum(TileRequestHandler.requests.values()), 2)
+
+    def test_concurrent_requests(self):
+        """
+        Requesting the same tile simultaneously only downloads it once
+        """
+        TileRequestHandler.delay = 0.5  # s
+        das = DataArrayShadowPyramidalCatmaid(self.stack_info, self.base_url, cache_dir=None)
+        tiles = []
+
+        def get_tile():
+            tiles.append(das.getTile(3, 1, 0))
+
+        threads = [threading.Thread(target=get_tile) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(tiles), 6)
+        for t in tiles:
+            self.assertTrue(numpy.all(t == 13))
+        self.assertEqual(sum(TileRequestHandler.requests.values()), 1)
+
+    def test_prefetch(self):
+        """
+        Prefetching downloads the tiles in parallel
+        """
+        TileRequestHandler.delay = 0.2  # s
+        das = DataArrayShadowPyramidalCatmaid(self.stack_info, self.base_url, cache_dir=self.cache_dir)
+        tiles = [(x, y, 0) for x in range(4) for y in range(4)]
+        tstart = time.time()
+        das.prefetchTiles(tiles + [(10, 10, 0), (0, 0, 8)])  # Tiles outside of the image are ignored
+        for x, y, z in tiles:
+            tile = das.getTile(x, y, z)
+            self.assertTrue(numpy.all(tile == y * 10 + x))
+        dur = time.time() - tstart
+
+        # 16 tiles downloaded serially would take 3.2 s
+        self.assertLess(dur, 16 * TileRequestHandler.delay / 2)
+        self.assertEqual(len(TileRequestHandler.requests), 16)
+        self.assertTrue(all(n == 1 for n in TileRequestHandler.requests.values()))
+
+    def test_disk_cache_lru(self):
+        cache = TileDiskCache(self.cache_dir, max_size=250)
+        cache.put("http://a", 0, b"a" * 100)
+        cache.put("http://b", 0, b"b" * 100)
+        self.assertEqual(cache.get("http://a", 0), b"a" * 100)  # a is now the most recently used
+        cache.put("http://c", 0, b"c" * 100)  # => b is removed
+
+        self.assertIsNone(cache.get("http://b", 0))
+        self.assertEqual(cache.get("http://a", 0), b"a" * 100)
+        self.assertEqual(cache.get("http://c", 0), b"c" * 100)
+        self.assertIsNone(cache.get("http://c", 1))  # Different zoom
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        # Reopening the cache keeps the content
+        cache = TileDiskCache(self.cache_dir, max_size=250)
+        self.assertEqual(cache.get("http://c", 0), b"c" * 100)
 
 
 # FIXME if we start using catmaid, make sure the test cases are independent of external servers.
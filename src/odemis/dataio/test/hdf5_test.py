@@ -1474,6 +1474,170 @@ class TestHDF5IO(unittest.TestCase):
         im = rdata[0]
         self.assertEqual(im.metadata[model.MD_ACQ_RECIPES], metadata[model.MD_ACQ_RECIPES])
 
+    def test_export_compression(self):
+        """
+        Check the compression method can be selected, and is recorded in the file
+        """
+        data = model.DataArray(numpy.arange(200 * 300, dtype=numpy.uint16).reshape(1, 1, 1, 200, 300),
+                               {model.MD_PIXEL_SIZE: (1e-6, 1e-6)})
+        for compression in (hdf5.COMPRESSION_GZIP, hdf5.COMPRESSION_GZIP_FAST, hdf5.COMPRESSION_LZF, None):
+            hdf5.export(FILENAME, data, compression=compression)
+
+            with h5py.File(FILENAME, "r") as f:
+                im = f["Acquisition0/ImageData/Image"]
+                if compression is None:
+                    self.assertNotIn("COMPRESSION", im.attrs)
+                else:
+                    self.assertEqual(im.attrs["COMPRESSION"], compression.encode("ascii"))
+
+            rdata = hdf5.read_data(FILENAME)
+            numpy.testing.assert_array_equal(rdata[0], data)
+
+        with self.assertRaises(ValueError):
+            hdf5.export(FILENAME, data, compression="foo")
+
+    def test_acquisition_writer(self):
+        """
+        Check data can be written progressively, row by row, and appended to a file
+        """
+        dtype = numpy.uint16
+        shape = (15, 20, 200)  # YXC
+        md = {model.MD_DIMS: "YXC",
+              model.MD_DESCRIPTION: "spectrum",
+              model.MD_PIXEL_SIZE: (1e-6, 2e-6),
+              model.MD_POS: (1e-3, -30e-3),
+              model.MD_WL_LIST: [500e-9 + i * 1e-9 for i in range(shape[-1])],
+              }
+        cube = numpy.random.randint(1, 4000, shape, dtype=dtype)
+
+        with hdf5.AcquisitionWriter(FILENAME) as writer:
+            n = writer.create_image(shape, dtype, md)
+            for y in range(shape[0]):
+                writer.write(n, cube[y:y + 1], (y, 0, 0))
+                writer.flush()
+                if y == 5:
+                    # The file should be readable during the acquisition
+                    rdata = hdf5.read_data(FILENAME)
+                    self.assertEqual(rdata[0].shape, (200, 1, 1, 15, 20))
+                    numpy.testing.assert_array_equal(rdata[0][:, 0, 0, 5, :], cube[5].T)
+                    numpy.testing.assert_array_equal(rdata[0][:, 0, 0, 6, :], 0)
+
+            with self.assertRaises(IndexError):
+                writer.write(n, cube[0:2], (14, 0, 0))
+
+            writer.set_thumbnail(model.DataArray(numpy.zeros((20, 30, 3), numpy.uint8)))
+
+        with h5py.File(FILENAME, "r") as f:
+            im = f["Acquisition0/ImageData/Image"]
+            self.assertEqual(im.attrs["COMPRESSION"], hdf5.COMPRESSION_GZIP_FAST.encode("ascii"))
+            # A chunk contains whole spectra
+            self.assertEqual(im.chunks[0], shape[-1])
+            self.assertEqual(tuple(im.attrs["IMAGE_MINMAXRANGE"]), (cube.min(), cube.max()))
+
+        # Append a 2D image, written in two halves (of columns)
+        img2d = numpy.random.randint(0, 255, (15, 20), dtype=numpy.uint8)
+        with hdf5.AcquisitionWriter(FILENAME, compression=hdf5.COMPRESSION_LZF, append=True) as writer:
+            n = writer.create_image(img2d.shape, img2d.dtype, {model.MD_PIXEL_SIZE: (1e-6, 2e-6)})
+            writer.write(n, img2d[:, :10], (0, 0))
+            writer.write(n, img2d[:, 10:], (0, 10))
+
+        rdata = hdf5.read_data(FILENAME)
+        self.assertEqual(len(rdata), 2)
+        spec = rdata[0]
+        numpy.testing.assert_array_equal(spec[:, 0, 0], numpy.moveaxis(cube, 2, 0))
+        self.assertEqual(spec.metadata[model.MD_DESCRIPTION], md[model.MD_DESCRIPTION])
+        self.assertEqual(spec.metadata[model.MD_PIXEL_SIZE], md[model.MD_PIXEL_SIZE])
+        numpy.testing.assert_allclose(spec.metadata[model.MD_WL_LIST], md[model.MD_WL_LIST])
+        numpy.testing.assert_array_equal(rdata[1][0, 0, 0], img2d)
+
+        rthumbs = hdf5.read_thumbnail(FILENAME)
+        self.assertEqual(rthumbs[0].shape, (20, 30, 3))
+
+    def test_open_data(self):
+        """
+        Check the data can be opened without reading it, and read partially
+        """
+        spec = numpy.random.randint(0, 4000, (50, 1, 1, 12, 15), dtype=numpy.uint16)
+        spec_md = {model.MD_DESCRIPTION: "spectrum",
+                   model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+                   model.MD_WL_LIST: [500e-9 + i * 1e-9 for i in range(spec.shape[0])],
+                   }
+        ldata = [model.DataArray(spec, spec_md)]
+        # 2 fluorescence channels, which are merged in the same acquisition
+        fluos = []
+        for i in range(2):
+            fmd = {model.MD_DESCRIPTION: "fluo%d" % i,
+                   model.MD_PIXEL_SIZE: (1e-7, 1e-7),
+                   model.MD_POS: (1e-3, 1e-3),
+                   model.MD_IN_WL: (400e-9 + i * 100e-9, 420e-9 + i * 100e-9),
+                   model.MD_OUT_WL: (500e-9 + i * 100e-9, 520e-9 + i * 100e-9),
+                   }
+            fluo = model.DataArray(numpy.random.randint(0, 255, (20, 30), dtype=numpy.uint16), fmd)
+            fluos.append(fluo)
+            ldata.append(fluo)
+        thumbnail = model.DataArray(numpy.zeros((20, 30, 3), numpy.uint8))
+
+        hdf5.export(FILENAME, ldata, thumbnail)
+
+        acd = hdf5.open_data(FILENAME)
+        self.assertEqual(len(acd.content), 3)
+        self.assertEqual(len(acd.thumbnails), 1)
+        self.assertEqual(acd.thumbnails[0].getData().shape, (20, 30, 3))
+
+        for i, das in enumerate(acd.content):
+            self.assertIsInstance(das, model.DataArrayShadow)
+            self.assertEqual(das.metadata[model.MD_FILENAME], FILENAME)
+            self.assertEqual(das.metadata[model.MD_IN_FILE_INDEX], i)
+
+        das_spec = acd.content[0]
+        self.assertEqual(das_spec.shape, spec.shape)
+        self.assertEqual(das_spec.metadata[model.MD_DESCRIPTION], "spectrum")
+        # One pixel spectrum
+        px_spec = das_spec[:, 0, 0, 5, 7]
+        self.assertEqual(px_spec.metadata[model.MD_DESCRIPTION], "spectrum")
+        numpy.testing.assert_array_equal(px_spec, spec[:, 0, 0, 5, 7])
+        # One wavelength plane
+        numpy.testing.assert_array_equal(das_spec[10, 0, 0], spec[10, 0, 0])
+        numpy.testing.assert_array_equal(das_spec[10, ...], spec[10])
+        numpy.testing.assert_array_equal(das_spec.getData(), spec)
+
+        # Each channel is opened separately
+        for das, fluo in zip(acd.content[1:], fluos):
+            self.assertEqual(das.shape, (1, 1, 20, 30))
+            self.assertEqual(das.metadata[model.MD_DESCRIPTION], fluo.metadata[model.MD_DESCRIPTION])
+            self.assertEqual(das.metadata[model.MD_IN_WL], fluo.metadata[model.MD_IN_WL])
+            numpy.testing.assert_array_equal(das[0, 0, 2:5], fluo[2:5])
+            numpy.testing.assert_array_equal(das.getData()[0, 0], fluo)
+
+        # read_data() gives the same result
+        rdata = hdf5.read_data(FILENAME)
+        self.assertEqual(len(rdata), 3)
+        numpy.testing.assert_array_equal(rdata[0], spec)
+        numpy.testing.assert_array_equal(rdata[2][0, 0], fluos[1])
+
+    def test_open_data_close(self):
+        """
+        Check the file is closed as soon as the data is not used anymore
+        """
+        data = model.DataArray(numpy.random.randint(0, 4000, (10, 20), dtype=numpy.uint16))
+        hdf5.export(FILENAME, data)
+
+        acd = hdf5.open_data(FILENAME)
+        das = acd.content[0]
+        dataset = das.dataset
+        # The file stays open as long as an image is used
+        del acd
+        self.assertTrue(dataset.id.valid)
+        numpy.testing.assert_array_equal(das[0, 0, 0, 2:4], data[2:4])
+        del das
+        self.assertFalse(dataset.id.valid)
+
+        # Explicitly closed
+        acd = hdf5.open_data(FILENAME)
+        dataset = acd.content[0].dataset
+        acd.close()
+        self.assertFalse(dataset.id.valid)
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
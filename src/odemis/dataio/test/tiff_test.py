@@ -23,11 +23,13 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 # Don't import unicode_literals to avoid issues with external functions. Code works on python2 and python3.
 import json
 import logging
+import math
 import os
 import re
 import time
 import unittest
 import xml.etree.ElementTree as ET
+from concurrent import futures
 from datetime import datetime
 # from unittest.case import skip
 
@@ -2712,6 +2714,159 @@ class TestTileRead(unittest.TestCase):
         except Exception as e:
             self.fail(f"Error reading tiles: {e}")
 
+    def test_parallel_and_prefetch_read(self):
+        """Test reading tiles simultaneously from multiple threads, and prefetching"""
+        size = (3000, 2000)
+        md = {
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+            model.MD_POS: (1e-3, 2e-3),
+            model.MD_DIMS: "YX",
+        }
+        arr = numpy.random.randint(0, 2 ** 12, size[::-1], dtype=numpy.uint16)
+        export(PYRAMID_FILENAME, model.DataArray(arr, md), pyramid=True)
+
+        das = open_acquisition(PYRAMID_FILENAME)[0]
+        ts = das.tile_shape
+        tiles = [(x, y, 0) for x in range(math.ceil(size[0] / ts[0]))
+                 for y in range(math.ceil(size[1] / ts[1]))]
+
+        # Tiles outside of the image are accepted (and ignored)
+        das.prefetchTiles(tiles + [(-1, 0, 0), (100, 100, 0), (0, 0, 42)])
+
+        def check_tile(t):
+            x, y, z = t
+            tile = das.getTile(x, y, z)
+            exp = arr[y * ts[1]:(y + 1) * ts[1], x * ts[0]:(x + 1) * ts[0]]
+            numpy.testing.assert_array_equal(tile, exp)
+
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(check_tile, tiles))
+
+        # A tile at a lower zoom level should still be the right one, even after
+        # reading from another level
+        tile = das.getTile(1, 1, 1)
+        self.assertEqual(tile.metadata[model.MD_PIXEL_SIZE], (2e-6, 2e-6))
+        self.assertEqual(tile.shape, (ts[1], ts[0]))
+
+
+class TestPyramidWriter(unittest.TestCase):
+
+    def tearDown(self):
+        # clean up
+        try:
+            os.remove(PYRAMID_FILENAME)
+        except Exception:
+            pass
+
+    def test_pyramid_writer(self):
+        """Test writing a pyramidal image tile by tile"""
+        size = (1300, 1000)  # X, Y
+        md = {
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+            model.MD_POS: (1e-3, 2e-3),
+            model.MD_DESCRIPTION: "stitched",
+        }
+        arr = numpy.random.randint(0, 2 ** 12, size[::-1], dtype=numpy.uint16)
+        ts = tiff.TILE_SIZE
+        tiles = [(x, y) for x in range(math.ceil(size[0] / ts)) for y in range(math.ceil(size[1] / ts))]
+
+        with tiff.PyramidWriter(PYRAMID_FILENAME, arr.shape, arr.dtype, md) as writer:
+            # The first row at once, and the rest tile by tile, in any order
+            writer.write_region(0, 0, arr[:ts])
+            for x, y in reversed(tiles):
+                if y > 0:
+                    writer.write_tile(x, y, arr[y * ts:(y + 1) * ts, x * ts:(x + 1) * ts])
+
+            with self.assertRaises(IndexError):
+                writer.write_tile(100, 0, arr[:ts, :ts])
+            with self.assertRaises(ValueError):
+                writer.write_region(10, 0, arr[:ts, :ts])
+
+        das = open_acquisition(PYRAMID_FILENAME)[0]
+        self.assertEqual(das.shape, arr.shape)
+        self.assertEqual(das.maxzoom, 2)
+        self.assertEqual(das.metadata[model.MD_DESCRIPTION], "stitched")
+        numpy.testing.assert_array_equal(das.getData(), arr)
+
+        # Lower resolution is the average of the pixels
+        tile = das.getTile(0, 0, 1)
+        exp = arr[:2 * ts, :2 * ts].reshape(ts, 2, ts, 2).mean(axis=(1, 3))
+        numpy.testing.assert_allclose(tile, exp, atol=1)
+        tile = das.getTile(0, 0, 2)
+        self.assertEqual(tile.shape, (250, 256))
+
+    def test_pyramid_writer_rgb_missing_tiles(self):
+        """Test writing a pyramidal RGB image, with some tiles never written"""
+        shape = (600, 700, 3)  # YXC
+        arr = numpy.random.randint(0, 255, shape, dtype=numpy.uint8)
+        ts = tiff.TILE_SIZE
+        writer = tiff.PyramidWriter(PYRAMID_FILENAME, shape, arr.dtype, {model.MD_PIXEL_SIZE: (1e-6, 1e-6)})
+        writer.write_tile(0, 0, arr[:ts, :ts])
+        writer.close()
+
+        das = open_acquisition(PYRAMID_FILENAME)[0]
+        self.assertEqual(das.shape, shape)
+        data = das.getData()
+        numpy.testing.assert_array_equal(data[:ts, :ts], arr[:ts, :ts])
+        self.assertEqual(data[ts:].max(), 0)
+
+    def test_pyramid_writer_rewrite_tile(self):
+        """Test writing a tile a second time is refused, and doesn't affect the lower levels"""
+        shape = (1100, 1000)  # YX
+        arr = numpy.random.randint(0, 2 ** 12, shape, dtype=numpy.uint16)
+        ts = tiff.TILE_SIZE
+        tiles = [(x, y) for x in range(math.ceil(shape[1] / ts)) for y in range(math.ceil(shape[0] / ts))]
+        zeros = numpy.zeros((ts, ts), dtype=arr.dtype)
+
+        with tiff.PyramidWriter(PYRAMID_FILENAME, shape, arr.dtype, {model.MD_PIXEL_SIZE: (1e-6, 1e-6)}) as writer:
+            for x, y in tiles:
+                writer.write_tile(x, y, arr[y * ts:(y + 1) * ts, x * ts:(x + 1) * ts])
+                if (x, y) == (1, 1):
+                    # Before its parent tile is complete
+                    with self.assertRaises(ValueError):
+                        writer.write_tile(x, y, zeros)
+            # Once all the levels are complete
+            with self.assertRaises(ValueError):
+                writer.write_tile(0, 0, zeros)
+
+        das = open_acquisition(PYRAMID_FILENAME)[0]
+        self.assertEqual(das.maxzoom, 2)
+        numpy.testing.assert_array_equal(das.getData(), arr)
+
+        # The lower resolutions correspond to the data written first
+        tile = das.getTile(0, 0, 1)
+        exp1 = arr[:2 * ts, :2 * ts].reshape(ts, 2, ts, 2).mean(axis=(1, 3))
+        numpy.testing.assert_allclose(tile, exp1, atol=1)
+        tile = das.getTile(0, 0, 2)
+        h, w = shape[0] // 4, shape[1] // 4
+        exp2 = arr[:h * 4, :w * 4].reshape(h, 4, w, 4).mean(axis=(1, 3))
+        self.assertEqual(tile.shape, (ts, w))
+        numpy.testing.assert_allclose(tile, exp2[:ts], atol=2)
+
+    def test_pyramid_writer_parallel(self):
+        """Test writing the tiles simultaneously from multiple threads"""
+        for dtype in (numpy.int16, numpy.float32):
+            shape = (1100, 900)  # YX
+            arr = (numpy.random.random(shape) * 2000 - 1000).astype(dtype)
+            ts = tiff.TILE_SIZE
+            tiles = [(x, y) for x in range(math.ceil(shape[1] / ts)) for y in range(math.ceil(shape[0] / ts))]
+
+            with tiff.PyramidWriter(PYRAMID_FILENAME, shape, dtype, {model.MD_PIXEL_SIZE: (1e-6, 1e-6)}) as writer:
+                def write_tile(t):
+                    x, y = t
+                    writer.write_tile(x, y, arr[y * ts:(y + 1) * ts, x * ts:(x + 1) * ts])
+
+                with futures.ThreadPoolExecutor(max_workers=4) as executor:
+                    list(executor.map(write_tile, tiles))
+
+            das = open_acquisition(PYRAMID_FILENAME)[0]
+            self.assertEqual(das.dtype, dtype)
+            numpy.testing.assert_array_equal(das.getData(), arr)
+            tile = das.getTile(0, 0, 1)
+            exp = arr[:2 * ts, :2 * ts].reshape(ts, 2, ts, 2).mean(axis=(1, 3))
+            numpy.testing.assert_allclose(tile, exp, atol=1)
+
+
 # Not used anymore
 # def rational2float(rational):
 #     """
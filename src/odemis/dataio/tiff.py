@@ -20,6 +20,7 @@ You should have received a copy of the GNU General Public License along with
 Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 import calendar
+import collections
 import configparser
 import json
 import logging
@@ -28,10 +29,14 @@ import operator
 import os
 import re
 import statistics
+import tempfile
 import threading
 import time
 import uuid
+import weakref
+import zlib
 import xml.etree.ElementTree as ET
+from concurrent import futures
 from datetime import datetime
 from typing import List, Optional, Union, TextIO, Any, Dict
 
@@ -74,6 +79,12 @@ CAN_SAVE_PYRAMID = True # indicates the support for pyramidal export
 TILE_SIZE = 256 # Tile size of pyramidal images
 LOSSY = False
 
+# Maximum number of handles opened simultaneously on a file to read its tiles
+# (in parallel, from different threads)
+MAX_TILE_HANDLES = max(2, min(8, os.cpu_count() or 1))
+# Maximum number of tiles kept after being prefetched, and not yet requested
+MAX_PREFETCHED_TILES = 256
+
 # We try to make it as much as possible looking like a normal (multi-page) TIFF,
 # with as much metadata as possible saved in the known TIFF tags. In addition,
 # we ensure it's compatible with OME-TIFF, which support much more metadata, and
@@ -2343,6 +2354,319 @@ def write_image(f, arr, compression=None, write_rgb=False, pyramid=False):
         f.write_tiles(subim, TILE_SIZE, TILE_SIZE, compression, write_rgb)
 
 
+class PyramidWriter(object):
+    """
+    Writes a pyramidal TIFF file of a single image, tile by tile, without ever
+    holding the full image in memory. The full resolution tiles are written to
+    the file as soon as they are received, while the lower resolution levels
+    are computed on the fly (by averaging 2x2 pixels of the level above), as
+    soon as the corresponding 2x2 tiles are complete, and are stored in
+    temporary memory-mapped files until the file is closed.
+    The full resolution tiles are compressed (with Deflate) by the thread
+    writing them, so that several tiles can be compressed simultaneously.
+    Usage:
+        with PyramidWriter(fn, shape, dtype, md) as writer:
+            for x, y, tile in ...:
+                writer.write_tile(x, y, tile)
+    """
+
+    def __init__(self, filename: str, shape, dtype, metadata: Optional[dict] = None,
+                 compressed: bool = True, tile_size: int = TILE_SIZE):
+        """
+        filename: name of the file to create
+        shape (int, int) or (int, int, int): shape of the complete image, either
+          YX (greyscale) or YXC (RGB(A), with C = 3 or 4).
+        dtype (numpy.dtype): data type of the image
+        metadata: metadata of the image, as for a DataArray
+        compressed: whether the file is compressed or not
+        tile_size: width and height of the tiles, must be even
+        raise ValueError: if the shape is not supported
+        """
+        if len(shape) == 2:
+            self._rgb = False
+            dims = "YX"
+        elif len(shape) == 3 and shape[2] in (3, 4):
+            self._rgb = True
+            dims = "YXC"
+        else:
+            raise ValueError("Shape %s not supported, must be YX or YXC" % (shape,))
+        if tile_size % 2:
+            raise ValueError("Tile size must be even, got %d" % (tile_size,))
+
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.tile_size = tile_size
+        md = dict(metadata or {})
+        md[model.MD_DIMS] = dims
+
+        # A (fake) DataArray with all the properties of the final image, but no memory
+        shadow = numpy.lib.stride_tricks.as_strided(numpy.zeros(1, dtype=self.dtype),
+                                                    shape=self.shape, strides=(0,) * len(shape))
+        shadow = _mergeCorrectionMetadata(model.DataArray(shadow, md))
+
+        if self.dtype in (numpy.int64, numpy.uint64) or not compressed:
+            self._compression = T.COMPRESSION_NONE  # libtiff doesn't support compression on these types
+        else:
+            # Deflate (instead of LZW, as in the rest of the module), as it can
+            # be done with zlib, outside of libtiff, and so from multiple threads.
+            self._compression = T.COMPRESSION_ADOBE_DEFLATE
+        # Same as libtiff, the horizontal predictor is only used for integers
+        self._predictor = (self._compression != T.COMPRESSION_NONE
+                           and not numpy.issubdtype(self.dtype, numpy.floating))
+
+        # Shape of each level: level 0 is the full image
+        self._shapes = [self.shape] + _genResizedShapes(shadow)
+        # number of tiles per level, in X and Y
+        self._ntiles = [(math.ceil(s[1] / tile_size), math.ceil(s[0] / tile_size)) for s in self._shapes]
+        # For level 0, whether the tile has been written. For the other
+        # levels, number of child tiles which have been merged.
+        self._tiles_done = [numpy.zeros(nt[::-1], dtype=numpy.uint8) for nt in self._ntiles]
+
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Store the reduced levels on disk, next to the final file
+        self._tmp_files = []
+        self._levels = [None]  # level 0 is directly written in the file
+        tmp_dir = os.path.dirname(os.path.abspath(filename))
+        for s in self._shapes[1:]:
+            tf = tempfile.TemporaryFile(prefix="odemis-pyramid-", dir=tmp_dir)
+            self._tmp_files.append(tf)
+            self._levels.append(numpy.memmap(tf, dtype=self.dtype, mode="w+", shape=s))
+
+        # Above 4 GB the file must be a BigTIFF. As it's compressed, we don't
+        # know the final size, so be conservative.
+        mode = "w8" if shadow.nbytes * 4 // 3 >= 2 ** 31 else "w"
+        self._file = TIFF.open(filename, mode=mode)
+        try:
+            self._writeHeader(shadow)
+        except Exception:
+            self._abort()
+            raise
+
+    def _writeHeader(self, shadow):
+        """
+        Write the metadata and the tags of the full resolution image
+        """
+        f = self._file
+        f.SetField(T.TIFFTAG_IMAGEDESCRIPTION, _convertToOMEMD([shadow]))
+        for key, val in _convertToTiffTag(shadow.metadata).items():
+            try:
+                f.SetField(key, val)
+            except Exception:
+                logging.exception("Failed to store tag %s with value '%s'", key, val)
+
+        if len(self._shapes) > 1:
+            # LibTIFF will automatically write the next N directories as subdirectories
+            f.SetField(T.TIFFTAG_SUBIFD, [0] * (len(self._shapes) - 1))
+
+        # Same fields as set by TIFF.write_tiles()
+        if numpy.issubdtype(self.dtype, numpy.floating):
+            sample_format = T.SAMPLEFORMAT_IEEEFP
+        elif numpy.issubdtype(self.dtype, numpy.unsignedinteger) or numpy.issubdtype(self.dtype, numpy.bool_):
+            sample_format = T.SAMPLEFORMAT_UINT
+        elif numpy.issubdtype(self.dtype, numpy.signedinteger):
+            sample_format = T.SAMPLEFORMAT_INT
+        else:
+            raise ValueError("Data type %s not supported" % (self.dtype,))
+        f.SetField(T.TIFFTAG_COMPRESSION, self._compression)
+        if self._predictor:
+            f.SetField(T.TIFFTAG_PREDICTOR, T.PREDICTOR_HORIZONTAL)
+        f.SetField(T.TIFFTAG_BITSPERSAMPLE, self.dtype.itemsize * 8)
+        f.SetField(T.TIFFTAG_SAMPLEFORMAT, sample_format)
+        f.SetField(T.TIFFTAG_ORIENTATION, T.ORIENTATION_TOPLEFT)
+        f.SetField(T.TIFFTAG_TILEWIDTH, self.tile_size)
+        f.SetField(T.TIFFTAG_TILELENGTH, self.tile_size)
+        f.SetField(T.TIFFTAG_IMAGEWIDTH, self.shape[1])
+        f.SetField(T.TIFFTAG_IMAGELENGTH, self.shape[0])
+        f.SetField(T.TIFFTAG_PLANARCONFIG, T.PLANARCONFIG_CONTIG)
+        if self._rgb:
+            f.SetField(T.TIFFTAG_PHOTOMETRIC, T.PHOTOMETRIC_RGB)
+            f.SetField(T.TIFFTAG_SAMPLESPERPIXEL, self.shape[2])
+            if self.shape[2] == 4:  # RGBA
+                f.SetField(T.TIFFTAG_EXTRASAMPLES, [T.EXTRASAMPLE_UNASSALPHA], count=1)
+        else:
+            f.SetField(T.TIFFTAG_PHOTOMETRIC, T.PHOTOMETRIC_MINISBLACK)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+    def _tileShape(self, level: int, x: int, y: int):
+        """
+        return (tuple of int): the shape of the given tile, which is smaller than
+          the tile size on the right and bottom borders.
+        """
+        shape = self._shapes[level]
+        ts = self.tile_size
+        if not (0 <= x < self._ntiles[level][0] and 0 <= y < self._ntiles[level][1]):
+            raise IndexError("Tile %d, %d is outside of the image" % (x, y))
+        return (min(ts, shape[0] - y * ts), min(ts, shape[1] - x * ts)) + shape[2:]
+
+    def write_tile(self, x: int, y: int, tile):
+        """
+        Write one tile of the full resolution image. The tiles can be written in
+          any order, and from any thread, but each tile only once (libtiff cannot
+          replace the data of a tile, and the tile is already merged into the
+          lower resolution levels).
+        x: index of the tile in X (ie, left pixel is x * tile_size)
+        y: index of the tile in Y
+        tile (numpy.ndarray): the data, of shape tile_size x tile_size (possibly
+          smaller for the tiles on the right and bottom borders).
+        raise IndexError: if the tile is outside of the image
+        raise ValueError: if the tile shape is not correct, or the tile was already written
+        """
+        tshape = self._tileShape(0, x, y)
+        if tile.shape != tshape:
+            # Also accept full tiles on the borders (but drop the extra pixels)
+            if tile.shape[2:] != tshape[2:] or tile.shape[0] < tshape[0] or tile.shape[1] < tshape[1]:
+                raise ValueError("Tile %d, %d should have shape %s, but got %s" %
+                                 (x, y, tshape, tile.shape))
+            tile = tile[:tshape[0], :tshape[1]]
+
+        ts = self.tile_size
+        buf = numpy.zeros((ts, ts) + self.shape[2:], dtype=self.dtype)
+        buf[:tshape[0], :tshape[1]] = tile
+        # The slow parts (compression and reduction) don't need the lock
+        raw = self._encodeTile(buf)
+        binned = self._reduceTile(buf[:tshape[0], :tshape[1]])
+        with self._lock:
+            if self._closed:
+                raise IOError("Writer already closed")
+            if self._tiles_done[0][y, x]:
+                raise ValueError("Tile %d, %d already written" % (x, y))
+            tile_idx = y * self._ntiles[0][0] + x
+            r = T.libtiff.TIFFWriteRawTile(self._file, tile_idx, raw, len(raw))
+            if r.value != len(raw):
+                raise IOError("Failed to write tile %d, %d" % (x, y))
+            self._tiles_done[0][y, x] = 1
+            self._mergeTile(1, x, y, binned)
+
+    def _encodeTile(self, buf):
+        """
+        Convert a complete tile to the data as stored in the file
+        buf (numpy.ndarray): the tile, of shape tile_size x tile_size
+        return (bytes): the (compressed) data
+        """
+        if self._compression == T.COMPRESSION_NONE:
+            return buf.tobytes()
+
+        if self._predictor:
+            # Horizontal predictor: store the difference with the previous pixel
+            # (for each channel). Integers overflow, as expected by the decoder.
+            diff = buf.copy()
+            diff[:, 1:] -= buf[:, :-1]
+            buf = diff
+        return zlib.compress(buf.tobytes())
+
+    def _reduceTile(self, data):
+        """
+        Average 2x2 pixels of a tile (the last odd row/column is dropped, as in
+          the level shape)
+        data (numpy.ndarray): the complete tile
+        return (numpy.ndarray): the tile at half the resolution
+        """
+        h, w = data.shape[0] // 2, data.shape[1] // 2
+        binned = data[:h * 2, :w * 2].reshape((h, 2, w, 2) + data.shape[2:])
+        binned = binned.mean(axis=(1, 3))
+        if numpy.issubdtype(self.dtype, numpy.integer):
+            binned = numpy.round(binned)
+        return binned
+
+    def write_region(self, x: int, y: int, data):
+        """
+        Write a rectangular part of the full resolution image, which must be
+          aligned on the tiles. Typically used to write a whole row of tiles.
+        x, y: position of the top-left pixel. Must be a multiple of the tile size.
+        data (numpy.ndarray): the data. Its width and height must be multiple
+          of the tile size, or reach the right/bottom border of the image.
+        """
+        ts = self.tile_size
+        if x % ts or y % ts:
+            raise ValueError("Position %d, %d is not aligned on the tiles" % (x, y))
+        h, w = data.shape[:2]
+        if (h % ts and y + h != self.shape[0]) or (w % ts and x + w != self.shape[1]):
+            raise ValueError("Region of shape %s at %d, %d doesn't cover complete tiles" %
+                             (data.shape, x, y))
+        for ty in range(0, h, ts):
+            for tx in range(0, w, ts):
+                self.write_tile((x + tx) // ts, (y + ty) // ts, data[ty:ty + ts, tx:tx + ts])
+
+    def _mergeTile(self, level: int, x: int, y: int, binned):
+        """
+        Reduce a complete tile of the level above, into the given level, and if
+          it makes a tile of that level complete, continue with the next level.
+        Must be called with the lock acquired.
+        level: the level to write into
+        x, y: index of the tile in the level *above*
+        binned: the data of the complete tile in the level above, reduced by
+          _reduceTile()
+        """
+        if level >= len(self._shapes):
+            return
+
+        h, w = binned.shape[:2]
+        if h and w:
+            hts = self.tile_size // 2
+            self._levels[level][y * hts:y * hts + h, x * hts:x * hts + w] = binned
+
+        # Is the parent tile complete?
+        px, py = x // 2, y // 2
+        done = self._tiles_done[level]
+        done[py, px] += 1
+        nchildren = sum(1 for cx in (px * 2, px * 2 + 1) for cy in (py * 2, py * 2 + 1)
+                        if cx < self._ntiles[level - 1][0] and cy < self._ntiles[level - 1][1])
+        if done[py, px] == nchildren:
+            ts = self.tile_size
+            tshape = self._tileShape(level, px, py)
+            ptile = numpy.asarray(self._levels[level][py * ts:py * ts + tshape[0], px * ts:px * ts + tshape[1]])
+            self._mergeTile(level + 1, px, py, self._reduceTile(ptile))
+
+    def close(self):
+        """
+        Finish writing the file. The tiles not written are filled with 0's.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            missing = numpy.argwhere(self._tiles_done[0] == 0)
+        if len(missing):
+            logging.warning("%d tiles were not written, will be filled with 0's", len(missing))
+            for y, x in missing:
+                self.write_tile(x, y, numpy.zeros(self._tileShape(0, x, y), dtype=self.dtype))
+
+        with self._lock:
+            try:
+                f = self._file
+                f.WriteDirectory()
+                write_rgb = self._rgb
+                for im in self._levels[1:]:
+                    f.SetField(T.TIFFTAG_SUBFILETYPE, T.FILETYPE_REDUCEDIMAGE)
+                    # Only read tile by tile from the (memory-mapped) data
+                    f.write_tiles(im, self.tile_size, self.tile_size, self._compression, write_rgb)
+            finally:
+                self._abort()
+
+    def _abort(self):
+        """
+        Close the file and all the temporary data, without finishing to write the file
+        """
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._levels = []
+        for tf in self._tmp_files:
+            tf.close()
+        self._tmp_files = []
+
+
 def export(
     filename: str,
     data: Union[model.DataArray, List[model.DataArray]],
@@ -2538,6 +2862,7 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
             'tiff_file' (handle): Handle of the tiff file
             'dir_index' (int): Index of the directory
             'lock' (threading.Lock): The lock that controls the access to the TIFF file
+            'reader' (_TileReader or None): Reader to use to read the tiles
         shape (tuple of int): The shape of the corresponding DataArray
         dtype (numpy.dtype): The data type
         metadata (dict str->val): The metadata
@@ -2584,6 +2909,33 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
             # It is the case when the DataArray has multiple pixelData (eg, when data has more than 2D).
             raise NotImplementedError("DataArray has multiple pixelData")
 
+        if not 0 <= zoom <= self.maxzoom:
+            raise ValueError("Invalid Z value %d" % (zoom,))
+
+        reader = tiff_info.get('reader')
+        if reader is not None:
+            # Several tiles can be read simultaneously, and maybe it's already prefetched
+            tile = reader.read_tile(tiff_info['dir_index'], x, y, zoom, self.tile_shape)
+        else:
+            tile = self._readTileLocked(tiff_info, x, y, zoom)
+
+        orig_pixel_size = self.metadata.get(model.MD_PIXEL_SIZE, (1, 1))
+
+        # calculate the pixel size of the tile for the zoom level
+        tile_pixel_size = tuple(ps * 2 ** zoom for ps in orig_pixel_size)
+
+        tile = model.DataArray(tile, self.metadata.copy())
+        tile.metadata[model.MD_PIXEL_SIZE] = tile_pixel_size
+        # calculate the center of the tile
+        tile.metadata[model.MD_POS] = get_tile_md_pos((x, y), self.tile_shape, tile, self)
+
+        return tile
+
+    def _readTileLocked(self, tiff_info, x, y, zoom):
+        """
+        Read one tile using the main handle of the TIFF file
+        return (ndarray): the tile data
+        """
         with tiff_info['lock']:
             tiff_file = tiff_info['handle']
             tiff_file.SetDirectory(tiff_info['dir_index'])
@@ -2594,26 +2946,202 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
                 if not sub_ifds:
                     raise ValueError("Image does not have zoom levels")
 
-                if not (0 <= zoom <= len(sub_ifds)):
-                    raise ValueError("Invalid Z value %d" % (zoom,))
-
                 # set the offset of the subimage. Z=0 is the main image
                 tiff_file.SetSubDirectory(sub_ifds[zoom - 1])
 
-            orig_pixel_size = self.metadata.get(model.MD_PIXEL_SIZE, (1, 1))
-
-            # calculate the pixel size of the tile for the zoom level
-            tile_pixel_size = tuple(ps * 2 ** zoom for ps in orig_pixel_size)
-
             xp = x * self.tile_shape[0]
             yp = y * self.tile_shape[1]
-            tile = tiff_file.read_one_tile(xp, yp)
-            tile = model.DataArray(tile, self.metadata.copy())
-            tile.metadata[model.MD_PIXEL_SIZE] = tile_pixel_size
-            # calculate the center of the tile
-            tile.metadata[model.MD_POS] = get_tile_md_pos((x, y), self.tile_shape, tile, self)
+            return tiff_file.read_one_tile(xp, yp)
 
-        return tile
+    def prefetchTiles(self, tiles):
+        """
+        Start reading tiles in background, so that the following calls to
+          getTile() for these tiles are faster. It's just a hint: it's fine to
+          never request these tiles, or to request other ones.
+        tiles (list of (int, int, int)): X, Y, zoom of each tile to read, the
+          most likely to be requested first. Tiles outside of the image are ignored.
+        """
+        tiff_info = self.tiff_info
+        if isinstance(tiff_info, list) or tiff_info.get('reader') is None:
+            return
+
+        valid_tiles = []
+        for x, y, zoom in tiles:
+            if not 0 <= zoom <= self.maxzoom:
+                continue
+            width = self.shape[1] // 2 ** zoom
+            height = self.shape[0] // 2 ** zoom
+            if 0 <= x * self.tile_shape[0] < width and 0 <= y * self.tile_shape[1] < height:
+                valid_tiles.append((x, y, zoom))
+
+        tiff_info['reader'].prefetch(tiff_info['dir_index'], valid_tiles, self.tile_shape)
+
+
+class _TileReader(object):
+    """
+    Reads the tiles of a (pyramidal) TIFF file, using multiple handles on the
+    same file, so that several tiles can be read (and decompressed) simultaneously
+    from different threads. It can also read tiles in advance (prefetch), in
+    background threads.
+    """
+
+    def __init__(self, filename: str, max_handles: int = MAX_TILE_HANDLES):
+        self.filename = filename
+        self._max_handles = max_handles
+        self._handles_cond = threading.Condition()
+        self._idle_handles = []  # list of (TIFF, (int, int)): handle + current (dir_index, zoom)
+        self._handles = []  # all the handles opened (to close them at the end)
+
+        self._sub_ifds = {}  # dir_index -> tuple of int: offset of the sub-IFDs
+
+        self._tiles_lock = threading.Lock()
+        # (dir_index, x, y, zoom) -> ndarray: tiles read in advance
+        self._prefetched = collections.OrderedDict()
+        # (dir_index, x, y, zoom) -> Future: tiles currently being prefetched
+        self._pending = {}
+        # Incremented at every new prefetch request, to drop the older requests
+        self._prefetch_gen = 0
+        self._executor = futures.ThreadPoolExecutor(max_workers=max(1, max_handles // 2),
+                                                    thread_name_prefix="TIFF tile prefetcher")
+        # Close all the files when the reader is not used anymore
+        weakref.finalize(self, _TileReader._close, self._handles, self._pending,
+                         self._tiles_lock, self._executor)
+
+    @staticmethod
+    def _close(handles, pending, tiles_lock, executor):
+        # Drop the prefetch requests not yet started (shutdown() only has a
+        # cancel_futures argument from Python 3.9)
+        with tiles_lock:
+            futs = list(pending.values())
+        for f in futs:
+            f.cancel()
+        executor.shutdown(wait=False)
+        for h in handles:
+            try:
+                h.close()
+            except Exception:
+                logging.warning("Failed to close TIFF handle", exc_info=True)
+
+    def _acquire_handle(self):
+        """
+        return (TIFF, (int, int) or None): a handle not used by any other thread,
+          and the (dir_index, zoom) it is currently set to.
+        """
+        with self._handles_cond:
+            while not self._idle_handles:
+                if len(self._handles) < self._max_handles:
+                    tfile = TIFF.open(self.filename, mode='r')
+                    self._handles.append(tfile)
+                    return tfile, None
+                self._handles_cond.wait()
+            return self._idle_handles.pop()
+
+    def _release_handle(self, tfile, directory):
+        with self._handles_cond:
+            self._idle_handles.append((tfile, directory))
+            self._handles_cond.notify()
+
+    def _read_tile_from_file(self, dir_index: int, x: int, y: int, zoom: int, tile_shape):
+        tfile, directory = self._acquire_handle()
+        try:
+            # Changing directory is slow, so only do it when needed
+            if directory != (dir_index, zoom):
+                directory = None  # In case of failure, the handle is in unknown state
+                tfile.SetDirectory(dir_index)
+                if zoom != 0:
+                    try:
+                        sub_ifds = self._sub_ifds[dir_index]
+                    except KeyError:
+                        # get an array of offsets, one for each subimage
+                        sub_ifds = tfile.GetField(T.TIFFTAG_SUBIFD)
+                        self._sub_ifds[dir_index] = sub_ifds
+                    if not sub_ifds:
+                        raise ValueError("Image does not have zoom levels")
+
+                    if not (0 <= zoom <= len(sub_ifds)):
+                        raise ValueError("Invalid Z value %d" % (zoom,))
+
+                    # set the offset of the subimage. Z=0 is the main image
+                    tfile.SetSubDirectory(sub_ifds[zoom - 1])
+                directory = (dir_index, zoom)
+
+            return tfile.read_one_tile(x * tile_shape[0], y * tile_shape[1])
+        finally:
+            self._release_handle(tfile, directory)
+
+    def read_tile(self, dir_index: int, x: int, y: int, zoom: int, tile_shape):
+        """
+        Read one tile, either from the prefetched tiles, or from the file.
+        tile_shape (int, int): the size of the tiles in X, Y
+        return (ndarray): the tile data
+        """
+        key = (dir_index, x, y, zoom)
+        with self._tiles_lock:
+            tile = self._prefetched.pop(key, None)
+            if tile is not None:
+                return tile
+            f = self._pending.get(key)
+
+        if f is not None:
+            if f.cancel():
+                # Still queued => faster to read it directly
+                with self._tiles_lock:
+                    self._pending.pop(key, None)
+            else:
+                # Already being read, just wait for it
+                tile = f.result()
+                if tile is not None:
+                    with self._tiles_lock:
+                        self._prefetched.pop(key, None)
+                    return tile
+
+        return self._read_tile_from_file(dir_index, x, y, zoom, tile_shape)
+
+    def prefetch(self, dir_index: int, tiles, tile_shape):
+        """
+        Start reading tiles in the background. Previous prefetch requests which
+          have not started yet are dropped.
+        tiles (list of (int, int, int)): x, y, zoom of each tile, the most
+          important first.
+        tile_shape (int, int): the size of the tiles in X, Y
+        """
+        with self._tiles_lock:
+            self._prefetch_gen += 1
+            gen = self._prefetch_gen
+            for x, y, zoom in tiles[:MAX_PREFETCHED_TILES]:
+                key = (dir_index, x, y, zoom)
+                if key in self._prefetched:
+                    self._prefetched.move_to_end(key)
+                    continue
+                if key in self._pending:
+                    continue
+                f = self._executor.submit(self._prefetch_tile, gen, key, tile_shape)
+                self._pending[key] = f
+
+    def _prefetch_tile(self, gen, key, tile_shape):
+        """
+        Called in a separate thread, to read a tile in advance
+        return (ndarray or None): the tile, or None if it was not needed anymore
+        """
+        try:
+            with self._tiles_lock:
+                if gen != self._prefetch_gen:
+                    return None  # Too late, the viewport has changed
+
+            try:
+                tile = self._read_tile_from_file(*key, tile_shape)
+            except Exception:
+                logging.debug("Failed to prefetch tile %s of %s", key, self.filename, exc_info=True)
+                return None
+
+            with self._tiles_lock:
+                self._prefetched[key] = tile
+                while len(self._prefetched) > MAX_PREFETCHED_TILES:
+                    self._prefetched.popitem(last=False)
+            return tile
+        finally:
+            with self._tiles_lock:
+                self._pending.pop(key, None)
 
 
 class AcquisitionDataTIFF(AcquisitionData):
@@ -2628,6 +3156,7 @@ class AcquisitionDataTIFF(AcquisitionData):
         # lock to avoid race conditions when accessing the TIFF file (as libtiff
         # uses multiple calls to access a specific IFD/tile + tag.
         self._lock = threading.Lock()
+        self._tile_readers = {}  # str -> _TileReader: filename -> reader
         tiff_file = TIFF.open(filename, mode='r')
         try:
             data, thumbnails = self._getAllOMEDataArrayShadows(filename, tiff_file)
@@ -2668,7 +3197,8 @@ class AcquisitionDataTIFF(AcquisitionData):
         thumbnails = []
         # iterates all the directories of the TIFF file
         for dir_index in self._iterDirectories(tfile):
-            das, is_thumb = self._createDataArrayShadows(filename, tfile, dir_index, lock)
+            das, is_thumb = self._createDataArrayShadows(filename, tfile, dir_index, lock,
+                                                         self._getTileReader(filename))
             if is_thumb:
                 data.append(None)
                 thumbnails.append(das)
@@ -2845,13 +3375,26 @@ class AcquisitionDataTIFF(AcquisitionData):
 
         raise LookupError("No OME XML data found")
 
+    def _getTileReader(self, filename: str) -> _TileReader:
+        """
+        return: the tile reader for the given file, shared among all its images
+        """
+        try:
+            return self._tile_readers[filename]
+        except KeyError:
+            reader = _TileReader(filename)
+            self._tile_readers[filename] = reader
+            return reader
+
     @staticmethod
-    def _createDataArrayShadows(filename: str, tfile, dir_index, lock):
+    def _createDataArrayShadows(filename: str, tfile, dir_index, lock, reader=None):
         """
         Create the DataArrayShadow from the TIFF metadata for the current directory
         tfile (tiff handle): Handle for the TIFF file
         dir_index (int): Index of the directory in the TIFF file
         lock (threading.Lock): The lock that controls the access to the TIFF file
+        reader (_TileReader or None): To read the tiles in parallel, with separate
+          handles on the file. If None, the tiles are read with tfile.
         return:
             das (DataArrayShadows): DataArrayShadows representing the image
             is_thumbnail (bool): True if the image is a thumbnail
@@ -2878,8 +3421,8 @@ class AcquisitionDataTIFF(AcquisitionData):
         # and it is not a part of DataArrayShadow class
         # It can also be a a list of tiff_info,
         # in case the DataArray has multiple pixelData (eg, when data has more than 2D).
-        # Add also the lock of the TIFF file
-        tiff_info = {'handle': tfile, 'dir_index': dir_index, 'lock': lock}
+        # Add also the lock of the TIFF file, and the reader for the tiles
+        tiff_info = {'handle': tfile, 'dir_index': dir_index, 'lock': lock, 'reader': reader}
         das = DataArrayShadowTIFF(tiff_info, shape, typ, md)
 
         return das, _isThumbnail(tfile)
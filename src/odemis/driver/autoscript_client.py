@@ -36,7 +36,7 @@ from Pyro5.errors import CommunicationError
 from scipy import ndimage
 
 from odemis import model, util
-from odemis.driver.xt_client import check_and_transfer_latest_package
+from odemis.driver.xt_client import SettingsPoller, check_and_transfer_latest_package, read_settings
 from odemis.model import (
     CancellableFuture,
     CancellableThreadPoolExecutor,
@@ -139,6 +139,8 @@ class SEM(model.HwComponent):
             logging.debug(
                 f"Successfully connected to autoscript server with software version {self._swVersion} and hardware"
                 f"version {self._hwVersion}")
+            # Recent versions of the adapter can read many settings in one call
+            self._has_get_settings = "get_settings" in self.server._pyroMethods
         except CommunicationError as err:
             raise HwError("Failed to connect to autoscript server '%s'. Check that the "
                           "uri is correct and autoscript server is"
@@ -157,6 +159,9 @@ class SEM(model.HwComponent):
             raise KeyError("SEM was not given any scanner as child. "
                            "One of 'sem-scanner', 'fib-scanner' need to be included as child")
 
+        # All the children register to it, to update their settings regularly
+        self._settings_poller = SettingsPoller(self)
+
         if "sem-scanner" in children:
             kwargs = children["sem-scanner"]
             has_detector = "sem-detector" in children
@@ -197,7 +202,13 @@ class SEM(model.HwComponent):
             self._fib_detector = Detector(parent=self, daemon=daemon, channel="ion", **ckwargs)
             self.children.value.add(self._fib_detector)
 
+        # Refresh regularly the settings, from the hardware
+        self._settings_poller.start()
+
     def terminate(self):
+        if hasattr(self, "_settings_poller"):
+            self._settings_poller.cancel()
+
         for child in self.children.value:
             child.terminate()
 
@@ -256,6 +267,16 @@ class SEM(model.HwComponent):
             self.server._pyroClaimOwnership()
             self.server.stop_stage_movement()
 
+    def get_settings(self, queries: List[Tuple]) -> Dict[Tuple, Any]:
+        """
+        Read multiple settings at once, in a single call to the server if it supports it.
+        The server "get_settings" method receives the list of queries and returns the list of values.
+        :param queries: each query is a tuple with the name of a getter of the server, followed by
+            its arguments. For instance: [("get_dwell_time", "electron"), ("get_stage_position",)].
+        :return: query -> value returned by the getter, as-is from the server.
+        """
+        return read_settings(self, queries)
+
     def get_stage_position(self) -> Dict[str, float]:
         """
         :return: the axes of the stage as keys with their corresponding position.
@@ -1263,32 +1284,52 @@ class Scanner(model.Emitter):
 
         # Refresh regularly the values, from the hardware, starting from now
         self._updateSettings()
-        self._va_poll = util.RepeatingTimer(5, self._updateSettings, "Settings polling")
-        self._va_poll.start()
+        self.parent._settings_poller.register(self._getPolledSettings, self._onPolledSettings)
 
     def terminate(self):
-        if self._va_poll:
-            self._va_poll.cancel()
-            self._va_poll = None
+        self.parent._settings_poller.unregister(self._onPolledSettings)
         super().terminate()
 
+    def _getPolledSettings(self) -> List[Tuple]:
+        """
+        :return: the settings to read from the server, to update the VAs (see SEM.get_settings())
+        """
+        queries = ["get_high_voltage", "get_beam_current", "get_beam_shift", "get_scan_rotation",
+                   "get_field_of_view", "beam_is_on", "beam_is_blanked", "get_scan_mode"]
+        if self._has_detector:
+            queries += ["get_dwell_time", "get_resolution"]
+        return [(q, self.channel) for q in queries]
+
     def _updateSettings(self) -> None:
         """
         Read all the current settings from the SEM and reflects them on the VAs
         """
+        try:
+            settings = self.parent.get_settings(self._getPolledSettings())
+        except Exception:
+            logging.exception("Unexpected failure when polling settings")
+            return
+        self._onPolledSettings(settings)
+
+    def _onPolledSettings(self, settings: Dict[Tuple, Any]) -> None:
+        """
+        Reflects the settings read from the SEM on the VAs
+        :param settings: the values of (at least) the settings returned by _getPolledSettings()
+        """
+        ch = self.channel
         try:
             if self._has_detector:
-                dwell_time = self.parent.get_dwell_time(self.channel)
+                dwell_time = settings[("get_dwell_time", ch)]
                 if dwell_time != self.dwellTime.value:
                     self.dwellTime._value = dwell_time
                     self.dwellTime.notify(dwell_time)
-                res = self.parent.get_resolution(self.channel)
+                res = tuple(settings[("get_resolution", ch)])
                 if res != self.resolution.value:
                     self.resolution._value = res
                     self.resolution.notify(res)
-                self._updateResolution()
+                self._updateResolution(res)
 
-            voltage = self.parent.get_high_voltage(self.channel)
+            voltage = settings[("get_high_voltage", ch)]
             v_range = self.accelVoltage.range
             if not v_range[0] <= voltage <= v_range[1]:
                 logging.info("Voltage {} V is outside of range {}, clipping to nearest value.".format(voltage, v_range))
@@ -1296,34 +1337,34 @@ class Scanner(model.Emitter):
             if voltage != self.accelVoltage.value:
                 self.accelVoltage._value = voltage
                 self.accelVoltage.notify(voltage)
-            beam_current = self.parent.get_beam_current(self.channel)
+            beam_current = settings[("get_beam_current", ch)]
             if beam_current != self.probeCurrent.value:
                 self.probeCurrent._value = beam_current
                 self.probeCurrent.notify(beam_current)
-            beam_shift = self.parent.get_beam_shift(self.channel)
+            beam_shift = tuple(settings[("get_beam_shift", ch)])
             if beam_shift != self.shift.value:
                 self.shift._value = beam_shift
                 self.shift.notify(beam_shift)
-            rotation = self.parent.get_scan_rotation(self.channel)
+            rotation = settings[("get_scan_rotation", ch)]
             if rotation != self.rotation.value:
                 self.rotation._value = rotation
                 self.rotation.notify(rotation)
-            fov = self.parent.get_field_of_view(self.channel)
+            fov = settings[("get_field_of_view", ch)]
             if fov != self.horizontalFoV.value:
                 self.horizontalFoV._value = fov
                 mag = self._hfw_nomag / fov
                 self.magnification._value = mag
                 self.horizontalFoV.notify(fov)
                 self.magnification.notify(mag)
-            beam_is_on = self.parent.get_beam_is_on(self.channel)
+            beam_is_on = settings[("beam_is_on", ch)]
             if beam_is_on != self.power.value:
                 self.power._value = beam_is_on
                 self.power.notify(beam_is_on)
-            is_blanked = self.parent.beam_is_blanked(self.channel)
+            is_blanked = settings[("beam_is_blanked", ch)]
             if is_blanked != self.blanker.value:
                 self.blanker._value = is_blanked
                 self.blanker.notify(is_blanked)
-            is_external = self._isExternal()
+            is_external = settings[("get_scan_mode", ch)].lower() == "external"
             if is_external != self.external.value:
                 self.external._value = is_external
                 self.external.notify(is_external)
@@ -1353,11 +1394,13 @@ class Scanner(model.Emitter):
     def _onScale(self, s) -> None:
         self._updatePixelSize()
 
-    def _updateResolution(self) -> None:
+    def _updateResolution(self, resolution: Optional[Tuple[int, int]] = None) -> None:
         """
         To be called to read the server resolution and update the corresponding VAs
+        :param resolution: the resolution, if it has already been read from the server
         """
-        resolution = tuple(self.parent.get_resolution(self.channel))
+        if resolution is None:
+            resolution = tuple(self.parent.get_resolution(self.channel))
         if resolution != self.resolution.value:
             scale = (self._shape[0] / resolution[0],) * 2
             self.scale._value = scale  # To not call the setter
@@ -1856,17 +1899,14 @@ class Stage(model.Actuator):
         self._updatePosition()
 
         # Refresh regularly the position
-        self._pos_poll = util.RepeatingTimer(5, self._refreshPosition, "Stage position polling")
-        self._pos_poll.start()
+        self.parent._settings_poller.register(self._getPolledSettings, self._refreshPosition)
 
     def terminate(self):
         if self._executor:
             self._executor.cancel()
             self._executor.shutdown()
             self._executor = None
-        if self._pos_poll:
-            self._pos_poll.cancel()
-            self._pos_poll = None
+        self.parent._settings_poller.unregister(self._refreshPosition)
         super().terminate()
 
     def _update_coordinate_system_offset(self):
@@ -1883,12 +1923,13 @@ class Stage(model.Actuator):
         logging.debug(f"The raw coordinates offset is {self._raw_offset}. "
                       f"Computed from raw stage coordinates: {pos}, specimen stage coordinates: {pos_linked}")
 
-    def _updatePosition(self):
+    def _updatePosition(self, raw_pos: Optional[Dict[str, float]] = None):
         """
         update the position VA
+        :param raw_pos: the position as reported by the server, if it has already been read
         """
         old_pos = self.position.value
-        pos = self._getPosition()
+        pos = self._getPosition(raw_pos)
         # Apply the offset to the raw coordinates
         for axis, offset in self._raw_offset.items():
             if axis in pos:
@@ -1906,20 +1947,32 @@ class Stage(model.Actuator):
         if old_pos != self.position.value:
             logging.debug("Updated position to %s", self.position.value)
 
-    def _refreshPosition(self):
+    def _getPolledSettings(self) -> List[Tuple]:
+        """
+        :return: the settings to read from the server, to update the position (see SEM.get_settings())
+        """
+        return [("get_stage_position",)]
+
+    def _refreshPosition(self, settings: Dict[Tuple, Any]):
         """
         Called regularly to update the current position
+        :param settings: the values of (at least) the settings returned by _getPolledSettings()
         """
         # We don't use the VA setters, to avoid sending back to the hardware a
         # set request
         try:
-            self._updatePosition()
+            self._updatePosition(settings[("get_stage_position",)])
         except Exception:
             logging.exception("Unexpected failure when updating position")
 
-    def _getPosition(self) -> Dict[str, float]:
-        """Get position and translate the axes names to be Odemis compatible."""
-        pos = self.parent.get_stage_position()
+    def _getPosition(self, raw_pos: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        """
+        Get position and translate the axes names to be Odemis compatible.
+        :param raw_pos: the position as reported by the server. If None, it is read from the server.
+        """
+        if raw_pos is None:
+            raw_pos = self.parent.get_stage_position()
+        pos = dict(raw_pos)
         pos["rx"] = pos.pop("t")
         pos["rz"] = pos.pop("r")
         return pos
@@ -2085,32 +2138,38 @@ class Focus(model.Actuator):
                              "An fib scanner is a required child component for the Focus class")
 
         # Refresh regularly the position
-        self._pos_poll = util.RepeatingTimer(5, self._refreshPosition, "Focus position polling")
-        self._pos_poll.start()
+        self.parent._settings_poller.register(self._getPolledSettings, self._refreshPosition)
 
     def terminate(self):
-        if self._pos_poll:
-            self._pos_poll.cancel()
-            self._pos_poll = None
+        self.parent._settings_poller.unregister(self._refreshPosition)
         super().terminate()
 
-    def _updatePosition(self):
+    def _updatePosition(self, z: Optional[float] = None):
         """
         update the position VA
+        :param z: the working distance, if it has already been read from the server
         """
-        z = self.parent.get_working_distance(self.channel)
+        if z is None:
+            z = self.parent.get_working_distance(self.channel)
         if self.position.value.get("z") != z:
             logging.debug("Updating %s position to %s for channel %s", self.name, z, self.channel)
         self.position._set_value({"z": z}, force_write=True)
 
-    def _refreshPosition(self):
+    def _getPolledSettings(self) -> List[Tuple]:
+        """
+        :return: the settings to read from the server, to update the position (see SEM.get_settings())
+        """
+        return [("get_working_distance", self.channel)]
+
+    def _refreshPosition(self, settings: Dict[Tuple, Any]):
         """
         Called regularly to update the current position
+        :param settings: the values of (at least) the settings returned by _getPolledSettings()
         """
         # We don't use the VA setters, to avoid sending back to the hardware a
         # set request
         try:
-            self._updatePosition()
+            self._updatePosition(settings[("get_working_distance", self.channel)])
         except Exception:
             logging.exception("Unexpected failure when updating SEM focus position")
 
@@ -32,7 +32,7 @@ import random
 import threading
 import time
 from abc import ABCMeta
-from typing import Tuple, Dict, Optional, List, Union
+from typing import Tuple, Dict, Optional, List, Union, NamedTuple
 
 import numpy
 from Pyro4 import oneway
@@ -416,15 +416,194 @@ def autoretry(f, self, *args, **kwargs):
     return res
 
 
+# TTTR (time-tagged time-resolved) records, as read from the FiFo in T3 mode.
+# Each record is 32 bits, and is either a photon, a marker, or an overflow of the sync counter.
+# The T3 records contain the sync counter ("nsync") and the time since the last sync ("dtime",
+# in multiples of the resolution, so directly the histogram bin).
+T3_FORMAT_PH300 = "PH300"  # PicoHarp 300
+T3_FORMAT_GENERIC = "generic"  # HydraHarp 400 (v2) and PicoHarp 330
+
+# Number of syncs after which the sync counter overflows
+T3_WRAPAROUND = {
+    T3_FORMAT_PH300: 2 ** 16,
+    T3_FORMAT_GENERIC: 2 ** 10,
+}
+# Maximum dtime value + 1 (ie, maximum histogram length)
+T3_DTIME_LEN = {
+    T3_FORMAT_PH300: 2 ** 12,
+    T3_FORMAT_GENERIC: 2 ** 15,
+}
+
+# Maximum number of pixels (ie, histograms) acquired in one measurement in TTTR mode
+TTTR_MAX_PIXELS = 2 ** 22  # 2048 x 2048 px
+# Maximum memory used by all the histograms of a measurement in TTTR mode (bytes)
+TTTR_MAX_HIST_SIZE = 2 ** 32  # 4 GiB
+# Number of records read from the FiFo at once in TTTR mode
+TTTR_READ_COUNT = 128 * 512
+
+
+class T3Events(NamedTuple):
+    """
+    Photons and markers decoded from T3 records. All the arrays have the same length.
+    """
+    nsync: numpy.ndarray  # int64: sync counter, including the overflows
+    channel: numpy.ndarray  # int8: input channel of the photon (0-based), -1 for a marker
+    dtime: numpy.ndarray  # uint16: time since the sync (in resolution units), 0 for a marker
+    markers: numpy.ndarray  # uint8: bitmask of the markers (bit 0 = marker 1), 0 for a photon
+
+
+def decode_t3_records(records: numpy.ndarray, rec_format: str, nsync_offset: int = 0
+                      ) -> Tuple[T3Events, int]:
+    """
+    Decode T3 records, as received from the FiFo. The decoding is vectorised, so it's much faster
+    to pass many records at once.
+    :param records: (uint32) the raw records
+    :param rec_format: T3_FORMAT_*
+    :param nsync_offset: the sync counter at the beginning of the records, as returned by the
+    previous call, to decode a stream of records chunk by chunk.
+    :return:
+      events: the photons and markers (the overflow records are dropped)
+      nsync_offset: the sync counter at the end of the records, to pass to the next call
+    """
+    records = numpy.asarray(records, dtype=numpy.uint32)
+    wrap = T3_WRAPAROUND[rec_format]
+
+    if rec_format == T3_FORMAT_PH300:
+        # | channel (4 bits) | dtime (12 bits) | nsync (16 bits) |
+        # channel 15 is special: dtime contains the markers, or 0 for an overflow.
+        chan = (records >> 28).astype(numpy.int8)
+        dtime = ((records >> 16) & 0xfff).astype(numpy.uint16)
+        special = (chan == 0xf)
+        markers = numpy.where(special, dtime & 0xf, 0).astype(numpy.uint8)
+        overflow = special & (markers == 0)
+        n_overflows = overflow.astype(numpy.int64)  # 1 wraparound per overflow record
+        channel = chan - 1  # Photons on channels 1 -> 4
+    elif rec_format == T3_FORMAT_GENERIC:
+        # | special (1 bit) | channel (6 bits) | dtime (15 bits) | nsync (10 bits) |
+        # If special: channel 63 = overflow (with nsync = number of overflows, 0 meaning 1),
+        # channel 1 -> 15 = markers (bitmask).
+        special = (records >> 31).astype(bool)
+        chan = ((records >> 25) & 0x3f).astype(numpy.int8)
+        dtime = ((records >> 10) & 0x7fff).astype(numpy.uint16)
+        overflow = special & (chan == 0x3f)
+        n_overflows = numpy.where(overflow, numpy.maximum(records & 0x3ff, 1), 0).astype(numpy.int64)
+        markers = numpy.where(special & ~overflow, chan & 0xf, 0).astype(numpy.uint8)
+        channel = chan
+    else:
+        raise ValueError("Unknown T3 record format %s" % (rec_format,))
+
+    # The overflows are counted up to (and including) each record
+    wraps = numpy.cumsum(n_overflows)
+    nsync = (records & (wrap - 1)).astype(numpy.int64) + (wraps + nsync_offset) * wrap
+    if wraps.size:
+        nsync_offset += int(wraps[-1])
+
+    is_marker = special & ~overflow
+    channel[special] = -1
+    dtime[is_marker] = 0
+
+    keep = ~overflow
+    events = T3Events(nsync[keep], channel[keep], dtime[keep], markers[keep])
+    return events, nsync_offset
+
+
+class T3Histogrammer:
+    """
+    Builds the time histograms of each pixel (ie, a FLIM image), from a stream of T3 records.
+    The pixels are delimited by a marker: each time the marker is received, the next pixel starts.
+    The photons received before the first marker are discarded, and the last pixel ends at the
+    next marker or at the end of the records.
+    The records can be passed chunk by chunk, as they are read from the device.
+    """
+
+    def __init__(self, rec_format: str, npixels: int, nbins: int, channel: int = 0, marker: int = 1):
+        """
+        :param rec_format: T3_FORMAT_*
+        :param npixels: number of pixels to acquire
+        :param nbins: length of each histogram. Photons with a larger dtime are discarded.
+        :param channel: input channel of the photons to count (0-based)
+        :param marker: marker (1 -> 4) indicating the start of a pixel
+        """
+        if not 1 <= marker <= 4:
+            raise ValueError("Marker must be between 1 and 4, but got %s" % (marker,))
+        self._rec_format = rec_format
+        self._npixels = npixels
+        self._nbins = nbins
+        self._channel = channel
+        self._marker_bit = 1 << (marker - 1)
+
+        self._nsync_offset = 0
+        self._pixel = -1  # index of the current pixel (-1 = before the first marker)
+        self.histograms = numpy.zeros((npixels, nbins), dtype=numpy.uint32)
+        self.n_records = 0
+
+    @property
+    def pixel(self) -> int:
+        """
+        Index of the pixel being acquired (-1 if the first marker hasn't been received yet)
+        """
+        return self._pixel
+
+    @property
+    def complete(self) -> bool:
+        """
+        True if all the pixels have been acquired (ie, the marker after the last pixel was received)
+        """
+        return self._pixel >= self._npixels
+
+    def add(self, records: numpy.ndarray) -> None:
+        """
+        Add the photons of the records to the histograms
+        :param records: (uint32) the next raw records of the stream
+        """
+        self.n_records += len(records)
+        events, self._nsync_offset = decode_t3_records(records, self._rec_format, self._nsync_offset)
+
+        # Index of the pixel of each event = number of markers so far (including the event) - 1
+        is_pixel_start = (events.markers & self._marker_bit) != 0
+        px_idx = numpy.cumsum(is_pixel_start) + self._pixel
+        if px_idx.size:
+            self._pixel = int(px_idx[-1])
+
+        ok = ((events.channel == self._channel) & (events.dtime < self._nbins) &
+              (px_idx >= 0) & (px_idx < self._npixels))
+        if not ok.any():
+            return
+
+        # Only count on the range of bins covered by the records (typically a few pixels)
+        bin_idx = px_idx[ok] * self._nbins + events.dtime[ok]
+        flat_hist = self.histograms.reshape(-1)
+        first = int(bin_idx.min())
+        span = int(bin_idx.max()) - first + 1
+        if span <= 4 * bin_idx.size:  # Many photons per bin
+            counts = numpy.bincount(bin_idx - first, minlength=span)
+            flat_hist[first:first + span] += counts.astype(numpy.uint32)
+        else:  # Few photons per bin: counting via sorting is faster than going through all the bins
+            bins, counts = numpy.unique(bin_idx, return_counts=True)
+            flat_hist[bins] += counts.astype(numpy.uint32)
+
+
 class PicoBase(model.Detector, metaclass=ABCMeta):
     """
     Base class for all the PicoQuant time-correlators drivers.
     """
+    _t3_format = T3_FORMAT_GENERIC  # Format of the records in T3 mode
 
     def __init__(self, name: str, role: str,
                  dependencies: Optional[Dict[str, model.HwComponent]] = None,
                  daemon: Optional["pyro4.Daemon"] = None,
+                 tttr_marker: Optional[int] = None,
                  **kwargs):
+        """
+        :param tttr_marker: if None, the device is used in histogramming mode, and each acquisition
+        returns one histogram. Otherwise, the device is used in TTTR (T3) mode, and the marker input
+        (1 -> 4) receives a pulse at the start of every pixel (typically, from the e-beam scanner).
+        Each acquisition then returns one histogram per pixel, and the number of pixels is set via
+        the second dimension of .resolution.
+        """
+        if tttr_marker is not None and not 1 <= tttr_marker <= 4:
+            raise ValueError("tttr_marker should be between 1 and 4, but got %s" % (tttr_marker,))
+        self._tttr_marker = tttr_marker
 
         super().__init__(name, role, daemon=daemon, dependencies=dependencies, **kwargs)
         self._in_channels: List[int] = []
@@ -605,6 +784,84 @@ class PicoBase(model.Detector, metaclass=ABCMeta):
 
         raise TimeoutError(f"Acquisition timeout after {timeout} s")
 
+    def _init_tttr(self) -> None:
+        """
+        Configure the markers, so that only the pixel marker is recorded, and the shape, for the
+        TTTR mode. To be called after the device is initialized in T3 mode.
+        """
+        self.SetMarkerEdges(1, 1, 1, 1)  # All rising edge
+        self.SetMarkerEnable(*(int(m == self._tttr_marker) for m in range(1, 5)))
+        # The histograms length is limited by the size of the dtime in the records
+        self._shape = (T3_DTIME_LEN[self._t3_format], TTTR_MAX_PIXELS, 2 ** 32)
+
+    def _init_resolution(self) -> None:
+        """
+        Create the .resolution VA, based on ._shape
+        """
+        if self._tttr_marker is None:
+            # Only one histogram
+            res = self._shape[:2]
+            self.resolution = model.ResolutionVA(res, (res, res), readonly=True)
+        else:
+            # One histogram per pixel. The histogram length can be reduced, to save memory when
+            # acquiring many pixels.
+            self.resolution = model.ResolutionVA((self._shape[0], 1), ((1, 1), self._shape[:2]),
+                                                 setter=self._setResolution)
+
+    def _setResolution(self, value: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Setter of .resolution, in TTTR mode
+        :param value: number of time bins, number of pixels
+        :return: the accepted resolution
+        :raise ValueError: if the histograms would take too much memory
+        """
+        nbins, npixels = value
+        hist_size = nbins * npixels * numpy.dtype(numpy.uint32).itemsize
+        if hist_size > TTTR_MAX_HIST_SIZE:
+            raise ValueError("Resolution %s would need %g GiB for the histograms, while max is %g GiB. "
+                             "Reduce the number of time bins or of pixels." %
+                             (value, hist_size / 2 ** 30, TTTR_MAX_HIST_SIZE / 2 ** 30))
+        return value
+
+    def _read_records(self) -> numpy.ndarray:
+        """
+        Read the T3 records available in the FiFo
+        return (ndarray of uint32): the records (can be empty)
+        """
+        return self.ReadFiFo(TTTR_READ_COUNT)
+
+    def _acq_read_tttr(self, timeout: float) -> Optional[numpy.ndarray]:
+        """
+        Read the records from the FiFo, and histogram them per pixel, until all the pixels are
+        acquired or the measurement is over.
+        Note: it expects that the measurement is running, in T3 mode.
+        timeout: how long to wait for the measurement to end (s)
+        return: the histograms (pixels x bins), or None if the acquisition should stop
+        raise TerminationRequested: if a terminate message was received
+        raise TimeoutError: if the measurement didn't end in time
+        """
+        nbins, npixels = self.resolution.value
+        hist = T3Histogrammer(self._t3_format, npixels, nbins, self._in_channels[0], self._tttr_marker)
+        tend = time.time() + timeout
+        records = numpy.empty((0,), dtype=numpy.uint32)
+        while not hist.complete:
+            # If no data was received, wait a little bit before checking again
+            if self._acq_should_stop(None if records.size else 1e-3):
+                return None
+
+            # Check the status *before* reading, so that if it's ended, the FiFo is then emptied
+            ended = self.CTCStatus()
+            records = self._read_records()
+            if records.size:
+                hist.add(records)
+            elif ended:
+                break
+            elif time.time() > tend:
+                raise TimeoutError(f"Acquisition timeout after {timeout} s")
+
+        logging.debug("Read %d records, for %d pixels", hist.n_records, min(hist.pixel + 1, npixels))
+        return hist.histograms
+
     def _toggle_shutters(self, shutters, open):
         """
         Open/ close protection shutters.
@@ -644,7 +901,8 @@ class PicoBase(model.Detector, metaclass=ABCMeta):
 
                 # Keep acquiring
                 while True:
-                    self.ClearHistMem()
+                    if self._tttr_marker is None:
+                        self.ClearHistMem()
 
                     # Wait for trigger (if synchronized)
                     if self._acq_wait_trigger():
@@ -665,7 +923,13 @@ class PicoBase(model.Detector, metaclass=ABCMeta):
                     # Wait for the acquisition to be done or until a stop or
                     # terminate message comes
                     try:
-                        if self._acq_wait_data(tstart + tacq, timeout=tacq * 3 + 1):
+                        if self._tttr_marker is not None:
+                            # The data is read while the measurement is running
+                            data = self._acq_read_tttr(timeout=tacq * 3 + 1)
+                            if data is None:
+                                # Stop message received
+                                break
+                        elif self._acq_wait_data(tstart + tacq, timeout=tacq * 3 + 1):
                             # Stop message received
                             break
                     except TimeoutError as ex:
@@ -677,7 +941,10 @@ class PicoBase(model.Detector, metaclass=ABCMeta):
                         self.StopMeas()
 
                     # Read data and pass it
-                    data = self.GetHistogram(self._in_channels[0])
+                    if self._tttr_marker is None:
+                        data = self.GetHistogram(self._in_channels[0])
+                    elif model.MD_TIME_LIST in md:
+                        md[model.MD_TIME_LIST] = md[model.MD_TIME_LIST][:data.shape[-1]]
                     da = model.DataArray(data, md)
                     self.data.notify(da)
 
@@ -704,6 +971,7 @@ class PH300(PicoBase):
     """
     Represents a PicoQuant PicoHarp 300.
     """
+    _t3_format = T3_FORMAT_PH300
     # For use by the RawDetector
     trg_lvl_rng = (PH_DISCRMIN * 1e-3, PH_DISCRMAX * 1e-3)  # V
     zc_lvl_rng = (PH_ZCMIN * 1e-3, PH_ZCMAX * 1e-3)  # V
@@ -723,6 +991,8 @@ class PH300(PicoBase):
             deprecated: use children .zeroCrossLevel instead
         shutter_axes (dict str -> str, value, value): internal child role of the photo-detector ->
           axis name, position when shutter is closed (ie protected), position when opened (receiving light).
+        tttr_marker (None or 1<=int<=4): marker input receiving the pixel start, to use the TTTR mode
+          (see PicoBase)
         """
         if dependencies is None:
             dependencies = {}
@@ -746,8 +1016,7 @@ class PH300(PicoBase):
 
         super().__init__(name, role, daemon=daemon, dependencies=dependencies, **kwargs)
 
-        # TODO: do we need TTTR mode?
-        self.Initialize(PH_MODE_HIST)
+        self.Initialize(PH_MODE_HIST if self._tttr_marker is None else PH_MODE_T3)
         self._swVersion = self.GetLibraryVersion()
         self._metadata[model.MD_SW_VERSION] = self._swVersion
         mod, partnum, ver = self.GetHardwareInfo()
@@ -820,6 +1089,8 @@ class PH300(PicoBase):
         # Indicate first dim is time and second dim is (useless) X (in reversed order)
         self._metadata[model.MD_DIMS] = "XT"
         self._shape = (PH_HISTCHAN, 1, 2 ** 16)  # Histogram is 32 bits, but only return 16 bits info
+        if self._tttr_marker is not None:
+            self._init_tttr()
 
         # For compatibility with the old versions of this driver which didn't have VAs, we set the
         # CFD values at init on the detectors, if they exist, and otherwise set them explicitly.
@@ -838,8 +1109,7 @@ class PH300(PicoBase):
             tres * 1e-12, pxd_ch, unit="s", setter=self._setPixelDuration
         )
 
-        res = self._shape[:2]
-        self.resolution = model.ResolutionVA(res, (res, res), readonly=True)
+        self._init_resolution()
 
         self.syncDiv = model.IntEnumerated(
             1, choices={1, 2, 4, 8}, unit="", setter=self._setSyncDiv
@@ -1104,6 +1374,22 @@ class PH300(PicoBase):
         # TODO: if it's really smaller (eg, 0), copy the data to avoid holding all the mem
         return buf[: nactual.value]
 
+    def SetMarkerEdges(self, me0, me1, me2, me3):
+        """
+        me<n> (int): active edge of marker signal <n>,
+            0 = falling
+            1 = rising
+        """
+        self._dll.SetMarkerEdges(self._idx, me0, me1, me2, me3)
+
+    def SetMarkerEnable(self, en0, en1, en2, en3):
+        """
+        en<n> (int): desired enable state of marker signal <n>,
+            0 = disabled,
+            1 = enabled
+        """
+        self._dll.SetMarkerEnable(self._idx, en0, en1, en2, en3)
+
     def _setPixelDuration(self, pxd):
         # TODO: delay until the end of an acquisition
 
@@ -1202,6 +1488,7 @@ class PH330(PicoBase):
          (ie protected), position when opened (receiving light). If provided, the shutter corresponding
          to the detector will be moved to the given positions when acquiring or not.
         :param daemon: used by the odemis back-end, see model.Component.
+        :param tttr_marker: marker input receiving the pixel start, to use the TTTR mode (see PicoBase)
         """
         if dependencies is None:
             dependencies = {}
@@ -1218,7 +1505,8 @@ class PH330(PicoBase):
 
         super().__init__(name, role, daemon=daemon, dependencies=dependencies, **kwargs)
 
-        self.Initialize(PH330_MODE_HIST, PH330_REFSRC_INTERNAL)
+        mode = PH330_MODE_HIST if self._tttr_marker is None else PH330_MODE_T3
+        self.Initialize(mode, PH330_REFSRC_INTERNAL)
         self.SetMeasControl(PH330_MEASCTRL_SINGLESHOT_CTC, PH330_EDGE_RISING, PH330_EDGE_RISING)
 
         self._swVersion = self.GetLibraryVersion()
@@ -1307,13 +1595,15 @@ class PH330(PicoBase):
 
         # Indicate first dim is time and second dim is (useless) X (in reversed order)
         self._metadata[model.MD_DIMS] = "XT"
-        # For now, we just hard-code the histogram length to the default value (and same as PH300).
-        # TODO: have a way for the user to change the length, by adjusting .resolution
-        self._histolen = self.SetHistoLen(PH330_DFLTLENCODE)  # 65536
-        self._shape = (self._histolen, 1, 2 ** 32)  # Histogram counts is 32 bits per bin
-        res = self._shape[:2]
-        self.resolution = model.ResolutionVA(res, (res, res), readonly=True)
-        logging.debug("Device has %d channels and histogram length set to %d bins", self._nchannels, self._histolen)
+        if self._tttr_marker is None:
+            # For now, we just hard-code the histogram length to the default value (and same as PH300).
+            # TODO: have a way for the user to change the length, by adjusting .resolution
+            self._histolen = self.SetHistoLen(PH330_DFLTLENCODE)  # 65536
+            self._shape = (self._histolen, 1, 2 ** 32)  # Histogram counts is 32 bits per bin
+        else:
+            self._init_tttr()
+        self._init_resolution()
+        logging.debug("Device has %d channels and histogram length set to %d bins", self._nchannels, self._shape[0])
 
         # Indicate first dim is time and second dim is (useless) X (in reversed order)
         self._metadata[model.MD_DIMS] = "XT"
@@ -1612,6 +1902,34 @@ class PH330(PicoBase):
         self._dll.GetElapsedMeasTime(self._idx, byref(elapsed))
         return elapsed.value * 1e-3
 
+    def ReadFiFo(self) -> numpy.ndarray:
+        """
+        Read the records available in the FiFo. The device must be initialised in T2 or T3 mode.
+        :return: the records (can be empty). Their interpretation depends on the mode.
+        """
+        # The DLL requires a buffer which can hold the maximum number of records
+        buf = numpy.empty((PH330_TTREADMAX,), dtype=numpy.uint32)
+        buf_ct = buf.ctypes.data_as(POINTER(c_uint32))
+        nactual = c_int()
+        self._dll.ReadFiFo(self._idx, buf_ct, byref(nactual))
+        # Copy the values read, to not hold the whole buffer in memory
+        return buf[:nactual.value].copy()
+
+    def SetMarkerEdges(self, me1: int, me2: int, me3: int, me4: int) -> None:
+        """
+        :param me<n>: active edge of marker signal <n> (PH330_EDGE_*)
+        """
+        self._dll.SetMarkerEdges(self._idx, me1, me2, me3, me4)
+
+    def SetMarkerEnable(self, en1: int, en2: int, en3: int, en4: int) -> None:
+        """
+        :param en<n>: 1 to enable the marker signal <n>, 0 to disable it
+        """
+        self._dll.SetMarkerEnable(self._idx, en1, en2, en3, en4)
+
+    def _read_records(self) -> numpy.ndarray:
+        return self.ReadFiFo()
+
     def _setPixelDuration(self, pxd: float) -> float:
         tresbase, bs = self.GetBaseResolution()
         b = int(pxd * 1e12 / tresbase)
@@ -1622,7 +1940,7 @@ class PH330(PicoBase):
         # Update metadata
         # pxd = tresbase * (2 ** bs)
         pxd = self.GetResolution() * 1e-12
-        tl = numpy.arange(self.resolution.value[0]) * pxd + self.syncOffset.value
+        tl = numpy.arange(self._shape[0]) * pxd + self.syncOffset.value
         self._metadata[model.MD_TIME_LIST] = tl
         return pxd
 
@@ -1638,7 +1956,7 @@ class PH330(PicoBase):
         # Update metadata
         # TODO: share it with pixelDuration? as _update_time_list?
         offset = offset_ps * 1e-12  # convert back the rounded value (in ps) to s
-        tl = numpy.arange(self.resolution.value[0]) * self.pixelDuration.value + offset
+        tl = numpy.arange(self._shape[0]) * self.pixelDuration.value + offset
         self._metadata[model.MD_TIME_LIST] = tl
         return offset
 
@@ -1668,6 +1986,8 @@ class HH400(PicoBase):
         zero_cross (8 (0 <= float <= 40 e-3)): zero cross voltage for the photo-detector 1 through 8 (in V)
         shutter_axes (dict str -> str, value, value): internal child role of the photo-detector ->
           axis name, position when shutter is closed (ie protected), position when opened (receiving light).
+        tttr_marker (None or 1<=int<=4): marker input receiving the pixel start, to use the TTTR mode
+          (see PicoBase)
         """
         if dependencies is None:
             dependencies = {}
@@ -1699,8 +2019,7 @@ class HH400(PicoBase):
 
         # TODO: metadata for indicating the range? cf WL_LIST?
 
-        # TODO: do we need TTTR mode?
-        self.Initialize(HH_MODE_HIST, 0)
+        self.Initialize(HH_MODE_HIST if self._tttr_marker is None else HH_MODE_T3, 0)
         self._swVersion = self.GetLibraryVersion()
         self._metadata[model.MD_SW_VERSION] = self._swVersion
         mod, partnum, ver = self.GetHardwareInfo()
@@ -1783,6 +2102,8 @@ class HH400(PicoBase):
             1,
             2 ** 16,
         )  # Histogram is 32 bits, but only return 16 bits info
+        if self._tttr_marker is not None:
+            self._init_tttr()
 
         # TODO: Currently uses same settings for all channels
         # self.SetInputChannelEnable(channel, bool)
@@ -1815,10 +2136,10 @@ class HH400(PicoBase):
             else:
                 self.SetInputCFD(i, int(dv * 1000), int(zc * 1000))
 
-        self._actuallen = self.SetHistoLen(HH_MAXLENCODE)
+        if self._tttr_marker is None:  # Histogram length is only used in histogramming mode
+            self._actuallen = self.SetHistoLen(HH_MAXLENCODE)
 
-        res = self._shape[:2]
-        self.resolution = model.ResolutionVA(res, (res, res), readonly=True)
+        self._init_resolution()
 
         # Sync signal settings
         self.syncDiv = model.IntEnumerated(
@@ -2615,6 +2936,130 @@ def _val(obj):
         return obj
 
 
+class FakeT3Source:
+    """
+    Simulates the FiFo of a device in T3 mode. It generates the records of a sample with a single
+    exponential decay, scanned pixel by pixel, with a marker at the start of each pixel.
+    """
+
+    def __init__(self, rec_format: str, resolution: float, sync_rate: float = 40e6,
+                 count_rate: float = 1e6, pixel_period: float = 1e-4, marker: Optional[int] = 1,
+                 channel: int = 0, lifetime: float = 2e-9, seed: Optional[int] = None):
+        """
+        :param rec_format: T3_FORMAT_*
+        :param resolution: duration of a time bin (s)
+        :param sync_rate: frequency of the sync signal (Hz)
+        :param count_rate: average number of photons per second
+        :param pixel_period: duration of a pixel (s)
+        :param marker: marker (1 -> 4) sent at the start of each pixel, or None for no marker
+        :param channel: input channel of the photons (0-based)
+        :param lifetime: decay time of the sample (s)
+        :param seed: seed for the random number generator, to get reproducible records
+        """
+        self._rec_format = rec_format
+        self._wrap = T3_WRAPAROUND[rec_format]
+        self._sync_rate = sync_rate
+        self._photons_per_sync = count_rate / sync_rate
+        self._pixel_syncs = max(1, int(round(pixel_period * sync_rate)))
+        self._markers = 0 if marker is None else 1 << (marker - 1)
+        self._channel = channel
+        self._sync_period_bins = max(1, int(1 / (sync_rate * resolution)))
+        self._max_dtime = min(self._sync_period_bins, T3_DTIME_LEN[rec_format])
+        self._lifetime_bins = lifetime / resolution
+        self._rng = numpy.random.default_rng(seed)
+
+        self._nsync = 0  # number of syncs generated so far
+        self._wraps = 0  # number of overflows generated so far
+        self._pending = numpy.empty((0,), dtype=numpy.uint32)
+        self._t_start = None
+        self._t_end = None
+
+    def generate(self, nsyncs: int) -> numpy.ndarray:
+        """
+        Generate the records of the next syncs
+        :param nsyncs: number of syncs to simulate
+        :return: (uint32) the records
+        """
+        start = self._nsync
+        end = start + nsyncs
+        self._nsync = end
+
+        # Markers at the beginning of each pixel
+        if self._markers:
+            first_px = -(-start // self._pixel_syncs)  # round up
+            mk_sync = numpy.arange(first_px * self._pixel_syncs, end, self._pixel_syncs, dtype=numpy.int64)
+        else:
+            mk_sync = numpy.empty((0,), dtype=numpy.int64)
+
+        # Photons, uniformly spread, with a decay starting a bit after the sync
+        nphotons = self._rng.poisson(self._photons_per_sync * nsyncs)
+        ph_sync = self._rng.integers(start, end, nphotons, dtype=numpy.int64)
+        ph_dtime = (self._sync_period_bins // 10 +
+                    self._rng.exponential(self._lifetime_bins, nphotons)).astype(numpy.int64)
+        ph_dtime %= self._sync_period_bins
+        inrange = ph_dtime < self._max_dtime  # Photons too late are not recorded
+        ph_sync = ph_sync[inrange]
+        ph_dtime = ph_dtime[inrange]
+
+        # Records for the markers and the photons, in time order (marker first at the same sync)
+        nsync = numpy.concatenate([mk_sync, ph_sync])
+        if self._rec_format == T3_FORMAT_PH300:
+            mk_rec = numpy.full(mk_sync.shape, (0xf << 28) | (self._markers << 16), dtype=numpy.int64)
+            ph_rec = ((self._channel + 1) << 28) | (ph_dtime << 16)
+        else:
+            mk_rec = numpy.full(mk_sync.shape, (1 << 31) | (self._markers << 25), dtype=numpy.int64)
+            ph_rec = (self._channel << 25) | (ph_dtime << 10)
+        order = numpy.argsort(nsync, kind="stable")
+        nsync = nsync[order]
+        events = (numpy.concatenate([mk_rec, ph_rec])[order] | (nsync % self._wrap)).astype(numpy.uint32)
+
+        # Insert the overflow records. On the PH300, each record is one overflow, on the other
+        # devices, a record contains the number of overflows (up to 1023).
+        wraps = nsync // self._wrap
+        n_overflows = numpy.diff(wraps, prepend=self._wraps)
+        if wraps.size:
+            self._wraps = int(wraps[-1])
+        if self._rec_format == T3_FORMAT_PH300:
+            n_ovf_records = n_overflows
+            ovf_record = 0xf << 28
+        else:
+            n_ovf_records = -(-n_overflows // 1023)  # round up
+            ovf_record = (1 << 31) | (0x3f << 25) | 1023
+
+        ev_pos = numpy.cumsum(n_ovf_records) + numpy.arange(events.size)
+        records = numpy.full((events.size + int(n_ovf_records.sum()),), ovf_record, dtype=numpy.uint32)
+        if self._rec_format != T3_FORMAT_PH300:
+            # The last overflow record before an event contains the remaining overflows
+            has_ovf = n_ovf_records > 0
+            last_ovf = n_overflows[has_ovf] - 1023 * (n_ovf_records[has_ovf] - 1)
+            records[ev_pos[has_ovf] - 1] = (1 << 31) | (0x3f << 25) | last_ovf
+        records[ev_pos] = events
+        return records
+
+    def start(self, duration: float) -> None:
+        """
+        Start the (simulated) measurement
+        :param duration: duration of the measurement (s)
+        """
+        self._t_start = time.time()
+        self._t_end = self._t_start + duration
+
+    def read(self, count: int) -> numpy.ndarray:
+        """
+        Read the records acquired since the start of the measurement
+        :param count: maximum number of records to return
+        :return: (uint32) the records (can be empty)
+        """
+        if self._t_start is not None:
+            now = min(time.time(), self._t_end)
+            nsyncs = int((now - self._t_start) * self._sync_rate) - self._nsync
+            if nsyncs > 0:
+                self._pending = numpy.concatenate([self._pending, self.generate(nsyncs)])
+
+        records, self._pending = self._pending[:count], self._pending[count:]
+        return records
+
+
 class FakePHDLL:
     """
     Fake PHDLL. It basically simulates one connected device, which returns
@@ -2628,6 +3073,8 @@ class FakePHDLL:
         self._base_res = 4  # ps
         self._bins = 0  # binning power
         self._syncdiv = 1
+        self._marker_enable = [0, 0, 0, 0]
+        self._t3_source = None  # FakeT3Source, when measuring in T3 mode
 
         # start/ (expected) end time of the current acquisition (or None if not started)
         self._acq_start = None
@@ -2711,6 +3158,11 @@ class FakePHDLL:
             raise DeviceError(-16, "ERROR_INSTANCE_RUNNING")
         self._acq_start = time.time()
         self._acq_end = self._acq_start + _val(tacq) * 1e-3
+        if self._mode == PH_MODE_T3:
+            marker = next((m + 1 for m, en in enumerate(self._marker_enable) if en), None)
+            res = self._base_res * (2 ** self._bins) * 1e-12
+            self._t3_source = FakeT3Source(T3_FORMAT_PH300, res, marker=marker)
+            self._t3_source.start(_val(tacq) * 1e-3)
 
     def PH_StopMeas(self, i):
         if self._acq_start is not None:
@@ -2749,6 +3201,22 @@ class FakePHDLL:
 
         ndbuffer[...] = numpy.random.randint(0, maxval + 1, PH_HISTCHAN, dtype=numpy.uint32)
 
+    def PH_SetMarkerEdges(self, i, me0, me1, me2, me3):
+        return
+
+    def PH_SetMarkerEnable(self, i, en0, en1, en2, en3):
+        self._marker_enable = [_val(en) for en in (en0, en1, en2, en3)]
+
+    def PH_ReadFiFo(self, i, buffer, count, p_nactual):
+        nactual = _deref(p_nactual, c_int)
+        if self._t3_source is None:
+            nactual.value = 0
+            return
+        records = self._t3_source.read(_val(count))
+        ndbuffer = numpy.ctypeslib.as_array(cast(buffer, POINTER(c_uint32)), (_val(count),))
+        ndbuffer[:records.size] = records
+        nactual.value = records.size
+
 
 class FakePH330DLL:
     """
@@ -2768,6 +3236,8 @@ class FakePH330DLL:
         self._sync_channel_offset = 0  # ps
         self._sync_trig_mode = PH330_TRGMODE_CFD
         self._channel_trig_mode = [PH330_TRGMODE_CFD] * self._nchannels
+        self._marker_enable = [0, 0, 0, 0]
+        self._t3_source = None  # FakeT3Source, when measuring in T3 mode
 
         self._acq_start = None
         self._acq_end = None
@@ -2896,6 +3366,11 @@ class FakePH330DLL:
             raise DeviceError(-16, "ERROR_INSTANCE_RUNNING")
         self._acq_start = time.time()
         self._acq_end = self._acq_start + _val(tacq) * 1e-3
+        if self._mode == PH330_MODE_T3:
+            marker = next((m + 1 for m, en in enumerate(self._marker_enable) if en), None)
+            res = self._base_res * (2 ** self._bins) * 1e-12
+            self._t3_source = FakeT3Source(T3_FORMAT_GENERIC, res, marker=marker)
+            self._t3_source.start(_val(tacq) * 1e-3)
 
     def PH330_StopMeas(self, i):
         if self._acq_start is not None:
@@ -2932,6 +3407,22 @@ class FakePH330DLL:
 
         ndbuffer[...] = numpy.random.randint(0, maxval + 1, self._histolen, dtype=numpy.uint32)
 
+    def PH330_SetMarkerEdges(self, i, me1, me2, me3, me4):
+        return
+
+    def PH330_SetMarkerEnable(self, i, en1, en2, en3, en4):
+        self._marker_enable = [_val(en) for en in (en1, en2, en3, en4)]
+
+    def PH330_ReadFiFo(self, i, buffer, p_nactual):
+        nactual = _deref(p_nactual, c_int)
+        if self._t3_source is None:
+            nactual.value = 0
+            return
+        records = self._t3_source.read(PH330_TTREADMAX)
+        ndbuffer = numpy.ctypeslib.as_array(cast(buffer, POINTER(c_uint32)), (PH330_TTREADMAX,))
+        ndbuffer[:records.size] = records
+        nactual.value = records.size
+
 
 class FakeHHDLL:
     """
@@ -2952,6 +3443,8 @@ class FakeHHDLL:
         self._inputOffset = []
         self._syncRate = 50000
         self._syncPeriod = 2000.0
+        self._marker_enable = [0, 0, 0, 0]
+        self._t3_source = None  # FakeT3Source, when measuring in T3 mode
 
         # start/ (expected) end time of the current acquisition (or None if not started)
         self._acq_start = None
@@ -3079,6 +3572,11 @@ class FakeHHDLL:
             raise DeviceError(-16, "ERROR_INSTANCE_RUNNING")
         self._acq_start = time.time()
         self._acq_end = self._acq_start + _val(tacq) * 1e-3
+        if self._mode == HH_MODE_T3:
+            marker = next((m + 1 for m, en in enumerate(self._marker_enable) if en), None)
+            res = self._base_res * (2 ** self._bincode) * 1e-12
+            self._t3_source = FakeT3Source(T3_FORMAT_GENERIC, res, marker=marker)
+            self._t3_source.start(_val(tacq) * 1e-3)
 
     def HH_StopMeas(self, i):
         if self._acq_start is not None:
@@ -3146,14 +3644,21 @@ class FakeHHDLL:
 
     # Special Functions for TTTR Mode
 
-    def HH_ReadFiFo(self, i, buffer, count, nactual):
-        raise NotImplementedError()
+    def HH_ReadFiFo(self, i, buffer, count, p_nactual):
+        nactual = _deref(p_nactual, c_int)
+        if self._t3_source is None:
+            nactual.value = 0
+            return
+        records = self._t3_source.read(_val(count))
+        ndbuffer = numpy.ctypeslib.as_array(cast(buffer, POINTER(c_uint32)), (_val(count),))
+        ndbuffer[:records.size] = records
+        nactual.value = records.size
 
     def HH_SetMarkerEdges(self, i, me0, me1, me2, me3):
-        raise NotImplementedError()
+        return
 
     def HH_SetMarkerEnable(self, i, en0, en1, en2, en3):
-        raise NotImplementedError()
+        self._marker_enable = [_val(en) for en in (en0, en1, en2, en3)]
 
     def HH_SetMarkerHoldoffTime(self, i, holdofftime):
         raise NotImplementedError()
@@ -76,6 +76,8 @@ import threading
 import time
 import warnings
 import weakref
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from collections.abc import Iterable
 from enum import Enum
 from typing import Any, Dict, List, Optional, Tuple, Set, Union, Callable
@@ -121,6 +123,10 @@ CHUNK_DURATION = 0.1  # s
 # issue (but the beginning of the scan will be discarded).
 MIN_FRAME_DURATION_CONT_ACQ = 1e-3  # s
 
+# Number of raster scan waveforms kept in memory, to be reused when switching back to previous
+# scan settings (eg, between a live view and an acquisition).
+WAVEFORM_CACHE_SIZE = 4
+
 
 
 class AnalogSEM(model.HwComponent):
@@ -1221,12 +1227,9 @@ class Acquirer:
                           "continuous acquisition, will use synchronized acquisition")
             return False
 
-        # TODO: now that the AO/DO data is sent in small pieces, we could duplicate it "on the fly"
-        # when ao_osr >= 1. In these cases, the sampling rate is always very small (by definition)
-        # so it's OK to do memory copy. This would avoid the (unlikely) case of
-        # using a huge amount of memory for the AO data if the user selects by mistake a large resolution
-        # + long dwell time. (which would probably be stopped before the end, but could fail to even
-        # start due to not having enough memory)
+        # Note: for raster scans, the AO/DO data is a LazyWaveform, which is computed chunk by chunk,
+        # as it is sent to the board. So even with a large resolution, or a long dwell time (ie,
+        # duplicated samples), it's quick to start, and doesn't use much memory.
         self._ao_data = scan_array
         self._ao_data_next_sample = 0  # position of the next sample to write to the board (updated by _write_ao_data())
 
@@ -1257,7 +1260,7 @@ class Acquirer:
             # for ending the last sample. So we just duplicate the last AO sample.
             acq_settings.ao_samples_n += 1
             logging.debug("Extending AO samples to %s for CI", acq_settings.ao_samples_n)
-            self._ao_data = numpy.append(self._ao_data, self._ao_data[:,-1:], axis=1)
+            self._ao_data = ExtendedWaveform(self._ao_data, 1)
 
         # WORKAROUND: The AO buffer size must be at least of len 2. So if there is just one
         # point, we duplicate it, to make the NI DAQ happy. (It's the same behaviour
@@ -1267,7 +1270,7 @@ class Acquirer:
         if acq_settings.ao_samples_n == 1:
             logging.debug("Duplicating AO buffer as it has size 1")
             acq_settings.ao_samples_n = 2
-            self._ao_data = numpy.append(self._ao_data, self._ao_data, 1)
+            self._ao_data = ExtendedWaveform(self._ao_data, 1)
 
         # Also pass AO data in chunks, so that it doesn't need to write the whole AO data before
         # starting, and also can handle really long scan. In tests, it seems it can sustain even 100µs
@@ -2298,6 +2301,206 @@ class ActiveTTLManager:
                 time.sleep(self._activation_delay)
 
 
+class LazyWaveform(metaclass=ABCMeta):
+    """
+    A waveform (ie, series of samples to output), which is only computed when it is read.
+    It behaves like a read-only numpy array, which is only efficient when slicing the last
+    dimension (ie, the time) contiguously. This allows to send a waveform to the board chunk by
+    chunk, without ever having the whole frame in memory, which for large scans would take a lot
+    of time to compute, and a lot of memory.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype):
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(numpy.prod(self.shape))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @abstractmethod
+    def _generate(self, start: int, stop: int) -> numpy.ndarray:
+        """
+        Compute a part of the waveform
+        :param start: first sample to compute
+        :param stop: last sample (excluded) to compute. Must be > start.
+        :return: the samples between start and stop. Same number of dimensions as the waveform.
+        """
+        pass
+
+    def __getitem__(self, key) -> numpy.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        lead, last = key[:-1], key[-1]
+
+        length = self.shape[-1]
+        if isinstance(last, slice) and last.step in (None, 1):
+            start, stop, _ = last.indices(length)
+            if stop <= start:
+                data = numpy.empty(self.shape[:-1] + (0,), dtype=self.dtype)
+            else:
+                data = self._generate(start, stop)
+        elif isinstance(last, (int, numpy.integer)):
+            if not -length <= last < length:
+                raise IndexError("Index %d out of bounds for waveform of length %d" % (last, length))
+            last %= length
+            data = self._generate(last, last + 1)[..., 0]
+        else:  # Anything fancy => compute everything
+            data = self._generate(0, length)[..., last]
+
+        return data[lead] if lead else data
+
+    def __array__(self, dtype=None, copy=None) -> numpy.ndarray:
+        # Compute the whole waveform. Should only be used for small waveforms (or testing).
+        data = self._generate(0, self.shape[-1])
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+
+class ExtendedWaveform(LazyWaveform):
+    """
+    A waveform extended at the end by repeating its last sample
+    """
+
+    def __init__(self, wf: Union[numpy.ndarray, LazyWaveform], n: int):
+        """
+        :param wf: the waveform to extend. Last dimension is the time.
+        :param n: number of extra samples
+        """
+        super().__init__(wf.shape[:-1] + (wf.shape[-1] + n,), wf.dtype)
+        self._wf = wf
+        self._wf_length = wf.shape[-1]
+
+    def _generate(self, start: int, stop: int) -> numpy.ndarray:
+        if stop <= self._wf_length:
+            return numpy.asarray(self._wf[..., start:stop])
+
+        # Some (or all) of the samples are in the extension
+        data = numpy.empty(self.shape[:-1] + (stop - start,), dtype=self.dtype)
+        wf_stop = max(start, self._wf_length)
+        data[..., :wf_stop - start] = self._wf[..., start:wf_stop]
+        data[..., wf_stop - start:] = self._wf[..., -1:]
+        return data
+
+
+class RasterScanWaveform(LazyWaveform):
+    """
+    Analog waveform to scan a 2D area, using linear interpolation between the limits. It's
+    basically a saw-tooth curve on the fast dimension and a linear increase on the slow dimension.
+    Shape is (2, Y * (X + margin) * dup), with dtype int16. The first row is for the fast dimension
+    (X), and the second row for the slow dimension (Y).
+    Only the values of one line are stored, and the rest is computed when requested.
+    """
+
+    def __init__(self,
+                 res: Tuple[int, int],
+                 limits: Tuple[Tuple[int, int], Tuple[int, int]],
+                 margin: int,
+                 dup: int,
+                 ):
+        """
+        :param res: size of the scanning area (X=fast, Y=slow axis)
+        :param limits: the min/max limits of fast, slow axes. Must NOT be numpy.uint
+        :param margin (0<=int): number of additional pixels to add at the beginning of
+            each scanned line
+        :param dup: (1<=int): how many times each pixel should be duplicated
+        """
+        # TODO: is this always this dtype? Use a get_ao_dtype()?
+        super().__init__((2, res[1] * (res[0] + margin) * dup), numpy.int16)
+
+        # Note: it's important that limits contain Python int's, and not numpy.uint's,
+        # because with uint's, linspace() goes crazy when limits go high->low.
+        line = numpy.empty((res[0] + margin, dup), dtype=numpy.int16)
+        line[margin:] = numpy.linspace(limits[0][0], limits[0][1], res[0])[:, numpy.newaxis]
+        # fill the margin with the first pixel
+        line[:margin] = limits[0][0]
+        self._line = line.ravel()  # X values of each line
+
+        self._y = numpy.empty(res[1], dtype=numpy.int16)
+        self._y[:] = numpy.linspace(limits[1][0], limits[1][1], res[1])  # Y value of each line
+
+    def _generate(self, start: int, stop: int) -> numpy.ndarray:
+        data = numpy.empty((2, stop - start), dtype=numpy.int16)
+        idx = numpy.arange(start, stop)
+        numpy.take(self._line, idx, out=data[0], mode="wrap")
+        numpy.take(self._y, idx // len(self._line), out=data[1])
+        return data
+
+
+class RasterTTLWaveform(LazyWaveform):
+    """
+    Digital waveform indicating when the pixel, line, frame start, as bits, for a 2D scan.
+    The rate is twice higher than the analog waveform, so that half of the dwell time the pixel
+    signal is high and the other half it is low. That's the slowest rate that allows to
+    distinguish each pixel.
+    Shape is (Y * 2 * (X + margin) * dup,). Every line is identical, excepted the frame signal,
+    which is low during the margin of the first line, and (if there is no margin) on the very
+    last sample.
+    """
+
+    def __init__(self,
+                 res: Tuple[int, int],
+                 margin: int,
+                 dup: int,
+                 dtype,
+                 inactive_bits: int,
+                 pixel_bits: int,
+                 line_bits: int,
+                 frame_bits: int,
+                 ):
+        """
+        :param res: size of the scanning area (X=fast, Y=slow axis)
+        :param margin (0<=int): number of additional pixels to add at the beginning of
+            each scanned line
+        :param dup: (1<=int): how many times each pixel should be duplicated
+        :param dtype: numpy.uint32 or numpy.bool_ (if only one port is used)
+        :param inactive_bits: bitmap of the value of all the ports when inactive
+        :param pixel_bits: bitmap of the ports following the pixel signal
+        :param line_bits: bitmap of the ports following the line signal
+        :param frame_bits: bitmap of the ports following the frame signal
+        """
+        width = 2 * (res[0] + margin)
+        super().__init__((res[1] * width * dup,), dtype)
+        dtype = self.dtype.type
+        self._frame_bits = dtype(frame_bits)
+
+        line = numpy.empty((width, dup), dtype=dtype)
+        line[...] = inactive_bits
+        # Pixel: everything after the margin, is filled with alternating high/low
+        line[margin * 2::2, 0] ^= dtype(pixel_bits)  # xor, to flip the bit
+        # Line: everything after the margin is the line
+        line[margin * 2:, :] ^= dtype(line_bits)
+        # Special case when there is no margin: make it low as the end of the line, to get a transition
+        # TODO: if there is really some hardware that rely on the precise timing for line and frame
+        # signals, even on such special cases (eg, spot mode), that might not be good enough. We
+        # would need to increase the TTL rate to AI rate, so that the last value corresponds to a very
+        # short time.
+        if not margin:
+            line[-1, -1] ^= dtype(line_bits)
+        # Frame: high everywhere, except for the margin of the first line (see _generate())
+        line ^= self._frame_bits
+        self._line = line.ravel()
+        self._first_line_margin = margin * 2 * dup  # number of samples with the frame signal low
+
+    def _generate(self, start: int, stop: int) -> numpy.ndarray:
+        data = numpy.take(self._line, numpy.arange(start, stop), mode="wrap")
+        if start < self._first_line_margin:
+            data[:self._first_line_margin - start] ^= self._frame_bits
+        # Special case when there is no margin: make it low as the end of the frame, to get a transition
+        if not self._first_line_margin and stop == self.shape[-1]:
+            data[-1] ^= self._frame_bits
+        return data
+
+
 class Scanner(model.Emitter):
     """
     Represents the e-beam scanner
@@ -2593,6 +2796,9 @@ class Scanner(model.Emitter):
         # Cached data for the waveforms
         self._prev_settings = [None, None, None, None, None]  # resolution, scale, translation, margin, ao_osr
         self._scan_array = None  # last scan array computed
+        self._ttl_signal = None  # last TTL signal computed
+        # (resolution, scale, translation, margin, ao_osr) -> (scan array, TTL signal), for raster scans
+        self._waveform_cache = OrderedDict()
         self._ao_osr = 1
         self._ai_osr = 1
         self._nrchans = 0
@@ -3016,7 +3222,15 @@ class Scanner(model.Emitter):
 
             new_settings = [resolution, scale, translation, margin, ao_osr]
             if len(self._prev_settings) != len(new_settings) or self._prev_settings != new_settings:
-                self._update_raw_scan_array(resolution, scale, translation, margin, ao_osr)
+                key = tuple(new_settings)
+                try:
+                    self._scan_array, self._ttl_signal = self._waveform_cache[key]
+                    self._waveform_cache.move_to_end(key)
+                except KeyError:
+                    self._update_raw_scan_array(resolution, scale, translation, margin, ao_osr)
+                    self._waveform_cache[key] = (self._scan_array, self._ttl_signal)
+                    while len(self._waveform_cache) > WAVEFORM_CACHE_SIZE:
+                        self._waveform_cache.popitem(last=False)
                 self._prev_settings = new_settings
 
         return (self._scan_array,
@@ -3231,14 +3445,8 @@ class Scanner(model.Emitter):
         logging.debug("ranges X = %sV, Y = %sV, for shape %s + margin %d",
                       roi_limits[0], roi_limits[1], shape, margin)
 
-        scan_array = self._generate_scan_array(shape, roi_limits_raw, margin, dup)
-        self._scan_array = scan_array.reshape(2, -1)  # flatten the YX+dup dimensions
-
-        # ttl_signal = self._generate_signal_array(shape, margin, dup)
-        ttl_signal = self._generate_signal_array_bits(shape, margin, dup)
-        if ttl_signal is not None:
-            ttl_signal = ttl_signal.ravel()  # flatten the YX+dup dimensions
-        self._ttl_signal = ttl_signal
+        self._scan_array = RasterScanWaveform(shape, roi_limits_raw, margin, dup)
+        self._ttl_signal = self._generate_signal_waveform(shape, margin, dup)
 
     @staticmethod
     def volt_to_raw(ao_channel: "AOChannel", volt: float) -> int:
@@ -3257,57 +3465,18 @@ class Scanner(model.Emitter):
         # Make sure it fits within a int16, as the polynomial and the rounding could make it too big
         return min(max(-32768, raw), 32767)
 
-    @staticmethod
-    def _generate_scan_array(res: Tuple[int, int],
-                             limits: Tuple[Tuple[int, int]],
-                             margin: int,
-                             dup: int,
-                             ) -> numpy.ndarray:
-        """
-        Generate an array of the values to send to scan a 2D area, using linear
-        interpolation between the limits. It's basically a saw-tooth curve on
-        the fast dimension and a linear increase on the slow dimension.
-        :param res: size of the scanning area (X=fast, Y=slow axis)
-        :param limits: the min/max limits of fast, slow axes. Must NOT be numpy.uint
-        :param margin (0<=int): number of additional pixels to add at the beginning of
-            each scanned line
-        :param dup: (1<=int): how many times each pixel should be duplicated
-        :returns (4D ndarray of 2,  Y, (X + margin), dup of int16): the
-            values for each points of the array, with X scanned fast, and Y
-            slowly.
-        """
-        # prepare an array of the right type
-        full_shape = (2, res[1], res[0] + margin, dup)
-        scan = numpy.empty(full_shape, dtype=numpy.int16, order='C')  # TODO: is this alway this dtype? Use a get_ao_dtype()?
-        scan_dup = numpy.moveaxis(scan, 3, 0)  # Move dup to the back, to tell numpy everything needs to be copied
-
-        # fill the Y dimension, by copying the X over every Y value
-        # swap because we the broadcast rule is going to duplicate on the first dimension(s)
-        scany = scan_dup[:, 1, :, :].swapaxes(1, 2)
-        # Note: it's important that limits contain Python int's, and not numpy.uint's,
-        # because with uint's, linspace() goes crazy when limits go high->low.
-        scany[:, :, :] = numpy.linspace(limits[1][0], limits[1][1], res[1])
-        # fill the X dimension
-        scan_dup[:, 0, :, margin:] = numpy.linspace(limits[0][0], limits[0][1], res[0])
-
-        # fill the margin with the first pixel (X dimension is already filled)
-        if margin:
-            scan_dup[:, 0, :, :margin] = limits[0][0]
-
-        return scan
-
-    def _generate_signal_array_bits(self,
-                                    res: Tuple[int, int],
-                                    margin: int,
-                                    dup: int,
-                                    ) -> Optional[numpy.ndarray]:
+    def _generate_signal_waveform(self,
+                                  res: Tuple[int, int],
+                                  margin: int,
+                                  dup: int,
+                                  ) -> Optional[RasterTTLWaveform]:
         """
         :param res: size of the scanning area (X=fast, Y=slow axis)
         :param margin (0<=int): number of additional pixels to add at the beginning of
             each scanned line
         :param dup: (1<=int): how many times each pixel should be duplicated
         :return:
-            ttl_signal: numpy array of shape Y,X*2, dup, dtype uint32: the digital signal indicating
+            ttl_signal: waveform of shape Y*X*2*dup, dtype uint32: the digital signal indicating
             when the pixel, line, frame start, as bits.
             The bits are set to match the *_ttl options.
             If not TTLs are to be changed, None is returned
@@ -3323,44 +3492,11 @@ class Scanner(model.Emitter):
         else:
             dtype = numpy.uint32
 
-        # Y dim is as expected, X dim is twice longer, to have the rate twice higher
-        # than the dwell time, with half of the dwell time the pixel signal high
-        # and half of the pixel signal the dwell time low. That's the slowest rate
-        # that allows to distinguish each pixel.
-        full_shape = (res[1], 2 * (res[0] + margin), dup)
-        ttl_signal = numpy.empty(full_shape, dtype=dtype, order='C')
         inactive_bitmap = sum(1 << port for port, inv in self._ttl_inverted.items() if inv)
-        ttl_signal[...] = inactive_bitmap
-
-        # Pixel: everything after the margin, is filled with alternating high/low
-        for c in self._pixel_ttl:
-            pixel_bit = dtype(1 << c)
-            ttl_signal[:, margin * 2::2, 0] ^= pixel_bit  # xor, to flip the bit
-
-        # Line: everything after the margin is the line
-        # Special array view, with dup to as first dim, to tell numpy everything needs to be copied
-        ttl_signal_dup = numpy.moveaxis(ttl_signal, 2, 0)
-        for c in self._line_ttl:
-            line_bit = dtype(1 << c)
-            ttl_signal_dup[:, :, margin * 2:] ^= line_bit
-            # Special case when there is no margin: make it low as the end of the line, to get a transition
-            # TODO: if there is really some hardware that rely on the precise timing for line and frame
-            # signals, even on such special cases (eg, spot mode), that might not be good enough. We
-            # would need to increase the TTL rate to AI rate, so that the last value corresponds to a very
-            # short time.
-            if not margin:
-                ttl_signal_dup[-1, :, -1] ^= line_bit
-
-        # Frame: almost everywhere high, except for the margin of the first line
-        for c in self._frame_ttl:
-            frame_bit = dtype(1 << c)
-            frame_signal = ttl_signal_dup.reshape(dup, res[1] * 2 * (res[0] + margin))
-            frame_signal[:, margin * 2:] ^= frame_bit
-            # Special case when there is no margin: make it low as the end of the frame, to get a transition
-            if not margin:
-                frame_signal[-1, -1] ^= frame_bit
-
-        return ttl_signal
+        return RasterTTLWaveform(res, margin, dup, dtype, inactive_bitmap,
+                                 pixel_bits=sum(1 << c for c in self._pixel_ttl),
+                                 line_bits=sum(1 << c for c in self._line_ttl),
+                                 frame_bits=sum(1 << c for c in self._frame_ttl))
 
     def _generate_signal_array_end(self) -> Optional[numpy.ndarray]:
         """
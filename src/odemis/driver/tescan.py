@@ -67,6 +67,11 @@ class DeviceType(Enum):
 
 DEFAULT_BITDEPTH = 16
 
+# Period (s) of the polling of the settings and stage position. It's adapted between these two values:
+# short while the values change, and longer when idle.
+POLL_PERIOD_MIN = 0.5
+POLL_PERIOD_MAX = 5
+
 
 class CancelledError(Exception):
     """Data receive was cancelled"""
@@ -804,8 +809,12 @@ class Scanner(model.Emitter):
         emode = self._device_handler.ScGetExternal()
         self.external = model.BooleanVA(bool(emode), setter=self._setExternal)
 
-        # Timer polling VAs so we keep up to date with changes made via Tescan UI
-        self._va_poll = util.RepeatingTimer(5, self._pollVAs, "VAs polling")
+        # Timer polling VAs so we keep up to date with changes made via Tescan UI.
+        # Polls faster while the settings are being changed.
+        self._polled_vas = [getattr(self, n) for n in ("horizontalFoV", "accelVoltage", "dwellTime", "rotation",
+                                                       "blanker", "probeCurrent", "shutter", "external")
+                            if hasattr(self, n)]
+        self._va_poll = util.AdaptiveRepeatingTimer(POLL_PERIOD_MIN, POLL_PERIOD_MAX, self._pollVAs, "VAs polling")
         self._va_poll.start()
 
     def get_dwell_time_lookup(self) -> Dict[int, float]:
@@ -1181,7 +1190,12 @@ class Scanner(model.Emitter):
         phy_pos = (px_pos[0] * pxs[0], -px_pos[1] * pxs[1])  # - to invert Y
         return phy_pos
 
-    def _pollVAs(self):
+    def _pollVAs(self) -> bool:
+        """
+        Read the settings from the SEM, and update the VAs accordingly
+        :return: True if any VA changed
+        """
+        prev_values = [va._value for va in self._polled_vas]
         try:
             with self.parent._acquisition_init_lock:
                 logging.debug(f"Updating {self.name} FoV, voltage and current")
@@ -1255,6 +1269,8 @@ class Scanner(model.Emitter):
         except Exception:
             logging.exception("Unexpected failure during VAs polling")
 
+        return [va._value for va in self._polled_vas] != prev_values
+
     def terminate(self):
         self._va_poll.cancel()
         self._va_poll.join(5)
@@ -1516,10 +1532,15 @@ class Stage(model.Actuator):
         self.position = model.VigilantAttribute({}, unit="m", readonly=True)
         self._updatePosition()
 
-        self._xyz_poll = util.RepeatingTimer(5, self._pollXYZ, "XYZ polling")
+        # Polls faster while the stage is moving
+        self._xyz_poll = util.AdaptiveRepeatingTimer(POLL_PERIOD_MIN, POLL_PERIOD_MAX, self._pollXYZ, "XYZ polling")
         self._xyz_poll.start()
 
-    def _pollXYZ(self):
+    def _pollXYZ(self) -> bool:
+        """
+        :return: True if the position changed
+        """
+        prev_pos = self.position.value
         try:
             self._updatePosition()
         except TypeError:
@@ -1528,6 +1549,7 @@ class Stage(model.Actuator):
             logging.warning("Could not poll, probably because the SharkSEM API is momentarily blocked")
         except Exception:
             logging.exception("Unexpected failure during XYZ polling")
+        return self.position.value != prev_pos
 
     def _checkPosition(self, orig_pos: Dict[str, float], target_pos: Dict[str, float], timeout: float = STAGE_WAIT_TIMEOUT):
         """
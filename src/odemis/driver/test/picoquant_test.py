@@ -19,6 +19,8 @@ import queue
 import threading
 from abc import ABCMeta
 
+import numpy
+
 from odemis import model
 from odemis.driver import picoquant, simulated
 import os
@@ -124,6 +126,100 @@ class TestHH400Static(unittest.TestCase):
         self.assertRaises(Exception, picoquant.HH400, **wrong_config)
 
 
+class TestT3Records(unittest.TestCase):
+    """
+    Tests the decoding and histogramming of the T3 records, without device
+    """
+
+    def test_decode_generic(self):
+        fmt = picoquant.T3_FORMAT_GENERIC
+        records = numpy.array([
+            (1 << 31) | (0x3f << 25) | 3,  # 3 overflows
+            (1 << 25) | (100 << 10) | 5,  # photon on channel 1
+            (1 << 31) | (2 << 25) | 7,  # marker 2
+            (1 << 31) | (0x3f << 25) | 0,  # 1 overflow (old style)
+            (0 << 25) | (32767 << 10) | 1023,  # photon on channel 0
+        ], dtype=numpy.uint32)
+
+        events, nsync_offset = picoquant.decode_t3_records(records, fmt, nsync_offset=10)
+        self.assertEqual(nsync_offset, 14)
+        numpy.testing.assert_array_equal(events.nsync, [13 * 1024 + 5, 13 * 1024 + 7, 14 * 1024 + 1023])
+        numpy.testing.assert_array_equal(events.channel, [1, -1, 0])
+        numpy.testing.assert_array_equal(events.dtime, [100, 0, 32767])
+        numpy.testing.assert_array_equal(events.markers, [0, 2, 0])
+
+    def test_decode_ph300(self):
+        fmt = picoquant.T3_FORMAT_PH300
+        records = numpy.array([
+            (0xf << 28),  # overflow
+            (1 << 28) | (100 << 16) | 5,  # photon on channel 0 (numbered 1 in the records)
+            (0xf << 28) | (4 << 16) | 7,  # marker 3
+            (0xf << 28),  # overflow
+            (2 << 28) | (4095 << 16) | 65535,  # photon on channel 1
+        ], dtype=numpy.uint32)
+
+        events, nsync_offset = picoquant.decode_t3_records(records, fmt)
+        self.assertEqual(nsync_offset, 2)
+        numpy.testing.assert_array_equal(events.nsync, [65536 + 5, 65536 + 7, 2 * 65536 + 65535])
+        numpy.testing.assert_array_equal(events.channel, [0, -1, 1])
+        numpy.testing.assert_array_equal(events.dtime, [100, 0, 4095])
+        numpy.testing.assert_array_equal(events.markers, [0, 4, 0])
+
+    def test_histogram_chunks(self):
+        """
+        Histogramming the records chunk by chunk gives the same result as all at once
+        """
+        for fmt in (picoquant.T3_FORMAT_PH300, picoquant.T3_FORMAT_GENERIC):
+            src = picoquant.FakeT3Source(fmt, 4e-12, pixel_period=1e-5, seed=1)
+            records = src.generate(2000000)  # 50 ms @ 40 MHz -> 5000 pixels
+
+            events, _ = picoquant.decode_t3_records(records, fmt)
+            photons = events.channel == 0
+            self.assertEqual(numpy.count_nonzero(events.markers), 5000)
+            # Overflows are correctly taken into account: the syncs are monotonic
+            self.assertTrue(numpy.all(numpy.diff(events.nsync) >= 0))
+
+            hist_all = picoquant.T3Histogrammer(fmt, 4000, 1024)
+            hist_all.add(records)
+            self.assertTrue(hist_all.complete)
+            self.assertEqual(hist_all.histograms.shape, (4000, 1024))
+            # All the photons before the 4001th marker, and within the histogram are counted
+            px_idx = numpy.cumsum(events.markers != 0) - 1
+            exp_count = numpy.count_nonzero(photons & (events.dtime < 1024) & (px_idx >= 0) & (px_idx < 4000))
+            self.assertEqual(hist_all.histograms.sum(), exp_count)
+            self.assertGreater(exp_count, 0)
+
+            hist_chunks = picoquant.T3Histogrammer(fmt, 4000, 1024)
+            for chunk in numpy.array_split(records, 77):
+                hist_chunks.add(chunk)
+            numpy.testing.assert_array_equal(hist_chunks.histograms, hist_all.histograms)
+
+    def test_throughput(self):
+        """
+        Report how many records per second can be decoded and histogrammed
+        """
+        for fmt in (picoquant.T3_FORMAT_PH300, picoquant.T3_FORMAT_GENERIC):
+            # ~10M records: 5 M counts/s during 2 s
+            src = picoquant.FakeT3Source(fmt, 4e-12, count_rate=5e6, pixel_period=1e-5, seed=1)
+            records = src.generate(80000000)
+
+            tstart = time.perf_counter()
+            picoquant.decode_t3_records(records, fmt)
+            dur_decode = time.perf_counter() - tstart
+
+            hist = picoquant.T3Histogrammer(fmt, 256 * 256, 256)
+            tstart = time.perf_counter()
+            for i in range(0, records.size, picoquant.TTTR_READ_COUNT):
+                hist.add(records[i:i + picoquant.TTTR_READ_COUNT])
+            dur_hist = time.perf_counter() - tstart
+
+            print(f"{fmt}: {records.size} records, decoded at {records.size / dur_decode * 1e-6:.1f} M records/s, "
+                  f"histogrammed at {records.size / dur_hist * 1e-6:.1f} M records/s")
+            self.assertEqual(hist.n_records, records.size)
+            # It should be way faster than that, but that's a safe minimum
+            self.assertGreater(records.size / dur_hist, 1e6)
+
+
 class PicoBaseTest(metaclass=ABCMeta):
     """
     Tests which can share a device initialization.
@@ -578,5 +674,75 @@ class TestHH400Shutters(PicoShuttersMixinTest, TestHH400):
                 cls.det1 = child
 
 
+class PicoTTTRTest(metaclass=ABCMeta):
+    """
+    Tests for the devices in TTTR mode. To be inherited, for each type of device.
+    The subclass should also inherit unittest.TestCase, and define .dev with tttr_marker=1.
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dev.terminate()
+        time.sleep(1)
+
+    def test_acquire_pixels(self):
+        dt = 1  # s
+        self.dev.dwellTime.value = dt
+        self.dev.resolution.value = (256, 20)  # 20 pixels of 256 time bins
+        # Time bins long enough to cover the whole period of the sync (25 ns in simulation)
+        self.dev.pixelDuration.value = min(d for d in self.dev.pixelDuration.choices if d >= 100e-12)
+        self.assertEqual(self.dev.resolution.value, (256, 20))
+
+        tstart = time.time()
+        data = self.dev.data.get()
+        dur = time.time() - tstart
+        self.assertEqual(data.shape, (20, 256))
+        tl = data.metadata[model.MD_TIME_LIST]
+        self.assertEqual(len(tl), data.shape[1])
+        if TEST_NOHW:
+            # The simulator sends the markers very often, so all the pixels are received early,
+            # and every pixel should have received some photons
+            self.assertLess(dur, dt)
+            self.assertTrue(numpy.all(data.sum(axis=1) > 0))
+
+        # Single pixel, full histogram
+        self.dev.resolution.value = (self.dev.shape[0], 1)
+        data = self.dev.data.get()
+        self.assertEqual(data.shape, (1, self.dev.shape[0]))
+
+    def test_resolution_too_large(self):
+        """Resolutions requiring too much memory for the histograms should be refused"""
+        self.dev.resolution.value = (256, 20)
+        with self.assertRaises(ValueError):
+            self.dev.resolution.value = self.dev.resolution.range[1]  # Max bins & pixels
+        self.assertEqual(self.dev.resolution.value, (256, 20))
+
+        # Many pixels are fine, if the histograms are short
+        self.dev.resolution.value = (16, self.dev.resolution.range[1][1])
+        self.assertEqual(self.dev.resolution.value, (16, self.dev.resolution.range[1][1]))
+        self.dev.resolution.value = (256, 20)
+
+
+class TestPH300TTTR(PicoTTTRTest, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dev = picoquant.PH300(tttr_marker=1, **PH300_KWARGS)
+
+
+class TestPH330TTTR(PicoTTTRTest, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dev = picoquant.PH330(tttr_marker=1, **PH330_KWARGS)
+
+
+class TestHH400TTTR(PicoTTTRTest, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dev = picoquant.HH400(tttr_marker=1, **HH400_KWARGS)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -22,7 +22,7 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 """
 import logging
 import sys
-from unittest import SkipTest, skip
+from unittest import SkipTest, skip, mock
 
 logging.getLogger().setLevel(logging.DEBUG)
 logging.basicConfig(format="%(asctime)s  %(levelname)-7s %(module)s:%(lineno)d %(message)s")
@@ -262,6 +262,7 @@ class TestAnalogSEM(unittest.TestCase):
         print(res)
 
         scan_array, ttl_array, act_dt, ao_osr, ai_osr, act_res, margin, is_vector_scan = self.scanner._get_scan_waveforms(1)
+        ttl_array = numpy.asarray(ttl_array)  # Compute the whole waveform
 
         plt.plot(scan_array[0], label="X")  # X voltage
         plt.plot(scan_array[1], label="Y")  # Y voltage
@@ -300,6 +301,7 @@ class TestAnalogSEM(unittest.TestCase):
         res = scanner.resolution.value
 
         scan_array, ttl_array, act_dt, ao_osr, ai_osr, act_res, margin, is_vector_scan = self.scanner._get_scan_waveforms(1)
+        ttl_array = numpy.asarray(ttl_array)  # Compute the whole waveform
 
         exp_margin = int(CONFIG_SCANNER["settle_time"] / dt)  # True if the whole FoV is scanned
         self.assertEqual(exp_margin, margin)
@@ -363,6 +365,7 @@ class TestAnalogSEM(unittest.TestCase):
         self.assertEqual(scanner.resolution.value, res)
 
         scan_array, ttl_array, act_dt, ao_osr, ai_osr, act_res, margin, is_vector_scan = self.scanner._get_scan_waveforms(1)
+        ttl_array = numpy.asarray(ttl_array)  # Compute the whole waveform
 
         self.assertEqual(margin, 0)  # No need for margin when scanning a spot
         self.assertEqual(res, act_res)
@@ -394,6 +397,51 @@ class TestAnalogSEM(unittest.TestCase):
         nb_transitions = numpy.sum(numpy.diff((ttl_array & self.frame_bit).astype(bool)))
         self.assertEqual(nb_transitions, 1)
 
+    def test_waveform_large(self):
+        """
+        Check the waveform of a large scan is lazy (only the chunks read are computed), and cached
+        """
+        scanner = self.scanner
+        scanner.dwellTime.value = 1e-6  # s
+        scanner.scale.value = (1, 1)
+        scanner.resolution.value = scanner.resolution.range[1]  # Full resolution (8192 x 6144)
+        res = scanner.resolution.value
+
+        scan_array, ttl_array, act_dt, ao_osr, ai_osr, act_res, margin, is_vector_scan = self.scanner._get_scan_waveforms(1)
+        # The whole waveforms are not computed in advance
+        self.assertIsInstance(scan_array, semnidaq.LazyWaveform)
+        self.assertIsInstance(ttl_array, semnidaq.LazyWaveform)
+
+        # The first chunk is what the acquisition needs to start: only it should be computed
+        with mock.patch.object(scan_array, "_generate", wraps=scan_array._generate) as scan_gen, \
+             mock.patch.object(ttl_array, "_generate", wraps=ttl_array._generate) as ttl_gen:
+            chunk = scan_array[:, :100000]
+            ttl_chunk = ttl_array[:200000]
+        scan_gen.assert_called_once_with(0, 100000)
+        ttl_gen.assert_called_once_with(0, 200000)
+
+        self.assertEqual(act_res, res)
+        exp_length = (res[0] + margin) * res[1] * ao_osr
+        self.assertEqual(scan_array.shape, (2, exp_length))
+        self.assertEqual(ttl_array.shape, (exp_length * 2,))
+        self.assertEqual(chunk.shape, (2, 100000))
+        self.assertEqual(ttl_chunk.shape, (200000,))
+        # The beginning of the scan is the flyback of the first line, then X increases
+        numpy.testing.assert_array_equal(chunk[0, :margin * ao_osr], scan_array[0, 0])
+        self.assertLess(chunk[0, margin * ao_osr], chunk[0, (margin + 1) * ao_osr])
+        self.assertEqual(chunk[1, 0], scan_array[1, (res[0] + margin) * ao_osr - 1])  # Same Y on the whole line
+        self.assertNotEqual(chunk[1, 0], scan_array[1, -1])
+
+        # Switch to a small scan, and back: the waveforms are reused
+        scanner.scale.value = (8, 8)
+        scanner.resolution.value = scanner.resolution.range[1]
+        self.scanner._get_scan_waveforms(1)
+        scanner.scale.value = (1, 1)
+        scanner.resolution.value = scanner.resolution.range[1]
+        scan_array2, ttl_array2, *_ = self.scanner._get_scan_waveforms(1)
+        self.assertIs(scan_array2, scan_array)
+        self.assertIs(ttl_array2, ttl_array)
+
     def test_waveform_scan_path(self):
         dt = 1e-6  # s
         # Basic scan path, which scan the 4 corners of the FoV, and the center
@@ -24,9 +24,11 @@ import logging
 import math
 import os
 import shutil
+import threading
 import time
 import unittest
 
+import Pyro5.api
 import numpy
 from odemis import model
 
@@ -1719,5 +1721,383 @@ class TestCheckLatestPackage(unittest.TestCase):
         self.assertIsNone(pkg)
 
 
+@Pyro5.api.expose
+class FakeXTServer:
+    """
+    Minimal simulator of the xtadapter server, only supporting reading the settings
+    """
+
+    def __init__(self):
+        self.settings = {
+            "get_scan_mode": "full_frame",
+            "get_ht_voltage": 5000.0,
+            "beam_is_blanked": False,
+            "get_ebeam_spotsize": 2.5,
+            "get_beam_shift": (0.0, 0.0),
+            "get_rotation": 0.0,
+            "get_scanning_size": (100e-6, 80e-6),
+            "get_dwell_time": 1e-6,
+            "get_resolution": (1536, 1024),
+            "get_stage_position": {"x": 0.0, "y": 0.0, "z": 0.01, "t": 0.0, "r": 0.0},
+            "get_free_working_distance": 4e-3,
+            "get_vacuum_state": "vacuum",
+            "get_pressure": 1e-3,
+        }
+        self.failing = set()  # name of the getters which raise an error
+
+    def _get(self, name):
+        if name in self.failing:
+            raise OSError("Failed to read %s" % (name,))
+        return self.settings[name]
+
+    def get_software_version(self):
+        return "xtadapter: 1.11.0, bitness: 64bit"
+
+    def get_hardware_version(self):
+        return "Fake SEM"
+
+    def ht_voltage_info(self):
+        return {"unit": "V", "range": (200.0, 30000.0)}
+
+    def spotsize_info(self):
+        return {"unit": None, "range": (1.0, 10.0)}
+
+    def beam_shift_info(self):
+        return {"unit": "m", "range": {"x": (-1e-4, 1e-4), "y": (-1e-4, 1e-4)}}
+
+    def rotation_info(self):
+        return {"unit": "rad", "range": (0.0, 2 * math.pi)}
+
+    def scanning_size_info(self):
+        return {"unit": "m", "range": {"x": (1e-6, 1e-3), "y": (1e-6, 1e-3)}}
+
+    def dwell_time_info(self):
+        return {"unit": "s", "range": (25e-9, 25e-3)}
+
+    def resolution_info(self):
+        return {"unit": "px", "range": {"x": (768, 6144), "y": (512, 4096)}}
+
+    def brightness_info(self):
+        return {"unit": "", "range": (0.0, 1.0)}
+
+    def contrast_info(self):
+        return {"unit": "", "range": (0.0, 1.0)}
+
+    def stage_info(self):
+        return {"unit": {"x": "m", "y": "m", "z": "m", "t": "rad", "r": "rad"},
+                "range": {"x": (-0.05, 0.05), "y": (-0.05, 0.05), "z": (0.0, 0.05),
+                          "t": (-0.1, 1.3), "r": (-math.pi, math.pi)}}
+
+    def fwd_info(self):
+        return {"unit": "m", "range": (0.0, 0.1)}
+
+    def pressure_info(self):
+        return {"unit": "Pa", "range": (0.0, 150e3)}
+
+    def set_raw_coordinate_system(self, raw_coordinates):
+        pass
+
+    def get_scan_mode(self):
+        return self._get("get_scan_mode")
+
+    def get_ht_voltage(self):
+        return self._get("get_ht_voltage")
+
+    def beam_is_blanked(self):
+        return self._get("beam_is_blanked")
+
+    def get_ebeam_spotsize(self):
+        return self._get("get_ebeam_spotsize")
+
+    def get_beam_shift(self):
+        return self._get("get_beam_shift")
+
+    def get_rotation(self):
+        return self._get("get_rotation")
+
+    def get_scanning_size(self):
+        return self._get("get_scanning_size")
+
+    def get_dwell_time(self):
+        return self._get("get_dwell_time")
+
+    def get_resolution(self):
+        return self._get("get_resolution")
+
+    def get_brightness(self, channel_name):
+        return 0.4
+
+    def get_contrast(self, channel_name):
+        return 0.6
+
+    def get_stage_position(self):
+        return self._get("get_stage_position")
+
+    def get_free_working_distance(self):
+        return self._get("get_free_working_distance")
+
+    def get_vacuum_state(self):
+        return self._get("get_vacuum_state")
+
+    def get_pressure(self):
+        return self._get("get_pressure")
+
+
+@Pyro5.api.expose
+class FakeXTServerBulk(FakeXTServer):
+    """
+    Simulator of the xtadapter server, which supports reading many settings at once
+    """
+
+    def get_settings(self, queries):
+        return [getattr(self, q[0])(*q[1:]) for q in queries]
+
+
+@Pyro5.api.expose
+class FakeXTServerPush(FakeXTServerBulk):
+    """
+    Simulator of the xtadapter server, which pushes the changes of the settings
+    """
+
+    def stream_settings(self, queries):
+        values = self.get_settings(queries)
+        yield values
+        last_yield = time.time()
+        while True:
+            time.sleep(0.01)
+            changes = []
+            for i, q in enumerate(queries):
+                try:
+                    v = getattr(self, q[0])(*q[1:])
+                except Exception:
+                    continue
+                if v != values[i]:
+                    values[i] = v
+                    changes.append((i, v))
+            if changes or time.time() > last_yield + xt_client.STREAM_KEEPALIVE:
+                yield changes
+                last_yield = time.time()
+
+
+class CountingDaemon(Pyro5.api.Daemon):
+    """
+    Pyro daemon which counts the number of requests received
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_requests = 0
+
+    def handleRequest(self, conn):
+        self.n_requests += 1
+        return super().handleRequest(conn)
+
+
+class TestSettingsPolling(unittest.TestCase):
+    """
+    Test polling the settings, using a local fake XT server
+    """
+
+    server_class = FakeXTServerBulk
+    has_get_settings = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = cls.server_class()
+        cls.daemon = CountingDaemon(host="localhost", port=0)
+        uri = cls.daemon.register(cls.server, "Microscope")
+        cls.daemon_thread = threading.Thread(target=cls.daemon.requestLoop, name="Fake XT server")
+        cls.daemon_thread.start()
+
+        config = {"name": "sem", "role": "sem", "address": str(uri),
+                  "children": {"scanner": CONFIG_SCANNER,
+                               "focus": CONFIG_FOCUS,
+                               "stage": CONFIG_STAGE,
+                               "detector": CONFIG_DETECTOR,
+                               "chamber": CONFIG_CHAMBER,
+                               }
+                  }
+        cls.microscope = xt_client.SEM(**config)
+        # Poll explicitly, to control when the requests happen
+        cls.microscope._settings_poller.cancel()
+        for child in cls.microscope.children.value:
+            if child.name == CONFIG_SCANNER["name"]:
+                cls.scanner = child
+            elif child.name == CONFIG_CHAMBER["name"]:
+                cls.chamber = child
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.microscope.terminate()
+        cls.daemon.shutdown()
+        cls.daemon_thread.join(5)
+
+    def tearDown(self):
+        self.server.failing.clear()
+
+    def _measure_polling(self):
+        """
+        :return: number of requests per poll, number of polls per second
+        """
+        poller = self.microscope._settings_poller
+        self.daemon.n_requests = 0
+        poller.poll()
+        n_requests = self.daemon.n_requests
+
+        n = 50
+        tstart = time.time()
+        for i in range(n):
+            poller.poll()
+        dur = time.time() - tstart
+        logging.info("Polled all settings %d times in %g s: %g polls/s, with %d requests per poll",
+                     n, dur, n / dur, n_requests)
+        return n_requests, n / dur
+
+    def test_round_trips(self):
+        self.assertEqual(self.microscope._has_get_settings, self.has_get_settings)
+        n_requests, _ = self._measure_polling()
+        if self.has_get_settings:
+            self.assertEqual(n_requests, 1)
+        else:
+            # One request per setting
+            self.assertGreater(n_requests, 10)
+
+    def test_update(self):
+        self.server.settings["get_ht_voltage"] = 10000.0
+        self.server.settings["get_pressure"] = 2e-3
+        self.microscope._settings_poller.poll()
+        self.assertEqual(self.scanner.accelVoltage.value, 10000.0)
+        self.assertEqual(self.chamber.pressure.value, 2e-3)
+
+    def test_failure(self):
+        """
+        A setting failing to be read shouldn't prevent the other settings from being updated
+        """
+        self.server.failing.add("get_pressure")
+        self.server.settings["get_ht_voltage"] = 15000.0
+        self.microscope._settings_poller.poll()
+        self.assertEqual(self.scanner.accelVoltage.value, 15000.0)
+
+
+class TestSettingsPollingNoBulk(TestSettingsPolling):
+    """
+    Test polling the settings, with an (old) XT server which doesn't support get_settings()
+    """
+
+    server_class = FakeXTServer
+    has_get_settings = False
+
+
+
+class TestAdaptivePolling(unittest.TestCase):
+    """
+    Test the polling of the settings is faster when the settings change, using a local fake XT server
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeXTServerBulk()
+        cls.daemon = CountingDaemon(host="localhost", port=0)
+        uri = cls.daemon.register(cls.server, "Microscope")
+        cls.daemon_thread = threading.Thread(target=cls.daemon.requestLoop, name="Fake XT server")
+        cls.daemon_thread.start()
+        config = {"name": "sem", "role": "sem", "address": str(uri),
+                  "children": {"scanner": CONFIG_SCANNER, "stage": CONFIG_STAGE}}
+        cls.microscope = xt_client.SEM(**config)
+        cls.microscope._settings_poller.cancel()
+        for child in cls.microscope.children.value:
+            if child.name == CONFIG_STAGE["name"]:
+                cls.stage = child
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.microscope.terminate()
+        cls.daemon.shutdown()
+        cls.daemon_thread.join(5)
+
+    def test_adaptive(self):
+        poller = xt_client.SettingsPoller(self.microscope, min_period=0.05, max_period=0.4)
+        poller.register(self.stage._getPolledSettings, self.stage._refreshPosition)
+        poller.start()
+        try:
+            # Idle => polls slowly (after 0.4, 0.8, 1.2 s)
+            self.daemon.n_requests = 0
+            time.sleep(1.3)
+            n_idle = self.daemon.n_requests
+            logging.info("Polled %d times in 1.3 s while idle", n_idle)
+            self.assertLessEqual(n_idle, 4)
+
+            # Stage "moving" => polls quickly
+            self.daemon.n_requests = 0
+            tstart = time.time()
+            while time.time() < tstart + 1.3:
+                self.server.settings["get_stage_position"]["x"] += 1e-6
+                time.sleep(0.01)
+            n_moving = self.daemon.n_requests
+            logging.info("Polled %d times in 1.3 s while moving", n_moving)
+            self.assertGreater(n_moving, 2 * n_idle)
+            testing.assert_pos_almost_equal(self.stage.position.value,
+                                            {"x": -self.server.settings["get_stage_position"]["x"]},
+                                            match_all=False, atol=1e-5)
+        finally:
+            poller.cancel()
+
+
+class TestSettingsPush(unittest.TestCase):
+    """
+    Test the settings changes pushed by the server, using a local fake XT server
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeXTServerPush()
+        cls.daemon = CountingDaemon(host="localhost", port=0)
+        uri = cls.daemon.register(cls.server, "Microscope")
+        cls.daemon_thread = threading.Thread(target=cls.daemon.requestLoop, name="Fake XT server")
+        cls.daemon_thread.start()
+        config = {"name": "sem", "role": "sem", "address": str(uri),
+                  "children": {"scanner": CONFIG_SCANNER,
+                               "focus": CONFIG_FOCUS,
+                               "stage": CONFIG_STAGE,
+                               "detector": CONFIG_DETECTOR,
+                               "chamber": CONFIG_CHAMBER,
+                               }
+                  }
+        cls.microscope = xt_client.SEM(**config)
+        for child in cls.microscope.children.value:
+            if child.name == CONFIG_SCANNER["name"]:
+                cls.scanner = child
+            elif child.name == CONFIG_FOCUS["name"]:
+                cls.efocus = child
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.microscope.terminate()
+        cls.daemon.shutdown()
+        cls.daemon_thread.join(5)
+
+    def test_push(self):
+        time.sleep(0.5)  # Wait for the stream to start
+
+        # When idle, only the keep-alive messages are sent
+        self.daemon.n_requests = 0
+        time.sleep(2)
+        n_idle = self.daemon.n_requests
+        logging.info("Received %d messages in 2 s while idle", n_idle)
+        self.assertLessEqual(n_idle, 3)
+
+        # A change is received almost immediately
+        self.server.settings["get_ht_voltage"] = 20000.0
+        self.server.settings["get_free_working_distance"] = 5e-3
+        tstart = time.time()
+        while self.scanner.accelVoltage.value != 20000.0:
+            self.assertLess(time.time(), tstart + 1, "Voltage change not received")
+            time.sleep(0.01)
+        logging.info("Change received after %g s", time.time() - tstart)
+        while self.efocus.position.value["z"] != 5e-3:
+            self.assertLess(time.time(), tstart + 1, "Focus change not received")
+            time.sleep(0.01)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -29,7 +29,7 @@ import time
 import zipfile
 from concurrent import futures
 from concurrent.futures import CancelledError
-from typing import Any, Dict, Optional, Set, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 import Pyro5.api
 import msgpack_numpy
@@ -79,6 +79,13 @@ RESOLUTIONS = (
 # Xtadapter debian package installation directory which contains xtadapter's zip files
 XT_INSTALL_DIR = "/usr/share/xtadapter"
 
+# Period (s) of the polling of the settings, when the server cannot push the changes. It's adapted
+# between these two values: short while the settings change, and longer when idle.
+POLL_PERIOD_MIN = 0.5
+POLL_PERIOD_MAX = 5
+# Maximum time (s) between two items of the settings stream, when the server pushes the changes
+STREAM_KEEPALIVE = 1
+
 
 class Package(object):
     """
@@ -253,6 +260,205 @@ def check_and_transfer_latest_package(client: 'SEM') -> None:
     except Exception:
         logging.warning("Failure during transfer latest xtadapter package (non critical)", exc_info=True)
 
+
+def read_settings(client: 'SEM', queries: List[Tuple]) -> Dict[Tuple, Any]:
+    """
+    Read multiple settings from the server. If the server supports it (ie, it has a "get_settings"
+    method), it's done in a single round-trip. Otherwise, each setting is read in turn.
+    :param client: the SEM component, connected to the server.
+    :param queries: each query is a tuple with the name of a getter of the server, followed by its
+        arguments. For instance: [("get_dwell_time",), ("get_brightness", "electron1")].
+    :return: query -> value returned by the getter. The values are passed as-is from the server,
+        so tuples are typically received as lists.
+    :raises: the error of the first getter which failed.
+    """
+    queries = [tuple(q) for q in queries]
+    if not queries:
+        return {}
+    with client._proxy_access:
+        client.server._pyroClaimOwnership()
+        if client._has_get_settings:
+            values = client.server.get_settings(queries)
+        else:
+            values = [getattr(client.server, q[0])(*q[1:]) for q in queries]
+    return dict(zip(queries, values))
+
+
+class SettingsPoller:
+    """
+    Keeps up-to-date the settings of all the children of a SEM component. Each child registers the
+    settings it needs, and receives the values whenever they might have changed, to update its VAs.
+    If the server supports it (ie, it has a "stream_settings" method), the server pushes the
+    changes as soon as they happen. Otherwise, the settings are polled, all together, with a single
+    request when it's supported (see read_settings()). The polling is faster when the settings
+    change (eg, the stage is moving), and slower when idle.
+    """
+
+    def __init__(self, client: model.HwComponent, min_period: float = POLL_PERIOD_MIN,
+                 max_period: float = POLL_PERIOD_MAX) -> None:
+        """
+        :param client: the SEM component, which provides the get_settings() method.
+        :param min_period: shortest time in seconds between two updates, when the settings change.
+        :param max_period: longest time in seconds between two updates, when the settings are idle.
+        """
+        self._client = client
+        self._min_period = min_period
+        self._max_period = max_period
+        self._listeners_lock = threading.Lock()
+        self._listeners = []  # list of (get_queries, callback)
+        self._settings = {}  # query -> latest value received
+        self._must_stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="Settings polling %s" % (client.name,),
+                                        daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def cancel(self) -> None:
+        self._must_stop.set()
+
+    def register(self, get_queries: Callable[[], List[Tuple]],
+                 callback: Callable[[Dict[Tuple, Any]], None]) -> None:
+        """
+        Add a listener to the polling.
+        :param get_queries: returns the settings to read, in the format of read_settings(). It's
+            called at every update, so the settings may change over time.
+        :param callback: called after every update, with the settings read (query -> value).
+        """
+        with self._listeners_lock:
+            self._listeners.append((get_queries, callback))
+
+    def unregister(self, callback: Callable[[Dict[Tuple, Any]], None]) -> None:
+        """
+        Remove a listener from the polling.
+        :param callback: the callback passed to register().
+        """
+        with self._listeners_lock:
+            self._listeners = [(q, c) for q, c in self._listeners if c != callback]
+
+    def _get_queries(self) -> Tuple[list, list, List[Tuple]]:
+        """
+        :return: the listeners, the queries of each listener (None if failed), and all the queries
+            merged, keeping the order and dropping duplicates.
+        """
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+
+        all_queries = {}
+        listener_queries = []
+        for get_queries, callback in listeners:
+            try:
+                queries = [tuple(q) for q in get_queries()]
+            except Exception:
+                logging.exception("Failed to list the settings to poll for %s", callback)
+                queries = None
+            listener_queries.append(queries)
+            all_queries.update(dict.fromkeys(queries or ()))
+
+        return listeners, listener_queries, list(all_queries)
+
+    def _notify(self, listeners: list, listener_queries: list, settings: Optional[Dict[Tuple, Any]]) -> None:
+        """
+        Pass the settings to the listeners
+        :param settings: the settings of all the listeners. If None, the settings are read listener
+            per listener.
+        """
+        for (get_queries, callback), queries in zip(listeners, listener_queries):
+            if queries is None:
+                continue
+            try:
+                callback(settings if settings is not None else self._client.get_settings(queries))
+            except Exception:
+                logging.exception("Unexpected failure when polling settings")
+
+    def poll(self) -> bool:
+        """
+        Read all the settings requested by the listeners, and pass them to the listeners.
+        :return: True if any setting changed since the previous update.
+        """
+        listeners, listener_queries, all_queries = self._get_queries()
+        try:
+            settings = self._client.get_settings(all_queries)
+        except Exception:
+            # Read the settings listener per listener, so that a single failing setting doesn't
+            # prevent the other listeners to be updated.
+            logging.debug("Failed to read all the settings at once, will read them separately", exc_info=True)
+            self._notify(listeners, listener_queries, None)
+            return False
+
+        changed = any(self._settings.get(q, settings[q]) != settings[q] for q in all_queries)
+        self._settings.update(settings)
+        self._notify(listeners, listener_queries, settings)
+        return changed
+
+    def _listen_changes(self) -> None:
+        """
+        Receive the settings changes pushed by the server, until the poller is stopped.
+        The server "stream_settings" method receives the list of queries, and returns a generator.
+        It first yields the values of all the queries, and then the (index, value) of the settings
+        which have changed, as soon as they change. To allow the client to stop or change the queries,
+        it yields at least every STREAM_KEEPALIVE seconds, possibly an empty list.
+        :raises: any communication error
+        """
+        # Use a separate connection, as the stream is blocking it
+        with Pyro5.api.Proxy(self._client.server._pyroUri) as proxy:
+            proxy._pyroTimeout = 10 * STREAM_KEEPALIVE
+            while not self._must_stop.is_set():
+                listeners, listener_queries, all_queries = self._get_queries()
+                stream = proxy.stream_settings(all_queries)
+                try:
+                    # First item is the values of all the settings
+                    settings = dict(zip(all_queries, next(stream)))
+                    self._settings.update(settings)
+                    self._notify(listeners, listener_queries, settings)
+                    for changes in stream:
+                        if self._must_stop.is_set():
+                            return
+                        if changes:
+                            for i, v in changes:
+                                settings[all_queries[i]] = v
+                            logging.debug("Received changes of %d settings", len(changes))
+                            self._settings.update(settings)
+                            self._notify(listeners, listener_queries, dict(settings))
+                        # The listeners or their queries changed => start a new stream
+                        listeners_new, listener_queries_new, all_queries_new = self._get_queries()
+                        if all_queries_new != all_queries or listeners_new != listeners:
+                            logging.debug("Settings to listen changed, restarting the stream")
+                            break
+                finally:
+                    stream.close()
+
+    def _run(self) -> None:
+        """
+        Main thread loop: listen to the changes pushed by the server, or poll regularly.
+        """
+        try:
+            period = self._max_period
+            while not self._must_stop.is_set():
+                if "stream_settings" in self._client.server._pyroMethods:
+                    try:
+                        self._listen_changes()
+                    except Exception:
+                        # Typically, the connection was lost. Poll until the server is back.
+                        logging.exception("Failed to receive the settings changes, will retry in %g s",
+                                          self._max_period)
+                        if self._must_stop.wait(self._max_period):
+                            return
+                        self.poll()
+                    continue
+
+                if self._must_stop.wait(period):
+                    return
+                if self.poll():
+                    period = self._min_period
+                else:
+                    period = min(period * 2, self._max_period)
+        except Exception:
+            logging.exception("Failure in the settings polling thread")
+        finally:
+            logging.debug("Settings polling thread over")
+
+
 class SEM(model.HwComponent):
     """
     Driver to communicate with XT software on TFS microscopes. XT is the software TFS uses to control their microscopes.
@@ -286,6 +492,8 @@ class SEM(model.HwComponent):
             logging.debug(
                 f"Successfully connected to xtadapter with software version {self._swVersion} and "
                 f"hardware version {self._hwVersion}")
+            # Recent versions of the xtadapter can read many settings in one call
+            self._has_get_settings = "get_settings" in self.server._pyroMethods
         except CommunicationError as err:
             raise HwError("Failed to connect to XT server '%s'. Check that the "
                           "uri is correct and XT server is"
@@ -306,6 +514,9 @@ class SEM(model.HwComponent):
 
         has_detector = "detector" in children
 
+        # All the children register to it, to update their settings regularly
+        self._settings_poller = SettingsPoller(self)
+
         if "scanner" in children:
             kwargs = children["scanner"]
             self._scanner = Scanner(parent=self, daemon=daemon, has_detector=has_detector, **kwargs)
@@ -355,7 +566,13 @@ class SEM(model.HwComponent):
                 self._detector = Detector(parent=self, daemon=daemon, **ckwargs)
             self.children.value.add(self._detector)
 
+        # Refresh regularly the settings, from the hardware
+        self._settings_poller.start()
+
     def terminate(self):
+        if hasattr(self, "_settings_poller"):
+            self._settings_poller.cancel()
+
         for child in self.children.value:
             child.terminate()
 
@@ -376,6 +593,17 @@ class SEM(model.HwComponent):
             self.server._pyroClaimOwnership()
             return self.server.transfer_latest_package(data)
 
+    def get_settings(self, queries: List[Tuple]) -> Dict[Tuple, Any]:
+        """
+        Read multiple settings at once, in a single call to the server if it supports it.
+        The server "get_settings" method receives the list of queries and returns the list of values.
+
+        :param queries: each query is a tuple with the name of a getter of the server, followed by
+            its arguments. For instance: [("get_dwell_time",), ("get_brightness", "electron1")].
+        :return: query -> value returned by the getter, as-is from the server.
+        """
+        return read_settings(self, queries)
+
     def move_stage(self, position: Dict[str, float], rel: bool = False) -> None:
         """
         Move the stage the given position in meters. This is non-blocking. Throws an error when the requested position
@@ -1483,22 +1711,41 @@ class Scanner(model.Emitter):
 
         # Refresh regularly the values, from the hardware, starting from now
         self._updateSettings()
-        self._va_poll = util.RepeatingTimer(5, self._updateSettings, "Settings polling")
-        self._va_poll.start()
+        self.parent._settings_poller.register(self._getPolledSettings, self._onPolledSettings)
 
     def terminate(self):
-        if self._va_poll:
-            self._va_poll.cancel()
-            self._va_poll = None
+        self.parent._settings_poller.unregister(self._onPolledSettings)
         super().terminate()
 
+    def _getPolledSettings(self) -> List[Tuple]:
+        """
+        :return: the settings to read from the server, to update the VAs (see SEM.get_settings())
+        """
+        queries = [("get_scan_mode",), ("get_ht_voltage",), ("beam_is_blanked",), ("get_ebeam_spotsize",),
+                   ("get_beam_shift",), ("get_rotation",), ("get_scanning_size",)]
+        if self._has_detector:
+            queries += [("get_dwell_time",), ("get_resolution",)]
+        return queries
+
     def _updateSettings(self) -> None:
         """
         Read all the current settings from the SEM and reflects them on the VAs
         """
+        try:
+            settings = self.parent.get_settings(self._getPolledSettings())
+        except Exception:
+            logging.exception("Unexpected failure when polling settings")
+            return
+        self._onPolledSettings(settings)
+
+    def _onPolledSettings(self, settings: Dict[Tuple, Any]) -> None:
+        """
+        Reflects the settings read from the SEM on the VAs
+        :param settings: the values of (at least) the settings returned by _getPolledSettings()
+        """
         logging.debug("Updating SEM settings")
         try:
-            external = self._isExternal()
+            external = settings[("get_scan_mode",)].lower() == "external"
             if external != self.external.value:
                 self.external._value = external
                 self.external.notify(external)
@@ -1507,12 +1754,12 @@ class Scanner(model.Emitter):
             # If external is True i.e. the scan mode is 'external' the dwellTime and resolution are
             # disabled and hence no need to reflect settings on the VAs.
             if self._has_detector and not self.external.value:
-                dwell_time = self.parent.get_dwell_time()
+                dwell_time = settings[("get_dwell_time",)]
                 if dwell_time != self.dwellTime.value:
                     self.dwellTime._value = dwell_time
                     self.dwellTime.notify(dwell_time)
-                    self._updateResolution()
-            voltage = self.parent.get_ht_voltage()
+                    self._updateResolution(tuple(settings[("get_resolution",)]))
+            voltage = settings[("get_ht_voltage",)]
             v_range = self.accelVoltage.range
             if not v_range[0] <= voltage <= v_range[1]:
                 logging.info("Voltage {} V is outside of range {}, clipping to nearest value.".format(voltage, v_range))
@@ -1520,24 +1767,24 @@ class Scanner(model.Emitter):
             if voltage != self.accelVoltage.value:
                 self.accelVoltage._value = voltage
                 self.accelVoltage.notify(voltage)
-            blanked = self.parent.beam_is_blanked()  # blanker status on the HW
+            blanked = settings[("beam_is_blanked",)]  # blanker status on the HW
             # if blanker is in auto mode (None), don't care about HW status (self-regulated)
             if self.blanker.value is not None and blanked != self.blanker.value:
                 self.blanker._value = blanked
                 self.blanker.notify(blanked)
-            spot_size = self.parent.get_ebeam_spotsize()
+            spot_size = settings[("get_ebeam_spotsize",)]
             if spot_size != self.spotSize.value:
                 self.spotSize._value = spot_size
                 self.spotSize.notify(spot_size)
-            beam_shift = self.parent.get_beam_shift()
+            beam_shift = tuple(settings[("get_beam_shift",)])
             if beam_shift != self.shift.value:
                 self.shift._value = beam_shift
                 self.shift.notify(beam_shift)
-            rotation = self.parent.get_rotation()
+            rotation = settings[("get_rotation",)]
             if rotation != self.rotation.value:
                 self.rotation._value = rotation
                 self.rotation.notify(rotation)
-            fov = self.parent.get_scanning_size()[0]
+            fov = settings[("get_scanning_size",)][0]
             if fov != self.horizontalFoV.value:
                 self.horizontalFoV._value = fov
                 mag = self._hfw_nomag / fov
@@ -1570,11 +1817,13 @@ class Scanner(model.Emitter):
     def _onScale(self, s) -> None:
         self._updatePixelSize()
 
-    def _updateResolution(self) -> None:
+    def _updateResolution(self, resolution: Optional[Tuple[int, int]] = None) -> None:
         """
         To be called to read the server resolution and update the corresponding VAs
+        :param resolution: the resolution, if it has already been read from the server
         """
-        resolution = tuple(self.parent.get_resolution())
+        if resolution is None:
+            resolution = tuple(self.parent.get_resolution())
         if resolution != self.resolution.value:
             scale = (self._shape[0] / resolution[0],) * 2
             self.scale._value = scale  # To not call the setter
@@ -1804,8 +2053,7 @@ class Detector(model.Detector):
 
         # Refresh regularly the values, from the hardware, starting from now
         self._updateSettings()
-        self._va_poll = util.RepeatingTimer(5, self._updateSettings, "Settings polling detector")
-        self._va_poll.start()
+        self.parent._settings_poller.register(self._getPolledSettings, self._onPolledSettings)
 
     def terminate(self) -> None:
         if self._generator:
@@ -1813,9 +2061,7 @@ class Detector(model.Detector):
             self._genmsg.put(GEN_TERM)
             self._generator.join(5)
             self._generator = None
-        if self._va_poll:
-            self._va_poll.cancel()
-            self._va_poll = None
+        self.parent._settings_poller.unregister(self._onPolledSettings)
         super().terminate()
 
     def start_generate(self) -> None:
@@ -1999,15 +2245,30 @@ class Detector(model.Detector):
 
         return scanner_name
 
+    def _getPolledSettings(self) -> List[Tuple]:
+        """
+        :return: the settings to read from the server, to update the VAs (see SEM.get_settings())
+        """
+        channel = self._scanner.channel
+        return [("get_brightness", channel), ("get_contrast", channel)]
+
     def _updateSettings(self) -> None:
         """
         Reads all the current settings from the Detector and reflects them on the VAs
         """
-        brightness = self.parent.get_brightness(self._scanner.channel)
+        self._onPolledSettings(self.parent.get_settings(self._getPolledSettings()))
+
+    def _onPolledSettings(self, settings: Dict[Tuple, Any]) -> None:
+        """
+        Reflects the settings read from the SEM on the VAs
+        :param settings: the values of (at least) the settings returned by _getPolledSettings()
+        """
+        channel = self._scanner.channel
+        brightness = settings[("get_brightness", channel)]
         if brightness != self.brightness.value:
             self.brightness._value = brightness
             self.brightness.notify(brightness)
-        contrast = self.parent.get_contrast(self._scanner.channel)
+        contrast = settings[("get_contrast", channel)]
         if contrast != self.contrast.value:
             self.contrast._value = contrast
             self.contrast.notify(contrast)
@@ -2097,9 +2358,7 @@ class Chamber(model.Actuator):
         info = self.parent.pressure_info()
         self.pressure = model.FloatContinuous(info["range"][0], info["range"], readonly=True, unit=info["unit"])
         self._refreshPressure()
-
-        self._polling_thread = util.RepeatingTimer(5, self._refreshPressure, "Pressure polling")
-        self._polling_thread.start()
+        self.parent._settings_poller.register(self._getPolledSettings, self._onPolledSettings)
 
         self._executor = CancellableThreadPoolExecutor(max_workers=1)
 
@@ -2132,14 +2391,27 @@ class Chamber(model.Actuator):
             self.parent.vent()
         self._refreshPressure()
 
+    def _getPolledSettings(self) -> List[Tuple]:
+        """
+        :return: the settings to read from the server, to update the VAs (see SEM.get_settings())
+        """
+        return [("get_vacuum_state",), ("get_pressure",)]
+
     def _refreshPressure(self) -> None:
+        self._onPolledSettings(self.parent.get_settings(self._getPolledSettings()))
+
+    def _onPolledSettings(self, settings: Dict[Tuple, Any]) -> None:
+        """
+        Reflects the settings read from the SEM on the VAs
+        :param settings: the values of (at least) the settings returned by _getPolledSettings()
+        """
         # Position (vacuum state)
-        state = self.parent.get_vacuum_state()
+        state = settings[("get_vacuum_state",)]
         val = {"vacuum": PRESSURE_PUMPED if state == "vacuum" else PRESSURE_VENTED}
         self.position._set_value(val, force_write=True)
 
         # Pressure
-        pressure = self.parent.get_pressure()
+        pressure = settings[("get_pressure",)]
         if pressure != -1:  # -1 is returned when the chamber is vented
             self.pressure._set_value(pressure, force_write=True)
             logging.debug("Updated chamber pressure, %s Pa, vacuum state %s.", pressure, val["vacuum"])
@@ -2153,9 +2425,7 @@ class Chamber(model.Actuator):
             self._executor.cancel()
             self._executor.shutdown()
             self._executor = None
-        if self._polling_thread:
-            self._polling_thread.cancel()
-            self._polling_thread = None
+        self.parent._settings_poller.unregister(self._onPolledSettings)
         super().terminate()
 
 
@@ -2265,17 +2535,14 @@ class Stage(model.Actuator):
         self._switch_coordinate_system(raw_coordinates)
 
         # Refresh regularly the position
-        self._pos_poll = util.RepeatingTimer(5, self._refreshPosition, "Stage position polling")
-        self._pos_poll.start()
+        self.parent._settings_poller.register(self._getPolledSettings, self._refreshPosition)
 
     def terminate(self):
         if self._executor:
             self._executor.cancel()
             self._executor.shutdown()
             self._executor = None
-        if self._pos_poll:
-            self._pos_poll.cancel()
-            self._pos_poll = None
+        self.parent._settings_poller.unregister(self._refreshPosition)
         super().terminate()
 
     def _switch_coordinate_system(self, raw_coordinates: bool) -> None:
@@ -2303,12 +2570,13 @@ class Stage(model.Actuator):
                 # Do not raise an error if non-raw coordinates are requested, because non-raw is the default in old
                 # versions of the xtadapter
 
-    def _updatePosition(self) -> None:
+    def _updatePosition(self, raw_pos: Optional[Dict[str, float]] = None) -> None:
         """
         update the position VA
+        :param raw_pos: the position as reported by the server, if it has already been read
         """
         old_pos = self.position.value
-        pos = self._getPosition()
+        pos = self._getPosition(raw_pos)
         if self._raw_coordinates:
             # correct for the offset such that the stage coordinates displayed in
             # TFS software is the same as Odemis
@@ -2328,21 +2596,33 @@ class Stage(model.Actuator):
         if old_pos != self.position.value:
             logging.debug("Updated position to %s", self.position.value)
 
-    def _refreshPosition(self) -> None:
+    def _getPolledSettings(self) -> List[Tuple]:
+        """
+        :return: the settings to read from the server, to update the position (see SEM.get_settings())
+        """
+        return [("get_stage_position",)]
+
+    def _refreshPosition(self, settings: Dict[Tuple, Any]) -> None:
         """
         Called regularly to update the current position
+        :param settings: the values of (at least) the settings returned by _getPolledSettings()
         """
         # We don't use the VA setters, to avoid sending back to the hardware a
         # set request
         logging.debug("Updating SEM stage position")
         try:
-            self._updatePosition()
+            self._updatePosition(settings[("get_stage_position",)])
         except Exception:
             logging.exception("Unexpected failure when updating position")
 
-    def _getPosition(self) -> Dict[str, float]:
-        """Get position and translate the axes names to be Odemis compatible."""
-        pos = self.parent.get_stage_position()
+    def _getPosition(self, raw_pos: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        """
+        Get position and translate the axes names to be Odemis compatible.
+        :param raw_pos: the position as reported by the server. If None, it is read from the server.
+        """
+        if raw_pos is None:
+            raw_pos = self.parent.get_stage_position()
+        pos = dict(raw_pos)
         pos["rx"] = pos.pop("t")
         pos["rz"] = pos.pop("r")
         # Make sure the full rotations are within the range (because the SEM
@@ -2634,17 +2914,14 @@ class Focus(model.Actuator):
                              "An ebeam or multi-beam scanner is a required child component for the Focus class")
 
         # Refresh regularly the position
-        self._pos_poll = util.RepeatingTimer(5, self._refreshPosition, "Focus position polling")
-        self._pos_poll.start()
+        self.parent._settings_poller.register(self._getPolledSettings, self._refreshPosition)
 
     def terminate(self) -> None:
         if self._executor:
             self._executor.cancel()
             self._executor.shutdown()
             self._executor = None
-        if self._pos_poll:
-            self._pos_poll.cancel()
-            self._pos_poll = None
+        self.parent._settings_poller.unregister(self._refreshPosition)
         super().terminate()
 
     @isasync
@@ -2704,22 +2981,31 @@ class Focus(model.Actuator):
                 logging.warning("Failed to cancel autofocus: %s", error_msg)
                 return False
 
-    def _updatePosition(self) -> None:
+    def _updatePosition(self, z: Optional[float] = None) -> None:
         """
         update the position VA
+        :param z: the free working distance, if it has already been read from the server
         """
-        z = self.parent.get_free_working_distance()
+        if z is None:
+            z = self.parent.get_free_working_distance()
         self.position._set_value({"z": z}, force_write=True)
 
-    def _refreshPosition(self) -> None:
+    def _getPolledSettings(self) -> List[Tuple]:
+        """
+        :return: the settings to read from the server, to update the position (see SEM.get_settings())
+        """
+        return [("get_free_working_distance",)]
+
+    def _refreshPosition(self, settings: Dict[Tuple, Any]) -> None:
         """
         Called regularly to update the current position
+        :param settings: the values of (at least) the settings returned by _getPolledSettings()
         """
         # We don't use the VA setters, to avoid sending back to the hardware a
         # set request
         logging.debug("Updating SEM focus position")
         try:
-            self._updatePosition()
+            self._updatePosition(settings[("get_free_working_distance",)])
         except Exception:
             logging.exception("Unexpected failure when updating position")
 
@@ -2885,8 +3171,8 @@ class MultiBeamScanner(Scanner):
             setter=self._setBeamPower
         )
 
-        # TODO If _updateSettings is updated move this to the top of the __init__ function. For now the update thread
-        #  can only be started after the MB VA's are initialized.
+        # The settings are read at the end of the init of the super class, so it can only be called after the
+        # MB VA's are initialized.
         # Instantiate the super scanner class with the update thread
         super(MultiBeamScanner, self).__init__(name, role, parent, hfw_nomag, **kwargs)
 
@@ -2906,52 +3192,54 @@ class MultiBeamScanner(Scanner):
             f = self._executor.submitf(f, self.parent.start_autostig)
         return f
 
-    def _updateSettings(self) -> None:
-        """
-        Read all the current settings from the SEM and reflects them on the VAs
-        """
-        # TODO When the new approach of adding update function to a list is implemented in xt_client.py instead of
-        #  overwriting the method updateSettings the method _updateMBSettings can be added to the list of
-        #  functions to be updated. That means the overwritten part in this class is no longer needed.
+    def _getPolledSettings(self) -> List[Tuple]:
+        # XT client settings + XTtoolkit settings
+        return super()._getPolledSettings() + [
+            ("scanning_size_info",), ("get_delta_pitch",), ("get_stigmator",), ("get_pattern_stigmator",),
+            ("get_dc_coils",), ("get_mpp_orientation",), ("get_beamlet_index",),
+            ("get_compound_lens_focusing_mode",), ("get_use_case",), ("get_beam_is_on",),
+        ]
 
+    def _onPolledSettings(self, settings: Dict[Tuple, Any]) -> None:
         # Polling XT client settings
-        super(MultiBeamScanner, self)._updateSettings()
+        super()._onPolledSettings(settings)
         # Polling XTtoolkit settings
         try:
-            self._updateHFWRange()
-            delta_pitch = self.parent.get_delta_pitch() * 1e-6
+            self._updateHFWRange(settings[("scanning_size_info",)]["range"]["x"],
+                                 settings[("get_scanning_size",)][0])
+            delta_pitch = settings[("get_delta_pitch",)] * 1e-6
             if delta_pitch != self.deltaPitch.value:
                 self.deltaPitch._value = delta_pitch
                 self.deltaPitch.notify(delta_pitch)
-            beam_stigmator = self.parent.get_stigmator()
+            beam_stigmator = tuple(settings[("get_stigmator",)])
             if beam_stigmator != self.beamStigmator.value:
                 self.beamStigmator._value = beam_stigmator
                 self.beamStigmator.notify(beam_stigmator)
-            pattern_stigmator = self.parent.get_pattern_stigmator()
+            pattern_stigmator = tuple(settings[("get_pattern_stigmator",)])
             if pattern_stigmator != self.patternStigmator.value:
                 self.patternStigmator._value = pattern_stigmator
                 self.patternStigmator.notify(pattern_stigmator)
-            beam_shift_transformation_matrix = self.parent.get_dc_coils()
+            beam_shift_transformation_matrix = settings[("get_dc_coils",)]
             if beam_shift_transformation_matrix != self.beamShiftTransformationMatrix.value:
                 self.beamShiftTransformationMatrix._value = beam_shift_transformation_matrix
                 self.beamShiftTransformationMatrix.notify(beam_shift_transformation_matrix)
-            mpp_rotation = math.radians(self.parent.get_mpp_orientation())
+            mpp_rotation = math.radians(settings[("get_mpp_orientation",)])
             if mpp_rotation != self.multiprobeRotation.value:
                 self.multiprobeRotation._value = mpp_rotation
                 self.multiprobeRotation.notify(mpp_rotation)
-            beamlet_index = tuple(int(i) for i in self.parent.get_beamlet_index())
+            beamlet_index = tuple(int(i) for i in settings[("get_beamlet_index",)])
             if beamlet_index != self.beamletIndex.value:
                 self.beamletIndex._value = beamlet_index
                 self.beamletIndex.notify(beamlet_index)
-            immersion = self.parent.get_compound_lens_focusing_mode() > 0
+            immersion = settings[("get_compound_lens_focusing_mode",)] > 0
             if immersion != self.immersion.value:
                 self.immersion._value = immersion
                 self.immersion.notify(immersion)
-            multibeam_mode = (self.parent.get_use_case() == 'MultiBeamTile')
+            multibeam_mode = (settings[("get_use_case",)] == 'MultiBeamTile')
             if multibeam_mode != self.multiBeamMode.value:
                 self.multiBeamMode._value = multibeam_mode
                 self.multiBeamMode.notify(multibeam_mode)
-            power = self.parent.get_beam_is_on()
+            power = settings[("get_beam_is_on",)]
             if power != self.power.value:
                 self.power._value = power
                 self.power.notify(power)
@@ -2989,17 +3277,23 @@ class MultiBeamScanner(Scanner):
         self._updateHFWRange()
         return self.parent.get_compound_lens_focusing_mode() > 0
 
-    def _updateHFWRange(self) -> None:
+    def _updateHFWRange(self, hfov_range: Optional[Tuple[float, float]] = None,
+                        fov: Optional[float] = None) -> None:
         """
         To be called when the field of view range might have changed.
         This can happen when some settings are changed.
         If the range is changed, the VA subscribers will be updated.
+        :param hfov_range: the field of view range, if it has already been read from the server
+        :param fov: the field of view, if it has already been read from the server
         """
-        hfov_range = tuple(self.parent.scanning_size_info()["range"]["x"])
+        if hfov_range is None:
+            hfov_range = self.parent.scanning_size_info()["range"]["x"]
+        hfov_range = tuple(hfov_range)
         if self.horizontalFoV.range != hfov_range:
             logging.debug("horizontalFoV range changed to %s", hfov_range)
 
-            fov = self.parent.get_scanning_size()[0]
+            if fov is None:
+                fov = self.parent.get_scanning_size()[0]
             self.horizontalFoV._value = fov
             self.horizontalFoV.range = hfov_range  # Does the notification
 
@@ -574,7 +574,8 @@ class DblMicroscopeCanvas(canvas.DraggableCanvas):
                 pos = util.img.getCenterOfTiles(rgba_im, tiles_merged_shape)
             else:
                 # Get converted RGBA image from cache, or create it and cache it
-                # On large images it costs 100 ms (per image and per canvas)
+                # On large images it costs 100 ms (per image and per canvas), unless
+                # the image comes with its BGRA version (as computed by the projections)
                 rgba_im = self._format_rgba_darray_cached(rgbim)
                 im_cache.append((weakref.ref(rgbim), rgba_im))
 
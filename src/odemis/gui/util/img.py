@@ -88,6 +88,15 @@ def format_rgba_darray(im_darray, alpha=None):
     return (DataArray of shape Y,X,4): The return type is the same of im_darray
     """
     if im_darray.shape[-1] == 3:
+        if alpha is None:
+            # If the image already comes with its BGRA version (as computed by
+            # the projections), it can be directly used.
+            bgra = getattr(im_darray, "bgra", None)
+            if bgra is not None and bgra.shape == im_darray.shape[:2] + (4,):
+                new_darray = model.DataArray(bgra)
+                new_darray.metadata['byteswapped'] = True
+                return new_darray
+
         h, w, _ = im_darray.shape
         rgba_shape = (h, w, 4)
         rgba = numpy.empty(rgba_shape, dtype=numpy.uint8)
@@ -2783,12 +2792,14 @@ def NDImage2wxImage(image):
     Converts a NDImage into a wxImage.
     Note, the copy of the data will be avoided whenever possible.
     image (ndarray of uint8 with shape YX3 or YX4): original image,
-     order of last dimension is RGB(A)
+     order of last dimension is RGB(A). If it's not C-contiguous, it's copied.
     return (wxImage)
     """
     assert(len(image.shape) == 3)
     size = image.shape[1::-1]
     if image.shape[2] == 3: # RGB
+        # The buffer must be contiguous => 1 copy if it's not
+        image = numpy.ascontiguousarray(image)
         wim = wx.ImageFromBuffer(*size, dataBuffer=image) # 0 copy
         return wim
     elif image.shape[2] == 4: # RGBA
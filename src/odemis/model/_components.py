@@ -69,6 +69,25 @@ def hasVA(component, vaname):
     return isinstance(getattr(component, vaname, None), _vattributes.VigilantAttributeBase)
 
 
+# Order in which VAs should be set to ensure the values are kept as-is (as each
+# VA might change the allowed values of the next ones). The VAs not listed are
+# set afterwards. This should be the behaviour of the hardware component...
+# but the driver might be buggy, so beware!
+VA_ORDER = ("binning", "scale", "resolution", "translation", "rotation", "dwellTime",
+            "timeRange", "streakMode", "MCPGain")
+
+
+def _index_in_va_order(vaname):
+    """
+    vaname (str): name of a VA
+    return (int): position of the VA in VA_ORDER
+    """
+    try:
+        return VA_ORDER.index(vaname)
+    except ValueError:  # not listed => put last
+        return len(VA_ORDER)
+
+
 def getROAttributes(component):
     """
     returns (dict of name -> value): all the names of the roattributes and their values
@@ -174,6 +193,58 @@ class Component(ComponentBase):
     def name(self):
         return self._name
 
+    def _getVA(self, vaname):
+        """
+        vaname (str): name of the VA
+        return (VigilantAttributeBase): the VA of this component
+        raises LookupError: if the component has no such VA
+        """
+        va = getattr(self, vaname, None)
+        if not isinstance(va, _vattributes.VigilantAttributeBase):
+            raise LookupError("Component %s has no VA %s" % (self.name, vaname))
+        return va
+
+    def getVAValues(self, vanames):
+        """
+        Read the value of multiple VAs at once. When the component is remote,
+        this is done in a single call.
+        vanames (iterable of str): names of the VAs
+        return (dict str -> value): VA name -> current value
+        raises LookupError: if one of the names is not a VA of the component
+        """
+        return {n: self._getVA(n).value for n in vanames}
+
+    def setVAValues(self, values, ignore_errors=False):
+        """
+        Change the value of multiple VAs at once. When the component is remote,
+        this is done in a single call. The VAs are set following VA_ORDER, so
+        that a VA changed first doesn't prevent the next ones from accepting
+        their value.
+        values (dict str -> value): VA name -> new value
+        ignore_errors (bool): if True, a VA which cannot be set is skipped
+          (and a warning logged), and the other ones are still set.
+          Otherwise, the first error is raised, and the following VAs are not set.
+        return (dict str -> value): VA name -> value after all the VAs have
+          been set. It can differ from the requested value, if the setter
+          adjusted it, or if setting it failed.
+        raises
+            LookupError: if one of the names is not a VA of the component
+            Exception: any error raised while setting a VA (if not ignore_errors)
+        """
+        vanames = sorted(values.keys(), key=_index_in_va_order)
+        vas = {n: self._getVA(n) for n in vanames}
+        for n in vanames:
+            try:
+                vas[n].value = values[n]
+            except Exception as ex:
+                if not ignore_errors:
+                    raise
+                logging.warning("Failed to set %s.%s to %s: %s", self.name, n, values[n], ex)
+
+        # Read back only once everything is set, as a VA might be updated when
+        # changing another one (eg, resolution when changing scale).
+        return {n: va.value for n, va in vas.items()}
+
     def terminate(self):
         """
         Stop the Component from executing.
@@ -274,6 +345,36 @@ def ComponentSerializer(self):
 Pyro4.Daemon.serializers[Component] = ComponentSerializer
 
 
+class PreservedVAs(object):
+    """
+    Context manager which saves the values of some VAs of a component when
+    entering, and restores them when leaving. For a remote component, saving
+    and restoring each take a single call, whatever the number of VAs.
+    The saved values (dict VA name -> value) are returned when entering.
+    """
+
+    def __init__(self, comp, vanames):
+        """
+        comp (Component): the component with the VAs
+        vanames (iterable of str): the names of the VAs to preserve
+        """
+        self._comp = comp
+        self._vanames = tuple(vanames)
+        self.values = {}
+
+    def __enter__(self):
+        self.values = self._comp.getVAValues(self._vanames)
+        return self.values
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        returns True if the exception is to be suppressed (never)
+        """
+        # Restore as much as possible, even if one VA fails
+        self._comp.setVAValues(self.values, ignore_errors=True)
+        return False
+
+
 class HwComponent(Component, metaclass=ABCMeta):
     """
     A generic class which represents a physical component of the microscope
@@ -561,10 +662,13 @@ class Microscope(HwComponent):
         if kwargs:
             raise ValueError("Microscope component cannot have initialisation arguments.")
 
-        # These 2 VAs should not modified, but by the backend
+        # These 3 VAs should not modified, but by the backend
         self.alive = _vattributes.VigilantAttribute(set())  # set of components
         # dict str -> int or Exception: name of component -> State
         self.ghosts = _vattributes.VigilantAttribute(dict())
+        # dict str -> (float, float or None): name of component -> time (s, since epoch)
+        # at which its instantiation started and ended (None if still running)
+        self.startupTimeline = _vattributes.VigilantAttribute(dict())
 
     @roattribute
     def model(self):
@@ -25,12 +25,18 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 # losslessly and with metadata attached (see _metadata for the conventional ones).
 
 import Pyro4
+import copy
+import functools
+import hashlib
 import logging
+from multiprocessing import shared_memory
 import numpy
 from odemis.model import _metadata, _vattributes
 from odemis.util import inspect_getmembers
 from odemis.util.weak import WeakMethod, WeakRefLostError
 import os
+import pickle
+import struct
 import threading
 import time
 import weakref
@@ -192,14 +198,816 @@ class DataFlowBase(object):
                 logging.exception("Exception when notifying a data_flow")
 
 
+# Arrays smaller than this are always sent as a copy over 0MQ, as the shared
+# memory bookkeeping would cost more than the copy itself.
+SHM_MIN_SIZE = 64 * 1024  # bytes
+SHM_ALIGNMENT = 4096  # bytes, each slot starts on a (memory) page boundary
+SHM_MAX_READERS = 8  # maximum number of subscribers for which the slots used are tracked
+# When no array may be discarded, maximum time the writer waits for the slowest
+# subscriber to process the array of a slot before reusing it. After that, the
+# array is copied over 0MQ instead.
+SHM_WAIT_TIMEOUT = 1  # s
+SHM_POLL_PERIOD = 0.5e-3  # s
+_SHM_SEQ_NONE = 0  # sequence number of a slot never written, or being written
+_SHM_NSLOTS = struct.Struct("<Q")  # first value of the shared memory: number of slots
+_shm_local_names = set()  # names of the shared memories created by this process
+
+
+def _shm_reader_id(name):
+    """
+    name (str): name of the subscriber (as passed to DataFlow.subscribe())
+    return (int > 0): ID of the subscriber in the shared memory
+    """
+    h = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(h, "little") | 1
+
+
+def _shm_header(buf, nslots):
+    """
+    Map the header of the shared memory of a _SharedMemoryRing
+    buf (memoryview): the shared memory
+    nslots (int > 0): number of slots
+    return:
+      seqs (numpy.ndarray of uint64 of shape nslots): sequence number of the
+        array in each slot.
+      entries (numpy.ndarray of uint64 of shape SHM_MAX_READERS x (2 + nslots)):
+        for each subscriber: its ID (0 if not used), the sequence number of the
+        latest array it has processed, and for each slot, the number of arrays
+        it is still using.
+    """
+    offset = _SHM_NSLOTS.size
+    seqs = numpy.ndarray((nslots,), dtype=numpy.uint64, buffer=buf, offset=offset)
+    offset += seqs.nbytes
+    entries = numpy.ndarray((SHM_MAX_READERS, 2 + nslots), dtype=numpy.uint64,
+                            buffer=buf, offset=offset)
+    return seqs, entries
+
+
+def _close_shm(shm, unlink=False):
+    """
+    Close (and unlink) a shared memory
+    return (bool): True if it could be closed, False if some arrays still use it
+    """
+    if unlink:
+        _shm_local_names.discard(shm.name)
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    try:
+        shm.close()
+    except BufferError:  # Some arrays still use it
+        return False
+    return True
+
+
+class _SharedMemoryRing(object):
+    """
+    Ring buffer of fixed size slots in POSIX shared memory, used by a DataFlow
+    to pass the array data to the subscribers in other processes without copying
+    it through the 0MQ socket. Only the writer (the DataFlow) should use it.
+    The shared memory starts with a header containing the number of slots, the
+    sequence number of the array stored in each slot (0 when the slot is being
+    written), and for each subscriber, the latest array it has processed and
+    the slots it is still using. The slots used by a subscriber are never
+    overwritten. If the arrays may not be discarded, a slot is also not
+    overwritten before every subscriber has processed its array.
+    """
+
+    def __init__(self, basename, nslots):
+        """
+        basename (str): prefix of the name of the shared memory objects
+        nslots (int > 0): number of arrays which can be stored simultaneously
+        """
+        self._basename = basename
+        self._nslots = nslots
+        self._header_size = _align(_SHM_NSLOTS.size + 8 * (nslots + SHM_MAX_READERS * (2 + nslots)),
+                                   SHM_ALIGNMENT)
+        self._slot_size = 0
+        self._shm = None
+        self._seqs = None  # numpy array views on the header
+        self._entries = None
+        self._slot_seqs = numpy.zeros((nslots,), dtype=numpy.uint64)  # sequence number of each slot
+        self._generation = 0
+        self._seq = 0  # sequence number of the latest array written
+        # Previous shared memories, kept until the subscribers have received all
+        # their arrays: SharedMemory, sequence number of the last array written
+        self._retired = []
+        self._readers = {}  # name -> entry index, seq when subscribed (of the subscribed readers)
+        self._owners = [None] * SHM_MAX_READERS  # name of the reader of each entry
+        self._lock = threading.Lock()
+
+    def add_reader(self, name):
+        """
+        Start tracking which arrays a (new) subscriber uses
+        name (str): unique name of the subscriber
+        """
+        with self._lock:
+            try:
+                idx = self._owners.index(name)
+            except ValueError:
+                idx = self._find_free_entry()
+                if idx is None:
+                    # It will still work, but the reader will have to copy the arrays
+                    logging.warning("Too many subscribers to shared memory %s, %s will not be tracked",
+                                    self._basename, name)
+                    return
+                self._owners[idx] = name
+                if self._entries is not None:
+                    self._entries[idx] = 0
+                    self._entries[idx, 0] = _shm_reader_id(name)
+            # It will only receive the arrays sent from now on
+            self._readers[name] = idx, self._seq
+
+    def remove_reader(self, name):
+        """
+        Stop waiting for a subscriber to process the arrays. The slots it still
+        uses are not overwritten until it has released them.
+        name (str): unique name of the subscriber
+        """
+        with self._lock:
+            self._readers.pop(name, None)
+
+    def _find_free_entry(self):
+        """
+        return (int or None): index of an entry not used by any reader
+        """
+        for idx, owner in enumerate(self._owners):
+            if owner is None:
+                return idx
+
+        for idx, owner in enumerate(self._owners):
+            if owner not in self._readers and not self._is_entry_used(idx):
+                return idx
+
+        return None
+
+    def _is_entry_used(self, idx):
+        """
+        return (bool): True if the reader of the entry still uses any array
+        """
+        if self._entries is not None and self._entries[idx, 2:].any():
+            return True
+        for shm, _ in self._retired:
+            _, entries = _shm_header(shm.buf, self._nslots)
+            if entries[idx, 2:].any():
+                return True
+        return False
+
+    def _min_processed(self):
+        """
+        return (int or None): sequence number of the latest array processed by
+          every subscriber, or None if there is no subscriber.
+        """
+        retired_entries = [_shm_header(shm.buf, self._nslots)[1] for shm, _ in self._retired]
+        if self._entries is not None:
+            retired_entries.append(self._entries)
+
+        processed = None
+        for idx, start_seq in self._readers.values():
+            # The reader updates the shared memory of the latest array it received
+            seq = max([start_seq] + [int(e[idx, 1]) for e in retired_entries])
+            processed = seq if processed is None else min(processed, seq)
+        return processed
+
+    def _forget_dead_readers(self):
+        """
+        Stop waiting for the subscribers whose process has ended without unsubscribing
+        """
+        for name, (idx, _) in list(self._readers.items()):
+            try:
+                # The name of a DataFlowProxy starts with the PID
+                os.kill(int(name.split("/")[0], 16), 0)
+            except ProcessLookupError:
+                logging.info("Subscriber %s to shared memory %s is gone", name, self._basename)
+                del self._readers[name]
+                if self._entries is not None:
+                    self._entries[idx, 2:] = 0
+            except (ValueError, OSError):
+                pass  # Not a standard name, or not allowed to check => assume it's running
+
+    def _allocate(self, nbytes):
+        """
+        (Re)create the shared memory so that each slot can contain nbytes
+        """
+        if self._shm is not None:
+            # Some subscribers might still have to receive arrays stored in the
+            # current shared memory => keep it for now
+            self._seqs = None
+            self._entries = None
+            self._retired.append((self._shm, self._seq))
+            self._shm = None
+
+        self._generation += 1
+        self._slot_size = _align(max(nbytes, 1), SHM_ALIGNMENT)
+        name = "%s-%d" % (self._basename, self._generation)
+        size = self._header_size + self._slot_size * self._nslots
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _shm_local_names.add(self._shm.name)
+        _SHM_NSLOTS.pack_into(self._shm.buf, 0, self._nslots)
+        self._seqs, self._entries = _shm_header(self._shm.buf, self._nslots)
+        self._seqs[:] = _SHM_SEQ_NONE
+        self._entries[:] = 0
+        for idx, owner in enumerate(self._owners):
+            if owner is not None:
+                self._entries[idx, 0] = _shm_reader_id(owner)
+        self._slot_seqs[:] = _SHM_SEQ_NONE
+        logging.debug("Allocated shared memory %s of %d bytes for %d slots",
+                      name, size, self._nslots)
+
+    def _release_retired(self, may_drop):
+        """
+        Unlink the previous shared memories, once the subscribers have received
+        all their arrays
+        may_drop (bool): if True, the arrays not yet received can be discarded
+          (as soon as nslots newer arrays have been written)
+        """
+        if not self._retired:
+            return
+
+        processed = self._min_processed()
+        retired = []
+        for shm, last_seq in self._retired:
+            if (processed is None or processed >= last_seq
+                or (may_drop and self._seq >= last_seq + self._nslots)
+               ):
+                logging.debug("Releasing shared memory %s", shm.name)
+                _close_shm(shm, unlink=True)
+            else:
+                retired.append((shm, last_seq))
+        self._retired = retired
+
+    def _find_free_slot(self, may_drop):
+        """
+        Pick the oldest slot which can be overwritten
+        may_drop (bool): if False, also wait (up to SHM_WAIT_TIMEOUT) until
+          every subscriber has processed the array of the slot.
+        return (int or None): the slot index, or None if none is available
+        """
+        deadline = time.monotonic() + SHM_WAIT_TIMEOUT
+        while True:
+            free = ~self._entries[:, 2:].any(axis=0)
+            if not free.any():
+                # Subscribers are holding to all the arrays, there is no telling
+                # when they will release them.
+                return None
+
+            if not may_drop:
+                processed = self._min_processed()
+                if processed is not None:
+                    free &= self._slot_seqs <= processed
+
+            if free.any():
+                candidates = numpy.flatnonzero(free)
+                return int(candidates[numpy.argmin(self._slot_seqs[candidates])])
+
+            if time.monotonic() > deadline:
+                logging.debug("Subscribers to shared memory %s are too slow, will copy the array",
+                              self._basename)
+                self._forget_dead_readers()
+                return None
+            time.sleep(SHM_POLL_PERIOD)
+
+    def write(self, data, may_drop=True):
+        """
+        Copy the data into a free slot, typically the oldest one.
+        data (numpy.ndarray): the array to store. It doesn't need to be contiguous.
+        may_drop (bool): if True, the arrays not yet received by a subscriber can
+          be overwritten. Otherwise, a slot is only overwritten after all the
+          subscribers have processed its array, waiting up to SHM_WAIT_TIMEOUT.
+        return (dict str -> value or None): the information needed by the reader
+          to find back the array, or None if no slot is available, in which case
+          the array has to be sent by other means.
+        """
+        with self._lock:
+            if self._shm is None or data.nbytes > self._slot_size:
+                self._allocate(data.nbytes)
+            self._release_retired(may_drop)
+
+            slot = self._find_free_slot(may_drop)
+            if slot is None:
+                return None
+
+            # Mark the slot as invalid while it's being written, so that a reader
+            # which hasn't received the previous array of this slot yet drops it.
+            # The readers mark the slot as used *before* checking its sequence
+            # number, so after this, no reader can start using the previous array.
+            self._seqs[slot] = _SHM_SEQ_NONE
+            if self._entries[:, 2 + slot].any():  # A reader just started using it
+                self._seqs[slot] = self._slot_seqs[slot]
+                return None
+
+            offset = self._header_size + slot * self._slot_size
+            dest = numpy.ndarray(data.shape, dtype=data.dtype, buffer=self._shm.buf, offset=offset)
+            numpy.copyto(dest, data, casting="no")  # Also removes the strides, if any
+            del dest  # Don't keep a reference to the buffer, to be able to close it
+            self._seq += 1
+            self._slot_seqs[slot] = self._seq
+            self._seqs[slot] = self._seq
+
+            return {"name": self._shm.name, "slot": slot, "seq": self._seq, "offset": offset}
+
+    def close(self):
+        """
+        Release the shared memory. The subscribers which have it already
+        mapped can still access it until they release it too.
+        """
+        with self._lock:
+            self._seqs = None
+            self._entries = None
+            if self._shm is not None:
+                self._retired.append((self._shm, self._seq))
+                self._shm = None
+            for shm, _ in self._retired:
+                _close_shm(shm, unlink=True)
+            self._retired = []
+
+
+def _release_shm_slot(lock, entry, slot):
+    """
+    Indicate a slot is not used anymore by the reader (called when the array is
+    garbage collected)
+    lock (threading.Lock): lock protecting the entry of the reader
+    entry (numpy.ndarray): entry of the reader in the shared memory header
+    slot (int): index of the slot
+    """
+    with lock:
+        entry[2 + slot] -= 1
+
+
+class _SharedMemoryReader(object):
+    """
+    Counterpart of _SharedMemoryRing, on the subscriber side: converts the
+    information received into read-only views on the shared memory. As long as
+    a view is used, the writer doesn't overwrite its slot.
+    """
+
+    def __init__(self, name):
+        """
+        name (str): name of the subscriber, as passed to DataFlow.subscribe()
+        """
+        self._name = name
+        self._id = _shm_reader_id(name)
+        self._shm = None
+        self._seqs = None  # numpy array views on the header of the current shared memory
+        self._entry = None  # None if the writer doesn't track this reader
+        self._retired = []  # SharedMemory not used anymore, but maybe still referenced
+        self._lock = threading.Lock()  # to update the entry (including from the garbage collector)
+
+    def _attach(self, name):
+        """
+        raise OSError: if the shared memory is not available (anymore)
+        """
+        try:
+            # From Python 3.13, it's possible to ask to not track the memory,
+            # which would otherwise be unlinked when the reader process ends.
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            # If created by this process, the writer will unlink it anyway
+            if shm.name not in _shm_local_names:
+                try:
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister(shm._name, "shared_memory")
+                except Exception:
+                    logging.debug("Failed to untrack shared memory %s", name, exc_info=True)
+
+        self._retire()
+        self._shm = shm
+        nslots, = _SHM_NSLOTS.unpack_from(shm.buf, 0)
+        self._seqs, entries = _shm_header(shm.buf, nslots)
+        idx = numpy.flatnonzero(entries[:, 0] == self._id)
+        if len(idx):
+            self._entry = entries[idx[0]]
+        else:
+            logging.debug("Reader %s not tracked in shared memory %s, will copy the arrays", self._name, name)
+            self._entry = None
+
+    def _retire(self):
+        self._release_retired()
+        if self._shm is not None:
+            self._seqs = None
+            self._entry = None
+            self._retired.append(self._shm)
+            self._shm = None
+
+    def _release_retired(self):
+        self._retired = [shm for shm in self._retired if not _close_shm(shm)]
+
+    def read(self, info, dtype, shape):
+        """
+        info (dict): as returned by _SharedMemoryRing.write()
+        dtype (numpy.dtype): type of the array
+        shape (tuple of int): shape of the array
+        return (numpy.ndarray or None): read-only view on the array, or None if
+          the slot was already overwritten by a newer array.
+        raise OSError: if the shared memory is not available anymore
+        """
+        if self._shm is None or self._shm.name.lstrip("/") != info["name"].lstrip("/"):
+            self._attach(info["name"])
+
+        slot, seq = info["slot"], info["seq"]
+        seqs, entry = self._seqs, self._entry
+        if entry is not None and entry[0] != self._id:
+            # Entry reused for another reader, after this reader unsubscribed
+            entry = None
+
+        offset = info["offset"]
+        nbytes = numpy.dtype(dtype).itemsize * int(numpy.prod(shape))
+        buf = self._shm.buf[offset:offset + nbytes]
+        if entry is None:
+            # The writer doesn't know which arrays are used => copy the data,
+            # and check it was not overwritten in the meantime
+            if seqs[slot] != seq:
+                return None
+            array = numpy.frombuffer(buf, dtype=dtype).copy()
+            if seqs[slot] != seq:
+                return None
+            return array.reshape(shape)
+
+        # Mark the slot as used *before* checking it still contains the array
+        with self._lock:
+            entry[2 + slot] += 1
+        if seqs[slot] != seq:
+            _release_shm_slot(self._lock, entry, slot)
+            return None
+
+        # All the views on the array will have this array as base, so it is
+        # only garbage collected once no view is used anymore.
+        array = numpy.frombuffer(buf, dtype=dtype)
+        array.flags.writeable = False
+        weakref.finalize(array, _release_shm_slot, self._lock, entry, slot)
+        return array.reshape(shape)
+
+    def set_processed(self, seq):
+        """
+        Indicate to the writer that the array has been processed by the listeners
+        seq (int): the sequence number of the array
+        """
+        entry = self._entry
+        if entry is not None and entry[0] == self._id:
+            entry[1] = seq
+
+    def close(self):
+        self._retire()
+        self._release_retired()
+
+
+def _align(size, alignment):
+    """
+    return (int): the smallest multiple of alignment >= size
+    """
+    return -(-size // alignment) * alignment
+
+
+# Binary encoding of the format of the arrays sent over 0MQ.
+# Instead of pickling the whole metadata for every array, which is often more
+# expensive than the data itself for small arrays, the metadata is encoded as a
+# difference compared to a "key frame": the latest array for which all the
+# metadata was sent. Simple values (float, int, str...) are encoded directly,
+# the rest is pickled.
+HEADER_VERSION = 1
+KEYFRAME_PERIOD = 100  # number of arrays after which the full metadata is sent again
+KEYFRAME_SUB_PERIOD = 1  # s, duration after a new subscription during which the full metadata is sent
+
+_HDR_KEYFRAME = 0x01  # The metadata is complete (otherwise, it's a delta)
+_HDR_SHM = 0x02  # The data is in shared memory
+_HDR_DTYPE_PICKLE = 0x04  # The dtype is pickled (because it's structured)
+_HDR_MD_PICKLE = 0x08  # The whole metadata is pickled (because some keys are not str)
+
+_HDR_FIXED = struct.Struct("<BBIB")  # version, flags, keyframe ID, ndim
+_HDR_SHM_INFO = struct.Struct("<QQQ")  # slot, seq, offset
+_HDR_LEN = struct.Struct("<I")
+_HDR_COUNT = struct.Struct("<H")
+_HDR_FLOAT = struct.Struct("<d")
+_HDR_INT = struct.Struct("<q")
+
+_IMMUTABLE_TYPES = (int, float, complex, str, bytes, bool, type(None))
+_NO_VALUE = object()  # To indicate a metadata is not present
+
+
+def _md_equal(a, b):
+    """
+    return (bool): True if the two metadata values are the same
+    """
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, numpy.ndarray):
+        return a.shape == b.shape and a.dtype == b.dtype and numpy.array_equal(a, b)
+    try:
+        return bool(a == b)
+    except Exception:  # eg, comparison of tuples containing arrays
+        return False
+
+
+def _is_immutable(v):
+    if isinstance(v, _IMMUTABLE_TYPES):
+        return True
+    if isinstance(v, tuple):
+        return all(_is_immutable(e) for e in v)
+    return False
+
+
+def _copy_md(md):
+    """
+    return (dict): copy of the metadata, with the mutable values copied too,
+      so that it cannot be affected by changes to the original metadata.
+    """
+    return {k: (v if _is_immutable(v) else copy.deepcopy(v)) for k, v in md.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def _shape_struct(ndim):
+    return struct.Struct("<%dQ" % ndim)
+
+
+def _pack_bytes(b):
+    return _HDR_LEN.pack(len(b)) + b
+
+
+def _unpack_bytes(buf, pos):
+    l, = _HDR_LEN.unpack_from(buf, pos)
+    pos += _HDR_LEN.size
+    return bytes(buf[pos:pos + l]), pos + l
+
+
+def _pack_value(v):
+    # Note: bool must be checked before int, as it's a subclass
+    t = type(v)
+    if t is float:
+        return b"d" + _HDR_FLOAT.pack(v)
+    elif t is bool:
+        return b"b" if v else b"B"
+    elif t is int and -2 ** 63 <= v < 2 ** 63:
+        return b"q" + _HDR_INT.pack(v)
+    elif t is str:
+        return b"s" + _pack_bytes(v.encode("utf-8"))
+    elif v is None:
+        return b"n"
+    elif t is tuple and v and all(type(e) is float for e in v):
+        # Very common: pixel size, position...
+        return b"t" + _HDR_COUNT.pack(len(v)) + struct.pack("<%dd" % len(v), *v)
+    else:
+        return b"p" + _pack_bytes(pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _unpack_value(buf, pos):
+    tag = chr(buf[pos])
+    pos += 1
+    if tag == "d":
+        v, = _HDR_FLOAT.unpack_from(buf, pos)
+        return v, pos + _HDR_FLOAT.size
+    elif tag == "b":
+        return True, pos
+    elif tag == "B":
+        return False, pos
+    elif tag == "q":
+        v, = _HDR_INT.unpack_from(buf, pos)
+        return v, pos + _HDR_INT.size
+    elif tag == "s":
+        b, pos = _unpack_bytes(buf, pos)
+        return b.decode("utf-8"), pos
+    elif tag == "n":
+        return None, pos
+    elif tag == "t":
+        n, = _HDR_COUNT.unpack_from(buf, pos)
+        pos += _HDR_COUNT.size
+        v = struct.unpack_from("<%dd" % n, buf, pos)
+        return v, pos + 8 * n
+    elif tag == "p":
+        b, pos = _unpack_bytes(buf, pos)
+        return pickle.loads(b), pos
+    else:
+        raise ValueError("Unknown metadata value type %r" % (tag,))
+
+
+class _HeaderEncoder(object):
+    """
+    Encodes the format (dtype, shape, metadata...) of the arrays sent on one
+    0MQ pipe. As the metadata is sent as a difference with the latest keyframe,
+    one encoder must be used per pipe, and all the arrays sent on that pipe
+    must be encoded.
+    """
+
+    def __init__(self):
+        self._keyframe_id = 0
+        self._keyframe_md = None
+        self._since_keyframe = 0
+        self._full_until = 0  # time until which the full metadata is sent
+        self._dtypes = {}  # numpy.dtype -> bytes
+
+    def force_keyframe(self, period=0):
+        """
+        Request the full metadata to be sent (eg, because a new reader has connected)
+        period (float >= 0): duration (in s) during which the full metadata will
+          be sent for every array.
+        """
+        self._keyframe_md = None
+        if period:
+            self._full_until = max(self._full_until, time.time() + period)
+
+    def encode(self, dtype, shape, md, shm=None):
+        """
+        dtype (numpy.dtype)
+        shape (tuple of int)
+        md (dict str -> value): the metadata
+        shm (None or dict): the shared memory information (see _SharedMemoryRing.write())
+        return (bytes): the header
+        """
+        flags = 0
+        changed = md
+        removed = ()
+        kmd = self._keyframe_md
+        if self._full_until and time.time() >= self._full_until:
+            self._full_until = 0
+        if kmd is None or self._full_until or self._since_keyframe >= KEYFRAME_PERIOD:
+            flags |= _HDR_KEYFRAME
+            if all(type(k) is str for k in md):
+                self._keyframe_id = (self._keyframe_id + 1) % 2 ** 32
+                self._keyframe_md = _copy_md(md)
+                self._since_keyframe = 0
+            else:
+                flags |= _HDR_MD_PICKLE
+        else:
+            # Only send the difference with the keyframe
+            self._since_keyframe += 1
+            changed = {}
+            nnew = 0
+            # Most values are typically the very same objects as in the keyframe
+            # => quickly filter them out
+            candidates = [(k, v) for k, v in md.items() if kmd.get(k, _NO_VALUE) is not v]
+            for k, v in candidates:
+                kv = kmd.get(k, _NO_VALUE)
+                if kv is _NO_VALUE:
+                    if type(k) is not str:
+                        flags |= _HDR_MD_PICKLE
+                        break
+                    nnew += 1
+                elif _md_equal(v, kv):
+                    continue
+                changed[k] = v
+            if len(md) - nnew < len(kmd):
+                removed = [k for k in kmd if k not in md]
+
+        try:
+            dtype_b = self._dtypes[dtype]
+        except KeyError:
+            if dtype.names is None:
+                dtype_b = dtype.str.encode("ascii")
+            else:
+                dtype_b = pickle.dumps(dtype, protocol=pickle.HIGHEST_PROTOCOL)
+            self._dtypes[dtype] = dtype_b
+        if dtype.names is not None:
+            flags |= _HDR_DTYPE_PICKLE
+
+        if shm:
+            flags |= _HDR_SHM
+
+        parts = [_HDR_FIXED.pack(HEADER_VERSION, flags, self._keyframe_id, len(shape)),
+                 _shape_struct(len(shape)).pack(*shape),
+                 _pack_bytes(dtype_b)]
+        if shm:
+            parts.append(_pack_bytes(shm["name"].encode("utf-8")))
+            parts.append(_HDR_SHM_INFO.pack(shm["slot"], shm["seq"], shm["offset"]))
+
+        if flags & _HDR_MD_PICKLE:
+            parts.append(_pack_bytes(pickle.dumps(md, protocol=pickle.HIGHEST_PROTOCOL)))
+            self._keyframe_md = None  # Next time, send a keyframe
+            return b"".join(parts)
+
+        parts.append(_HDR_COUNT.pack(len(changed)))
+        for k, v in changed.items():
+            parts.append(_pack_bytes(k.encode("utf-8")))
+            parts.append(_pack_value(v))
+        parts.append(_HDR_COUNT.pack(len(removed)))
+        for k in removed:
+            parts.append(_pack_bytes(k.encode("utf-8")))
+
+        return b"".join(parts)
+
+
+class _HeaderDecoder(object):
+    """
+    Counterpart of _HeaderEncoder, on the subscriber side.
+    """
+
+    def __init__(self):
+        self._keyframe_id = None
+        self._keyframe_md = None  # immutable values of the keyframe (shared between arrays)
+        self._keyframe_mutable = ()  # key, value, copy function of the mutable values of the keyframe
+        self._dtypes = {}  # bytes -> numpy.dtype
+
+    def _set_keyframe(self, keyframe_id, md):
+        """
+        Store the metadata of a keyframe
+        return (dict): a copy of the metadata to be used by the keyframe array
+        """
+        self._keyframe_id = keyframe_id
+        self._keyframe_md = {}
+        mutable = []
+        for k, v in md.items():
+            if _is_immutable(v):
+                self._keyframe_md[k] = v
+            # Every array needs its own copy of the mutable values => pick the
+            # fastest way to copy them.
+            elif type(v) is numpy.ndarray:
+                mutable.append((k, v, numpy.ndarray.copy))
+            elif type(v) is list and all(_is_immutable(e) for e in v):
+                mutable.append((k, v, list))
+            else:
+                mutable.append((k, pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads))
+        self._keyframe_mutable = mutable
+        return self._keyframe_md_copy()
+
+    def _keyframe_md_copy(self):
+        md = self._keyframe_md.copy()
+        for k, v, copy_func in self._keyframe_mutable:
+            md[k] = copy_func(v)
+        return md
+
+    def decode(self, buf):
+        """
+        buf (bytes or buffer): the header, as generated by _HeaderEncoder.encode()
+        return (dict str -> value or None): the array format, with the keys
+          "dtype", "shape", "metadata", and optionally "shm". None if it cannot
+          be decoded because the keyframe was not received.
+        raise ValueError: if the header is not in the expected format
+        """
+        buf = memoryview(buf)
+        version, flags, keyframe_id, ndim = _HDR_FIXED.unpack_from(buf, 0)
+        if version != HEADER_VERSION:
+            raise ValueError("Unsupported DataArray header version %d" % (version,))
+        pos = _HDR_FIXED.size
+        shape = _shape_struct(ndim).unpack_from(buf, pos)
+        pos += 8 * ndim
+        dtype_b, pos = _unpack_bytes(buf, pos)
+        try:
+            dtype = self._dtypes[dtype_b]
+        except KeyError:
+            if flags & _HDR_DTYPE_PICKLE:
+                dtype = pickle.loads(dtype_b)
+            else:
+                dtype = numpy.dtype(dtype_b.decode("ascii"))
+            self._dtypes[dtype_b] = dtype
+        aformat = {"dtype": dtype, "shape": shape}
+
+        if flags & _HDR_SHM:
+            name, pos = _unpack_bytes(buf, pos)
+            slot, seq, offset = _HDR_SHM_INFO.unpack_from(buf, pos)
+            pos += _HDR_SHM_INFO.size
+            aformat["shm"] = {"name": name.decode("utf-8"), "slot": slot, "seq": seq, "offset": offset}
+
+        if flags & _HDR_MD_PICKLE:
+            md_b, pos = _unpack_bytes(buf, pos)
+            aformat["metadata"] = pickle.loads(md_b)
+            self._keyframe_md = None
+            return aformat
+
+        changed = {}
+        n, = _HDR_COUNT.unpack_from(buf, pos)
+        pos += _HDR_COUNT.size
+        for i in range(n):
+            k, pos = _unpack_bytes(buf, pos)
+            changed[k.decode("utf-8")], pos = _unpack_value(buf, pos)
+        removed = []
+        n, = _HDR_COUNT.unpack_from(buf, pos)
+        pos += _HDR_COUNT.size
+        for i in range(n):
+            k, pos = _unpack_bytes(buf, pos)
+            removed.append(k.decode("utf-8"))
+
+        if flags & _HDR_KEYFRAME:
+            md = self._set_keyframe(keyframe_id, changed)
+        else:
+            if self._keyframe_md is None or self._keyframe_id != keyframe_id:
+                return None  # Missed the keyframe => cannot reconstruct the metadata
+
+            md = self._keyframe_md_copy()
+            md.update(changed)
+            for k in removed:
+                md.pop(k, None)
+
+        aformat["metadata"] = md
+        return aformat
+
+
 # DataFlow object to create on the server (in a component)
 class DataFlow(DataFlowBase):
-    def __init__(self, max_discard=100):
+    def __init__(self, max_discard=100, shm_slots=0):
         """
         max_discard (int): mount of messages that can be discarded in a row if
                             a new one is already available. 0 to keep (notify)
                             all the messages (dangerous if callback is slower
                             than the generator).
+        shm_slots (int >= 0): if > 0, the large arrays are passed to the remote
+          subscribers via a ring buffer of this number of slots in shared memory,
+          instead of being copied over the 0MQ socket. The subscribers receive
+          a read-only view on the data. A slot is not overwritten as long as a
+          subscriber uses its array. If max_discard > 0, a subscriber which
+          falls behind by more than shm_slots arrays drops the oldest ones.
+          If max_discard is 0, the DataFlow waits for the subscribers to have
+          processed the array of a slot before overwriting it. If no slot is
+          available, the array is copied over 0MQ.
         """
         DataFlowBase.__init__(self)
         # different from ._listeners for notify() to do different things
@@ -215,6 +1023,10 @@ class DataFlow(DataFlowBase):
         self._max_discard_orig = max_discard  # Used when switching between synchronized and not
         self._max_discard_last_update = None  # Value when last updated (when there are no remote listeners)
 
+        self._shm_slots = shm_slots
+        self._shm_ring = None  # _SharedMemoryRing, created when registered
+        self._hdr_encoder = _HeaderEncoder()
+
     def _getproxystate(self):
         """
         Equivalent to __getstate__() of the proxy version
@@ -238,6 +1050,13 @@ class DataFlow(DataFlowBase):
     def _set_max_discard(self, value):
         self.max_discard = value
 
+    def _request_keyframe(self):
+        """
+        Called by a remote subscriber which cannot decode the arrays, because it
+        missed the latest keyframe (eg, the 0MQ messages were dropped).
+        """
+        self._hdr_encoder.force_keyframe()
+
     def _update_pipe_hwm(self):
         """
         updates the high water mark option of OMQ pipe according to max_discard
@@ -321,6 +1140,11 @@ class DataFlow(DataFlowBase):
         logging.debug("server is registered to send to " + "ipc://" + self._global_name)
         self.pipe.bind("ipc://" + self._global_name)
 
+        if self._shm_slots > 0:
+            # The name must be short and without "/" => cannot use the global name
+            basename = "odemis-df-%x-%x" % (os.getpid(), id(self))
+            self._shm_ring = _SharedMemoryRing(basename, self._shm_slots)
+
     def _unregister(self):
         """
         unregister the dataflow from the daemon and clean up the 0MQ bindings
@@ -328,6 +1152,9 @@ class DataFlow(DataFlowBase):
         daemon = getattr(self, "_pyroDaemon", None)
         if daemon:
             daemon.unregister(self)
+        if self._shm_ring:
+            self._shm_ring.close()
+            self._shm_ring = None
         if self._ctx:
             self.pipe.close()
             self.pipe = None
@@ -375,6 +1202,10 @@ class DataFlow(DataFlowBase):
             # add string to listeners if listener is string
             if isinstance(listener, str):
                 self._remote_listeners.add(listener)
+                if self._shm_ring:
+                    self._shm_ring.add_reader(listener)
+                # The new subscriber needs the complete metadata
+                self._hdr_encoder.force_keyframe(KEYFRAME_SUB_PERIOD)
             else:
                 assert callable(listener)
                 self._listeners.add(WeakMethod(listener))
@@ -403,6 +1234,8 @@ class DataFlow(DataFlowBase):
             if isinstance(listener, str):
                 # remove string from listeners
                 self._remote_listeners.discard(listener)
+                if self._shm_ring:
+                    self._shm_ring.remove_reader(listener)
             else:
                 self._listeners.discard(WeakMethod(listener))
 
@@ -426,25 +1259,45 @@ class DataFlow(DataFlowBase):
             # is gone (if there is a way to associate it)
 
             # TODO thread-safe for self.pipe ?
-            dformat = {"dtype": str(data.dtype), "shape": data.shape, "metadata": data.metadata}
-            self.pipe.send_pyobj(dformat, zmq.SNDMORE)
-            try:
-                if not data.flags["C_CONTIGUOUS"]:
-                    # if not in C order, it will be received incorrectly
-                    # TODO: if it's just rotated, send the info to reconstruct it
-                    # and avoid the memory copy
-                    raise TypeError("Need C ordered array")
-                self.pipe.send(memoryview(data), copy=False)
-            except TypeError:
-                # not all buffers can be sent zero-copy (e.g., has strides)
-                # try harder by copying (which removes the strides)
-                logging.debug("Failed to send data with zero-copy")
-                data = numpy.require(data, requirements=["C_CONTIGUOUS"])
-                self.pipe.send(memoryview(data), copy=False)
+            md = getattr(data, "metadata", {})
+            shm = None
+            if self._shm_ring and data.nbytes >= SHM_MIN_SIZE:
+                # If no array may be discarded, this waits for the subscribers
+                # to process the array previously in the slot.
+                shm = self._shm_ring.write(data, may_drop=self._max_discard > 0)
+            if shm:
+                # Only the location of the data is sent, the data is in shared memory
+                header = self._hdr_encoder.encode(data.dtype, data.shape, md, shm)
+                self.pipe.send(header, zmq.SNDMORE)
+                self.pipe.send(b"")
+            else:
+                header = self._hdr_encoder.encode(data.dtype, data.shape, md)
+                self._send_data(header, data)
 
         # publish locally
         DataFlowBase.notify(self, data)
 
+    def _send_data(self, header, data):
+        """
+        Send the header and the data of the array over the 0MQ pipe
+        header (bytes): the array format (including metadata), as encoded by _HeaderEncoder
+        data (numpy.ndarray): the array
+        """
+        self.pipe.send(header, zmq.SNDMORE)
+        try:
+            if not data.flags["C_CONTIGUOUS"]:
+                # if not in C order, it will be received incorrectly
+                # TODO: if it's just rotated, send the info to reconstruct it
+                # and avoid the memory copy
+                raise TypeError("Need C ordered array")
+            self.pipe.send(memoryview(data), copy=False)
+        except TypeError:
+            # not all buffers can be sent zero-copy (e.g., has strides)
+            # try harder by copying (which removes the strides)
+            logging.debug("Failed to send data with zero-copy")
+            data = numpy.require(data, requirements=["C_CONTIGUOUS"])
+            self.pipe.send(memoryview(data), copy=False)
+
     def __del__(self):
         if self._count_listeners() > 0:
             self.stop_generate()
@@ -582,6 +1435,10 @@ class SubscribeProxyThread(threading.Thread):
         self._data.rcvhwm = 0
         self._data.connect("ipc://" + uri)
 
+        # To access the arrays passed via shared memory (if the DataFlow uses it)
+        self._shm = _SharedMemoryReader(df_proxy._proxy_name)
+        self._hdr_decoder = _HeaderDecoder()
+
     def run(self):
         """
         Process messages for commands and data
@@ -598,6 +1455,7 @@ class SubscribeProxyThread(threading.Thread):
             # Read from the remote DataFlow when the subscription is started.
             max_discard = 0
             discarded = 0  # Number of messages discarded in a row
+            keyframe_requested = False
             while True:
                 socks = dict(poller.poll())
 
@@ -622,8 +1480,23 @@ class SubscribeProxyThread(threading.Thread):
                 # receive data
                 if self._data in socks:
                     # TODO: be more resilient if wrong data is received (can block forever)
-                    array_format = self._data.recv_pyobj()
+                    header = self._data.recv(copy=False)
                     array_buf = self._data.recv(copy=False)
+                    array_format = self._hdr_decoder.decode(header.buffer)
+                    if array_format is None:
+                        # Can happen just after subscribing, or if the keyframe
+                        # message was dropped => ask for a new one (only once).
+                        logging.debug("Dataflow %s dropped array without metadata keyframe", self.uri)
+                        if not keyframe_requested:
+                            keyframe_requested = True
+                            try:
+                                self.weak_df._request_keyframe()
+                            except ReferenceError:
+                                raise
+                            except Exception:
+                                logging.warning("Failed to request keyframe on dataflow %s", self.uri, exc_info=True)
+                        continue
+                    keyframe_requested = False
                     # logging.debug("Received new DataArray over ZMQ for %s", self.uri)
                     # more fresh data already?
                     if (discarded < max_discard
@@ -638,14 +1511,32 @@ class SubscribeProxyThread(threading.Thread):
                     if discarded:
                         logging.warning("Dataflow %s dropped %d arrays", self.uri, discarded)
                     discarded = 0
-                    # TODO: any need to use zmq.utils.rebuffer.array_from_buffer()?
-                    if len(array_buf):
-                        array = numpy.frombuffer(array_buf, dtype=array_format["dtype"])
-                    else:  # frombuffer doesn't support zero length array
-                        array = numpy.empty((0,), dtype=array_format["dtype"])
-                    array.shape = array_format["shape"]
+                    shm_info = array_format.get("shm")
+                    if shm_info:
+                        try:
+                            array = self._shm.read(shm_info, array_format["dtype"],
+                                                   array_format["shape"])
+                        except OSError as ex:
+                            # Typically, the writer has already released this shared memory
+                            logging.debug("Dataflow %s dropped array in shared memory not available: %s",
+                                          self.uri, ex)
+                            continue
+                        if array is None:
+                            logging.debug("Dataflow %s dropped array already overwritten in shared memory",
+                                          self.uri)
+                            self._shm.set_processed(shm_info["seq"])
+                            continue
+                    else:
+                        # TODO: any need to use zmq.utils.rebuffer.array_from_buffer()?
+                        if len(array_buf):
+                            array = numpy.frombuffer(array_buf, dtype=array_format["dtype"])
+                        else:  # frombuffer doesn't support zero length array
+                            array = numpy.empty((0,), dtype=array_format["dtype"])
+                        array.shape = array_format["shape"]
                     darray = DataArray(array, metadata=array_format["metadata"])
                     self.weak_df.notify(darray)
+                    if shm_info:
+                        self._shm.set_processed(shm_info["seq"])
 
         except ReferenceError:  # The DataFlow(Proxy) is gone
             # => stop this thread too
@@ -663,6 +1554,10 @@ class SubscribeProxyThread(threading.Thread):
                 self._data.close()
             except Exception:
                 print("Exception closing ZMQ data connection")
+            try:
+                self._shm.close()
+            except Exception:
+                print("Exception closing shared memory")
 
 
 def unregister_dataflows(self):
@@ -22,13 +22,17 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 
 import Pyro4
 from Pyro4.core import oneway
+import atexit
+import collections
 from collections.abc import Iterable, Set
 import logging
 import numbers
 import numpy
 from odemis.util.weak import WeakMethod, WeakRefLostError
 import os
+import pickle
 import threading
+import time
 import types
 import sys
 import zmq
@@ -139,8 +143,8 @@ class VigilantAttribute(VigilantAttributeBase):
         self._remote_listeners = set() # any unique string works
 
         self._global_name = None # to be filled when registered
-        self._ctx = None
-        self.pipe = None
+        self._topic = None
+        self.pipe = None  # _VAPublisher, when registered
         self.debug = False  # If True, this VA will print a call stack when its value is set
         self.max_discard = max_discard
 
@@ -260,20 +264,14 @@ class VigilantAttribute(VigilantAttributeBase):
         """
         daemon.register(self)
 
-        # create a zmq pipe to publish the data
-        # Warning: notify() will most likely run in a separate thread, which is
-        # not recommended by 0MQ. At least, we should never access it from this
-        # thread anymore. To be safe, it might need a pub-sub forwarder proxy inproc
-        self._ctx = zmq.Context(1)
-        self.pipe = self._ctx.socket(zmq.PUB)
-        self.pipe.linger = 1 # don't keep messages more than 1s after close
-        # self.pipe.hwm has to be 0 (default), otherwise it drops _new_ values
-
         uri = daemon.uriFor(self)
         # uri.sockname is the file name of the pyro daemon (with full path)
         self._global_name = uri.sockname + "@" + uri.object
-        logging.debug("VA server is registered to send to " + "ipc://" + self._global_name)
-        self.pipe.bind("ipc://" + self._global_name)
+        # All the VAs of the same daemon share the same 0MQ pipe, and the
+        # subscribers filter the updates based on the topic.
+        self._topic = _va_topic(uri.object)
+        self.pipe = _VAPublisher.get(daemon, uri.sockname)
+        logging.debug("VA server is registered to send to %s", self._global_name)
 
     def _unregister(self):
         """
@@ -289,12 +287,8 @@ class VigilantAttribute(VigilantAttributeBase):
                 self._remote_listeners.clear()
 
             if self.pipe:
-                self.pipe.close()
+                self.pipe.release()
                 self.pipe = None
-
-            if self._ctx:
-                self._ctx.term()
-                self._ctx = None
         except Exception:
             pass  # we've done our best
 
@@ -333,7 +327,7 @@ class VigilantAttribute(VigilantAttributeBase):
 
         # publish the data remotely
         if self._remote_listeners:
-            self.pipe.send_pyobj(v)
+            self.pipe.send(self._topic, v)
 
         # publish locally
         VigilantAttributeBase.notify(self, v)
@@ -357,9 +351,7 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         self.max_discard = 100
         self.readonly = False # will be updated in __setstate__
 
-        self._ctx = None
-        self._commands = None
-        self._thread = None
+        self._mux = None  # _VAMultiplexer, when listening
 
     def __getattr__(self, name):
         # Behaviour of .range and .choices remote attributes:
@@ -425,17 +417,7 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         self._global_name = self._pyroUri.sockname + "@" + self._pyroUri.object
         self._proxy_name = "%x/%x" % (os.getpid(), id(self))
 
-        self._ctx = None
-        self._commands = None
-        self._thread = None
-
-    def _create_thread(self):
-        logging.debug("Creating thread for VA %s", self._global_name)
-        self._ctx = zmq.Context(1) # apparently 0MQ reuse contexts
-        self._commands = self._ctx.socket(zmq.PAIR)
-        self._commands.bind("inproc://" + self._global_name)
-        self._thread = SubscribeProxyThread(self.notify, self._global_name, self.max_discard, self._ctx)
-        self._thread.start()
+        self._mux = None
 
     def subscribe(self, listener, init=False):
         count_before = len(self._listeners)
@@ -450,10 +432,9 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         """
         start the remote subscription
         """
-        if not self._thread:
-            self._create_thread()
-        self._commands.send(b"SUB")
-        self._commands.recv() # synchronise
+        # Always ask, in case the previous multiplexer was stopped
+        self._mux = _VAMultiplexer.get(self._pyroUri.sockname)
+        self._mux.subscribe(_va_topic(self._pyroUri.object), self.notify, self.max_discard)
 
         # send subscription to the actual VA
         # a bit tricky because the underlying method gets created on the fly
@@ -469,22 +450,18 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         stop the remote subscription
         """
         Pyro4.Proxy.__getattr__(self, "unsubscribe")(self._proxy_name)
-        if self._commands:
-            self._commands.send(b"UNSUB")
+        if self._mux:
+            self._mux.unsubscribe(_va_topic(self._pyroUri.object), self.notify)
 
     def __del__(self):
-        # end the thread (but it will stop as soon as it notices we are gone anyway)
+        # The multiplexer will automatically drop this proxy as soon as it
+        # notices it's gone, but the remote VA must be told explicitly.
         try:
-            if self._thread:
-                if self._thread.is_alive():
-                    if len(self._listeners):
-                        logging.warning("Stopping subscription while there are still subscribers "
-                                        "because VA '%s' is going out of context",
-                                        self._global_name)
-                        Pyro4.Proxy.__getattr__(self, "unsubscribe")(self._proxy_name)
-                    self._commands.send(b"STOP")
-                self._commands.close()
-            # self._ctx.term()
+            if self._mux and len(self._listeners):
+                logging.warning("Stopping subscription while there are still subscribers "
+                                "because VA '%s' is going out of context",
+                                self._global_name)
+                Pyro4.Proxy.__getattr__(self, "unsubscribe")(self._proxy_name)
         except Exception:
             pass
 
@@ -494,74 +471,442 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
             pass  # don't be too rough if that fails, it's not big deal anymore
 
 
-class SubscribeProxyThread(threading.Thread):
-    def __init__(self, notifier, uri, max_discard, zmq_ctx):
+# Duration (in s) during which the updates received are accumulated before
+# being dispatched to the VA proxies. When several updates of the same VA are
+# received during this window, only the latest one is dispatched (within the
+# limit of the max_discard of the VA). With 0, the updates already received are
+# still coalesced, but no time is spent waiting for more.
+VA_COALESCE_WINDOW = 0  # s
+
+def setVACoalescingWindow(window):
+    """
+    Change the coalescing window of all the VA multiplexers of this process
+    window (float >= 0): duration in s (see VA_COALESCE_WINDOW)
+    """
+    global VA_COALESCE_WINDOW
+    if window < 0:
+        raise ValueError("Coalescing window must be positive, got %s" % (window,))
+    VA_COALESCE_WINDOW = window
+    with _VAMultiplexer._muxes_lock:
+        for mux in _VAMultiplexer._muxes.values():
+            mux.window = window
+
+
+def _va_topic(objid):
+    """
+    objid (str): the Pyro object ID of the VA
+    return (bytes): the 0MQ topic used to publish the VA updates. As 0MQ uses
+      prefix matching, it's terminated by a null character.
+    """
+    return objid.encode("utf-8") + b"\0"
+
+
+class _VAPublisher(object):
+    """
+    0MQ pipe shared by all the VAs of a Pyro daemon to publish their new values
+    to the remote subscribers.
+    """
+
+    def __init__(self, daemon, uri):
+        """
+        daemon (Pyro4.Daemon): daemon to which the VAs are registered
+        uri (str): unique name of the pipe
+        """
+        self._daemon = daemon
+        self.uri = uri
+        self._lock = threading.Lock()  # 0MQ sockets are not thread-safe
+        self._users = 0
+        self._ctx = zmq.Context(1)
+        self._pipe = self._ctx.socket(zmq.PUB)
+        self._pipe.linger = 1  # don't keep messages more than 1s after close
+        # self._pipe.hwm has to be 0 (default), otherwise it drops _new_ values
+        self._pipe.bind("ipc://" + uri)
+
+    @classmethod
+    def get(cls, daemon, sockname):
+        """
+        Return the publisher of the daemon, and create it if needed.
+        The caller must call .release() when it's not used anymore.
+        daemon (Pyro4.Daemon)
+        sockname (str): file name of the daemon socket
+        return (_VAPublisher)
+        """
+        pub = getattr(daemon, "_odemis_va_publisher", None)
+        if pub is None:
+            # "Pyro." is reserved by Pyro for its own objects => cannot
+            # conflict with the name of another object
+            pub = cls(daemon, sockname + "@Pyro.VAs")
+            daemon._odemis_va_publisher = pub
+            logging.debug("VA publisher created on %s", pub.uri)
+        pub._users += 1
+        return pub
+
+    def send(self, topic, v):
+        """
+        Publish a new value
+        topic (bytes): the topic of the VA
+        v (object): the new value
+        """
+        msg = pickle.dumps(v, protocol=pickle.DEFAULT_PROTOCOL)
+        with self._lock:
+            if self._pipe:
+                self._pipe.send_multipart([topic, msg])
+
+    def release(self):
+        """
+        Indicate that one VA doesn't use the publisher anymore. When no VA uses
+        it, the 0MQ pipe is closed.
+        """
+        with self._lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+
+            if getattr(self._daemon, "_odemis_va_publisher", None) is self:
+                del self._daemon._odemis_va_publisher
+            self._pipe.close()
+            self._pipe = None
+            self._ctx.term()
+            self._ctx = None
+
+
+class _VAMultiplexer(threading.Thread):
+    """
+    Receives the updates of all the VAs of a remote Pyro daemon, and dispatches
+    them to the VA proxies of this process which are subscribed. There is only
+    one per daemon (and per process), to avoid having a thread and a 0MQ
+    connection for every VA.
+    The listeners of each VA are called from a thread dedicated to this VA (see
+    _VADispatcher), so that a slow (or blocking) listener only delays the
+    updates of its own VA.
+    """
+    _muxes = {}  # (pid, str) -> _VAMultiplexer
+    _muxes_lock = threading.Lock()
+
+    def __init__(self, uri, window=0):
         """
-        notifier (callable): method to call when a new value arrives
         uri (string): unique string to identify the connection
-        max_discard (int)
-        zmq_ctx (0MQ context): available 0MQ context to use
+        window (float >= 0): coalescing window, in s (see VA_COALESCE_WINDOW)
         """
-        threading.Thread.__init__(self, name="zmq for VA " + uri)
+        threading.Thread.__init__(self, name="zmq for VAs " + uri)
         self.daemon = True
         self.uri = uri
-        self.max_discard = max_discard
-        self._ctx = zmq_ctx
-        # don't keep strong reference to notifier so that it can be garbage
-        # collected normally and it will let us know then that we can stop
-        self.w_notifier = WeakMethod(notifier)
+        self.window = window
+
+        # topic (bytes) -> list of (WeakMethod, max_discard)
+        # Only modified from this thread
+        self._subscribers = {}
+
+        # topic (bytes) -> _VADispatcher: present as long as the topic has subscribers
+        # Only modified from this thread
+        self._dispatchers = {}
 
-        # create a zmq synchronised channel to receive commands
-        self._commands = zmq_ctx.socket(zmq.PAIR)
+        self._ctx = zmq.Context(1)
+        # To receive commands from other threads: they are queued, and the
+        # thread is woken up via the 0MQ pair.
+        self._cmd_lock = threading.Lock()  # To protect the queue and the command socket
+        self._cmd_queue = collections.deque()  # (str, bytes, object, Event or None)
+        self._cmd_client = self._ctx.socket(zmq.PAIR)
+        self._cmd_client.bind("inproc://" + uri)
+        self._commands = self._ctx.socket(zmq.PAIR)
         self._commands.connect("inproc://" + uri)
 
         # create a zmq subscription to receive the data
-        self.data = zmq_ctx.socket(zmq.SUB)
-        self.data.connect("ipc://" + uri)
+        self._data = self._ctx.socket(zmq.SUB)
+        self._data.linger = 0
+        self._data.connect("ipc://" + uri)
+
+    @classmethod
+    def get(cls, sockname):
+        """
+        Return the multiplexer for the given daemon, and start it if needed
+        sockname (str): file name of the daemon socket
+        return (_VAMultiplexer)
+        """
+        # The pid is part of the key, as a forked process has the dictionary,
+        # but not the threads.
+        key = (os.getpid(), sockname)
+        with cls._muxes_lock:
+            mux = cls._muxes.get(key)
+            if mux is None:
+                mux = cls(sockname + "@Pyro.VAs", VA_COALESCE_WINDOW)
+                logging.debug("Creating VA multiplexer for %s", mux.uri)
+                mux.start()
+                cls._muxes[key] = mux
+            return mux
+
+    @classmethod
+    def stop_all(cls):
+        """
+        Stop all the multiplexers of this process. The VA proxies subscribed
+        will not receive updates anymore.
+        """
+        with cls._muxes_lock:
+            muxes = [m for (pid, _), m in cls._muxes.items() if pid == os.getpid()]
+        for mux in muxes:
+            mux.stop()
+
+    def stop(self):
+        """
+        Stop receiving the updates, and close the 0MQ connections.
+        Blocks until the thread is done (unless called from a listener).
+        """
+        with self._muxes_lock:
+            for k, m in list(self._muxes.items()):
+                if m is self:
+                    del self._muxes[k]
+        self._send_command("STOP", None, None)
+        if threading.current_thread() is not self and self.is_alive():
+            self.join(5)
+
+    def subscribe(self, topic, notifier, max_discard):
+        """
+        Start dispatching the updates of a VA.
+        Returns once the subscription is active.
+        topic (bytes): topic of the VA
+        notifier (callable): method to call when a new value arrives. Only a
+          weak reference is kept.
+        max_discard (int): amount of updates that can be discarded in a row if
+          a new one is already available.
+        """
+        entry = (WeakMethod(notifier), max_discard)
+        if threading.current_thread() is self:
+            # Happens if a VA is subscribed from a VA callback => can't wait
+            # for ourselves, so directly do it.
+            self._add_subscriber(topic, entry)
+            return
+
+        done = threading.Event()
+        self._send_command("SUB", topic, entry, done)
+        done.wait()
+
+    def unsubscribe(self, topic, notifier):
+        """
+        Stop dispatching the updates of a VA (asynchronously)
+        topic (bytes): topic of the VA
+        notifier (callable): as passed to subscribe()
+        """
+        wnotifier = WeakMethod(notifier)
+        if threading.current_thread() is self:
+            self._remove_subscriber(topic, wnotifier)
+            return
+
+        self._send_command("UNSUB", topic, wnotifier)
+
+    def _send_command(self, cmd, topic, arg, done=None):
+        with self._cmd_lock:
+            if self._cmd_client is None:
+                logging.debug("VA multiplexer %s already stopped, ignoring %s command", self.uri, cmd)
+                if done:
+                    done.set()
+                return
+            self._cmd_queue.append((cmd, topic, arg, done))
+            self._cmd_client.send(b"")
+
+    def _add_subscriber(self, topic, entry):
+        subs = self._subscribers.setdefault(topic, [])
+        if not subs:
+            self._data.setsockopt(zmq.SUBSCRIBE, topic)
+            dispatcher = _VADispatcher(self, topic)
+            dispatcher.start()
+            self._dispatchers[topic] = dispatcher
+        subs.append(entry)
+
+    def _remove_subscriber(self, topic, wnotifier):
+        subs = self._subscribers.get(topic, [])
+        for e in subs:
+            if e[0] == wnotifier:
+                subs.remove(e)
+                break
+        else:
+            return
+        if not subs:
+            del self._subscribers[topic]
+            self._data.setsockopt(zmq.UNSUBSCRIBE, topic)
+            self._dispatchers.pop(topic).stop()
 
     def run(self):
         # Process messages for commands and data
         poller = zmq.Poller()
         poller.register(self._commands, zmq.POLLIN)
-        poller.register(self.data, zmq.POLLIN)
-        discarded = 0
+        poller.register(self._data, zmq.POLLIN)
+        try:
+            while True:
+                try:
+                    socks = dict(poller.poll())
+
+                    # process commands
+                    if socks.get(self._commands) == zmq.POLLIN:
+                        self._commands.recv()
+                        with self._cmd_lock:
+                            cmd, topic, arg, done = self._cmd_queue.popleft()
+                        if cmd == "SUB":
+                            self._add_subscriber(topic, arg)
+                        elif cmd == "UNSUB":
+                            self._remove_subscriber(topic, arg)
+                        elif cmd == "STOP":
+                            return
+                        if done:
+                            done.set()
+
+                    # receive data
+                    if socks.get(self._data) == zmq.POLLIN:
+                        for topic, msg in self._receive_pending():
+                            self._queue(topic, msg)
+                except Exception:
+                    logging.exception("Failure in VA multiplexer %s", self.uri)
+        finally:
+            self._close()
+
+    def _close(self):
+        """
+        Release all the resources (from the thread itself, when it ends)
+        """
+        logging.debug("Stopping VA multiplexer %s", self.uri)
+        for dispatcher in self._dispatchers.values():
+            dispatcher.stop()
+        self._dispatchers = {}
+        with self._cmd_lock:
+            # Unblock the threads waiting for a subscription
+            for _, _, _, done in self._cmd_queue:
+                if done:
+                    done.set()
+            self._cmd_queue.clear()
+            self._cmd_client.close()
+            self._cmd_client = None
+        self._commands.close()
+        self._data.close()
+        self._subscribers = {}
+        self._ctx.term()
+
+    def _receive_pending(self):
+        """
+        Receive all the updates available (and the ones arriving during the
+        coalescing window), and coalesce the updates of the same VA.
+        return (list of [bytes, bytes]): topic and pickled value, in order of
+          arrival
+        """
+        pending = []  # list of [topic, msg]
+        latest = {}  # topic -> [index in pending, number of discarded]
+        tend = time.time() + self.window
         while True:
-            socks = dict(poller.poll())
-
-            # process commands
-            if socks.get(self._commands) == zmq.POLLIN:
-                message = self._commands.recv()
-                if message == b"SUB":
-                    self.data.setsockopt(zmq.SUBSCRIBE, b'')
-                    self._commands.send(b"SUBD")
-                elif message == b"UNSUB":
-                    self.data.setsockopt(zmq.UNSUBSCRIBE, b'')
-                    # no confirmation (async)
-                elif message == b"STOP":
-                    self._commands.close()
-                    self.data.close()
-                    return
+            topic, msg = self._data.recv_multipart()
+            prev = latest.get(topic)
+            if prev is not None and prev[1] < self._max_discard(topic):
+                # Replace the previous value by the new one
+                pending[prev[0]][1] = msg
+                prev[1] += 1
+            else:
+                latest[topic] = [len(pending), 0]
+                pending.append([topic, msg])
+
+            if not self._data.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                # Nothing more immediately available => wait for the rest of the window
+                left = tend - time.time()
+                if left <= 0 or not self._data.poll(left * 1000):
+                    break
+
+        discarded = sum(d for _, d in latest.values())
+        if discarded:
+            logging.debug("VA multiplexer discarded %d values", discarded)
+        return pending
+
+    def _max_discard(self, topic):
+        subs = self._subscribers.get(topic)
+        if not subs:
+            return 0
+        return min(md for _, md in subs)
+
+    def _queue(self, topic, msg):
+        """
+        Pass a new value to the dispatcher of its VA
+        topic (bytes): the topic of the VA
+        msg (bytes): the pickled value
+        """
+        dispatcher = self._dispatchers.get(topic)
+        if dispatcher is None:
+            return  # Already unsubscribed
+        dispatcher.put(msg, self._max_discard(topic))
+
+
+class _VADispatcher(threading.Thread):
+    """
+    Calls the listeners of one VA of a _VAMultiplexer, in the order the values
+    are received. It has its own thread, so that listeners which block (eg,
+    because they set another remote VA, and wait for its update) never prevent
+    the updates of the other VAs from being dispatched.
+    """
 
-            # receive data
-            if socks.get(self.data) == zmq.POLLIN:
-                value = self.data.recv_pyobj()
-                # more fresh data already?
-                if (
-                        self.data.getsockopt(zmq.EVENTS) & zmq.POLLIN and
-                        discarded < self.max_discard
-                ):
-                    discarded += 1
-                    continue
-                if discarded:
-                    logging.debug("VA discarded %d values", discarded)
-                discarded = 0
+    def __init__(self, mux, topic):
+        """
+        mux (_VAMultiplexer): the multiplexer receiving the updates
+        topic (bytes): the topic of the VA
+        """
+        threading.Thread.__init__(self, name="VA dispatch %s" % (topic.rstrip(b"\0").decode("utf-8", "replace"),))
+        self.daemon = True
+        self._mux = mux
+        self._topic = topic
+        self._cond = threading.Condition()
+        self._queue = collections.deque()  # pickled values to dispatch
+        self._discarded = 0  # number of values discarded in a row
+        self._stopped = False
+
+    def put(self, msg, max_discard):
+        """
+        Add a new value to dispatch. If values are already waiting (because the
+        listeners are slow), the latest one is replaced, within the limit of
+        max_discard.
+        msg (bytes): the pickled value
+        max_discard (int): amount of updates that can be discarded in a row
+        """
+        with self._cond:
+            if self._queue and self._discarded < max_discard:
+                self._queue[-1] = msg
+                self._discarded += 1
+            else:
+                self._queue.append(msg)
+            self._cond.notify()
 
+    def stop(self):
+        """
+        Stop dispatching (asynchronously). The values not yet dispatched are dropped.
+        """
+        with self._cond:
+            self._stopped = True
+            self._queue.clear()
+            self._cond.notify()
+
+    def run(self):
+        topic = self._topic
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                msg = self._queue.popleft()
+                self._discarded = 0
+
+            # Copy, as the list is modified by the multiplexer thread
+            subs = list(self._mux._subscribers.get(topic, ()))
+            if not subs:
+                continue  # Already unsubscribed
+            try:
+                value = pickle.loads(msg)
+            except Exception:
+                logging.exception("Failed to decode VA update for %s", topic)
+                continue
+            for wnotifier, _ in subs:
                 try:
-                    self.w_notifier(value)
+                    wnotifier(value)
                 except WeakRefLostError:
-                    self._commands.close()
-                    self.data.close()
-                    return
+                    self._mux._send_command("UNSUB", topic, wnotifier)
+                except Exception:
+                    logging.exception("Failed to notify VA update for %s", topic)
+
+
+# Closes the 0MQ connections cleanly when the process ends
+atexit.register(_VAMultiplexer.stop_all)
 
 
 def unregister_vigilant_attributes(self):
@@ -225,6 +225,95 @@ class TestActuator(unittest.TestCase):
 #             self.assertAlmostEqual(val, abs_mov_back[axis])
 
 
+class TestVAValues(unittest.TestCase):
+
+    def setUp(self):
+        self.comp = FakeScanner("scanner", "e-beam")
+
+    def test_set_order(self):
+        """
+        The VAs should be set following VA_ORDER, whatever the order passed
+        """
+        ret = self.comp.setVAValues({"dwellTime": 2e-6, "resolution": (256, 256),
+                                     "translation": (10, -10), "scale": (4, 4)})
+        self.assertEqual(self.comp.set_order, ["scale", "resolution", "translation", "dwellTime"])
+        self.assertEqual(ret, {"scale": (4, 4), "resolution": (256, 256),
+                               "translation": (10, -10), "dwellTime": 2e-6})
+
+        # The returned values are the ones accepted, after all the VAs are set
+        ret = self.comp.setVAValues({"resolution": (1024, 1024)})
+        self.assertEqual(ret, {"resolution": (256, 256)})
+
+    def test_errors(self):
+        with self.assertRaises(LookupError):
+            self.comp.setVAValues({"scale": (2, 2), "foo": 1})
+        with self.assertRaises(LookupError):
+            self.comp.getVAValues(["scale", "role"])  # not a VA
+        self.assertEqual(self.comp.set_order, [])
+
+        # dwellTime out of range => first error raised
+        with self.assertRaises(IndexError):
+            self.comp.setVAValues({"dwellTime": 10, "scale": (2, 2)})
+        self.assertEqual(self.comp.scale.value, (2, 2))
+
+        ret = self.comp.setVAValues({"dwellTime": 10, "scale": (1, 1), "translation": (1, 1)},
+                                    ignore_errors=True)
+        self.assertEqual(ret, {"dwellTime": 1e-6, "scale": (1, 1), "translation": (1, 1)})
+
+    def test_preserve(self):
+        orig = self.comp.getVAValues(["scale", "resolution", "dwellTime"])
+        with model.PreservedVAs(self.comp, ["scale", "resolution", "dwellTime"]) as saved:
+            self.assertEqual(saved, orig)
+            self.comp.scale.value = (8, 8)  # Also changes the resolution
+            self.comp.dwellTime.value = 5e-6
+        self.assertEqual(self.comp.getVAValues(["scale", "resolution", "dwellTime"]), orig)
+
+        # Also restored on exception
+        with self.assertRaises(ValueError):
+            with model.PreservedVAs(self.comp, ["dwellTime"]):
+                self.comp.dwellTime.value = 5e-6
+                raise ValueError("Failure during acquisition")
+        self.assertEqual(self.comp.dwellTime.value, orig["dwellTime"])
+
+
+class FakeScanner(model.Emitter):
+    """
+    Scanner with a resolution limited by the scale
+    """
+    def __init__(self, name, role, **kwargs):
+        model.Emitter.__init__(self, name, role, **kwargs)
+        self._shape = (1024, 1024)
+        self.set_order = []  # names of the VAs, in the order they were set
+        self.scale = model.TupleContinuous((1, 1), [(1, 1), (16, 16)],
+                                           setter=self._setScale)
+        self.resolution = model.ResolutionVA((1024, 1024), [(1, 1), (1024, 1024)],
+                                             setter=self._setResolution)
+        self.translation = model.TupleContinuous((0, 0), [(-512, -512), (512, 512)],
+                                                 setter=self._setTranslation)
+        self.dwellTime = model.FloatContinuous(1e-6, (1e-7, 1), setter=self._setDwellTime)
+
+    def _setScale(self, value):
+        self.set_order.append("scale")
+        # Keep the same field of view => update the resolution
+        max_res = tuple(int(s // v) for s, v in zip(self._shape, value))
+        self.resolution._value = max_res
+        self.resolution.notify(max_res)
+        return value
+
+    def _setResolution(self, value):
+        self.set_order.append("resolution")
+        max_res = tuple(int(s // v) for s, v in zip(self._shape, self.scale.value))
+        return tuple(min(v, m) for v, m in zip(value, max_res))
+
+    def _setTranslation(self, value):
+        self.set_order.append("translation")
+        return value
+
+    def _setDwellTime(self, value):
+        self.set_order.append("dwellTime")
+        return value
+
+
 class FakeActuator(Actuator):
     @isasync
     def moveRel(self, shift):
@@ -24,11 +24,14 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 import logging
 
 from Pyro4.core import oneway
+import numpy
 from odemis import model
+from odemis.model import _dataflow
 import pickle
 import threading
 import time
 import unittest
+import zmq
 
 
 class SimpleDataFlow(model.DataFlow):
@@ -358,5 +361,261 @@ class TestDataFlow(unittest.TestCase):
         self.assertEqual(self.left, 10)
 
 
+class TestSharedMemoryRing(unittest.TestCase):
+    """
+    Test the transfer of arrays via shared memory, without a remote process
+    """
+
+    def setUp(self):
+        self.ring = _dataflow._SharedMemoryRing("odemis-test-%x" % (id(self),), 2)
+        self.reader = _dataflow._SharedMemoryReader("0/1")
+        self.ring.add_reader("0/1")
+
+    def tearDown(self):
+        self.reader.close()
+        self.ring.close()
+
+    def _write(self, i, shape=(256, 256), may_drop=True):
+        return self.ring.write(numpy.full(shape, i, dtype=numpy.uint16), may_drop)
+
+    def _read(self, info, shape=(256, 256)):
+        return self.reader.read(info, numpy.uint16, shape)
+
+    def test_used_slot(self):
+        """
+        A slot used by the reader is not overwritten
+        """
+        info = self._write(1)
+        array = self._read(info)
+        self.assertFalse(array.flags.writeable)
+        view = model.DataArray(array)[10:20]
+        del array
+
+        infos = [self._write(i) for i in range(2, 6)]
+        self.assertTrue(all(inf["slot"] != info["slot"] for inf in infos))
+        self.assertTrue(numpy.all(view == 1))
+        self.assertIsNone(self._read(infos[0]))  # Overwritten (as discarding is allowed)
+        numpy.testing.assert_array_equal(self._read(infos[-1]), 5)
+
+        # When the reader uses all the slots, the arrays cannot be passed
+        held = self._read(infos[-1])
+        self.assertIsNone(self._write(6))
+        del held
+
+        # Once the view is released, the slot can be used again
+        del view
+        slots = {self._write(i)["slot"] for i in range(7, 9)}
+        self.assertIn(info["slot"], slots)
+
+    def test_no_drop(self):
+        """
+        When not discarding, a slot is only overwritten once the array has been processed
+        """
+        timeout = _dataflow.SHM_WAIT_TIMEOUT
+        _dataflow.SHM_WAIT_TIMEOUT = 0.1
+        try:
+            infos = [self._write(i, may_drop=False) for i in range(2)]
+            self.assertIsNone(self._write(2, may_drop=False))  # Times out
+
+            # The writer waits until the array is processed
+            numpy.testing.assert_array_equal(self._read(infos[0]), 0)
+            threading.Timer(0.05, self.reader.set_processed, args=(infos[0]["seq"],)).start()
+            info = self._write(3, may_drop=False)
+            self.assertEqual(info["slot"], infos[0]["slot"])
+            # The second array is still there
+            numpy.testing.assert_array_equal(self._read(infos[1]), 1)
+        finally:
+            _dataflow.SHM_WAIT_TIMEOUT = timeout
+
+    def test_reallocate(self):
+        """
+        When the arrays get bigger, the arrays already sent can still be received
+        """
+        info = self._write(1, may_drop=False)
+        info_big = self._write(2, shape=(512, 512), may_drop=False)
+        self.assertNotEqual(info["name"], info_big["name"])
+        numpy.testing.assert_array_equal(self._read(info), 1)
+        self.reader.set_processed(info["seq"])
+        numpy.testing.assert_array_equal(self._read(info_big, (512, 512)), 2)
+        self.reader.set_processed(info_big["seq"])
+
+        # The previous shared memory has been released, so the array is lost
+        self._write(3, shape=(512, 512), may_drop=False)
+        reader2 = _dataflow._SharedMemoryReader("0/1")
+        with self.assertRaises(OSError):
+            reader2.read(info, numpy.uint16, (256, 256))
+        reader2.close()
+
+    def test_untracked(self):
+        """
+        A reader unknown to the writer gets a copy of the array
+        """
+        reader2 = _dataflow._SharedMemoryReader("0/2")
+        info = self._write(1)
+        array = reader2.read(info, numpy.uint16, (256, 256))
+        self.assertTrue(array.flags.writeable)
+        numpy.testing.assert_array_equal(array, 1)
+        del array
+        reader2.close()
+
+
+class TestHeaderEncoding(unittest.TestCase):
+    """
+    Test the binary encoding of the DataArray format sent over 0MQ
+    """
+
+    def setUp(self):
+        self.md = {model.MD_ACQ_DATE: 1e9,
+                   model.MD_PIXEL_SIZE: (1e-6, 2e-6),
+                   model.MD_BINNING: (1, 1),
+                   model.MD_DESCRIPTION: "blabla",
+                   model.MD_EXP_TIME: 0.1,
+                   model.MD_AR_POLE: (1.0, 2.0),
+                   model.MD_WL_LIST: [500e-9, 501e-9, 502e-9],
+                   model.MD_HW_NAME: None,
+                   model.MD_INTEGRATION_COUNT: 3,
+                   "Bool": True,
+                   "Array": numpy.arange(5, dtype=float),
+                   }
+
+    def test_keyframe_delta(self):
+        enc = _dataflow._HeaderEncoder()
+        dec = _dataflow._HeaderDecoder()
+
+        hdr = enc.encode(numpy.dtype("uint16"), (256, 512), self.md)
+        aformat = dec.decode(hdr)
+        self.assertEqual(aformat["dtype"], numpy.dtype("uint16"))
+        self.assertEqual(aformat["shape"], (256, 512))
+        self._assert_md_equal(aformat["metadata"], self.md)
+
+        # Only the acquisition date changes => small header
+        md2 = self.md.copy()
+        md2[model.MD_ACQ_DATE] += 1
+        del md2[model.MD_DESCRIPTION]
+        hdr2 = enc.encode(numpy.dtype("uint16"), (256, 512), md2)
+        self.assertLess(len(hdr2), len(hdr) / 4)
+        aformat = dec.decode(hdr2)
+        self._assert_md_equal(aformat["metadata"], md2)
+
+        # The metadata of each array is independent
+        aformat["metadata"][model.MD_WL_LIST].append(503e-9)
+        aformat = dec.decode(hdr2)
+        self._assert_md_equal(aformat["metadata"], md2)
+
+        # A decoder which missed the keyframe cannot decode the delta
+        dec2 = _dataflow._HeaderDecoder()
+        self.assertIsNone(dec2.decode(hdr2))
+        enc.force_keyframe()
+        hdr3 = enc.encode(numpy.dtype("uint16"), (256, 512), md2)
+        self._assert_md_equal(dec2.decode(hdr3)["metadata"], md2)
+
+    def test_request_keyframe(self):
+        """
+        A subscriber which missed the keyframe can get the full metadata again
+        """
+        df = SimpleDataFlow()
+        dec = _dataflow._HeaderDecoder()
+        df._hdr_encoder.encode(numpy.dtype("uint16"), (256, 512), self.md)
+        hdr = df._hdr_encoder.encode(numpy.dtype("uint16"), (256, 512), self.md)
+        self.assertIsNone(dec.decode(hdr))
+
+        df._request_keyframe()
+        hdr = df._hdr_encoder.encode(numpy.dtype("uint16"), (256, 512), self.md)
+        self._assert_md_equal(dec.decode(hdr)["metadata"], self.md)
+
+    def test_special_formats(self):
+        enc = _dataflow._HeaderEncoder()
+        dec = _dataflow._HeaderDecoder()
+
+        # structured dtype, non-str keys, shared memory, empty array
+        dtype = numpy.dtype([("x", "<f4"), ("y", "<i2")])
+        md = {1: "a", "b": 2}
+        shm = {"name": "odemis-test", "slot": 2, "seq": 12, "offset": 4096}
+        aformat = dec.decode(enc.encode(dtype, (0,), md, shm))
+        self.assertEqual(aformat["dtype"], dtype)
+        self.assertEqual(aformat["shape"], (0,))
+        self.assertEqual(aformat["metadata"], md)
+        self.assertEqual(aformat["shm"], shm)
+
+        # After a pickled metadata, a keyframe is sent
+        aformat = dec.decode(enc.encode(numpy.dtype(">f8"), (3, 2), self.md))
+        self.assertEqual(aformat["dtype"], numpy.dtype(">f8"))
+        self._assert_md_equal(aformat["metadata"], self.md)
+
+    def test_speed(self):
+        """
+        Compare the number of arrays per second sent over 0MQ when the format
+        is pickled (previous method) vs the binary encoding. The speed is only
+        reported, as it depends too much on the load of the computer.
+        """
+        ctx = zmq.Context(1)
+        try:
+            for shape in ((1, 1024), (2048, 2048)):
+                data = model.DataArray(numpy.zeros(shape, dtype=numpy.uint16), self.md)
+                n = 200 if data.nbytes > 1e6 else 10000
+                fps_pickle = self._measure_fps(ctx, data, n, self._send_pickle, self._recv_pickle)
+                fps_bin = self._measure_fps(ctx, data, n, self._send_binary, self._recv_binary)
+                logging.info("Shape %s: %g fps with pickle, %g fps with binary header",
+                             shape, fps_pickle, fps_bin)
+        finally:
+            ctx.term()
+
+    def _measure_fps(self, ctx, data, n, send, recv):
+        pub = ctx.socket(zmq.PAIR)
+        sub = ctx.socket(zmq.PAIR)
+        # Never block when closing, even if some messages are still referenced
+        pub.linger = 0
+        sub.linger = 0
+        pub.bind("inproc://test_header_speed")
+        sub.connect("inproc://test_header_speed")
+        enc = _dataflow._HeaderEncoder()
+        dec = _dataflow._HeaderDecoder()
+        try:
+            tstart = time.time()
+            for i in range(n):
+                data.metadata[model.MD_ACQ_DATE] = tstart + i
+                send(pub, enc, data)
+                da = recv(sub, dec)
+            dur = time.time() - tstart
+            self.assertEqual(da.metadata[model.MD_ACQ_DATE], tstart + n - 1)
+            del da  # Release the last 0MQ frame, before closing the sockets
+            return n / dur
+        finally:
+            pub.close()
+            sub.close()
+
+    def _send_pickle(self, pipe, enc, data):
+        dformat = {"dtype": str(data.dtype), "shape": data.shape, "metadata": data.metadata}
+        pipe.send_pyobj(dformat, zmq.SNDMORE)
+        pipe.send(memoryview(data), copy=False)
+
+    def _recv_pickle(self, pipe, dec):
+        aformat = pipe.recv_pyobj()
+        buf = pipe.recv(copy=False)
+        array = numpy.frombuffer(buf, dtype=aformat["dtype"])
+        array.shape = aformat["shape"]
+        return model.DataArray(array, metadata=aformat["metadata"])
+
+    def _send_binary(self, pipe, enc, data):
+        pipe.send(enc.encode(data.dtype, data.shape, data.metadata), zmq.SNDMORE)
+        pipe.send(memoryview(data), copy=False)
+
+    def _recv_binary(self, pipe, dec):
+        hdr = pipe.recv(copy=False)
+        buf = pipe.recv(copy=False)
+        aformat = dec.decode(hdr.buffer)
+        array = numpy.frombuffer(buf, dtype=aformat["dtype"])
+        array.shape = aformat["shape"]
+        return model.DataArray(array, metadata=aformat["metadata"])
+
+    def _assert_md_equal(self, md, exp_md):
+        self.assertEqual(set(md.keys()), set(exp_md.keys()))
+        for k, v in exp_md.items():
+            if isinstance(v, numpy.ndarray):
+                numpy.testing.assert_array_equal(md[k], v)
+            else:
+                self.assertEqual(md[k], v, "Metadata %s differs" % (k,))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -541,6 +541,43 @@ class RemoteTest(unittest.TestCase):
         self.assertEqual(count_end, self.count)
         self.assertGreaterEqual(count_end, 1)
 
+    def test_dataflow_shm(self):
+        """
+        Check the arrays are received via shared memory, as read-only views
+        """
+        self.count = 0
+        self.expected_shape = (2048, 2048)
+        self.data_arrays_sent = 0
+        self.writeable = set()
+        self.comp.datashm.reset()
+
+        self.comp.datashm.subscribe(self.receive_data_shm)
+        time.sleep(0.5)
+        self.comp.datashm.unsubscribe(self.receive_data_shm)
+        count_end = self.count
+        print("received %d arrays over %d" % (self.count, self.data_arrays_sent))
+
+        time.sleep(0.1)
+        self.assertEqual(count_end, self.count)
+        self.assertGreaterEqual(count_end, 1)
+        self.assertEqual(self.writeable, {False})
+
+        # Small arrays are still copied over 0MQ
+        self.count = 0
+        self.writeable = set()
+        self.expected_shape = (16, 16)
+        self.comp.datashm.setShape((16, 16), 16)
+        self.comp.datashm.subscribe(self.receive_data_shm)
+        time.sleep(0.5)
+        self.comp.datashm.unsubscribe(self.receive_data_shm)
+        self.comp.datashm.setShape((2048, 2048), 16)
+        self.assertGreaterEqual(self.count, 1)
+        self.assertEqual(self.writeable, {True})
+
+    def receive_data_shm(self, dataflow, data):
+        self.writeable.add(data.flags.writeable)
+        self.receive_data(dataflow, data)
+
     def test_synchronized_df(self):
         """
         Tests 2 dataflows, one synchronized on the event of acquisition started
@@ -758,9 +795,42 @@ class RemoteTest(unittest.TestCase):
         except TypeError:
             pass # as it should be
 
+    def test_va_multiplexing(self):
+        """
+        Check that all the VAs of a component share the same thread for receiving
+        the updates, and that rapid updates are coalesced.
+        """
+        vas = [self.comp.prop, self.comp.cont, self.comp.enum, self.comp.cut, self.comp.listval]
+        threads_before = threading.active_count()
+        for va in vas:
+            va.subscribe(self.receive_va_update)
+        time.sleep(0.01)  # It can take some time to subscribe
+
+        mux_threads = [t for t in threading.enumerate() if t.name.startswith("zmq for VAs")]
+        logging.info("%d threads before subscribing to %d VAs, %d after",
+                     threads_before, len(vas), threading.active_count())
+        self.assertEqual(len(mux_threads), 1)
+
+        try:
+            # Burst of updates, while the notifications are slow to process
+            self.called = 0
+            self.last_value = None
+            self.sleep_on_update = 0.1
+            for i in range(20):
+                self.comp.change_prop(i)
+            time.sleep(1)
+            self.assertEqual(self.last_value, 19)
+            # 20 updates, but some are discarded while the listener is busy
+            self.assertLess(self.called, 20)
+        finally:
+            self.sleep_on_update = 0
+            for va in vas:
+                va.unsubscribe(self.receive_va_update)
+
     def receive_va_update(self, value):
         logging.debug("Update va to %s", value)
         self.called += 1
+        time.sleep(getattr(self, "sleep_on_update", 0))
         self.last_value = value
         self.assertIsInstance(value, (int, float))
 
@@ -823,6 +893,35 @@ class RemoteTest(unittest.TestCase):
         self.assertEqual(self.called, 3)
         l.unsubscribe(self.receive_listva_update)
 
+    def test_va_values(self):
+        """
+        Read and write multiple VAs in one call
+        """
+        vals = self.comp.getVAValues(["prop", "cont", "enum"])
+        self.assertEqual(vals, {"prop": 42, "cont": 2, "enum": "a"})
+
+        ret = self.comp.setVAValues({"prop": 3, "cont": 3.0, "enum": "c"})
+        self.assertEqual(ret, {"prop": 3, "cont": 3, "enum": "c"})
+        self.assertEqual(self.comp.prop.value, 3)
+        self.assertEqual(self.comp.enum.value, "c")
+
+        # Out of range
+        with self.assertRaises(IndexError):
+            self.comp.setVAValues({"prop": 4, "cont": 4.0})
+
+        # Out of range, but the other VAs are still set
+        ret = self.comp.setVAValues({"prop": 5, "cont": 4.0}, ignore_errors=True)
+        self.assertEqual(ret, {"prop": 5, "cont": 3})
+
+        with self.assertRaises(LookupError):
+            self.comp.getVAValues(["prop", "ping"])
+
+        with model.PreservedVAs(self.comp, ["prop", "enum"]) as saved:
+            self.assertEqual(saved, {"prop": 5, "enum": "c"})
+            self.comp.prop.value = 6
+            self.comp.enum.value = "a"
+        self.assertEqual(self.comp.getVAValues(["prop", "enum"]), saved)
+
     def receive_listva_update(self, value):
         logging.debug("listva changed to %s", value)
         self.called += 1
@@ -891,6 +990,7 @@ class MyComponent(model.Component):
         self.hwTrigger = model.HwTrigger()
         self.data = FakeDataFlow(sae=self.startAcquire)
         self.datas = SynchronizableDataFlow()
+        self.datashm = FakeDataFlow(shm_slots=4)
 
         self.data_count = 0
         self._df = None
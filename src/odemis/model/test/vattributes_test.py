@@ -24,7 +24,12 @@ from builtins import str
 import logging
 import numpy
 from odemis import model
+from odemis.model import _vattributes
+import os
 import pickle
+import shutil
+import tempfile
+import threading
 import time
 import unittest
 from unittest.case import skip
@@ -553,6 +558,97 @@ class VigilantAttributeTest(unittest.TestCase):
         propt.unsubscribe(self.callback_test_notify)
 
 
+class VAMultiplexerTest(unittest.TestCase):
+    """
+    Test the dispatch of the VA updates received from another container,
+    without a remote process
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        uri = os.path.join(self.tmpdir, "test.ipc@Pyro.VAs")
+        self.pub = _vattributes._VAPublisher(None, uri)
+        self.mux = _vattributes._VAMultiplexer(uri)
+        self.mux.start()
+        self.received = {}  # topic -> list of values
+        self.slow = threading.Event()
+
+    def tearDown(self):
+        self.slow.set()
+        self.mux.stop()
+        self.pub.release()
+        shutil.rmtree(self.tmpdir)
+
+    def on_fast(self, v):
+        self.received.setdefault(b"fast\0", []).append(v)
+
+    def on_slow(self, v):
+        self.received.setdefault(b"slow\0", []).append(v)
+        self.slow.wait(5)
+
+    def test_slow_listener(self):
+        """
+        A slow listener doesn't delay the updates of the other VAs
+        """
+        self.mux.subscribe(b"slow\0", self.on_slow, 100)
+        self.mux.subscribe(b"fast\0", self.on_fast, 100)
+        time.sleep(0.1)  # Wait for the subscription to be active on the 0MQ pipe
+
+        self.pub.send(b"slow\0", 0)
+        time.sleep(0.1)  # The slow listener is now busy
+        for i in range(1, 5):
+            self.pub.send(b"slow\0", i)
+            self.pub.send(b"fast\0", i)
+        time.sleep(0.2)
+        self.assertEqual(self.received[b"slow\0"], [0])
+        self.assertEqual(self.received[b"fast\0"][-1], 4)
+
+        # Once the listener is done, it only gets the latest value
+        self.slow.set()
+        time.sleep(0.2)
+        self.assertEqual(self.received[b"slow\0"], [0, 4])
+
+    def test_blocking_listeners(self):
+        """
+        Many blocking listeners don't prevent the updates of the other VAs, even
+        when a listener waits for the update of another VA
+        """
+        slow_topics = [b"slow%d\0" % i for i in range(8)]
+        for t in slow_topics:
+            self.mux.subscribe(t, self.on_slow, 100)
+
+        # Blocks until the "fast" VA is updated
+        fast_received = threading.Event()
+        waited = []
+
+        def on_wait(v):
+            waited.append(fast_received.wait(5))
+
+        def on_fast(v):
+            self.on_fast(v)
+            fast_received.set()
+
+        self.mux.subscribe(b"wait\0", on_wait, 100)
+        self.mux.subscribe(b"fast\0", on_fast, 100)
+        time.sleep(0.1)  # Wait for the subscription to be active on the 0MQ pipe
+
+        for t in slow_topics:
+            self.pub.send(t, 0)
+        self.pub.send(b"wait\0", 0)
+        time.sleep(0.1)  # All the slow listeners, and the waiting one, are now busy
+        self.pub.send(b"fast\0", 1)
+        time.sleep(0.2)
+        self.assertEqual(self.received[b"fast\0"], [1])
+        self.assertEqual(waited, [True])
+
+    def test_stop(self):
+        self.mux.subscribe(b"fast\0", self.on_fast, 100)
+        self.mux.stop()
+        self.assertFalse(self.mux.is_alive())
+        # Subscribing to a stopped multiplexer doesn't block
+        self.mux.subscribe(b"slow\0", self.on_slow, 100)
+
+
 class LittleObject(object):
     def __init__(self):
         self.called = 0
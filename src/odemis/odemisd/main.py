@@ -47,6 +47,7 @@ from odemis.util.driver import (BACKEND_DEAD, BACKEND_RUNNING,
                                 get_backend_status)
 
 DEFAULT_SETTINGS_FILE = "/etc/odemis-settings.yaml"
+DEFAULT_MAX_PARALLEL = 1  # maximum number of components instantiated simultaneously
 
 status_to_xtcode = {BACKEND_RUNNING: 0,
                     BACKEND_DEAD: 1,
@@ -62,7 +63,8 @@ class BackendContainer(model.Container):
     """
 
     def __init__(self, model_file, settings_file, create_sub_containers=False,
-                 dry_run=False, strict_children: bool = False, name=model.BACKEND_NAME):
+                 dry_run=False, strict_children: bool = False, name=model.BACKEND_NAME,
+                 max_parallel: int = DEFAULT_MAX_PARALLEL):
         """
         inst_file (file): opened file that contains the yaml
         settings_file (file): opened file that contains the persistent data
@@ -73,6 +75,8 @@ class BackendContainer(model.Container):
           model without actually any driver contacting the hardware.
         strict_children: If True, make the microscope file syntax check stricter, and explicitly
         distinguish between children and dependencies.
+        max_parallel: maximum number of components instantiated simultaneously.
+          1 to instantiate them one at a time.
         """
         model.Container.__init__(self, name)
 
@@ -82,7 +86,12 @@ class BackendContainer(model.Container):
         self._inst_thread = None # thread running the component instantiation
         self._must_stop = threading.Event()
         self._dry_run = dry_run
-        # TODO: have an argument to ask for disabling parallel start? same as create_sub_containers?
+        if max_parallel < 1:
+            raise ValueError("max_parallel must be at least 1, got %s" % (max_parallel,))
+        self._max_parallel = max_parallel
+        # To protect the .alive and .ghosts VAs of the microscope, which are
+        # updated by the instantiation of each component
+        self._mic_lock = threading.RLock()
 
         # parse the instantiation file
         logging.debug("model instantiation file is: %s", os.path.abspath(self._model.name))
@@ -210,6 +219,9 @@ class BackendContainer(model.Container):
         """
         Thread continuously monitoring the components that need to be instantiated
         """
+        executor = futures.ThreadPoolExecutor(max_workers=self._max_parallel,
+                                              thread_name_prefix="Component instantiator")
+        running = {}  # Future -> str: name of the components being instantiated
         try:
             # Hack warning: there is a bug in python when using lock (eg, logging)
             # and simultaneously using threads and process: is a thread acquires
@@ -222,46 +234,55 @@ class BackendContainer(model.Container):
             mic = self._instantiator.microscope
             failed = set() # set of str: name of components that failed recently
             while not self._must_stop.is_set():
-                # Try to start simultaneously all the components that are
-                # independent from each other
-                nexts = set()
-                while not nexts:
-                    instantiated = set(c.name for c in mic.alive.value) | {mic.name}
-                    nexts = self._instantiator.get_instantiables(instantiated)
+                # Start simultaneously all the components that are independent
+                # from each other. As soon as one component is instantiated,
+                # check whether it allows new components to be instantiated.
+                instantiated = set(c.name for c in mic.alive.value) | {mic.name}
+                nexts = self._instantiator.get_instantiables(instantiated)
+                nexts -= failed | set(running.values())
+
+                # Creating a container forks the process, which is only safe
+                # when no other thread is busy. So create the containers before
+                # instantiating the components, and postpone the components
+                # which need a new container while others are being instantiated.
+                if self._max_parallel > 1 and nexts:
+                    need_cont = {n for n in nexts if self._instantiator.needs_new_container(n)}
+                    if need_cont and running:
+                        nexts -= need_cont
+                    elif need_cont:
+                        cfailed = self._instantiator.prepare_containers(need_cont)
+                        failed |= cfailed
+                        nexts -= cfailed
+
+                if nexts:
+                    logging.debug("Trying to instantiate comps: %s", ", ".join(nexts))
+                for n in nexts:
+                    with self._mic_lock:
+                        ghosts = mic.ghosts.value.copy()
+                        if n not in ghosts:
+                            logging.warning("going to instantiate %s but not a ghost", n)
+                        ghosts[n] = ST_STARTING
+                        mic.ghosts.value = ghosts
+                    f = executor.submit(self._instantiate_component_timed, n)
+                    running[f] = n
+
+                if not running:
                     # If still some non-failed component, immediately try again,
                     # otherwise give some time for things to get fixed or broken
-                    nexts -= failed
-                    if not nexts:
-                        if self._dry_run:
-                            return # everything instantiated, good enough
-
-                        if self._must_stop.wait(10):
-                            return
-                        failed = set() # not recent anymore
+                    if self._dry_run:
+                        return # everything instantiated, good enough
 
-                logging.debug("Trying to instantiate comps: %s", ", ".join(nexts))
+                    if self._must_stop.wait(10):
+                        return
+                    failed = set() # not recent anymore
+                    continue
 
-                for n in nexts:
-                    ghosts = mic.ghosts.value.copy()
-                    if n not in ghosts:
-                        logging.warning("going to instantiate %s but not a ghost", n)
-                    # TODO: run each of them in a future, so that they start
-                    # in parallel, and (bonus) when the future is done, check
-                    # immediately which component can be started. The only
-                    # difficulty is to ensure non-concurrent access to .ghosts
-                    # and .alive .
+                # Block until one instantiation is over (or we need to stop)
+                done, _ = futures.wait(running, timeout=1, return_when=futures.FIRST_COMPLETED)
+                for f in done:
+                    n = running.pop(f)
                     try:
-                        ghosts[n] = ST_STARTING
-                        mic.ghosts.value = ghosts
-                        newcmps = self._instantiate_component(n)
-                        if self._must_stop.is_set():
-                            # in case the termination was too late to stop these new component
-                            for c in newcmps:
-                                try:
-                                    c.terminate()
-                                except Exception:
-                                    logging.warning("Failed to terminate component '%s'", c.name, exc_info=True)
-                            break
+                        newcmps = f.result()
                     except ValueError:
                         if self._dry_run:
                             raise
@@ -270,7 +291,10 @@ class BackendContainer(model.Container):
                         logging.debug("Stopping instantiation due to unrecoverable error")
                         threading.Thread(target=self.terminate).start()
                         return
-                    if not newcmps:
+                    if self._must_stop.is_set():
+                        # in case the termination was too late to stop these new component
+                        self._terminate_late_components(newcmps)
+                    elif not newcmps:
                         failed.add(n)
             self._update_persistent_metadata()
 
@@ -278,8 +302,50 @@ class BackendContainer(model.Container):
             logging.exception("Instantiator thread failed")
             raise
         finally:
+            # The components waiting to be instantiated are dropped. The ones
+            # being instantiated will be stopped as soon as they are ready, as
+            # it's not possible to interrupt them.
+            for f in running:
+                if not f.cancel():
+                    f.add_done_callback(self._on_late_instantiation)
+            executor.shutdown(wait=False)
             logging.debug("Instantiator thread finished")
 
+    def _on_late_instantiation(self, f):
+        try:
+            newcmps = f.result()
+        except Exception:
+            return
+        self._terminate_late_components(newcmps)
+
+    def _terminate_late_components(self, newcmps):
+        for c in newcmps:
+            try:
+                c.terminate()
+            except Exception:
+                logging.warning("Failed to terminate component '%s'", c.name, exc_info=True)
+
+    def _instantiate_component_timed(self, name):
+        """
+        Same as _instantiate_component(), but also records the start and end
+        time in the .startupTimeline of the microscope.
+        """
+        mic = self._instantiator.microscope
+        with self._mic_lock:
+            timeline = mic.startupTimeline.value.copy()
+            timeline[name] = (time.time(), None)
+            mic.startupTimeline.value = timeline
+
+        try:
+            return self._instantiate_component(name)
+        finally:
+            with self._mic_lock:
+                timeline = mic.startupTimeline.value.copy()
+                timeline[name] = (timeline[name][0], time.time())
+                mic.startupTimeline.value = timeline
+                logging.info("Instantiation of component %s took %g s",
+                             name, timeline[name][1] - timeline[name][0])
+
     def _instantiate_component(self, name):
         """
         Instantiate a component and handle the outcome
@@ -291,15 +357,16 @@ class BackendContainer(model.Container):
         # TODO: use the AST from the microscope (instead of the original one
         # in _instantiator) to allow modifying it online?
         mic = self._instantiator.microscope
-        ghosts = mic.ghosts.value.copy()
         try:
             comp = self._instantiator.instantiate_component(name)
         except model.HwError as exp:
             # HwError means: hardware problem, try again later
             logging.warning("Failed to start component %s due to device error: %s",
                             name, exp)
-            ghosts[name] = exp
-            mic.ghosts.value = ghosts
+            with self._mic_lock:
+                ghosts = mic.ghosts.value.copy()
+                ghosts[name] = exp
+                mic.ghosts.value = ghosts
             return set()
         except Exception as exp:
             # Anything else means: microscope file or driver is borked => give up
@@ -326,13 +393,15 @@ class BackendContainer(model.Container):
                 logging.warning("Component %s instantiated extra unexpected components %s",
                                 name, new_names - exp_names)
 
-            mic.alive.value = mic.alive.value | new_cmps
-            # update ghosts by removing all the new components
-            dchildren = self._instantiator.get_children_names(name)
-            for n in dchildren:
-                del ghosts[n]
+            with self._mic_lock:
+                mic.alive.value = mic.alive.value | new_cmps
+                # update ghosts by removing all the new components
+                ghosts = mic.ghosts.value.copy()
+                dchildren = self._instantiator.get_children_names(name)
+                for n in dchildren:
+                    del ghosts[n]
 
-            mic.ghosts.value = ghosts
+                mic.ghosts.value = ghosts
 
             for c in new_cmps:
                 prop_names, _ = self._instantiator.get_persistent(c.name)
@@ -511,9 +580,11 @@ class BackendRunner(object):
 
     def __init__(self, model_file, settings_file, daemon=False, dry_run=False,
                  strict_children: bool = False,
-                 containement=CONTAINER_SEPARATED):
+                 containement=CONTAINER_SEPARATED,
+                 max_parallel: int = DEFAULT_MAX_PARALLEL):
         """
         containement (CONTAINER_*): the type of container policy to use
+        max_parallel: maximum number of components instantiated simultaneously
         """
         self.model = model_file
         self.settings = settings_file
@@ -521,6 +592,7 @@ class BackendRunner(object):
         self.dry_run = dry_run
         self.strict_children = strict_children
         self.containement = containement
+        self.max_parallel = max_parallel
 
         self._container = None
 
@@ -624,7 +696,8 @@ class BackendRunner(object):
             create_sub_containers = False
 
         self._container = BackendContainer(self.model, self.settings, create_sub_containers,
-                                        dry_run=self.dry_run, strict_children=self.strict_children)
+                                        dry_run=self.dry_run, strict_children=self.strict_children,
+                                        max_parallel=self.max_parallel)
 
         try:
             self._container.run()
@@ -690,6 +763,10 @@ def main(args):
                          help="Stricter microscope file check forbidding using children as dependencies")
     opt_grp.add_argument("--debug", action="store_true", dest="debug",
                          default=False, help="Activate debug mode, where everything runs in one process")
+    opt_grp.add_argument("--max-parallel", dest="max_parallel", metavar="N", type=int,
+                         default=DEFAULT_MAX_PARALLEL,
+                         help="Maximum number of components started simultaneously "
+                              "(default = %d, 1 to start them one at a time)" % DEFAULT_MAX_PARALLEL)
     opt_grp.add_argument("--log-level", dest="loglev", metavar="LEVEL", type=int,
                          default=0, help="Set verbosity level (0-2, default = 0)")
     opt_grp.add_argument("--log-target", dest="logtarget", metavar="{auto,stderr,filename}",
@@ -801,7 +878,7 @@ def main(args):
         # let's become the back-end for real
         runner = BackendRunner(options.model, settings_file, options.daemon,
                                dry_run=options.validate, strict_children=options.strict_children,
-                               containement=cont_pol)
+                               containement=cont_pol, max_parallel=options.max_parallel)
         runner.run()
     except ValueError as exp:
         logging.error("%s", exp)
@@ -29,6 +29,7 @@ import itertools
 import logging
 import os
 import re
+import threading
 import yaml
 
 from odemis import model
@@ -261,6 +262,9 @@ class Instantiator(object):
         self.sub_containers = {}  # container's name -> container: all the sub-containers created for the components
         self._comp_container = {}  # comp name -> container: the container that runs the given component
         self.create_sub_containers = create_sub_containers # flag for creating sub-containers
+        # Components can be instantiated simultaneously from different threads,
+        # this protects .components, .sub_containers and ._comp_container
+        self._lock = threading.RLock()
         self.dry_run = dry_run # flag for instantiating mock version of the components
         self.strict_children = strict_children  # Flag to indicate
 
@@ -600,6 +604,48 @@ class Instantiator(object):
 
         return True
 
+    def _has_own_container(self, name):
+        """
+        name (str): name of the component instance
+        return (bool): True if the component runs in a container created for it
+        """
+        return (self.create_sub_containers and self.ast[name].get("class") != "Microscope"
+                and self.is_leaf(name))
+
+    def needs_new_container(self, name):
+        """
+        name (str): name of the component instance
+        return (bool): True if instantiating the component will create a new
+          container (because it was not created by prepare_containers())
+        """
+        with self._lock:
+            return self._has_own_container(name) and name not in self.sub_containers
+
+    def prepare_containers(self, names):
+        """
+        Create the containers of the components which run in their own container,
+        before instantiating them. Creating a container forks the process, which
+        is only safe when no other thread is busy. So it should be done before
+        instantiating components simultaneously from different threads.
+        names (iterable of str): names of the components about to be instantiated
+        return (set of str): names of the components for which the container
+          could not be created
+        """
+        failed = set()
+        for name in names:
+            if not self.needs_new_container(name):
+                continue
+            try:
+                # new container has the same name as the component
+                cont = model.createNewContainer(name, validate=False)
+            except Exception:
+                logging.exception("Failed to create the container for component %s", name)
+                failed.add(name)
+                continue
+            with self._lock:
+                self.sub_containers[name] = cont
+        return failed
+
     def _get_container(self, name):
         """
         Find the best container to instantiate a component
@@ -612,7 +658,7 @@ class Instantiator(object):
             return self.root_container
 
         # If it's a leaf, use its own container
-        if self.create_sub_containers and self.is_leaf(name):
+        if self._has_own_container(name):
             return None
 
         # If it's not a leaf, it's probably a wrapper (eg, MultiplexActuator),
@@ -692,24 +738,45 @@ class Instantiator(object):
             class_comp = mock.MockComponent
 
         try:
-            cont = self._get_container(name)
-            if cont is None:
-                # new container has the same name as the component
-                cont, comp = model.createInNewContainer(name, class_comp, args)
-                self.sub_containers[name] = cont
+            with self._lock:
+                cont = self._get_container(name)
+                new_cont = cont is None
+                if new_cont:
+                    # Use the container created by prepare_containers(), if any
+                    cont = self.sub_containers.get(name)
+            if new_cont:
+                if cont is None:
+                    # new container has the same name as the component
+                    cont = model.createNewContainer(name, validate=False)
+                try:
+                    comp = model.createInContainer(cont, class_comp, args)
+                except Exception:
+                    with self._lock:
+                        self.sub_containers.pop(name, None)
+                    try:
+                        cont.terminate()  # Non blocking
+                    except Exception:
+                        logging.exception("Failed to stop the container %s after component failure",
+                                          name)
+                    raise
+                with self._lock:
+                    self.sub_containers[name] = cont
             else:
                 logging.debug("Creating %s in container %s", name, cont)
                 comp = model.createInContainer(cont, class_comp, args)
-            self._comp_container[name] = cont
+            with self._lock:
+                self._comp_container[name] = cont
         except Exception:
             logging.error("Error while instantiating component %s.", name)
             raise
 
-        self.components.add(comp)
-        # Add all the children, which were created by delegation, to our list of components.
-        self.components |= comp.children.value
-        for child in comp.children.value:
-            self._comp_container[child.name] = cont
+        children = comp.children.value
+        with self._lock:
+            self.components.add(comp)
+            # Add all the children, which were created by delegation, to our list of components.
+            self.components |= children
+            for child in children:
+                self._comp_container[child.name] = cont
 
         return comp
 
@@ -721,7 +788,9 @@ class Instantiator(object):
         Raises:
              LookupError: if no component is found
         """
-        for comp in self.components:
+        with self._lock:
+            comps = self.components.copy()
+        for comp in comps:
             if comp.name == name:
                 return comp
         raise LookupError("No component named '%s' found" % name)
@@ -911,7 +980,9 @@ class Instantiator(object):
             ValueError: if the component has already been instantiated
             KeyError: if component should be created by delegation
         """
-        for c in self.components:
+        with self._lock:
+            comps = self.components.copy()
+        for c in comps:
             if c.name == name:
                 raise ValueError("Trying to instantiate again component %s" % name)
 
@@ -938,7 +1009,8 @@ class Instantiator(object):
         """
         comps = set()
         if instantiated is None:
-            instantiated = set(c.name for c in self.components)
+            with self._lock:
+                instantiated = set(c.name for c in self.components)
         for n, attrs in self.ast.items():
             if n in instantiated: # should not be already instantiated
                 continue
@@ -27,8 +27,10 @@ except ImportError:  # Python 3 naming
     import io as StringIO
 import logging
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
 import time
 import unittest
 
@@ -43,7 +45,7 @@ logging.getLogger().setLevel(logging.DEBUG)
 
 # ODEMISD_CMD = "/usr/bin/python2 -m odemis.odemisd.main"
 ODEMISD_CMD = [sys.executable, os.path.dirname(odemis.__file__) + "/odemisd/main.py"]
-FILE_PATH = os.path.dirname(__file__)
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 SIM_CONFIG = os.path.join(FILE_PATH, "optical-sim.odm.yaml")
 
 
@@ -123,6 +125,12 @@ class TestCommandLine(unittest.TestCase):
         # NOTE: it seems unittest does this already, but that's just in case
         self.saved_stdout = sys.stdout
 
+        # Run each test in its own directory, so that the log and settings
+        # files it creates don't end up in the source tree
+        self._orig_cwd = os.getcwd()
+        self._tmpdir = tempfile.mkdtemp()
+        os.chdir(self._tmpdir)
+
     def tearDown(self):
         sys.stdout = self.saved_stdout
         # Make sure the backend is stopped
@@ -134,6 +142,8 @@ class TestCommandLine(unittest.TestCase):
             except Exception:
                 pass  # Odemis is not installed, too bad
         time.sleep(1)  # give it some time to finish
+        os.chdir(self._orig_cwd)
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
 
     def test_error_command_line(self):
         """
@@ -156,6 +166,16 @@ class TestCommandLine(unittest.TestCase):
         self.assertGreater(st.st_size, 0)
         os.remove("test.log")
 
+    def test_validate_sequential(self):
+        """
+        Check the components can be instantiated one at a time, or all in parallel
+        """
+        for n in (1, 32):
+            cmdline = "odemisd --log-level=2 --log-target=test.log --max-parallel=%d --validate %s" % (n, SIM_CONFIG)
+            ret = main.main(cmdline.split())
+            self.assertEqual(ret, 0, "trying to run '%s'" % cmdline)
+        os.remove("test.log")
+
     def test_help(self):
         """
         It checks handling help option
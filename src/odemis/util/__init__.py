@@ -33,6 +33,7 @@ from typing import Iterable, Tuple, TypeVar
 import numpy
 
 from .concurrent import (  # noqa: F401
+    AdaptiveRepeatingTimer,
     BackgroundWorker,
     RepeatingTimer,
     bindFuture,
@@ -21,6 +21,8 @@ If not, see http://www.gnu.org/licenses/.
 
 import logging
 import math
+import threading
+from collections import OrderedDict
 from typing import List, Optional, Tuple
 
 import matplotlib
@@ -28,7 +30,7 @@ matplotlib.use("Agg")  # use non-GUI backend
 import matplotlib.pyplot as plt
 import numpy
 from numpy import ma
-from scipy.interpolate import LinearNDInterpolator
+from scipy.sparse import csr_matrix
 from scipy.spatial import Delaunay as DelaunayTriangulation
 
 from odemis import model
@@ -57,21 +59,23 @@ DEFAULT_SLIT_WIDTH = 10e-6  # m, width of the slit used in the spectrometer
 DEFAULT_SENSOR_PIXEL_SIZE = (10e-6, 10e-6)  # m, pixel size of the sensor used in the spectrometer
 DEFAULT_BINNING = (1, 1)  # (x, y) binning of the sensor used in the spectrometer
 
+# Maximum number of remapping tables kept in memory. A table for a full-screen polar
+# projection (1134 x 1134 px) takes ~50 MB.
+AR_REMAP_CACHE_SIZE = 4
 
-def _ExtractAngleInformation(data, hole):
+
+def _ExtractAngleGeometry(data, hole):
     """
-    Calculates the corresponding theta and phi angles for each pixel in the input data.
-    Calculates the corresponding intensity values for a given theta/phi combination
-    for each pixel in the input data. Calculates a mask, which crops the data to angles,
-    which are collectible by the system.
+    Calculates the corresponding theta and phi angles for each pixel in the input data,
+    and the masks of the pixels which contain angles collectible by the system.
+    Only the shape and the metadata of the data are used, not the pixel values.
     :param data: (model.DataArray) The image that was projected on the detector after being
             reflected on the parabolic mirror.
     :returns:
         theta_data: array containing theta values for each px in raw data
         phi_data: array containing phi values for each px in raw data
-        intensity_data: array containing the measured intensity values for each px in raw data
-            and a given theta/phi combination. AR_data is corrected for photon collection
-            efficiency
+        omega: array containing the solid angle collected by each px in raw data
+        mirror_mask: mask of the pixels which receive light from the mirror
         circle_mask_dilated: mask used to crop the data for angles collectible by the system.
             Mask is dilated for visualization to avoid edge effects during triangulation
             and interpolation.
@@ -89,8 +93,8 @@ def _ExtractAngleInformation(data, hole):
 
     pole_pos = (pole_x, pole_y)
 
-    # Crop the input image to half circle (set values outside of half circle zero)
-    cropped_image = _CropHalfCircle(data, pixel_size, pole_pos, hole=hole)
+    # Mask of the half circle (the values outside of it are to be set to zero)
+    mirror_mask = _CreateMirrorMask(data, pixel_size, pole_pos, hole=hole)
 
     # return dilated circle_mask to crop input data
     # hole=False for dilated mask to avoid edge effects during interpolation
@@ -123,11 +127,34 @@ def _ExtractAngleInformation(data, hole):
     # phi_data: array containing phi values for each px in raw data
     theta_data, phi_data, omega = _FindAngle(x_array, y_array, pixel_size, parabola_f)
 
+    return theta_data, phi_data, omega, mirror_mask, circle_mask_dilated
+
+
+def _ExtractAngleInformation(data, hole):
+    """
+    Calculates the corresponding theta and phi angles for each pixel in the input data.
+    Calculates the corresponding intensity values for a given theta/phi combination
+    for each pixel in the input data. Calculates a mask, which crops the data to angles,
+    which are collectible by the system.
+    :param data: (model.DataArray) The image that was projected on the detector after being
+            reflected on the parabolic mirror.
+    :returns:
+        theta_data: array containing theta values for each px in raw data
+        phi_data: array containing phi values for each px in raw data
+        intensity_data: array containing the measured intensity values for each px in raw data
+            and a given theta/phi combination. AR_data is corrected for photon collection
+            efficiency
+        circle_mask_dilated: mask used to crop the data for angles collectible by the system.
+            Mask is dilated for visualization to avoid edge effects during triangulation
+            and interpolation.
+    """
+    theta_data, phi_data, omega, mirror_mask, circle_mask_dilated = _ExtractAngleGeometry(data, hole)
+
     # intensity_data contains the intensity values from raw data.
     # It already reflects the shape of the mirror
     # and is normalized by omega (solid angle:
     # measure for photon collection efficiency depending on theta and phi)
-    intensity_data = cropped_image / omega
+    intensity_data = numpy.where(mirror_mask, data, 0) / omega
 
     return theta_data, phi_data, intensity_data, circle_mask_dilated
 
@@ -187,43 +214,151 @@ def _flipDataIfMirrorFlipped(data):
 
     focus_distance = data.metadata.get(model.MD_AR_FOCUS_DISTANCE, AR_FOCUS_DISTANCE)
     if focus_distance < 0:
-        data = data[::-1, :]
+        data = data[..., ::-1, :]
         data.metadata = data.metadata.copy()
         data.metadata[model.MD_AR_FOCUS_DISTANCE] *= -1  # invert the focus distance for inverted mirror
         # put new y pole coordinate
         arpole = data.metadata[model.MD_AR_POLE]
-        data.metadata[model.MD_AR_POLE] = (arpole[0], data.shape[0] - 1 - arpole[1])
+        data.metadata[model.MD_AR_POLE] = (arpole[0], data.shape[-2] - 1 - arpole[1])
     return data
 
 
-def AngleResolved2Polar(data, output_size, hole=True):
+class ARRemapping(object):
     """
-    Converts an angle resolved image to polar (aka azimuthal) projection.
+    Conversion of angle resolved images to a projection (polar or rectangular).
+    The conversion only depends on the mirror geometry, the position of the pole and
+    the pixel size, so it is computed once, as a linear interpolation stored in a sparse
+    matrix. Converting an image is then a single sparse matrix-vector product.
+    """
+
+    def __init__(self, matrix, output_shape):
+        """
+        :param matrix: (scipy.sparse matrix of shape (prod(output_shape), Y * X)) the
+          interpolation weights of every input pixel for every output pixel.
+        :param output_shape: (int, int) shape of the projected image
+        """
+        self.matrix = matrix
+        self.output_shape = tuple(output_shape)
+
+    def apply(self, data):
+        """
+        Convert the image(s).
+        :param data: (ndarray of shape (..., Y, X)) One or more images.
+        :returns: (ndarray of float of shape (...,) + output_shape) The projected image(s).
+        """
+        lead_shape = data.shape[:-2]
+        flat = numpy.asarray(data, dtype=numpy.float64).reshape(-1, data.shape[-2] * data.shape[-1])
+        out = (self.matrix @ flat.T).T  # The matrix product requires the pixels on the first dim
+        return out.reshape(lead_shape + self.output_shape)
+
+
+# Conversions recently used, to reuse them for the next images with the same geometry
+_remap_cache = OrderedDict()  # key -> ARRemapping, the most recently used last
+_remap_cache_lock = threading.Lock()
+
+
+def _getARRemapping(data, output_size, hole, projection):
+    """
+    Returns the conversion of the angle resolved images, from the cache if available.
     :param data: (model.DataArray) The image that was projected on the detector after being
-            reflected on the parabolic mirror. The flat line of the D shape is
-            expected to be horizontal, at the top. It needs MD_PIXEL_SIZE and MD_AR_POLE
-            metadata. Pixel size is the sensor pixel size * binning / magnification.
-            Shape is (x, y).
-    :param output_size: (int) The size of the output DataArray (assumed to be square).
+      reflected on the parabolic mirror, as in AngleResolved2Polar(). If the mirror is flipped,
+      it should already be inverted (cf _flipDataIfMirrorFlipped()). Shape is (..., Y, X).
+    :param output_size: (int or (int, int)) The size of the output image.
     :param hole: (boolean) Crop the pole if True.
-    :returns: (model.DataArray) Converted image in polar view. Shape is (output_size, output_size).
+    :param projection: (str) "polar" or "rectangular".
+    :returns: (ARRemapping) The conversion for this image geometry.
     """
+    md = data.metadata
+    try:
+        key = (projection, data.shape[-2:], output_size, hole,
+               tuple(md[model.MD_PIXEL_SIZE]), tuple(md[model.MD_AR_POLE]),
+               md.get(model.MD_AR_PARABOLA_F, AR_PARABOLA_F),
+               md.get(model.MD_AR_XMAX, AR_XMAX),
+               md.get(model.MD_AR_HOLE_DIAMETER, AR_HOLE_DIAMETER),
+               md.get(model.MD_AR_FOCUS_DISTANCE, AR_FOCUS_DISTANCE),
+               )
+    except KeyError:
+        raise ValueError("Metadata required: MD_PIXEL_SIZE, MD_AR_POLE, MD_AR_PARABOLA_F.")
+
+    with _remap_cache_lock:
+        try:
+            remap = _remap_cache[key]
+            _remap_cache.move_to_end(key)
+            return remap
+        except KeyError:
+            pass
+
+    # Computed outside of the lock, as it's slow. If the same conversion is computed
+    # simultaneously in two threads, they'll just both store the (same) result.
+    # Only the geometry of the image is used, so just pass the first one.
+    image = data[(0,) * (data.ndim - 2)]
+    if projection == "polar":
+        remap = _ComputePolarRemapping(image, output_size, hole)
+    elif projection == "rectangular":
+        remap = _ComputeRectangularRemapping(image, output_size, hole)
+    else:
+        raise ValueError("Unknown projection %s" % (projection,))
+
+    with _remap_cache_lock:
+        _remap_cache[key] = remap
+        while len(_remap_cache) > AR_REMAP_CACHE_SIZE:
+            _remap_cache.popitem(last=False)
+
+    return remap
 
-    data = _flipDataIfMirrorFlipped(data)
 
+def _ComputeInterpolationMatrix(points, src_index, src_factor, xi, n_src):
+    """
+    Computes the linear interpolation over the Delaunay triangulation of the points, as a sparse matrix.
+    It is the same interpolation as scipy's LinearNDInterpolator (points, values)(xi).
+    :param points: (ndarray of shape (N, 2)) The coordinates of the input data points.
+    :param src_index: (ndarray of int of shape N) The index of the source pixel of each point.
+    :param src_factor: (ndarray of shape n_src) The factor to apply to the value of each source pixel.
+    :param xi: (ndarray of shape (M, 2)) The coordinates where to interpolate.
+    :param n_src: (int) The total number of source pixels.
+    :returns: (scipy.sparse.csr_matrix of shape (M, n_src)) The interpolation weights. The output
+      pixels outside of the triangulation have no weight (and so are 0).
+    """
+    triang = DelaunayTriangulation(points)
+    simplices = triang.find_simplex(xi)
+    inside = simplices >= 0
+    simplices = simplices[inside]
+
+    # Barycentric coordinates of each output position, in its triangle
+    transform = triang.transform[simplices]
+    bary = numpy.einsum("ijk,ik->ij", transform[:, :2], xi[inside] - transform[:, 2])
+    weights = numpy.column_stack((bary, 1 - bary.sum(axis=1)))
+
+    rows = numpy.repeat(numpy.flatnonzero(inside), 3)
+    cols = src_index[triang.simplices[simplices]].ravel()
+    weights = weights.ravel() * src_factor[cols]
+    # Note: if multiple points come from the same source pixel, the weights are summed
+    return csr_matrix((weights, (rows, cols)), shape=(len(xi), n_src))
+
+
+def _ComputePolarRemapping(data, output_size, hole):
+    """
+    Computes the conversion of an angle resolved image to polar projection.
+    :param data: (model.DataArray) The (non-flipped) image, as in AngleResolved2Polar().
+    :param output_size: (int) The size of the output image (assumed to be square).
+    :param hole: (boolean) Crop the pole if True.
+    :returns: (ARRemapping) The conversion. The output is not yet rotated.
+    """
     # calculate the corresponding theta and phi angles based on the geometrical properties
     # of the mirror for each px on the raw data
-    # TODO the angles are all the same for a given mirror shape
     # TODO runtime could be improved by calc mirror shape with pole pos at center and always move data to center
-    # TODO implement: if not theta, phi, intensity -> calc angles
-    theta_data, phi_data, intensity_data, circle_mask_dilated = _ExtractAngleInformation(data, hole)
+    theta_data, phi_data, omega, mirror_mask, circle_mask_dilated = _ExtractAngleGeometry(data, hole)
+    # The intensity of each px is normalized by omega (solid angle: measure for photon collection
+    # efficiency depending on theta and phi), and the data outside of the mirror is set to zero.
+    intensity_factor = numpy.where(mirror_mask, 1 / omega, 0).ravel()
+    px_index = numpy.arange(data.shape[0] * data.shape[1]).reshape(data.shape)
 
     # Crop the raw input data based on the mirror mask (circle_mask) to save memory and improve runtime.
     # We use a dilated mask for cropping to avoid edge effects during triangulation and interpolation.
     # The additional data points (due to dilation) will be set to zero during the interpolation step by intensity_data.
     theta_data_masked = theta_data[circle_mask_dilated]  # list of values for theta within mask
     phi_data_masked = phi_data[circle_mask_dilated]  # list of values for phi within mask
-    intensity_data_masked = intensity_data[circle_mask_dilated]  # list of values for intensity within mask
+    px_index_masked = px_index[circle_mask_dilated]  # list of the px index within mask
 
     # Convert the spherical coordinates theta and phi into polar coordinates for display in GUI
     # theta equals radial distance r to center of whole (0 - 90 degree)
@@ -238,84 +373,45 @@ def AngleResolved2Polar(data, output_size, hole=True):
     # Therefore, not all px in the output image are populated.
     # Moreover, the data is masked with the mirror shape (mask_circle).
     # Therefore, we perform a delaunay triangulation of the given data points.
-    # The delaunay object is passed to the interpolator with the corresponding intensity values (intensity_data).
-    # The interpolator also receives a meshgrid (set of coordinates) of the size specified for the output image.
-    # The input data points (theta and phi) are mapped on the meshgrid. As the meshgrid contains much more positions
-    # compared to the input data points, the interpolator fills up the empty grid positions with intensity values.
-    # These intensity values are interpolated from the intensity values of the positions spanning the triangle they
-    # are contained in (triangle from delaunay triangulation).
-    # Grid positions located outside of any delaunay triangle are set to NaN.
-
-    # Note: delaunay triangulation input points: ndarray of floats, shape (numpyoints, ndim) -> transpose data for input
+    # The output grid (set of coordinates) of the size specified for the output image is then
+    # located in the triangulation. As the grid contains much more positions compared to the
+    # input data points, the empty grid positions are filled with intensity values interpolated
+    # from the intensity values of the positions spanning the triangle they are contained in.
+    # Grid positions located outside of any delaunay triangle are set to 0.
+
+    # Note: delaunay triangulation input points: ndarray of floats, shape (numpoints, ndim) -> transpose data for input
     data_transposed = numpy.array([x_data_polar, y_data_polar]).T  # transpose moves angle orientation from CCW to CW
-    triang = DelaunayTriangulation(data_transposed)
-    # create interpolation object
-    interp = LinearNDInterpolator(triang, intensity_data_masked.flat)
     # create grid of positions for interpolation: neg to pos as x/y data polar
     # contain now values from -output_size/2 to +output_size/2
     xi, yi = numpy.meshgrid(numpy.linspace(-output_size / 2, output_size / 2, output_size),
                             numpy.linspace(-output_size / 2, output_size / 2, output_size))
+    grid = numpy.column_stack((xi.ravel(), yi.ravel()))
 
-    # interpolate
-    qz = interp(xi, yi)
-    # polar coordinate transformation starts with 0 at horizontal axis by definition
-    qz = numpy.rot90(qz)  # rotate by 90 degrees CCW so we start 0 at top (angles will be CW orientated)
-    qz[numpy.isnan(qz)] = 0  # remove NaNs created during interpolation
-    assert numpy.all(qz > -1)  # there should be no negative values, some very small due to interpolation are possible
-    qz[qz < 0] = 0  # all negative values (due to interpolation or wrong background subtraction) set to zero
-
-    # plot the data
-    # plt.figure()
-    # plt.plot(theta_data_polar, phi_data_polar)
-    #
-    # plt.figure()
-    # plt.plot(triang.points[:, 0], triang.points[:, 1])
-    #
-    # plt.figure()
-    # plt.plot(triang.points[:, 0], triang.points[:, 1], 'o')
-    # plt.triplot(triang.points[:, 0], triang.points[:, 1], triang.simplices.copy())
-    # plt.title("delaunay tesselation (triangulation)")
-
-    return model.DataArray(qz, data.metadata)
+    matrix = _ComputeInterpolationMatrix(data_transposed, px_index_masked, intensity_factor,
+                                         grid, px_index.size)
+    return ARRemapping(matrix, xi.shape)
 
 
-def AngleResolved2Rectangular(data, output_size, hole=True):
+def _ComputeRectangularRemapping(data, output_size, hole):
     """
-    Converts an angle resolved image to equirectangular (aka cylindrical) projection (ie, phi/theta axes).
-    Note: Even if the input contains only positive values, there might be some small negative
-    values in the output due to interpolation. Also note, that NaNs occurring in the
-    interpolation step are set to 0.
-    :param data: (model.DataArray) The image that was projected on the detector after being
-                reflected on the parabolic mirror. The flat line of the D shape is
-                expected to be horizontal, at the top. It needs MD_PIXEL_SIZE and MD_AR_POLE
-                metadata. Pixel size is the sensor pixel size * binning / magnification.
-    :param output_size: (int, int) The size of the output DataArray (theta, phi),
-                not including the theta/phi angles at the first row/column.
+    Computes the conversion of an angle resolved image to equirectangular projection.
+    :param data: (model.DataArray) The (non-flipped) image, as in AngleResolved2Rectangular().
+    :param output_size: (int, int) The size of the output image (theta, phi).
     :param hole: (boolean) Crop the pole if True.
-    :returns: (model.DataArray) Converted image in equi-rectangular view. Shape is output_size.
+    :returns: (ARRemapping) The conversion.
     """
-
-    data = _flipDataIfMirrorFlipped(data)
-
     # calculate the corresponding theta and phi angles based on the geometrical properties
     # of the mirror for each px on the raw data
-    theta_data, phi_data, intensity_data, circle_mask_dilated = _ExtractAngleInformation(data, hole)
+    theta_data, phi_data, omega, mirror_mask, circle_mask_dilated = _ExtractAngleGeometry(data, hole)
+    intensity_factor = numpy.where(mirror_mask, 1 / omega, 0).ravel()
+    px_index = numpy.arange(data.shape[0] * data.shape[1]).reshape(data.shape)
 
     # extend the data range to take care of edge effects during interpolation step
     # extend the range of phi from 0 - 2pi to -2pi to 4pi to take care of periodicity of phi
     # Note: Don't try to extend the image left and right by an amount < pi.
     # It will lead to the mentioned problems with the interpolation (even pi is not enough).
-    # e.g. don't try the following - it produces edge effects...
-    # num = int(phi_data.shape[0] / 4)  # = pi
-    # phi_data_edge = numpy.append(numpy.append((phi_data - 2 * math.pi)[:, -num:], phi_data, axis=1),
-    #                              (phi_data + 2 * math.pi)[:, :num], axis=1)
-    # theta_data_edge = numpy.append(numpy.append(theta_data[:,-num:], theta_data, axis=1), theta_data[:,:num], axis=1)
-    # intensity_data_edge = numpy.append(numpy.append(intensity_data[:,-num:], intensity_data, axis=1),
-    #                                      intensity_data[:,:num], axis=1)
-    # circle_mask_dilated_2 = numpy.append(numpy.append(circle_mask_dilated[:, -num:], circle_mask_dilated, axis=1),
-    #                                      circle_mask_dilated[:, :num], axis=1)
-
-    # So triple the data for theta, intensity and mask, and extend phi to cover the range from -2pi to +4pi
+
+    # So triple the data for theta, px index and mask, and extend phi to cover the range from -2pi to +4pi
     # for interpolation only use the data from -pi to +3pi, which is sufficient to take care of most edge effects
     low_border = int(phi_data.shape[1] - phi_data.shape[1] / 2 - 1)
     high_border = int(phi_data.shape[1] * 2 + phi_data.shape[1] / 2 + 1)
@@ -323,7 +419,7 @@ def AngleResolved2Rectangular(data, output_size, hole=True):
     phi_data_doubled = numpy.concatenate((phi_data - 2 * math.pi, phi_data, phi_data + 2 * math.pi),
                                          axis=1)[:, low_border: high_border]  # -pi to +3pi
     theta_data_doubled = numpy.tile(theta_data, (1, 3))[:, low_border: high_border]
-    intensity_data_doubled = numpy.tile(intensity_data, (1, 3))[:, low_border: high_border]
+    px_index_doubled = numpy.tile(px_index, (1, 3))[:, low_border: high_border]
     circle_mask_dilated_doubled = numpy.tile(circle_mask_dilated, (1, 3))[:, low_border: high_border]
 
     # Crop the raw input data based on the mirror mask (circle_mask) to save memory and improve runtime.
@@ -331,35 +427,77 @@ def AngleResolved2Rectangular(data, output_size, hole=True):
     # The additional data points (due to dilation) will be set to zero during the interpolation step by intensity_data.
     theta_data_masked = theta_data_doubled[circle_mask_dilated_doubled]  # list containing values from 0 to +pi/2
     phi_data_masked = phi_data_doubled[circle_mask_dilated_doubled]  # list containing values from -pi to + 3pi
-    intensity_data_masked = intensity_data_doubled[circle_mask_dilated_doubled]
+    px_index_masked = px_index_doubled[circle_mask_dilated_doubled]
 
-    # Multiple theta-phi combinations will be mapped to the same px in the output image after polar-transformation.
-    # Therefore, not all px in the output image are populated.
-    # Moreover, the data is masked with the mirror shape (mask_circle).
-    # Therefore, we perform a delaunay triangulation of the given data points.
-    # The delaunay object is passed to the interpolator with the corresponding intensity values (intensity_data).
-    # The interpolator also receives a meshgrid (set of coordinates) of the size specified for the output image.
-    # The input data points (theta and phi) are mapped on the meshgrid. As the meshgrid contains much more positions
-    # compared to the input data points, the interpolator fills up the empty grid positions with intensity values.
-    # These intensity values are interpolated from the intensity values of the positions spanning the triangle they
-    # are contained in (triangle from delaunay triangulation).
-    # Grid positions located outside of any delaunay triangle are set to NaN.
-
-    logging.debug("Computing the rect of data of shape %s", data.shape)
+    # Same as for the polar projection: delaunay triangulation of the data points, and
+    # linear interpolation in the triangles for each position of the output grid.
+    logging.debug("Computing the rect conversion of data of shape %s with output size %s",
+                  data.shape, output_size)
     # Note: delaunay triangulation input points: ndarray of floats, shape (numpoints, ndim) -> transpose data for input
     data_transposed = numpy.array([phi_data_masked, theta_data_masked]).T
-    triang = DelaunayTriangulation(data_transposed)
-
-    logging.debug("Interpolating with output size %s", output_size)
-    # create interpolation object
-    interp = LinearNDInterpolator(triang, intensity_data_masked.flat)
     # create grid of positions for interpolation
     xi, yi = numpy.meshgrid(numpy.linspace(0, 2 * numpy.pi, output_size[1]),
                             numpy.linspace(0, numpy.pi / 2, output_size[0]))
+    grid = numpy.column_stack((xi.ravel(), yi.ravel()))
+
+    matrix = _ComputeInterpolationMatrix(data_transposed, px_index_masked, intensity_factor,
+                                         grid, px_index.size)
+    return ARRemapping(matrix, xi.shape)
 
-    # interpolate
-    qz = interp(xi, yi)
-    qz[numpy.isnan(qz)] = 0  # remove NaNs created during interpolation but keep negative values
+
+def AngleResolved2Polar(data, output_size, hole=True):
+    """
+    Converts an angle resolved image to polar (aka azimuthal) projection.
+    :param data: (model.DataArray) The image that was projected on the detector after being
+            reflected on the parabolic mirror. The flat line of the D shape is
+            expected to be horizontal, at the top. It needs MD_PIXEL_SIZE and MD_AR_POLE
+            metadata. Pixel size is the sensor pixel size * binning / magnification.
+            Shape is (x, y). It can also have extra dimensions before (eg, C, T, Z, Y, X),
+            to convert all the images at once. They all share the same metadata.
+    :param output_size: (int) The size of the output DataArray (assumed to be square).
+    :param hole: (boolean) Crop the pole if True.
+    :returns: (model.DataArray) Converted image in polar view. Shape is (output_size, output_size),
+      with the extra dimensions of the data before.
+    """
+
+    data = _flipDataIfMirrorFlipped(data)
+
+    # The conversion only depends on the geometry, so it's reused between images
+    remap = _getARRemapping(data, output_size, hole, "polar")
+    qz = remap.apply(data)
+
+    # polar coordinate transformation starts with 0 at horizontal axis by definition
+    qz = numpy.rot90(qz, axes=(-2, -1))  # rotate by 90 degrees CCW so we start 0 at top (angles will be CW orientated)
+    assert numpy.all(qz > -1)  # there should be no negative values, some very small due to interpolation are possible
+    qz[qz < 0] = 0  # all negative values (due to interpolation or wrong background subtraction) set to zero
+
+    return model.DataArray(qz, data.metadata)
+
+
+def AngleResolved2Rectangular(data, output_size, hole=True):
+    """
+    Converts an angle resolved image to equirectangular (aka cylindrical) projection (ie, phi/theta axes).
+    Note: Even if the input contains only positive values, there might be some small negative
+    values in the output due to interpolation. Also note, that positions outside of the
+    interpolation area are set to 0.
+    :param data: (model.DataArray) The image that was projected on the detector after being
+                reflected on the parabolic mirror. The flat line of the D shape is
+                expected to be horizontal, at the top. It needs MD_PIXEL_SIZE and MD_AR_POLE
+                metadata. Pixel size is the sensor pixel size * binning / magnification.
+                It can also have extra dimensions before (eg, C, T, Z, Y, X), to convert all
+                the images at once. They all share the same metadata.
+    :param output_size: (int, int) The size of the output DataArray (theta, phi),
+                not including the theta/phi angles at the first row/column.
+    :param hole: (boolean) Crop the pole if True.
+    :returns: (model.DataArray) Converted image in equi-rectangular view. Shape is output_size,
+      with the extra dimensions of the data before.
+    """
+
+    data = _flipDataIfMirrorFlipped(data)
+
+    # The conversion only depends on the geometry, so it's reused between images
+    remap = _getARRemapping(data, tuple(output_size), hole, "rectangular")
+    qz = remap.apply(data)
 
     return model.DataArray(qz, data.metadata)
 
@@ -401,23 +539,6 @@ def ARBackgroundSubtract(data):
     return model.DataArray(ret_data, data.metadata)
 
 
-def _CropHalfCircle(data, pixel_size, pole_pos, offset_radius=0, hole=True):
-    """
-    Crops the image to half circle shape based on focus_distance, xmax, parabola_f, and hole_diameter.
-    :param data: (model.DataArray) The data array with the image. Shape is (x, y).
-    :param pixel_size: (float, float) effective pixel sie = sensor_pixel_size * binning / magnification
-    :param pole_pos: (float, float) x/y coordinates of the pole (MD_AR_POLE)
-    :param offset_radius: (int) Offset of the radius in px to dilate the mask (takes care of edge effects
-                        during triangulation and interpolation steps)
-    :param hole: (boolean) Crop the area around the pole if True
-    :returns: (model.DataArray) Cropped image
-    """
-    # Create mirror mask and apply to the image
-    circle_mask = _CreateMirrorMask(data, pixel_size, pole_pos, offset_radius, hole)
-    image = numpy.where(circle_mask, data, 0)
-    return image
-
-
 def _CreateMirrorMask(data, pixel_size, pole_pos, offset_radius=0, hole=True):
     """
     Creates half circle mask (i.e. True inside half circle, False outside) based on
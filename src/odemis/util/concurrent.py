@@ -234,6 +234,66 @@ class RepeatingTimer(threading.Thread):
         self._must_stop.set()
 
 
+class AdaptiveRepeatingTimer(RepeatingTimer):
+    """
+    A repeating timer, which calls the callback more often when something is happening.
+    The callback should return True when it detected some activity (eg, a value changed). In such
+    case, it's called again after min_period. Otherwise, the period is doubled, up to max_period.
+    """
+
+    def __init__(self, min_period: float, max_period: float, callback: Callable[[], bool],
+                 name: str = "TimerThread"):
+        """
+        :param min_period: shortest time in seconds between two calls, when active
+        :param max_period: longest time in seconds between two calls, when idle
+        :param callback: function to call. It returns True if some activity was detected.
+        :param name: thread name
+        """
+        super().__init__(max_period, callback, name)
+        self.min_period = min_period
+        self.max_period = max_period
+        self._wakeup = threading.Event()
+
+    def run(self) -> None:
+        """
+        Main thread loop: waits for the period then calls the callback repeatedly.
+        """
+        try:
+            while True:
+                self._wakeup.wait(self.period)
+                self._wakeup.clear()
+                if self._must_stop.is_set():
+                    return
+                try:
+                    active = self.callback()
+                except weak.WeakRefLostError:
+                    # it's gone, it's over
+                    return
+                if active:
+                    self.period = self.min_period
+                else:
+                    self.period = min(self.period * 2, self.max_period)
+        except Exception:
+            logging.exception("Failure while calling repeating timer '%s'", self.name)
+        finally:
+            logging.debug("Repeating timer thread '%s' over", self.name)
+
+    def accelerate(self) -> None:
+        """
+        Call the callback as soon as possible, and then use the shortest period. To be used when
+        some activity is expected (eg, a move was just started).
+        """
+        self.period = self.min_period
+        self._wakeup.set()
+
+    def cancel(self) -> None:
+        """
+        Stop the timer.
+        """
+        super().cancel()
+        self._wakeup.set()
+
+
 class BackgroundWorker:
     """
     A simple background worker that runs a function in a separate thread.
@@ -26,6 +26,13 @@ import numpy
 from scipy import ndimage
 from scipy.optimize import curve_fit
 from scipy.signal import medfilt
+from scipy.spatial import Delaunay
+
+from odemis.util import linalg
+
+# Maximum shape of the part of the image used to measure the focus level, when
+# only the center of the image is used (Y, X)
+FOCUS_ROI_SHAPE = (512, 512)  # px
 
 
 def _convertRBGToGrayscale(image):
@@ -159,3 +166,99 @@ def AssessFocus(levels, min_ratio=15):
         logging.debug("Significant focus level deviation was found")
         return True
     return False
+
+
+def CropForFocus(image, shape=FOCUS_ROI_SHAPE):
+    """
+    Keep only the center of an image, to measure its focus level faster. As the
+    focus measurements are based on the sharpness of the details, a crop keeps
+    the same sensitivity, contrarily to downsampling.
+    image (numpy array of shape YX or YXC): the image
+    shape (int, int): maximum shape of the cropped image (Y, X)
+    returns (numpy array): the center of the image (a view, no copy is made)
+    """
+    crop = []
+    for l, ml in zip(image.shape[:2], shape):
+        start = max(0, (l - ml) // 2)
+        crop.append(slice(start, start + ml))
+    return image[tuple(crop)]
+
+
+class FocusSurface(object):
+    """
+    Model of the focus position over the sample, based on the focus positions
+    measured at various places. It allows predicting the focus at a new place.
+    Within the points, the focus is interpolated linearly on their (Delaunay)
+    triangulation. Outside, a plane fitted on all the points is used. With less
+    than 3 non-collinear points, the focus of the closest point is used.
+    """
+
+    def __init__(self, points=()):
+        """
+        points (iterable of (float, float, float)): known focus positions, as
+          X, Y (of the stage), Z (of the focuser)
+        """
+        self._points = numpy.empty((0, 3))
+        self._tri = None  # Delaunay, or None if not computed yet
+        self._plane = None  # gamma, normal of the fitted plane, or None if not computed yet
+        for p in points:
+            self.add_point(*p)
+
+    def __len__(self):
+        return len(self._points)
+
+    @property
+    def points(self):
+        """
+        (numpy array of shape N, 3): the known focus positions (X, Y, Z)
+        """
+        return self._points.copy()
+
+    def add_point(self, x, y, z):
+        """
+        Add a known focus position
+        x, y (float): position of the stage
+        z (float): position of the focuser at good focus
+        """
+        self._points = numpy.append(self._points, [[x, y, z]], axis=0)
+        # Recomputed when needed
+        self._tri = None
+        self._plane = None
+
+    def _is_flat(self):
+        """
+        return (bool): True if the points cannot be triangulated (ie, less than
+          3 points, or all on a line).
+        """
+        if len(self._points) < 3:
+            return True
+        xy = self._points[:, :2] - self._points[:, :2].mean(axis=0)
+        return numpy.linalg.matrix_rank(xy) < 2
+
+    def predict(self, x, y):
+        """
+        Estimate the focus position at a given place
+        x, y (float): position of the stage
+        return (float): the estimated focus position
+        raise LookupError: if there is no known focus position
+        """
+        if len(self._points) == 0:
+            raise LookupError("No focus position known")
+
+        if self._is_flat():
+            dists = numpy.hypot(self._points[:, 0] - x, self._points[:, 1] - y)
+            return float(self._points[numpy.argmin(dists), 2])
+
+        if self._tri is None:
+            self._tri = Delaunay(self._points[:, :2])
+        simplex = self._tri.find_simplex((x, y))
+        if simplex >= 0:
+            tr = self._points[self._tri.simplices[simplex]]
+            return float(linalg.get_point_on_plane(x, y, tr))
+
+        # Outside of the triangulation => extrapolate based on the plane fitted on all the points
+        if self._plane is None:
+            self._plane = linalg.fit_plane_lstsq(self._points)
+        gamma, normal = self._plane
+        # (0, 0, gamma) is where the plane intersects with the z-axis
+        return float(linalg.get_z_pos_on_plane(x, y, (0, 0, gamma), normal))
@@ -22,9 +22,14 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 
 # various functions to convert and modify images (as DataArray)
 
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import logging
 import math
 import numpy
+import os
+import threading
+import weakref
 from odemis import model
 import scipy.ndimage
 import cv2
@@ -44,6 +49,91 @@ except ImportError:
     logging.warning("Failed to load optimised functions, slow version will be used.")
     img_fast = None
 
+# Maximum number of threads used to convert one image to RGB
+RGB_CONVERSION_THREADS = os.cpu_count() or 1
+# Minimum number of pixels converted by a thread: below that, starting the
+# thread costs more than it saves
+RGB_CONVERSION_MIN_PIXELS = 256 * 1024
+
+_rgb_executor = None
+_rgb_executor_lock = threading.Lock()
+
+
+def _get_rgb_executor():
+    """
+    return (ThreadPoolExecutor): the executor shared by all the RGB conversions
+    """
+    global _rgb_executor
+    with _rgb_executor_lock:
+        if _rgb_executor is None:
+            _rgb_executor = ThreadPoolExecutor(max_workers=RGB_CONVERSION_THREADS,
+                                               thread_name_prefix="RGB conversion")
+        return _rgb_executor
+
+
+# (id of the colormap, number of entries) -> (weakref to the colormap, LUT)
+# Colormaps are not hashable, so they are identified by their id, and the entry
+# is removed as soon as the colormap is deleted (which frees its id).
+_colormap_luts = {}
+
+
+def _get_colormap_lut(cmap):
+    """
+    The look-up table is computed only the first time, and cached as long as the
+    colormap exists.
+    cmap (matplotlib.colors.Colormap): a colormap
+    return (numpy.ndarray of shape (N, 3) of uint8): RGB colour of each entry of
+      the colormap. It's shared between all the callers, so it must not be modified.
+    """
+    key = (id(cmap), cmap.N)
+    try:
+        ref, lut = _colormap_luts[key]
+        if ref() is cmap:
+            return lut
+    except KeyError:
+        pass
+
+    lut = numpy.ascontiguousarray(cmap(numpy.arange(cmap.N), bytes=True)[:, :3])
+    _colormap_luts[key] = (weakref.ref(cmap, lambda _, k=key: _colormap_luts.pop(k, None)), lut)
+    return lut
+
+
+def _DataArray2RGBFast(data, irange, tint, alpha=None):
+    """
+    Do not call directly, use DataArray2RGB or DataArray2BGRA.
+    Converts the image with the optimised code. Large images are split in
+    blocks of rows, converted in parallel.
+    data (numpy.ndarray): 2D greyscale image
+    irange (2 numbers): low/high values, low < high
+    tint (3-tuple of 0 <= int <= 255, or matplotlib.colors.Colormap)
+    alpha (None or 0 <= int <= 255): if None, the output is RGB. Otherwise, it is
+      BGRA, premultiplied by the given alpha.
+    return (numpy.ndarray of shape data.shape + (3 or 4,) of uint8)
+    raise ValueError: if the optimised code doesn't support the data
+    """
+    if isinstance(tint, colors.Colormap):
+        tint = _get_colormap_lut(tint)
+    if alpha is None:
+        ret = numpy.empty(data.shape + (3,), dtype=numpy.uint8)
+        convert = functools.partial(img_fast.DataArray2RGB, irange=irange, tint=tint)
+    else:
+        ret = numpy.empty(data.shape + (4,), dtype=numpy.uint8)
+        convert = functools.partial(img_fast.DataArray2BGRA, irange=irange, tint=tint, alpha=alpha)
+
+    nblocks = min(RGB_CONVERSION_THREADS, data.shape[0], data.size // RGB_CONVERSION_MIN_PIXELS)
+    if nblocks <= 1:
+        return convert(data, ret=ret)
+
+    # The optimised code releases the GIL, so the blocks are really processed in parallel
+    bounds = numpy.linspace(0, data.shape[0], nblocks + 1).astype(int)
+    executor = _get_rgb_executor()
+    fs = [executor.submit(convert, data[s:e], ret=ret[s:e])
+          for s, e in zip(bounds[:-1], bounds[1:])]
+    for f in fs:
+        f.result()
+    return ret
+
+
 # This is a weave-based optimised version (but weave requires g++ installed)
 #def DataArray2RGB_fast(data, irange, tint=(255, 255, 255)):
 #    """
@@ -240,25 +330,59 @@ def compactHistogram(hist, length):
     chist = hist.reshape(-1, bin_size)
     return numpy.sum(chist, 1)
 
-# TODO: compute histogram faster. There are several ways:
-# * x=numpy.bincount(a.flat, minlength=depth) => fast (~0.03s for
-#   a 2048x2048 array) but only works on flat array with uint8 and uint16 and
-#   creates 2**16 bins if uint16 (so need to do a reshape and sum on top of it)
-# * numpy.histogram(a, bins=256, range=(0,depth)) => slow (~0.09s for a
-#   2048x2048 array) but works exactly as needed directly in every case.
-# * see weave? (~ 0.01s for 2048x2048 array of uint16) eg:
-#  timeit.timeit("counts=numpy.zeros((2**16), dtype=numpy.uint32);
-#  weave.inline( code, ['counts', 'idxa'])", "import numpy;from scipy import weave; code=r\"for (int i=0; i<Nidxa[0]; i++) { COUNTS1( IDXA1(i)>>8)++; }\"; idxa=numpy.ones((2048*2048), dtype=numpy.uint16)+15", number=100)
-# * see cython?
+# Note about histogram computation speed, for a 2048x2048 array:
+# * x=numpy.bincount(a.flat, minlength=depth) => fast (~0.03s) but only works
+#   on flat array with uint8 and uint16 and creates 2**16 bins if uint16.
+# * numpy.histogram(a, bins=256, range=(0,depth)) => slow (~0.09s) but works
+#   exactly as needed directly in every case.
+# * img_fast.histogram() => same as numpy.histogram, in a single pass (~0.01s),
+#   and can be run in parallel on blocks of the image.
 # for comparison, a.min() + a.max() are 0.01s for 2048x2048 array
 
 
-def histogram(data, irange=None):
+def _histogramFast(data, irange, length):
+    """
+    Do not call directly, use histogram.
+    Computes the histogram with the optimised code. Large images are split in
+    blocks of rows, processed in parallel.
+    data (numpy.ndarray): 2D image
+    irange (2 numbers): low/high values, low < high
+    length (0 < int): number of bins
+    return:
+      hist (ndarray 1D of 0<=int): number of pixels in each bin
+      above (int): number of pixels above the range (not counted)
+    raise ValueError: if the optimised code doesn't support the data
+    """
+    nblocks = min(RGB_CONVERSION_THREADS, data.shape[0], data.size // RGB_CONVERSION_MIN_PIXELS)
+    if nblocks <= 1:
+        return img_fast.histogram(data, irange, length)
+
+    # The optimised code releases the GIL, so the blocks are really processed in
+    # parallel. Each block has its own histogram, and they are summed at the end.
+    bounds = numpy.linspace(0, data.shape[0], nblocks + 1).astype(int)
+    executor = _get_rgb_executor()
+    fs = [executor.submit(img_fast.histogram, data[s:e], irange, length)
+          for s, e in zip(bounds[:-1], bounds[1:])]
+    hist, above = fs[0].result()
+    for f in fs[1:]:
+        h, a = f.result()
+        hist += h
+        above += a
+    return hist, above
+
+
+def histogram(data, irange=None, max_pixels=None):
     """
     Compute the histogram of the given image.
     data (numpy.ndarray of numbers): greyscale image
     irange (None or tuple of 2 unsigned int): min/max values to be found
       in the data. None => auto (min, max will be detected from the data)
+    max_pixels (None or 0 < int): if the image has more pixels, only a regular
+      subsample of it (of at most max_pixels) is used. The histogram then contains
+      the counts of the subsample. That is much faster for large images, at the
+      cost of a small error. Typically, with N pixels, the ratio of pixels below a
+      given value is within sqrt(ln(2 / p) / (2 * N)) of the real ratio, with
+      probability 1 - p (eg, 0.2% with 1M pixels, with probability 99.9%).
     return hist, edges:
      hist (ndarray 1D of 0<=int): number of pixels with the given value
       Note that the length of the returned histogram is not fixed. If irange
@@ -268,6 +392,11 @@ def histogram(data, irange=None):
        edges[1] is included in the bin. If irange is defined, it's the same
        values.
     """
+    if max_pixels is not None and data.ndim >= 2 and data.size > max_pixels:
+        # Take one pixel every "step" pixels, along the last two dimensions
+        step = int(math.ceil(math.sqrt(data.size / max_pixels)))
+        data = data[..., ::step, ::step]
+
     if irange is None:
         if data.dtype.kind in "biu":
             idt = numpy.iinfo(data.dtype)
@@ -287,7 +416,18 @@ def histogram(data, irange=None):
         # TODO: for 32 or 64 bits with full range, convert to a view looking
         # only at the 2 high bytes.
         length = irange[1] - irange[0] + 1
-        hist = numpy.bincount(data.flat, minlength=length)
+        hist = None
+        if img_fast and data.ndim == 2 and data.dtype.kind == "u":
+            try:
+                # Bins of width 1, centered on each integer
+                hist, above = _histogramFast(data.view(numpy.ndarray), (-0.5, length - 0.5), length)
+                if above:
+                    hist = None  # let numpy report the values outside of the range
+            except ValueError as exp:
+                logging.info("Fast histogram cannot run: %s", exp)
+
+        if hist is None:
+            hist = numpy.bincount(data.flat, minlength=length)
         edges = (0, hist.size - 1)
         if edges[1] > irange[1]:
             logging.warning("Unexpected value %d outside of range %s", edges[1], irange)
@@ -297,6 +437,14 @@ def histogram(data, irange=None):
         else:
             # For floats, it will automatically find the minimum and maximum
             length = 256
+
+        if img_fast and data.ndim == 2:
+            try:
+                hist, _ = _histogramFast(data.view(numpy.ndarray), irange, length)
+                return hist, (irange[0], irange[1])
+            except ValueError as exp:
+                logging.info("Fast histogram cannot run: %s", exp)
+
         hist, all_edges = numpy.histogram(data, bins=length, range=irange)
         edges = (max(irange[0], all_edges[0]),
                  min(irange[1], all_edges[-1]))
@@ -390,6 +538,14 @@ def DataArray2RGB(data, irange=None, tint=(255, 255, 255)):
     # Otherwise, continue with the old method
 
     if isinstance(tint, colors.Colormap):
+        if img_fast and irange[0] < irange[1]:
+            try:
+                return _DataArray2RGBFast(data, irange, tint)
+            except ValueError as exp:
+                logging.info("Fast conversion cannot run: %s", exp)
+            except Exception:
+                logging.exception("Failed to use the fast conversion")
+
         # Normalize the data to the interval [0, 1.0]
         # TODO: Add logarithmic normalization with LogNorm
         # norm = colors.LogNorm(vmin=data.min(), vmax=data.max())
@@ -406,9 +562,7 @@ def DataArray2RGB(data, irange=None, tint=(255, 255, 255)):
         drescaled = data
         # TODO: also write short-cut for 16 bits by reading only the high byte?
     else:
-        # If data might go outside of the range, clip first
         if data.dtype.kind in "iu":
-            # no need to clip if irange is the whole possible range
             idt = numpy.iinfo(data.dtype)
             # Ensure B&W if there is only one value allowed
             if irange[0] >= irange[1]:
@@ -416,22 +570,25 @@ def DataArray2RGB(data, irange=None, tint=(255, 255, 255)):
                     irange = (irange[0] - 1, irange[0])
                 else:
                     irange = (irange[0], irange[0] + 1)
+        else:
+            # Ensure B&W if there is just one value allowed
+            if irange[0] >= irange[1]:
+                irange = (irange[0] - 1e-9, irange[0])
 
-            if img_fast:
-                try:
-                    # only (currently) supports uint16
-                    return img_fast.DataArray2RGB(data, irange, tint)
-                except ValueError as exp:
-                    logging.info("Fast conversion cannot run: %s", exp)
-                except Exception:
-                    logging.exception("Failed to use the fast conversion")
+        if img_fast:
+            try:
+                return _DataArray2RGBFast(data, irange, tint)
+            except ValueError as exp:
+                logging.info("Fast conversion cannot run: %s", exp)
+            except Exception:
+                logging.exception("Failed to use the fast conversion")
 
+        # If data might go outside of the range, clip first
+        if data.dtype.kind in "iu":
+            # no need to clip if irange is the whole possible range
             if irange[0] > idt.min or irange[1] < idt.max:
                 data = data.clip(*irange)
         else: # floats et al. => always clip
-            # Ensure B&W if there is just one value allowed
-            if irange[0] >= irange[1]:
-                irange = (irange[0] - 1e-9, irange[0])
             data = data.clip(*irange)
 
         # use .tolist() to force conversion to "safe" Python type, which avoid overflows
@@ -486,6 +643,53 @@ def DataArray2RGB(data, irange=None, tint=(255, 255, 255)):
     return rgb
 
 
+def DataArray2BGRA(data, irange=None, tint=(255, 255, 255), alpha=255):
+    """
+    Same as DataArray2RGB(), but directly converts to the format used for
+    displaying with cairo (ARGB32 or RGB24 surfaces): BGRA, with the colours
+    premultiplied by the alpha. This avoids converting the RGB image afterwards.
+    :param data: (numpy.ndarray of unsigned int) 2D image greyscale
+    :param irange: (None or tuple of 2 values) min/max intensities mapped
+        to black/white. See DataArray2RGB().
+    :param tint: (3-tuple of 0 <= int <= 255, or colors.Colormap) RGB colour of the
+        final image, or colour map. See DataArray2RGB().
+    :param alpha: (0 <= int <= 255) opacity of the image
+    :return: (numpy.ndarray of shape data.shape + (4,) of uint8) converted image in BGRA.
+    """
+    assert(data.ndim == 2)  # => 2D with greyscale
+
+    if img_fast and irange is not None:
+        # Same conditions as in DataArray2RGB() to use the optimised version.
+        # The optimised version works with floats, so no need to truncate the
+        # irange to the data type (which would shift the range on integer data).
+        irange = numpy.array(irange, dtype=numpy.float64)
+        if irange[0] < irange[1]:
+            try:
+                return _DataArray2RGBFast(data.view(numpy.ndarray), irange, tint, alpha)
+            except ValueError as exp:
+                logging.info("Fast conversion cannot run: %s", exp)
+            except Exception:
+                logging.exception("Failed to use the fast conversion")
+
+    rgb = DataArray2RGB(data, irange, tint)
+    bgra = numpy.empty(rgb.shape[:2] + (4,), dtype=numpy.uint8)
+    if alpha == 255:
+        bgra[:, :, 0:3] = rgb[:, :, ::-1]
+    else:
+        numpy.multiply(rgb[:, :, ::-1], alpha / 255, out=bgra[:, :, 0:3], casting="unsafe")
+    bgra[:, :, 3] = alpha
+    return bgra
+
+
+def BGRA2RGB(bgra):
+    """
+    Convert a BGRA image to RGB (the alpha channel is dropped).
+    :param bgra: (numpy.ndarray of shape YX4) image in BGRA (as returned by DataArray2BGRA())
+    :return: (numpy.ndarray of shape YX3) C-contiguous image in RGB
+    """
+    return numpy.ascontiguousarray(bgra[:, :, 2::-1])
+
+
 def projectYXC2RGB8(data: numpy.ndarray, irange: Optional[Tuple[int, int]] = None,
                     tint: Tuple[int, int, int] = (255, 255, 255)) -> numpy.ndarray:
     """
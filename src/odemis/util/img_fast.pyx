@@ -22,94 +22,264 @@ import cython
 import numpy
 cimport numpy
 
-# TODO: use fused types to support multiple types (but needs Cython >= 0.20)
-ctypedef numpy.uint16_t uint16_t
+# All the types of data supported by the optimised conversion
+ctypedef fused data_t:
+    numpy.uint8_t
+    numpy.int8_t
+    numpy.uint16_t
+    numpy.int16_t
+    numpy.uint32_t
+    numpy.int32_t
+    numpy.uint64_t
+    numpy.int64_t
+    numpy.float32_t
+    numpy.float64_t
+
+_SUPPORTED_DTYPES = frozenset(numpy.dtype(t) for t in
+                              (numpy.uint8, numpy.int8, numpy.uint16, numpy.int16,
+                               numpy.uint32, numpy.int32, numpy.uint64, numpy.int64,
+                               numpy.float32, numpy.float64))
 
 # nogil allows multi-threading but prevents use of any Python objects or call
 # TODO: from cython 3.0 (Ubuntu 24.04) add "noexcept" next to nogil for better optimisation
 @cython.cdivision(True)
-cdef void cDataArray2RGB(uint16_t* data, int datalen, uint16_t irange0, uint16_t irange1,
-                         int* tint, numpy.uint8_t* ret) nogil:
-    cdef double b = 255. / <double>(irange1 - irange0)
-    cdef double br = (b * <double>tint[0]) / 255.
-    cdef double bg = (b * <double>tint[1]) / 255.
-    cdef double bb = (b * <double>tint[2]) / 255.
-
-    cdef numpy.uint8_t di
-    cdef double df
-    cdef int retpos = 0
-
-    if tint[0] == tint[1] == tint[2] == 255:
-        # optimised version, without tinting (about 2x faster)
-        for i in range(datalen):
-            # clip
-            if data[i] <= irange0:
-                di = 0
-            elif data[i] >= irange1:
-                di = 255
-            else:
-                di = <numpy.uint8_t> ((data[i] - irange0) * b + 0.5)
-            ret[retpos] = di
-            retpos += 1
-            ret[retpos] = di
-            retpos += 1
-            ret[retpos] = di
-            retpos += 1
-    else:
-        for i in range(datalen):
-            # clip
-            if data[i] <= irange0:
-                ret[retpos] = 0
-                retpos += 1
-                ret[retpos] = 0
-                retpos += 1
-                ret[retpos] = 0
-                retpos += 1
-            elif data[i] >= irange1:
-                ret[retpos] = tint[0]
-                retpos += 1
-                ret[retpos] = tint[1]
-                retpos += 1
-                ret[retpos] = tint[2]
-                retpos += 1
-            else:
-                df = (data[i] - irange0)
-                ret[retpos] = <numpy.uint8_t> (df * br + 0.5)
-                retpos += 1
-                ret[retpos] = <numpy.uint8_t> (df * bg + 0.5)
-                retpos += 1
-                ret[retpos] = <numpy.uint8_t> (df * bb + 0.5)
-                retpos += 1
-
-# This function is probably not needed, but I have no idea how to instantiate
-# a numpy array which can be passed as a pointer
+cdef void cDataArray2RGB(const data_t* data, Py_ssize_t datalen, double irange0, double irange1,
+                         double scale, double offset,
+                         const numpy.uint8_t* lut, Py_ssize_t lutlen, Py_ssize_t nchan,
+                         numpy.uint8_t* ret) nogil:
+    cdef Py_ssize_t last = lutlen - 1
+    cdef Py_ssize_t retpos = 0
+    cdef Py_ssize_t i, idx
+    cdef double v
+
+    for i in range(datalen):
+        v = <double> data[i]
+        # clip
+        if v <= irange0:
+            idx = 0
+        elif v >= irange1:
+            idx = last
+        elif v != v:  # NaN => black (with the same alpha as the other pixels)
+            ret[retpos] = 0
+            ret[retpos + 1] = 0
+            ret[retpos + 2] = 0
+            if nchan == 4:
+                ret[retpos + 3] = lut[3]
+            retpos += nchan
+            continue
+        else:
+            idx = <Py_ssize_t> ((v - irange0) * scale + offset)
+            if idx > last:
+                idx = last
+
+        # Look-up the colour
+        idx *= nchan
+        ret[retpos] = lut[idx]
+        ret[retpos + 1] = lut[idx + 1]
+        ret[retpos + 2] = lut[idx + 2]
+        if nchan == 4:
+            ret[retpos + 3] = lut[idx + 3]
+        retpos += nchan
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def wrapDataArray2RGB(numpy.ndarray[uint16_t, ndim=2] data not None,
-                  irange,
-                  tint,
-                  numpy.ndarray[numpy.uint8_t, ndim=3] ret not None):
-    cdef int ctint[3]
-    ctint[0] = tint[0]
-    ctint[1] = tint[1]
-    ctint[2] = tint[2]
-    cDataArray2RGB(&data[0,0], data.size, irange[0], irange[1], ctint, &ret[0,0,0])
-
-
-def DataArray2RGB(data, irange, tint=(255, 255, 255)):
+def _wrapDataArray2RGB(const data_t[::1] data not None, double irange0, double irange1,
+                       double scale, double offset,
+                       const numpy.uint8_t[:, ::1] lut not None,
+                       numpy.uint8_t[::1] ret not None):
+    if data.shape[0] == 0:
+        return
+    with nogil:
+        cDataArray2RGB(&data[0], data.shape[0], irange0, irange1, scale, offset,
+                       &lut[0, 0], lut.shape[0], lut.shape[1], &ret[0])
+
+
+def tint_to_lut(tint):
+    """
+    Compute the look-up table corresponding to a tint
+    tint (3-tuple of 0 <= int <= 255): RGB colour of the maximum value
+    return (numpy.ndarray of shape (256, 3) of uint8): the RGB colour of each
+      of the 256 intensity levels
+    """
+    levels = numpy.arange(256, dtype=numpy.float64)[:, numpy.newaxis]
+    return (levels * (numpy.array(tint, dtype=numpy.float64) / 255) + 0.5).astype(numpy.uint8)
+
+
+def _check_input(data, irange):
+    """
+    Check the data and range can be handled by the optimised conversion
+    return (float, float): the low/high values of the range
+    raise ValueError: if the data is not supported by the optimised version
+    """
     if not data.flags.c_contiguous:
         raise ValueError("Optimised version only works with C-contiguous arrays")
-    if data.dtype != numpy.uint16:
+    if data.dtype not in _SUPPORTED_DTYPES:
         # Note: cython automatically detects such errors, but it seems that with
         # ctyhon 0.23, it can leak memory.
-        raise ValueError("Optimised version only works on uint16 (got %s)" % (data.dtype,))
+        raise ValueError("Optimised version doesn't support %s" % (data.dtype,))
     # Note: we could also make an optimised version for F-contiguous arrays,
     # but it's not clear when it'd be useful. For more complex arrays, it's also
     # probably possible to generate a faster version than numpy, but I don't
     # know how.
-    if irange[0] >= irange[1]:
+    irange0, irange1 = float(irange[0]), float(irange[1])
+    if not irange0 < irange1:
         raise ValueError("irange needs to be a tuple of low/high values")
-    ret = numpy.empty(data.shape + (3,), dtype=numpy.uint8)
-    wrapDataArray2RGB(data, irange, tint, ret)
+    return irange0, irange1
+
+
+def _get_lut(tint, irange0, irange1):
+    """
+    return (numpy.ndarray of shape (N, 3) of uint8, float, float): the RGB look-up
+      table, and the scale and offset to convert a value to an index of the table
+    """
+    if isinstance(tint, numpy.ndarray):
+        lut = numpy.ascontiguousarray(tint, dtype=numpy.uint8)
+        if lut.ndim != 2 or lut.shape[1] != 3 or lut.shape[0] < 1:
+            raise ValueError("Look-up table should be of shape (N, 3), got %s" % (lut.shape,))
+        # Same as matplotlib: each entry covers an equal part of the range
+        scale = lut.shape[0] / (irange1 - irange0)
+        offset = 0
+    else:
+        lut = tint_to_lut(tint)
+        # Round to the closest level
+        scale = 255 / (irange1 - irange0)
+        offset = 0.5
+    return lut, scale, offset
+
+
+def _check_output(ret, shape):
+    """
+    return (numpy.ndarray of shape of uint8): ret, or a new array if it was None
+    """
+    if ret is None:
+        return numpy.empty(shape, dtype=numpy.uint8)
+    elif ret.shape != shape or ret.dtype != numpy.uint8 or not ret.flags.c_contiguous:
+        raise ValueError("ret should be a C-contiguous array of uint8 of shape %s" % (shape,))
+    return ret
+
+
+def DataArray2RGB(data, irange, tint=(255, 255, 255), ret=None):
+    """
+    Convert a greyscale image to RGB.
+    The GIL is released during the conversion, so several parts of an image
+    can be converted simultaneously, from different threads.
+    data (numpy.ndarray): C-contiguous 2D image, of any int or float type
+      (except float16)
+    irange (2 numbers): low/high values, mapped to the lowest/highest colour
+    tint (3-tuple of 0 <= int <= 255, or numpy.ndarray of shape (N, 3) of uint8):
+      either the RGB colour of the highest value, or a look-up table (eg, of a
+      colormap). In such case, the range is split in N equal bins, each of them
+      mapped to the colour of the corresponding entry.
+    ret (None or numpy.ndarray of shape data.shape + (3,) of uint8): C-contiguous
+      array where to write the result. If None, a new array is created.
+    return (numpy.ndarray of shape data.shape + (3,) of uint8): the RGB image
+    raise ValueError: if the data is not supported by the optimised version
+    """
+    irange0, irange1 = _check_input(data, irange)
+    lut, scale, offset = _get_lut(tint, irange0, irange1)
+    ret = _check_output(ret, data.shape + (3,))
+
+    _wrapDataArray2RGB(data.reshape(-1), irange0, irange1, scale, offset,
+                       lut, ret.reshape(-1))
     return ret
 
+
+def DataArray2BGRA(data, irange, tint=(255, 255, 255), alpha=255, ret=None):
+    """
+    Convert a greyscale image to BGRA, with the colours premultiplied by the alpha.
+    That is the format of the cairo ARGB32 (and RGB24) surfaces, on little-endian
+    computers.
+    Same arguments as DataArray2RGB(), and:
+    alpha (0 <= int <= 255): opacity of the image
+    ret (None or numpy.ndarray of shape data.shape + (4,) of uint8): C-contiguous
+      array where to write the result. If None, a new array is created.
+    return (numpy.ndarray of shape data.shape + (4,) of uint8): the BGRA image
+    raise ValueError: if the data is not supported by the optimised version
+    """
+    irange0, irange1 = _check_input(data, irange)
+    lut, scale, offset = _get_lut(tint, irange0, irange1)
+    ret = _check_output(ret, data.shape + (4,))
+
+    # Convert the look-up table, instead of each pixel
+    bgra_lut = numpy.empty((lut.shape[0], 4), dtype=numpy.uint8)
+    bgra_lut[:, :3] = lut[:, ::-1] * (alpha / 255) + 0.5
+    bgra_lut[:, 3] = alpha
+
+    _wrapDataArray2RGB(data.reshape(-1), irange0, irange1, scale, offset,
+                       bgra_lut, ret.reshape(-1))
+    return ret
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def _wrapHistogram(const data_t[:, :] data not None, double lo, double hi,
+                   const numpy.float64_t[::1] edges not None,
+                   numpy.int64_t[::1] hist not None):
+    """
+    return (int): number of values above hi (which are not counted)
+    """
+    cdef Py_ssize_t nbins = hist.shape[0]
+    cdef double norm = nbins / (hi - lo)
+    cdef Py_ssize_t above = 0
+    cdef Py_ssize_t i, j, idx
+    cdef double v
+
+    with nogil:
+        for i in range(data.shape[0]):
+            for j in range(data.shape[1]):
+                v = <double> data[i, j]
+                if v < lo or v != v:  # too low or NaN
+                    continue
+                elif v > hi:
+                    above += 1
+                    continue
+
+                idx = <Py_ssize_t> ((v - lo) * norm)
+                if idx >= nbins:
+                    idx = nbins - 1
+                # Same correction as numpy.histogram(), in case of rounding error
+                if v < edges[idx]:
+                    idx -= 1
+                elif idx < nbins - 1 and v >= edges[idx + 1]:
+                    idx += 1
+                hist[idx] += 1
+
+    return above
+
+
+def histogram(data, irange, nbins, hist=None):
+    """
+    Compute the histogram of an image, with bins of equal width, the same way as
+    numpy.histogram(data, nbins, irange).
+    The GIL is released during the computation, so several parts of an image
+    can be processed simultaneously, from different threads.
+    data (numpy.ndarray): 2D image, of any int or float type (except float16).
+      It doesn't need to be contiguous, so it can be a subsample (eg, data[::2, ::2]).
+    irange (2 numbers): low/high values. The values outside are not counted.
+    nbins (0 < int): number of bins
+    hist (None or numpy.ndarray of shape nbins, of int64): C-contiguous array
+      where to accumulate the counts. If None, a new array is created.
+    return:
+      hist (numpy.ndarray of shape nbins, of int64): the histogram
+      above (int): number of values above the range
+    raise ValueError: if the data is not supported by the optimised version
+    """
+    if data.ndim != 2:
+        raise ValueError("Optimised version only works with 2D arrays")
+    if data.dtype not in _SUPPORTED_DTYPES:
+        raise ValueError("Optimised version doesn't support %s" % (data.dtype,))
+    lo, hi = float(irange[0]), float(irange[1])
+    if not lo < hi:
+        raise ValueError("irange needs to be a tuple of low/high values")
+
+    if hist is None:
+        hist = numpy.zeros(nbins, dtype=numpy.int64)
+    elif hist.shape != (nbins,) or hist.dtype != numpy.int64 or not hist.flags.c_contiguous:
+        raise ValueError("hist should be a C-contiguous array of int64 of shape %s" % (nbins,))
+
+    # Same edges as numpy.histogram()
+    edges = numpy.linspace(lo, hi, nbins + 1, dtype=numpy.float64)
+    above = _wrapHistogram(data, lo, hi, edges, hist)
+    return hist, above
@@ -23,6 +23,7 @@ import logging
 import math
 import unittest
 from pathlib import Path
+from unittest import mock
 
 import numpy
 
@@ -443,6 +444,72 @@ class TestAngleResolvedDataConversion(unittest.TestCase):
         self.assertEqual(result.shape, (201, 201, 3))
         self.assertEqual(result_polar_2.shape, result_polar_1.shape)
 
+    def test_remapping_cache(self):
+        """
+        Tests that the conversion is reused for images with the same geometry.
+        """
+        data = self.data
+        C, T, Z, Y, X = data[0].shape
+        data[0].shape = Y, X
+        angleres._remap_cache.clear()
+
+        with mock.patch.object(angleres, "_ComputePolarRemapping",
+                               wraps=angleres._ComputePolarRemapping) as compute:
+            result = angleres.AngleResolved2Polar(data[0], 201)
+            self.assertEqual(compute.call_count, 1)
+            self.assertEqual(len(angleres._remap_cache), 1)
+
+            # Different image, same geometry => reuse the conversion
+            data2 = model.DataArray(data[0][::-1].copy(), data[0].metadata)
+            result2 = angleres.AngleResolved2Polar(data2, 201)
+            self.assertEqual(compute.call_count, 1)
+            self.assertEqual(len(angleres._remap_cache), 1)
+
+        # Same result as with a newly computed conversion
+        angleres._remap_cache.clear()
+        numpy.testing.assert_allclose(result2, angleres.AngleResolved2Polar(data2, 201))
+
+        # Another pole position => new conversion
+        data[0].metadata[model.MD_AR_POLE] = (data[0].metadata[model.MD_AR_POLE][0] + 1,
+                                              data[0].metadata[model.MD_AR_POLE][1])
+        result_pole = angleres.AngleResolved2Polar(data[0], 201)
+        self.assertEqual(len(angleres._remap_cache), 2)
+        self.assertFalse(numpy.allclose(result, result_pole))
+
+        # The cache is bounded
+        for s in range(201, 201 + angleres.AR_REMAP_CACHE_SIZE + 1):
+            angleres.AngleResolved2Rectangular(data[0], (90, s))
+        self.assertEqual(len(angleres._remap_cache), angleres.AR_REMAP_CACHE_SIZE)
+
+    def test_multiple_images(self):
+        """
+        Tests the conversion of multiple images at once.
+        """
+        data = self.data
+        C, T, Z, Y, X = data[0].shape
+        data[0].shape = Y, X
+        images = [data[0], data[0][::-1], data[0] // 2]
+        cube = model.DataArray(numpy.array(images)[:, numpy.newaxis], data[0].metadata)  # 3, 1, Y, X
+
+        result = angleres.AngleResolved2Polar(cube, 201)
+        self.assertEqual(result.shape, (3, 1, 201, 201))
+        for im, r in zip(images, result):
+            im = model.DataArray(im, data[0].metadata)
+            numpy.testing.assert_allclose(r[0], angleres.AngleResolved2Polar(im, 201))
+
+        result = angleres.AngleResolved2Rectangular(cube, (90, 360))
+        self.assertEqual(result.shape, (3, 1, 90, 360))
+        for im, r in zip(images, result):
+            im = model.DataArray(im, data[0].metadata)
+            numpy.testing.assert_allclose(r[0], angleres.AngleResolved2Rectangular(im, (90, 360)))
+
+        # Also with an inverted mirror
+        data_inv = ensure2DImage(self.data_invMir[0])
+        cube = model.DataArray(numpy.array([data_inv, data_inv * 2]), data_inv.metadata)
+        result = angleres.AngleResolved2Polar(cube, 201)
+        numpy.testing.assert_allclose(result[0], angleres.AngleResolved2Polar(data_inv, 201))
+        numpy.testing.assert_allclose(result[1], result[0] * 2)
+
 
 class TestExtractThetaList(unittest.TestCase):
 
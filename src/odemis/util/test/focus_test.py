@@ -19,7 +19,7 @@ You should have received a copy of the GNU General Public License along with Ode
 import unittest
 import numpy
 
-from odemis.util.focus import MeasureSpotsFocus, MeasureOpticalFocus
+from odemis.util.focus import MeasureSpotsFocus, MeasureOpticalFocus, CropForFocus, FocusSurface
 
 
 class TestMeasureOpticalFocus(unittest.TestCase):
@@ -64,5 +64,61 @@ class TestMeasureSpotsFocus(unittest.TestCase):
         self.assertGreater(focus_level, 1)  # Usually much higher than 1e12!
 
 
+class TestCropForFocus(unittest.TestCase):
+
+    def test_simple(self):
+        image = numpy.zeros((2152, 3512), dtype=numpy.uint16)
+        image[1076, 1756] = 1000
+        crop = CropForFocus(image, (512, 256))
+        self.assertEqual(crop.shape, (512, 256))
+        self.assertEqual(crop[256, 128], 1000)  # Center is kept
+
+        # Smaller than the crop => unchanged
+        image = numpy.zeros((101, 512, 3), dtype=numpy.uint8)
+        crop = CropForFocus(image, (512, 512))
+        self.assertEqual(crop.shape, image.shape)
+
+
+class TestFocusSurface(unittest.TestCase):
+
+    def test_plane(self):
+        # Tilted sample: z = 0.01 * x - 0.02 * y + 1e-6
+        def z_plane(x, y):
+            return 0.01 * x - 0.02 * y + 1e-6
+
+        surface = FocusSurface()
+        self.assertEqual(len(surface), 0)
+        with self.assertRaises(LookupError):
+            surface.predict(0, 0)
+
+        # Single point => constant
+        surface.add_point(0, 0, z_plane(0, 0))
+        self.assertEqual(surface.predict(1e-3, 1e-3), z_plane(0, 0))
+
+        # Two points => closest one
+        surface.add_point(1e-3, 0, z_plane(1e-3, 0))
+        self.assertEqual(surface.predict(0.9e-3, 1e-3), z_plane(1e-3, 0))
+
+        # Collinear points => still closest one
+        surface.add_point(2e-3, 0, z_plane(2e-3, 0))
+        self.assertEqual(surface.predict(0.1e-3, 1e-3), z_plane(0, 0))
+
+        # Now a real plane, both inside and outside the triangulation
+        surface.add_point(1e-3, 1e-3, z_plane(1e-3, 1e-3))
+        self.assertEqual(len(surface), 4)
+        for x, y in ((1e-3, 0.5e-3), (1.5e-3, 0.2e-3), (-1e-3, 2e-3), (5e-3, 5e-3)):
+            self.assertAlmostEqual(surface.predict(x, y), z_plane(x, y), places=12)
+
+    def test_interpolation(self):
+        points = [(0, 0, 0), (1, 0, 1), (0, 1, 1), (1, 1, 0)]
+        surface = FocusSurface(points)
+        numpy.testing.assert_array_equal(surface.points, points)
+        for x, y, z in points:
+            self.assertAlmostEqual(surface.predict(x, y), z)
+        # Inside, it stays within the values of the points
+        for x, y in ((0.5, 0.5), (0.2, 0.7), (0.9, 0.1)):
+            self.assertTrue(0 <= surface.predict(x, y) <= 1)
+
+
 if __name__ == "__main__":
     unittest.main()
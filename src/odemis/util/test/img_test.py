@@ -297,6 +297,66 @@ class TestHistogram(unittest.TestCase):
         hist_forced, edges = img.histogram(grey_img, edges)
         numpy.testing.assert_array_equal(hist, hist_forced)
 
+    def test_same_as_numpy(self):
+        """
+        Check the histogram is the same as the one computed by numpy
+        """
+        rng = numpy.random.default_rng(0)
+        ndimg = rng.normal(1000, 200, size=(1536, 2048))
+
+        # uint16, with the full range: exactly one bin per value
+        data = numpy.clip(ndimg, 0, 4095).astype(numpy.uint16)
+        hist, edges = img.histogram(data, (0, 4095))
+        self.assertEqual(edges, (0, 4095))
+        numpy.testing.assert_array_equal(hist, numpy.bincount(data.flat, minlength=4096))
+
+        # uint32, with a large range: several values per bin
+        data = (ndimg * 2 ** 18).astype(numpy.uint32)
+        irange = (0, 2 ** 32 - 1)
+        hist, edges = img.histogram(data, irange)
+        self.assertEqual(edges, irange)
+        np_hist, _ = numpy.histogram(data, bins=8192, range=irange)
+        numpy.testing.assert_array_equal(hist, np_hist)
+
+        # float, not contiguous, with a range smaller than the data
+        data = ndimg[::2, 10:-10]
+        irange = (500.5, 1500.2)
+        hist, edges = img.histogram(data, irange)
+        self.assertEqual(edges, irange)
+        np_hist, _ = numpy.histogram(data, bins=256, range=irange)
+        numpy.testing.assert_array_equal(hist, np_hist)
+
+    def test_max_pixels(self):
+        """
+        Check the histogram of a subsample of the image is close to the real one
+        """
+        rng = numpy.random.default_rng(0)
+        data = rng.normal(1000, 200, size=(2048, 2048)).clip(0, 4095).astype(numpy.uint16)
+        irange = (0, 4095)
+
+        tstart = time.time()
+        for i in range(10):
+            hist, edges = img.histogram(data, irange)
+        dur_full = (time.time() - tstart) / 10
+        tstart = time.time()
+        for i in range(10):
+            shist, sedges = img.histogram(data, irange, max_pixels=512 * 512)
+        dur_sub = (time.time() - tstart) / 10
+        logging.info("Histogram took %g s on the full image, and %g s on a subsample",
+                     dur_full, dur_sub)
+
+        self.assertEqual(sedges, edges)
+        self.assertEqual(len(shist), len(hist))
+        self.assertLessEqual(shist.sum(), 512 * 512)
+        # The cumulative distributions should be very close
+        cdf = numpy.cumsum(hist) / hist.sum()
+        scdf = numpy.cumsum(shist) / shist.sum()
+        self.assertLess(numpy.abs(cdf - scdf).max(), 0.01)
+
+        # Small images are not subsampled
+        hist, edges = img.histogram(data[:100, :100], irange, max_pixels=512 * 512)
+        self.assertEqual(hist.sum(), 100 * 100)
+
     def test_compact(self):
         """
         test the compactHistogram()
@@ -510,6 +570,93 @@ class TestDataArray2RGB(unittest.TestCase):
         # ±1, to handle the value shifts by the standard converter to handle floats
         numpy.testing.assert_almost_equal(rgb, rgb_nc_back, decimal=0)
 
+    def _convert_slow(self, data, irange, tint=(255, 255, 255)):
+        """
+        Convert the data to RGB on the standard path, by passing a non C-contiguous array
+        """
+        data_nc = numpy.asfortranarray(data)
+        assert not data_nc.flags.c_contiguous
+        return img.DataArray2RGB(data_nc, irange, tint)
+
+    def test_fast_dtypes(self):
+        """Test the fast conversion gives the same result as the standard one, for all types"""
+        if img.img_fast is None:
+            self.skipTest("img_fast not available, cannot test it")
+
+        shape = (512, 300)
+        for dtype in (numpy.uint8, numpy.int8, numpy.uint16, numpy.int16, numpy.uint32,
+                      numpy.int32, numpy.int64, numpy.float32, numpy.float64):
+            if numpy.dtype(dtype).kind == "f":
+                data = numpy.random.uniform(-10, 500, shape).astype(dtype)
+                irange = (0.5, 450.2)
+            else:
+                idt = numpy.iinfo(dtype)
+                data = numpy.random.randint(idt.min, idt.max, shape, dtype=dtype)
+                irange = (idt.min // 2 + 3, idt.max // 4)
+            # Many threads => bigger than a block
+            data = numpy.tile(data, (4, 2))
+
+            for tint in ((255, 255, 255), (0, 73, 255)):
+                rgb = img.DataArray2RGB(data, irange, tint)
+                rgb_std = self._convert_slow(data, irange, tint)
+                self.assertEqual(rgb.shape, data.shape + (3,))
+                # ±1, as the standard conversion rounds down while the fast one rounds to the closest
+                numpy.testing.assert_allclose(rgb, rgb_std, atol=1, rtol=0,
+                                              err_msg="Failed with %s and tint %s" % (numpy.dtype(dtype), tint))
+
+    def test_fast_colormap(self):
+        """Test the fast conversion of a colormap gives the same result as matplotlib"""
+        if img.img_fast is None:
+            self.skipTest("img_fast not available, cannot test it")
+
+        data = numpy.random.randint(0, 4096, (300, 200), dtype=numpy.uint16)
+        data[0, 0] = 0
+        data[0, 1] = 4095
+        irange = (100, 3000)
+        for cmap in (cm.viridis, colors.ListedColormap([(1, 0, 0), (0, 1, 0), (0, 0, 1)])):
+            rgb = img.DataArray2RGB(data, irange, cmap)
+            rgb_std = self._convert_slow(data, irange, cmap)
+            numpy.testing.assert_array_equal(rgb[0, 0], rgb_std[0, 0])
+            numpy.testing.assert_array_equal(rgb[0, 1], rgb_std[0, 1])
+            # Values just at the boundary between two colours might be rounded
+            # differently, but that should be very rare
+            diff = numpy.any(rgb != rgb_std, axis=2)
+            self.assertLess(numpy.count_nonzero(diff), data.size * 0.005)
+
+        # The look-up table of a colormap is only computed once
+        cmap = colors.ListedColormap([(1, 0, 0), (0, 1, 0), (0, 0, 1)])
+        lut = img._get_colormap_lut(cmap)
+        self.assertEqual(lut.shape, (3, 3))
+        self.assertIs(img._get_colormap_lut(cmap), lut)
+
+    def test_speed_4k(self):
+        """Benchmark the conversion of 4k x 4k frames, for each type"""
+        if img.img_fast is None:
+            self.skipTest("img_fast not available, cannot test it")
+
+        shape = (4096, 4096)
+        tint = (0, 73, 255)
+        for dtype in (numpy.uint8, numpy.uint16, numpy.uint32, numpy.int16, numpy.int32,
+                      numpy.float32, numpy.float64):
+            if numpy.dtype(dtype).kind == "f":
+                data = numpy.random.uniform(0, 1000, shape).astype(dtype)
+            else:
+                data = numpy.random.randint(0, min(numpy.iinfo(dtype).max, 4096), shape, dtype=dtype)
+            irange = (10, 900)
+
+            tstart = time.time()
+            for i in range(3):
+                img.DataArray2RGB(data, irange, tint)
+            fast_dur = (time.time() - tstart) / 3
+
+            tstart = time.time()
+            self._convert_slow(data, irange, tint)
+            std_dur = time.time() - tstart
+
+            # Only for information, as the timing depends too much on the computer
+            logging.info("4k x 4k %s: fast conversion = %g s, standard = %g s",
+                         numpy.dtype(dtype), fast_dur, std_dur)
+
     def test_tint(self):
         """test with tint (on the fast path)"""
         size = (1024, 1024)
@@ -646,6 +793,68 @@ class TestDataArray2RGB(unittest.TestCase):
         self.assertEqual(hist[-2], 0)
 
 
+class TestDataArray2BGRA(unittest.TestCase):
+
+    def test_same_as_rgb(self):
+        """BGRA conversion should give the same colours as the RGB conversion"""
+        data = numpy.random.randint(0, 4096, (600, 500), dtype=numpy.uint16)
+        irange = (100, 3000)
+        for tint in ((255, 255, 255), (0, 73, 255), cm.viridis):
+            rgb = img.DataArray2RGB(data, irange, tint)
+            bgra = img.DataArray2BGRA(data, irange, tint)
+            self.assertEqual(bgra.shape, data.shape + (4,))
+            self.assertEqual(bgra.dtype, numpy.uint8)
+            self.assertTrue(bgra.flags.c_contiguous)
+            numpy.testing.assert_array_equal(bgra[:, :, 2::-1], rgb)
+            self.assertTrue(numpy.all(bgra[:, :, 3] == 255))
+
+            if isinstance(tint, colors.Colormap):
+                continue  # Values at the boundary between two colours might differ (cf test_fast_colormap)
+
+            # Without the fast conversion, the result should be (almost) the same
+            img_fast = img.img_fast
+            try:
+                img.img_fast = None
+                bgra_std = img.DataArray2BGRA(data, irange, tint)
+            finally:
+                img.img_fast = img_fast
+            numpy.testing.assert_allclose(bgra, bgra_std, atol=1, rtol=0)
+
+    def test_alpha(self):
+        """The colours should be premultiplied by the alpha"""
+        data = numpy.random.uniform(0, 10, (300, 200))
+        data[0, 0] = numpy.nan
+        irange = (1.0, 9.0)
+        tint = (0, 73, 255)
+        rgb = img.DataArray2RGB(data, irange, tint)
+        bgra = img.DataArray2BGRA(data, irange, tint, alpha=128)
+        self.assertTrue(numpy.all(bgra[:, :, 3] == 128))
+        numpy.testing.assert_allclose(bgra[1:, :, 2::-1], rgb[1:] * (128 / 255), atol=1)
+        numpy.testing.assert_array_equal(bgra[0, 0], [0, 0, 0, 128])
+
+    def test_float_irange(self):
+        """A float irange on integer data should not be truncated"""
+        data = numpy.array([[0, 1, 2, 3]], dtype=numpy.uint16)
+        irange = (0.5, 2.5)
+        bgra = img.DataArray2BGRA(data, irange)
+        # Same as converting the data as float
+        rgb = img.DataArray2RGB(data.astype(numpy.float64), irange)
+        numpy.testing.assert_allclose(bgra[:, :, 2::-1], rgb, atol=1, rtol=0)
+        # 1 is at 1/4 of the range (and would be at 1/2 if irange was truncated to (0, 2))
+        self.assertAlmostEqual(int(bgra[0, 1, 0]), 64, delta=1)
+
+    def test_bgra2rgb(self):
+        """The RGB image should have the RGB colours, and be C-contiguous"""
+        data = numpy.random.randint(0, 256, (30, 20), dtype=numpy.uint8)
+        bgra = img.DataArray2BGRA(data, (0, 255), (255, 0, 20))
+        rgb = img.BGRA2RGB(bgra)
+        self.assertEqual(rgb.shape, data.shape + (3,))
+        self.assertTrue(rgb.flags.c_contiguous)
+        numpy.testing.assert_array_equal(rgb, bgra[:, :, 2::-1])
+        # ±1, as the direct mapping of uint8 rounds down, while the BGRA conversion rounds to the closest
+        numpy.testing.assert_allclose(rgb, img.DataArray2RGB(data, (0, 255), (255, 0, 20)), atol=1, rtol=0)
+
+
 class TestBin(unittest.TestCase):
 
     def test_simple(self):
@@ -36,7 +36,7 @@ from odemis.util import (
     limit_invocation,
     perpendicular_distance,
     timeout,
-    to_str_escape, BackgroundWorker, rotate_rect, testing,
+    to_str_escape, BackgroundWorker, AdaptiveRepeatingTimer, rotate_rect, testing,
 )
 
 logging.getLogger().setLevel(logging.DEBUG)
@@ -180,6 +180,39 @@ class TestBackgroundWorker(unittest.TestCase):
         self.assertIn("done", self.results)
 
 
+class TestAdaptiveRepeatingTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.active = False
+
+    def callback(self) -> bool:
+        self.calls.append(time.time())
+        return self.active
+
+    def test_adapt_period(self):
+        timer = AdaptiveRepeatingTimer(0.05, 0.4, self.callback, "Test timer")
+        timer.start()
+
+        # Idle => slows down, up to the max period
+        time.sleep(1.5)
+        n_idle = len(self.calls)
+        self.assertLessEqual(n_idle, 4)  # 0.4, 0.8, 1.2 s
+        self.assertEqual(timer.period, 0.4)
+
+        # Active => as fast as possible
+        self.active = True
+        timer.accelerate()
+        time.sleep(0.5)
+        n_active = len(self.calls) - n_idle
+        self.assertGreaterEqual(n_active, 6)
+        self.assertEqual(timer.period, 0.05)
+
+        timer.cancel()
+        timer.join(1)
+        self.assertFalse(timer.is_alive())
+
+
 class TestExectuteTask(unittest.TestCase):
 
     def test_execute(self):
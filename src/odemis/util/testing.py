@@ -33,7 +33,9 @@ from odemis.util import driver
 # ODEMISD_CMD = ["/usr/bin/python2", "-m", "odemis.odemisd.main"]
 # -m doesn't work when run from PyDev... not entirely sure why
 ODEMISD_CMD = [sys.executable, os.path.dirname(odemis.__file__) + "/odemisd/main.py"]
-ODEMISD_ARG = ["--log-level=2", "--log-target=testdaemon.log", "--daemonize"]
+ODEMISD_ARG = ["--log-level=2",
+               "--log-target=%s" % os.path.join(tempfile.gettempdir(), "testdaemon.log"),
+               "--daemonize"]
 
 
 def setlimits():